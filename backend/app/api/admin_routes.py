@@ -6,11 +6,58 @@ Usage unique : migrations RGPD et opérations one-shot en production.
 Historique :
 - POST /admin/run-migration   → vidage raw_email_text ✅ FAIT (colonne supprimée en prod)
 - GET  /admin/check-migration → vérification ✅ FAIT
+- GET  /admin/db-pool         → métriques du pool de connexions (process courant)
+- GET  /admin/email-locks     → attente des verrous par candidat (tous workers)
+- GET  /admin/webhook-dedup   → re-soumissions du watcher ignorées (idempotence)
 """
 
-from fastapi import APIRouter
+import hmac
+
+from fastapi import APIRouter, HTTPException, Request
+
+from app.core.config import settings
+from app.database.database import pool_metrics
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
+
+def _check_admin_secret(request: Request) -> None:
+    auth = request.headers.get("x-watcher-secret", "")
+    if not settings.WATCHER_SECRET or not hmac.compare_digest(auth, settings.WATCHER_SECRET):
+        raise HTTPException(status_code=403, detail="Secret invalide")
+
+
+@router.get("/db-pool")
+def db_pool(request: Request):
+    _check_admin_secret(request)
+    return pool_metrics()
+
+
+@router.get("/email-locks")
+def email_locks(request: Request):
+    _check_admin_secret(request)
+    import redis
+    from app.services.job_lock_service import lock_metrics
+
+    conn = redis.from_url(settings.REDIS_URL or "redis://localhost:6379")
+    try:
+        return lock_metrics(conn)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Redis indisponible : {e}")
+
+
+@router.get("/webhook-dedup")
+def webhook_dedup(request: Request):
+    _check_admin_secret(request)
+    import redis
+    from app.services.idempotency_service import dedup_metrics
+
+    conn = redis.from_url(settings.REDIS_URL or "redis://localhost:6379")
+    try:
+        return dedup_metrics(conn)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Redis indisponible : {e}")
+
+
 # Toutes les migrations ont été exécutées.
 # Ce fichier est conservé comme point d'extension pour de futures opérations one-shot.
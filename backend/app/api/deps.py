@@ -5,9 +5,11 @@ Import unique ici, pas de duplication dans chaque fichier.
 """
 
 from fastapi import Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app.database.database import get_db
+from app.database.database import get_db, get_read_db
 from app.database.models import User
 from app.security import get_current_user as get_current_user_token
 
@@ -24,14 +26,32 @@ async def get_current_user_db(
     - JWT Google OAuth : {"sub": google_id, "email": "user@gmail.com"}
     - JWT classique : {"sub": "user@email.com"}
     """
-    # Essayer d'abord 'email' (Google OAuth), puis 'sub' (JWT classique)
-    email = token_payload.get("email") or token_payload.get("sub")
-    
-    if not email:
-        raise HTTPException(status_code=401, detail="Token invalide")
+    email = _token_email(token_payload)
 
     user = db.query(User).filter(User.email == email).first()
     if not user:
         raise HTTPException(status_code=401, detail="Utilisateur introuvable")
 
-    return user
\ No newline at end of file
+    return user
+
+
+async def get_current_user_async(
+    token_payload: dict = Depends(get_current_user_token),
+    db: AsyncSession = Depends(get_read_db),
+) -> User:
+    """Variante de get_current_user_db pour les routes sur session async."""
+    email = _token_email(token_payload)
+
+    user = (await db.execute(select(User).where(User.email == email))).scalars().first()
+    if not user:
+        raise HTTPException(status_code=401, detail="Utilisateur introuvable")
+
+    return user
+
+
+def _token_email(token_payload: dict) -> str:
+    # Essayer d'abord 'email' (Google OAuth), puis 'sub' (JWT classique)
+    email = token_payload.get("email") or token_payload.get("sub")
+    if not email:
+        raise HTTPException(status_code=401, detail="Token invalide")
+    return email
\ No newline at end of file
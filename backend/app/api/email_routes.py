@@ -2,25 +2,29 @@
 
 import base64
 import hashlib
-import json
 import logging
 import time
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from pathlib import Path
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from pydantic import BaseModel
-from sqlalchemy import func
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
 
-from app.api.deps import get_current_user_db
+from app.api.deps import get_current_user_async, get_current_user_db
+from app.core.config import settings
 from app.core.security_utils import send_email_via_resend
-from app.database.database import get_db
+from app.database.database import get_db, get_read_db
 from app.database.models import (
     AppSettings, EmailAnalysis, FileAnalysis,
     TenantEmailLink, TenantFile, User,
 )
+from app.services.stats_service import (
+    DAILY_METRICS, MAX_TIMESERIES_DAYS, get_agency_stats, get_timeseries,
+)
 
 router = APIRouter(tags=["Emails"])
 log = logging.getLogger(__name__)
@@ -48,6 +52,11 @@ class EmailHistoryItem(BaseModel):
         from_attributes = True
 
 
+class EmailHistoryPage(BaseModel):
+    items: List[EmailHistoryItem]
+    next_cursor: Optional[str] = None
+
+
 class EmailDetailResponse(BaseModel):
     id: int
     created_at: Optional[datetime] = None
@@ -85,94 +94,134 @@ class ProcessEmailRequest(BaseModel):
 
 @router.get("/dashboard/stats")
 async def get_stats(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user_db),
+    response: Response,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user_async),
 ):
     aid = current_user.agency_id
-    total = db.query(EmailAnalysis).filter(EmailAnalysis.agency_id == aid).count()
-    high = db.query(EmailAnalysis).filter(
-        EmailAnalysis.agency_id == aid,
-        func.lower(EmailAnalysis.urgency).contains("urg"),
-    ).count()
-
-    from app.database.models import TenantFile, TenantFileStatus
-    tenant_count = db.query(TenantFile).filter(TenantFile.agency_id == aid).count()
-    tenant_incomplete = db.query(TenantFile).filter(
-        TenantFile.agency_id == aid,
-        TenantFile.status == TenantFileStatus.INCOMPLETE,
-    ).count()
-
-    cat_stats = (
-        db.query(EmailAnalysis.category, func.count(EmailAnalysis.id))
-        .filter(EmailAnalysis.agency_id == aid)
-        .group_by(EmailAnalysis.category)
-        .all()
-    )
-    recents = (
-        db.query(EmailAnalysis)
-        .filter(EmailAnalysis.agency_id == aid)
-        .order_by(EmailAnalysis.id.desc())
-        .limit(5).all()
-    )
+    # KPIs + répartition + derniers emails : compteurs pré-agrégés (1 requête, cache court)
+    stats = await db.run_sync(get_agency_stats, aid)
+    response.headers["Cache-Control"] = f"private, max-age={settings.DASHBOARD_STATS_TTL_SECONDS}"
     return {
-        "kpis": {
-            "total_emails": total,
-            "high_urgency": high,
-            "tenant_files": tenant_count,
-            "tenant_files_incomplete": tenant_incomplete,
-        },
-        "charts": {"distribution": [{"name": c[0], "value": c[1]} for c in cat_stats]},
+        "kpis": stats["kpis"],
+        "charts": {"distribution": stats["distribution"]},
         "recents": [
             {
-                "id": r.id, "subject": r.subject, "category": r.category,
-                "urgency": r.urgency,
-                "date": r.created_at.strftime("%d/%m %H:%M") if r.created_at else "",
+                "id": r["id"], "subject": r["subject"], "category": r["category"],
+                "urgency": r["urgency"],
+                "date": r["created_at"].strftime("%d/%m %H:%M") if r["created_at"] else "",
             }
-            for r in recents
+            for r in stats["recents"]
         ],
     }
 
 
+@router.get("/dashboard/timeseries")
+async def get_dashboard_timeseries(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    metrics: Optional[str] = Query(None, description="Métriques séparées par des virgules"),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user_async),
+):
+    """
+    Séries journalières pré-agrégées (emails par catégorie / urgence / décision
+    de filtre, documents par type, transitions de statut des dossiers).
+    Par défaut : les 30 derniers jours, toutes les métriques.
+    """
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=29)
+    if start > end:
+        raise HTTPException(400, "start doit précéder end")
+    if (end - start).days + 1 > MAX_TIMESERIES_DAYS:
+        raise HTTPException(400, f"Plage limitée à {MAX_TIMESERIES_DAYS} jours")
+
+    wanted = [m.strip() for m in metrics.split(",") if m.strip()] if metrics else list(DAILY_METRICS)
+    unknown = set(wanted) - set(DAILY_METRICS)
+    if unknown:
+        raise HTTPException(400, f"Métrique(s) inconnue(s) : {', '.join(sorted(unknown))}")
+
+    return await db.run_sync(get_timeseries, current_user.agency_id, start, end, wanted)
+
+
 # ── Historique ─────────────────────────────────────────────────────────────────
 
-@router.get("/email/history", response_model=List[EmailHistoryItem])
+def _encode_history_cursor(created_at: datetime, email_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{email_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_history_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, email_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at), int(email_id)
+    except Exception:
+        raise HTTPException(400, "Curseur invalide")
+
+
+@router.get("/email/history", response_model=EmailHistoryPage)
 async def get_history(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user_db),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    category: Optional[str] = None,
+    urgency: Optional[str] = None,
+    processing_status: Optional[str] = None,
+    reply_sent: Optional[bool] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user_async),
 ):
-    emails = (
-        db.query(EmailAnalysis)
-        .filter(EmailAnalysis.agency_id == current_user.agency_id)
-        .order_by(EmailAnalysis.id.desc())
-        .all()
+    """
+    Historique paginé par curseur (keyset sur created_at, id — du plus récent
+    au plus ancien). `next_cursor` est à renvoyer tel quel pour la page suivante.
+    """
+    page_q = select(EmailAnalysis).where(EmailAnalysis.agency_id == current_user.agency_id)
+    if category:
+        page_q = page_q.where(EmailAnalysis.category == category)
+    if urgency:
+        page_q = page_q.where(EmailAnalysis.urgency == urgency)
+    if processing_status:
+        page_q = page_q.where(EmailAnalysis.processing_status == processing_status)
+    if reply_sent is not None:
+        page_q = page_q.where(EmailAnalysis.reply_sent == reply_sent)
+    if cursor:
+        page_q = page_q.where(
+            tuple_(EmailAnalysis.created_at, EmailAnalysis.id) < _decode_history_cursor(cursor)
+        )
+
+    # Page d'abord (limit + 1 pour savoir s'il y a une suite), jointure dossier ensuite :
+    # la résolution du dossier lié ne porte que sur les lignes de la page.
+    page = (
+        page_q.order_by(EmailAnalysis.created_at.desc(), EmailAnalysis.id.desc())
+        .limit(limit + 1)
+        .subquery()
+    )
+    email = aliased(EmailAnalysis, page)
+    linked_tf_id = (
+        select(func.min(TenantEmailLink.tenant_file_id))
+        .where(TenantEmailLink.email_analysis_id == email.id)
+        .scalar_subquery()
     )
-    if not emails:
-        return []
-
-    email_ids = [e.id for e in emails]
-    links = db.query(TenantEmailLink).filter(
-        TenantEmailLink.email_analysis_id.in_(email_ids)
-    ).all()
-    email_to_tenant = {}
-    for link in links:
-        if link.email_analysis_id not in email_to_tenant:
-            email_to_tenant[link.email_analysis_id] = link.tenant_file_id
-
-    # Charger les infos des dossiers liés (nom + email candidat)
-    tenant_file_ids = list(set(email_to_tenant.values()))
-    tenant_map = {}
-    if tenant_file_ids:
-        tfs = db.query(TenantFile).filter(TenantFile.id.in_(tenant_file_ids)).all()
-        tenant_map = {tf.id: tf for tf in tfs}
-
-    for e in emails:
-        tf_id = email_to_tenant.get(e.id)
-        tf = tenant_map.get(tf_id) if tf_id else None
-        setattr(e, "tenant_file_id", tf_id)
-        setattr(e, "tenant_name", tf.candidate_name if tf else None)
-        setattr(e, "tenant_email", tf.candidate_email if tf else None)
-
-    return emails
+    rows = (await db.execute(
+        select(email, TenantFile.id, TenantFile.candidate_name, TenantFile.candidate_email)
+        .outerjoin(TenantFile, TenantFile.id == linked_tf_id)
+        .order_by(email.created_at.desc(), email.id.desc())
+    )).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1][0]
+        next_cursor = _encode_history_cursor(last.created_at, last.id)
+
+    items = []
+    for e, tf_id, tenant_name, tenant_email in rows:
+        item = EmailHistoryItem.model_validate(e)
+        item.tenant_file_id = tf_id
+        item.tenant_name = tenant_name
+        item.tenant_email = tenant_email
+        items.append(item)
+
+    return EmailHistoryPage(items=items, next_cursor=next_cursor)
 
 
 @router.get("/email/{email_id}", response_model=EmailDetailResponse)
@@ -222,15 +271,12 @@ async def regenerate_reply(
     ).first()
     if link:
         tf = db.query(TenantFile).filter(TenantFile.id == link.tenant_file_id).first()
-        if tf and tf.checklist_json:
-            try:
-                checklist = json.loads(tf.checklist_json)
-                received_docs = checklist.get("received", [])
-                missing_docs = checklist.get("missing", [])
-                payslip_required = checklist.get("payslip_required", 3)
-                payslip_received = checklist.get("payslip_received", 0)
-            except Exception:
-                pass
+        if tf:
+            checklist = tf.checklist
+            received_docs = checklist["received"]
+            missing_docs = checklist["missing"]
+            payslip_required = checklist["payslip_required"]
+            payslip_received = checklist["payslip_received"]
 
     reply_result = await generate_reply(
         from_email=email.sender_email or "",
@@ -327,7 +373,7 @@ async def process_email_manual(
     """
     from app.services.document_service import analyze_document
     from app.services.email_service import analyze_email, generate_reply
-    from app.services.storage_service import upload_file as r2_upload
+    from app.services.storage_service import store_object
     from app.services.tenant_service import (
         ensure_tenant_file, ensure_email_link,
         attach_files_to_tenant_file, recompute_checklist,
@@ -375,10 +421,11 @@ async def process_email_manual(
                 continue
 
             safe_name = f"{aid}_{int(time.time())}_{Path(filename).name}"
-            r2_upload(raw_bytes, safe_name, content_type)
+            storage_key = store_object(db, raw_bytes, file_hash, content_type)
 
             new_file = FileAnalysis(
                 filename=safe_name,
+                storage_key=storage_key,
                 file_type=doc_result.doc_type,
                 sender=req.from_email,
                 extracted_date=doc_result.extracted_date,
@@ -443,12 +490,8 @@ async def process_email_manual(
             # ── 5. Attachement documents + recalcul checklist ──────────────────
             if saved_file_ids:
                 attach_files_to_tenant_file(db, tenant_file, saved_file_ids)
-                db.refresh(tenant_file)
                 recompute_checklist(db, tenant_file)
-                checklist = (
-                    json.loads(tenant_file.checklist_json)
-                    if tenant_file.checklist_json else None
-                )
+                checklist = tenant_file.checklist
 
             tenant_file_id = tenant_file.id
 
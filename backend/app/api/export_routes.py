@@ -0,0 +1,130 @@
+# app/api/export_routes.py
+"""
+Export groupé de dossiers locataires (archivage d'une période de location).
+
+- POST /exports/tenant-files          → crée un job RQ (queue 'exports')
+- GET  /exports/{job_id}              → statut + progression + token de téléchargement
+- GET  /exports/download/{token}      → archive ZIP (lien direct, sans JWT, expirant)
+"""
+
+import json
+import logging
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+
+from app.api.deps import get_current_user_db
+from app.core.config import settings
+from app.database.database import get_db
+from app.database.models import ExportJob, TenantFileStatus, User
+from app.services.storage_service import stream_file
+
+log = logging.getLogger(__name__)
+router = APIRouter(prefix="/exports", tags=["Exports"])
+
+
+# ── Schemas ────────────────────────────────────────────────────────────────────
+
+class BulkExportRequest(BaseModel):
+    status: Optional[str] = None
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+    include_closed: bool = True
+
+
+def _job_response(job: ExportJob) -> dict:
+    done = job.status == "success"
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "progress": {
+            "processed": job.processed_dossiers,
+            "total": job.total_dossiers,
+        },
+        "size_bytes": job.size_bytes,
+        "download_token": job.download_token if done else None,
+        "expires_at": job.expires_at if done else None,
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
+
+
+# ── Routes ─────────────────────────────────────────────────────────────────────
+
+@router.post("/tenant-files")
+async def create_bulk_export(
+    payload: BulkExportRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user_db),
+):
+    import redis
+    from rq import Queue
+    from app.tasks import export_tenant_files_job
+
+    if payload.status and payload.status not in {s.value for s in TenantFileStatus}:
+        raise HTTPException(400, f"Statut inconnu : '{payload.status}'")
+
+    filters = {
+        "status": payload.status,
+        "created_from": payload.created_from.isoformat() if payload.created_from else None,
+        "created_to": payload.created_to.isoformat() if payload.created_to else None,
+        "include_closed": payload.include_closed,
+    }
+    job = ExportJob(
+        agency_id=current_user.agency_id,
+        requested_by=current_user.id,
+        status="pending",
+        filters_json=json.dumps(filters),
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+
+    r = redis.from_url(settings.REDIS_URL or "redis://localhost:6379")
+    q = Queue("exports", connection=r)
+    q.enqueue(export_tenant_files_job, job.id, job_timeout=6 * 60 * 60)
+
+    log.info(f"[exports] Job #{job.id} enqueued agency={job.agency_id} filters={filters}")
+    return _job_response(job)
+
+
+@router.get("/{job_id}")
+async def get_bulk_export(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user_db),
+):
+    job = db.query(ExportJob).filter(
+        ExportJob.id == job_id,
+        ExportJob.agency_id == current_user.agency_id,
+    ).first()
+    if not job:
+        raise HTTPException(404, "Export introuvable")
+    return _job_response(job)
+
+
+@router.get("/download/{token}")
+def download_bulk_export(
+    token: str,
+    db: Session = Depends(get_db),
+):
+    job = db.query(ExportJob).filter(
+        ExportJob.download_token == token,
+        ExportJob.status == "success",
+    ).first()
+    if not job or not job.object_key:
+        raise HTTPException(404, "Export introuvable")
+    if job.expires_at and job.expires_at < datetime.utcnow():
+        raise HTTPException(410, "Lien d'export expiré")
+
+    filename = f"export_dossiers_{job.id}.zip"
+    return StreamingResponse(
+        stream_file(job.object_key),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -9,12 +9,16 @@ from typing import List, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from pydantic import BaseModel
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app.api.deps import get_current_user_db
-from app.services.storage_service import download_file as r2_download, delete_file as r2_delete
-from app.database.database import get_db
-from app.database.models import FileAnalysis, TenantDocumentLink, TenantFile, TenantFileStatus, TenantDocType, User
+from app.api.deps import get_current_user_async, get_current_user_db
+from app.services.storage_service import (
+    download_file as r2_download, object_key_for, release_object,
+)
+from app.database.database import get_db, get_read_db
+from app.database.models import FileAnalysis, TenantDocType, User
 
 router = APIRouter(tags=["Fichiers"])
 
@@ -37,30 +41,85 @@ class FileHistoryItem(BaseModel):
 
 # ── Routes ─────────────────────────────────────────────────────────────────────
 
+HISTORY_COUNT_MAX_AGE = 30  # secondes — compteur mis en cache côté client
+# Taille de page quand seul `cursor` est fourni ; ni `limit` ni `cursor` →
+# liste complète (comportement historique, attendu par le frontend)
+LIST_PAGE_SIZE = 100
+
+
+def _files_history_query(
+    agency_id: int,
+    exclude_other: bool,
+    file_type: Optional[str],
+    created_from: Optional[datetime],
+    created_to: Optional[datetime],
+):
+    query = select(FileAnalysis).where(FileAnalysis.agency_id == agency_id)
+    if exclude_other:
+        query = query.where(FileAnalysis.file_type != TenantDocType.OTHER.value)
+    if file_type:
+        query = query.where(FileAnalysis.file_type == file_type)
+    if created_from:
+        query = query.where(FileAnalysis.created_at >= created_from)
+    if created_to:
+        query = query.where(FileAnalysis.created_at < created_to)
+    return query
+
+
 @router.get("/api/files/history", response_model=List[FileHistoryItem])
 async def get_files_history(
+    response: Response,
     exclude_other: bool = Query(
         default=True,
         description="Si true (défaut), masque les documents non reconnus (type OTHER)"
     ),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user_db),
+    file_type: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    limit: int = Query(LIST_PAGE_SIZE, ge=1, le=500),
+    cursor: Optional[int] = Query(None, description="id du dernier document de la page précédente"),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user_async),
 ):
     """
-    Retourne l'historique des documents analysés.
+    Retourne l'historique des documents analysés, du plus récent au plus ancien.
     Par défaut, les documents de type OTHER (non reconnus, formats non supportés)
     sont masqués car ils n'apportent pas de valeur dans l'interface.
     Passer exclude_other=false pour les afficher (debug).
+
+    Pagination keyset sur id, LIST_PAGE_SIZE documents par défaut : si une page
+    suivante existe, son curseur est renvoyé dans l'en-tête X-Next-Cursor.
     """
-    query = db.query(FileAnalysis).filter(
-        FileAnalysis.agency_id == current_user.agency_id
+    query = _files_history_query(
+        current_user.agency_id, exclude_other, file_type, created_from, created_to,
     )
+    query = query.order_by(FileAnalysis.id.desc())
+    if cursor is not None:
+        query = query.where(FileAnalysis.id < cursor)
+
+    files = (await db.execute(query.limit(limit + 1))).scalars().all()
+    if len(files) > limit:
+        files = files[:limit]
+        response.headers["X-Next-Cursor"] = str(files[-1].id)
+    return files
 
-    if exclude_other:
-        query = query.filter(FileAnalysis.file_type != TenantDocType.OTHER.value)
 
-    files = query.order_by(FileAnalysis.id.desc()).all()
-    return files
+@router.get("/api/files/history/count")
+async def count_files_history(
+    response: Response,
+    exclude_other: bool = True,
+    file_type: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user_async),
+):
+    query = _files_history_query(
+        current_user.agency_id, exclude_other, file_type, created_from, created_to,
+    )
+    total = await db.scalar(select(func.count()).select_from(query.subquery()))
+    response.headers["Cache-Control"] = f"private, max-age={HISTORY_COUNT_MAX_AGE}"
+    return {"total": total}
 
 
 @router.get("/api/files/view/{file_id}")
@@ -77,7 +136,7 @@ def view_file(
         raise HTTPException(404, "Fichier introuvable")
 
     try:
-        raw_bytes = r2_download(f.filename)
+        raw_bytes = r2_download(object_key_for(f))
     except Exception:
         raise HTTPException(404, "Fichier introuvable dans le stockage")
 
@@ -106,7 +165,7 @@ async def download_file(
         raise HTTPException(404, "Fichier introuvable ou accès refusé")
 
     try:
-        raw_bytes = r2_download(f.filename)
+        raw_bytes = r2_download(object_key_for(f))
     except Exception:
         raise HTTPException(404, "Fichier introuvable dans le stockage")
 
@@ -146,38 +205,16 @@ async def delete_file(
     if not f:
         raise HTTPException(404, "Introuvable")
 
-    # Récupère les dossiers liés avant suppression
-    tenant_ids = [
-        row[0] for row in
-        db.query(TenantDocumentLink.tenant_file_id)
-        .filter(TenantDocumentLink.file_analysis_id == f.id).all()
-    ]
-
-    # Supprime le lien document ↔ dossier
-    db.query(TenantDocumentLink).filter(
-        TenantDocumentLink.file_analysis_id == f.id
-    ).delete(synchronize_session=False)
-
-    # Recalcule la checklist de chaque dossier affecté
-    # en utilisant recompute_checklist (supporte la nouvelle checklist à 5 types)
-    from app.services.tenant_service import recompute_checklist
-    for tid in tenant_ids:
-        tf = db.query(TenantFile).filter(TenantFile.id == tid).first()
-        if not tf:
-            continue
-        remaining = db.query(TenantDocumentLink).filter(
-            TenantDocumentLink.tenant_file_id == tf.id
-        ).all()
-        if not remaining:
-            tf.checklist_json = None
-            tf.status = TenantFileStatus.NEW
-            db.commit()
-        else:
-            recompute_checklist(db, tf)
-
-    # Supprime le fichier de R2
+    # Détache le document de chaque dossier (compteurs décrémentés),
+    # puis recalcule leur statut
+    from app.services.tenant_service import detach_file_everywhere, recompute_checklist
+    for tf in detach_file_everywhere(db, f.id):
+        recompute_checklist(db, tf)
+    db.commit()
+
+    # Retire la référence R2 (l'objet n'est supprimé que s'il n'est plus partagé)
     try:
-        r2_delete(f.filename)
+        release_object(db, object_key_for(f))
     except Exception:
         pass  # fichier déjà absent de R2, on continue
 
@@ -12,11 +12,11 @@ from sqlalchemy.orm import Session
 from app.api.deps import get_current_user_db
 from app.database.database import get_db
 from app.database.models import (
-    Agency, AgencyBlacklist, AgencyEmailConfig, AppSettings, EmailAnalysis, FileAnalysis,
-    Invoice, RefreshToken, TenantDocumentLink, TenantEmailLink,
-    TenantFile, User, UserRole,
+    Agency, AgencyBlacklist, AgencyDailyStat, AgencyEmailConfig, AgencyStatCounter, AppSettings,
+    EmailAnalysis, ExportJob, FileAnalysis, Invoice, RefreshToken, TenantDocumentLink,
+    TenantEmailLink, TenantFile, User, UserRole,
 )
-from app.services.storage_service import delete_file as r2_delete
+from app.services.storage_service import delete_files, object_key_for, release_object
 
 router = APIRouter(tags=["Settings"])
 log = logging.getLogger(__name__)
@@ -147,12 +147,13 @@ async def delete_my_account(
         files = db.query(FileAnalysis).filter(FileAnalysis.agency_id == aid).all()
         deleted_r2 = 0
         for f in files:
-            if f.filename:
+            key = object_key_for(f)
+            if key:
                 try:
-                    r2_delete(f.filename)
-                    deleted_r2 += 1
+                    if release_object(db, key):
+                        deleted_r2 += 1
                 except Exception as e:
-                    log.warning(f"[delete_account] R2 delete échoué ({f.filename}) : {e}")
+                    log.warning(f"[delete_account] R2 delete échoué ({key}) : {e}")
 
         db.query(TenantDocumentLink).filter(
             TenantDocumentLink.tenant_file_id.in_(
@@ -170,6 +171,14 @@ async def delete_my_account(
         db.query(Invoice).filter(Invoice.agency_id == aid).delete(synchronize_session=False)
         db.query(AppSettings).filter(AppSettings.agency_id == aid).delete(synchronize_session=False)
         db.query(AgencyEmailConfig).filter(AgencyEmailConfig.agency_id == aid).delete(synchronize_session=False)
+        exports = db.query(ExportJob).filter(ExportJob.agency_id == aid)
+        try:
+            delete_files(job.object_key for job in exports if job.object_key)
+        except Exception as e:
+            log.warning(f"[delete_account] R2 delete exports échoué : {e}")
+        exports.delete(synchronize_session=False)
+        db.query(AgencyStatCounter).filter(AgencyStatCounter.agency_id == aid).delete(synchronize_session=False)
+        db.query(AgencyDailyStat).filter(AgencyDailyStat.agency_id == aid).delete(synchronize_session=False)
         db.query(RefreshToken).filter(RefreshToken.user_id == current_user.id).delete(synchronize_session=False)
         db.query(User).filter(User.agency_id == aid).delete(synchronize_session=False)
         db.query(Agency).filter(Agency.id == aid).delete(synchronize_session=False)
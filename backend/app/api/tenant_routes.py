@@ -7,31 +7,34 @@ FIX P0: upload_document_for_tenant écrit désormais dans Cloudflare R2
 """
 
 import hashlib
-import io
-import json
 import logging
 import time
-import zipfile
 from datetime import datetime
 from pathlib import Path
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Response, UploadFile
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, EmailStr
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app.api.deps import get_current_user_db
-from app.database.database import get_db
+from app.api.deps import get_current_user_async, get_current_user_db
+from app.database.database import get_db, get_read_db
 from app.database.models import (
-    DocQuality, EmailAnalysis, FileAnalysis, TenantDocumentLink,
+    EmailAnalysis, FileAnalysis, TenantDocumentLink,
     TenantEmailLink, TenantFile, TenantFileStatus, User,
 )
-from app.services.storage_service import download_file, upload_file as r2_upload
+from app.services.export_service import (
+    archive_basename, iter_zip, load_tenant_file_export, prefetch, tenant_file_entries,
+)
+from app.services.storage_service import object_key_for, store_object
 
 log = logging.getLogger(__name__)
 from app.services.tenant_service import (
     attach_files_to_tenant_file,
+    detach_document,
     recompute_checklist,
 )
 
@@ -114,17 +117,88 @@ async def create_tenant_file(
     )
 
 
+LIST_COUNT_MAX_AGE = 30  # secondes — compteur mis en cache côté client
+# Taille de page quand seul `cursor` est fourni ; ni `limit` ni `cursor` →
+# liste complète (comportement historique, attendu par le frontend)
+LIST_PAGE_SIZE = 100
+
+
+def _tenant_files_query(
+    agency_id: int,
+    status: Optional[str],
+    created_from: Optional[datetime],
+    created_to: Optional[datetime],
+    candidate_email: Optional[str],
+    is_closed: Optional[bool],
+):
+    query = select(TenantFile).where(TenantFile.agency_id == agency_id)
+    if status:
+        try:
+            query = query.where(TenantFile.status == TenantFileStatus(status))
+        except ValueError:
+            raise HTTPException(400, f"Statut inconnu : '{status}'")
+    if created_from:
+        query = query.where(TenantFile.created_at >= created_from)
+    if created_to:
+        query = query.where(TenantFile.created_at < created_to)
+    if candidate_email:
+        # Recherche par préfixe : exploite l'index (agency_id, candidate_email)
+        prefix = candidate_email.strip().lower()
+        query = query.where(TenantFile.candidate_email.startswith(prefix, autoescape=True))
+    if is_closed is not None:
+        query = query.where(TenantFile.is_closed == is_closed)
+    return query
+
+
 @router.get("", response_model=List[TenantFileListItem])
 async def list_tenant_files(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user_db),
+    response: Response,
+    status: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    candidate_email: Optional[str] = Query(None, description="Préfixe de l'email candidat"),
+    is_closed: Optional[bool] = None,
+    limit: int = Query(LIST_PAGE_SIZE, ge=1, le=500),
+    cursor: Optional[int] = Query(None, description="id du dernier dossier de la page précédente"),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user_async),
 ):
-    return (
-        db.query(TenantFile)
-        .filter(TenantFile.agency_id == current_user.agency_id)
-        .order_by(TenantFile.id.desc())
-        .all()
+    """
+    Dossiers de l'agence, du plus récent au plus ancien.
+    Pagination keyset sur id, LIST_PAGE_SIZE dossiers par défaut : curseur de
+    la page suivante dans X-Next-Cursor.
+    """
+    query = _tenant_files_query(
+        current_user.agency_id, status, created_from, created_to, candidate_email, is_closed,
     )
+    query = query.order_by(TenantFile.id.desc())
+    if cursor is not None:
+        query = query.where(TenantFile.id < cursor)
+
+    tenant_files = (await db.execute(query.limit(limit + 1))).scalars().all()
+    if len(tenant_files) > limit:
+        tenant_files = tenant_files[:limit]
+        response.headers["X-Next-Cursor"] = str(tenant_files[-1].id)
+    return tenant_files
+
+
+@router.get("/count")
+async def count_tenant_files(
+    response: Response,
+    status: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    candidate_email: Optional[str] = None,
+    is_closed: Optional[bool] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user_async),
+):
+    query = _tenant_files_query(
+        current_user.agency_id, status, created_from, created_to, candidate_email, is_closed,
+    )
+    total = await db.scalar(select(func.count()).select_from(query.subquery()))
+    response.headers["Cache-Control"] = f"private, max-age={LIST_COUNT_MAX_AGE}"
+    return {"total": total}
 
 
 @router.post("/from-email/{email_id}", response_model=TenantFileDetail)
@@ -206,12 +280,6 @@ async def get_tenant_file(
     email_ids = [l.email_analysis_id for l in tf.email_links]
     file_ids = [l.file_analysis_id for l in tf.document_links]
 
-    # Auto-fix dossiers incohérents
-    if len(file_ids) == 0 and tf.checklist_json:
-        tf.checklist_json = None
-        tf.status = TenantFileStatus.NEW
-        db.commit()
-
     return TenantFileDetail(
         id=tf.id, status=_tf_status(tf),
         candidate_email=tf.candidate_email, candidate_name=tf.candidate_name,
@@ -272,68 +340,17 @@ async def delete_tenant_file(
     return {"status": "deleted"}
 
 
-def _generate_summary_pdf(tf, emails_data: list, documents: list) -> bytes:
-    """Génère un PDF de synthèse du dossier locataire."""
-    from fpdf import FPDF
-
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_auto_page_break(auto=True, margin=15)
-
-    pdf.set_font("Helvetica", "B", 16)
-    pdf.cell(0, 10, "Dossier locataire - Resume", ln=True)
-    pdf.set_font("Helvetica", size=11)
-    pdf.ln(4)
-
-    candidate = tf.candidate_name or tf.candidate_email or f"#{tf.id}"
-    status_val = tf.status.value if hasattr(tf.status, "value") else str(tf.status)
-
-    for label, value in [
-        ("Candidat", candidate),
-        ("Email", tf.candidate_email or "-"),
-        ("Statut", status_val),
-        ("Exporte le", datetime.utcnow().strftime("%d/%m/%Y %H:%M") + " UTC"),
-    ]:
-        pdf.cell(40, 8, f"{label} :", ln=False)
-        pdf.cell(0, 8, str(value), ln=True)
-
-    pdf.ln(6)
-    pdf.set_font("Helvetica", "B", 13)
-    pdf.cell(0, 8, f"Emails ({len(emails_data)})", ln=True)
-    pdf.set_font("Helvetica", size=10)
-    for e in emails_data:
-        subj = (e.get("subject") or "(sans sujet)")[:80]
-        sender = e.get("sender_email") or ""
-        pdf.cell(0, 6, f"  - {subj} ({sender})", ln=True)
-        if e.get("summary"):
-            truncated = (e["summary"] or "")[:200]
-            pdf.set_font("Helvetica", "I", 9)
-            pdf.multi_cell(0, 5, f"    {truncated}")
-            pdf.set_font("Helvetica", size=10)
-
-    pdf.ln(4)
-    pdf.set_font("Helvetica", "B", 13)
-    pdf.cell(0, 8, f"Documents ({len(documents)})", ln=True)
-    pdf.set_font("Helvetica", size=10)
-    for d in documents:
-        doc_type = d.file_type or "Document"
-        pdf.cell(0, 6, f"  - {doc_type} — {d.filename}", ln=True)
-        if d.summary:
-            truncated = (d.summary or "")[:200]
-            pdf.set_font("Helvetica", "I", 9)
-            pdf.multi_cell(0, 5, f"    {truncated}")
-            pdf.set_font("Helvetica", size=10)
-
-    return pdf.output()
-
-
 @router.get("/{tenant_id}/export")
 async def export_tenant_file(
     tenant_id: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user_db),
 ):
-    """Export complet du dossier locataire en ZIP (emails.json + documents/ + summary.pdf)."""
+    """
+    Export complet du dossier locataire en ZIP (emails.json + documents/ + summary.pdf).
+    Le ZIP est streamé : les documents R2 sont préchargés en parallèle et envoyés
+    au fil de l'eau, sans construire l'archive en mémoire.
+    """
     aid = current_user.agency_id
     tf = db.query(TenantFile).filter(
         TenantFile.id == tenant_id,
@@ -342,58 +359,20 @@ async def export_tenant_file(
     if not tf:
         raise HTTPException(404, "Dossier introuvable")
 
-    # 1. Emails liés
-    emails_data = []
-    for link in tf.email_links:
-        ea = db.query(EmailAnalysis).filter(EmailAnalysis.id == link.email_analysis_id).first()
-        if ea:
-            emails_data.append({
-                "id": ea.id,
-                "sender_email": ea.sender_email,
-                "subject": ea.subject,
-                "category": ea.category,
-                "urgency": ea.urgency,
-                "summary": ea.summary,
-                "received_at": ea.created_at.isoformat() if ea.created_at else None,
-            })
-
-    # 2. Documents liés
-    file_analyses = []
-    for link in tf.document_links:
-        fa = db.query(FileAnalysis).filter(FileAnalysis.id == link.file_analysis_id).first()
-        if fa:
-            file_analyses.append(fa)
-
-    # 3. Construction ZIP en mémoire
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-        zf.writestr("emails.json", json.dumps(emails_data, ensure_ascii=False, indent=2))
-
-        for fa in file_analyses:
-            try:
-                file_bytes = download_file(fa.filename)
-                ext = Path(fa.filename).suffix or ""
-                safe_name = f"{fa.file_type or 'document'}_{fa.id}{ext}"
-                zf.writestr(f"documents/{safe_name}", file_bytes)
-            except Exception as e:
-                log.warning(f"[export] Impossible de télécharger {fa.filename}: {e}")
-
-        try:
-            summary_pdf = _generate_summary_pdf(tf, emails_data, file_analyses)
-            zf.writestr("summary.pdf", summary_pdf)
-        except Exception as e:
-            log.warning(f"[export] Erreur génération PDF summary: {e}")
-
-    buf.seek(0)
+    # Emails + documents liés : deux requêtes, chargées avant le stream
+    # (la session est fermée avant l'envoi de la réponse)
+    emails_data, file_analyses = load_tenant_file_export(db, tf)
 
-    candidate = tf.candidate_name or tf.candidate_email or f"dossier_{tenant_id}"
-    safe_candidate = "".join(c if c.isalnum() or c in "-_" else "_" for c in candidate)
-    filename = f"dossier_{safe_candidate}.zip"
+    filename = f"dossier_{archive_basename(tf)}.zip"
 
     log.info(f"[export] Dossier #{tenant_id} exporté par user={current_user.id} agency={aid}")
 
+    entries = tenant_file_entries(
+        tf, emails_data, file_analyses,
+        fetched=prefetch(file_analyses, object_key_for),
+    )
     return StreamingResponse(
-        buf,
+        iter_zip(entries),
         media_type="application/zip",
         headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
@@ -428,10 +407,8 @@ async def upload_document_for_tenant(
 
     if existing:
         attach_files_to_tenant_file(db=db, tenant_file=tf, file_ids=[existing.id])
-        db.refresh(tf)
         recompute_checklist(db, tf)
-        checklist = json.loads(tf.checklist_json) if tf.checklist_json else {}
-        missing = [DOC_LABELS.get(c, c) for c in checklist.get("missing", [])]
+        missing = [DOC_LABELS.get(c, c) for c in tf.checklist["missing"]]
         return {
             "status": "uploaded",
             "file_id": existing.id,
@@ -449,12 +426,14 @@ async def upload_document_for_tenant(
     )
 
     # ── FIX P0 : Upload vers R2 (plus de disque local) ─────────────────────
+    # Stockage adressé par contenu : pas de nouvel upload si le contenu existe déjà
     safe_name = f"{aid}_{int(time.time())}_{Path(file.filename).name}"
     content_type = file.content_type or "application/octet-stream"
-    r2_upload(file_bytes, safe_name, content_type)
+    storage_key = store_object(db, file_bytes, file_hash, content_type)
 
     new_file = FileAnalysis(
         filename=safe_name,
+        storage_key=storage_key,
         file_type=doc_result.doc_type,
         sender=tf.candidate_email or "",
         extracted_date=doc_result.extracted_date,
@@ -468,11 +447,9 @@ async def upload_document_for_tenant(
     db.refresh(new_file)
 
     attach_files_to_tenant_file(db=db, tenant_file=tf, file_ids=[new_file.id])
-    db.refresh(tf)
     recompute_checklist(db, tf)
 
-    checklist = json.loads(tf.checklist_json) if tf.checklist_json else {}
-    missing = [DOC_LABELS.get(c, c) for c in checklist.get("missing", [])]
+    missing = [DOC_LABELS.get(c, c) for c in tf.checklist["missing"]]
 
     return {
         "status": "uploaded",
@@ -515,10 +492,9 @@ async def attach_document_to_tenant(
         return {"status": "already_linked", "tenant_id": tf.id, "file_id": fa.id}
 
     attach_files_to_tenant_file(db=db, tenant_file=tf, file_ids=[fa.id])
-    db.refresh(tf)
     recompute_checklist(db, tf)
 
-    checklist = json.loads(tf.checklist_json) if tf.checklist_json else None
+    checklist = tf.checklist
     return {
         "status": "linked",
         "tenant_id": tf.id,
@@ -550,12 +526,10 @@ async def detach_document_from_tenant(
     if not link:
         raise HTTPException(404, "Lien document/dossier introuvable")
 
-    db.delete(link)
-    db.commit()
-    db.refresh(tf)
+    detach_document(db, tf, link)
     recompute_checklist(db, tf)
 
-    checklist = json.loads(tf.checklist_json) if tf.checklist_json else None
+    checklist = tf.checklist
     return {
         "status": "unlinked",
         "tenant_id": tf.id,
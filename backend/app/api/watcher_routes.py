@@ -6,20 +6,27 @@ Authentification par x-watcher-secret header.
 - GET  /watcher/configs        → liste des agences avec Gmail connecté
 - POST /watcher/update-token   → MAJ access_token après refresh OAuth
 - GET  /watcher/check-sender   → vérifie si un email est connu (candidat existant)
+- GET  /watcher/known-senders  → expéditeurs connus d'une agence (cache local du watcher)
 """
 
+import hashlib
 import hmac
 import logging
+import threading
+from collections import OrderedDict, defaultdict
 from datetime import datetime
+from typing import Optional
 
-from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
 from pydantic import BaseModel, EmailStr
-from sqlalchemy import or_
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
+from app.core.email_utils import canonical_email
 from app.core.security_utils import fernet_decrypt_str, fernet_encrypt_str
-from app.database.database import get_db
+from app.database.database import get_async_db, get_db, get_read_db
 from app.database import models
 
 log = logging.getLogger(__name__)
@@ -31,114 +38,128 @@ def _check_secret(x_watcher_secret: str = Header(...)):
         raise HTTPException(status_code=403, detail="Secret invalide")
 
 
-# ══════════════════════════════════════════════════════════════════════════════
-# 📧 NORMALISATION EMAILS (Gmail, Outlook, etc.)
-# ══════════════════════════════════════════════════════════════════════════════
+# ── GET /watcher/configs ───────────────────────────────────────────────────────
 
-def normalize_email(email: str) -> tuple[str, str]:
-    """
-    Normalise un email selon les règles du provider.
-    
-    Retourne (normalized_email, canonical_email) :
-    - normalized_email : version normalisée (sans points Gmail, etc.)
-    - canonical_email : version canonique (sans alias +)
-    
-    Règles par provider :
-    - Gmail / Googlemail :
-      - Ignore les points : user.name@gmail.com = username@gmail.com
-      - Ignore les alias + : user+test@gmail.com = user@gmail.com
-    - Outlook / Hotmail / Live :
-      - Garde les alias + : user+test@outlook.com ≠ user@outlook.com
-    - Autres (Yahoo, ProtonMail, etc.) :
-      - Pas de normalisation spéciale
-    
-    Tous :
-    - Case-insensitive : User@Gmail.com = user@gmail.com
-    """
-    if not email or "@" not in email:
-        return email.lower() if email else "", ""
-    
-    local, domain = email.rsplit("@", 1)
-    local = local.lower()
-    domain = domain.lower()
-    
-    # ── Gmail / Googlemail : ignore points + alias ───────────────────────────
-    if domain in ["gmail.com", "googlemail.com"]:
-        # Version normalisée : sans points
-        local_normalized = local.replace(".", "")
-        
-        # Version canonique : sans points ET sans alias
-        local_canonical = local_normalized.split("+")[0]
-        
-        return (
-            f"{local_normalized}@{domain}",
-            f"{local_canonical}@{domain}",
-        )
-    
-    # ── Outlook / Hotmail / Live : garde tout ─────────────────────────────────
-    elif domain in ["outlook.com", "outlook.fr", "hotmail.com", "hotmail.fr", "live.com", "live.fr"]:
-        # Pas de normalisation spéciale
-        # Les alias + sont DISTINCTS chez Outlook
-        return f"{local}@{domain}", f"{local}@{domain}"
-    
-    # ── Autres providers (Yahoo, ProtonMail, custom domains) ─────────────────
-    else:
-        # Pas de normalisation
-        return f"{local}@{domain}", f"{local}@{domain}"
+# Derniers états servis (ETag → versions par agence), pour répondre en delta
+CONFIG_SNAPSHOTS_MAX = 32
+_config_snapshots: "OrderedDict[str, dict[int, str]]" = OrderedDict()
+_config_snapshots_lock = threading.Lock()
 
 
-# ── GET /watcher/configs ───────────────────────────────────────────────────────
+def _config_etag(versions: dict[int, str]) -> str:
+    raw = ";".join(f"{aid}:{v}" for aid, v in sorted(versions.items()))
+    return '"' + hashlib.sha256(raw.encode()).hexdigest()[:32] + '"'
+
+
+def _remember_config_snapshot(etag: str, versions: dict[int, str]) -> None:
+    with _config_snapshots_lock:
+        _config_snapshots[etag] = versions
+        _config_snapshots.move_to_end(etag)
+        while len(_config_snapshots) > CONFIG_SNAPSHOTS_MAX:
+            _config_snapshots.popitem(last=False)
+
+
+def _known_config_snapshot(etag: str) -> dict[int, str] | None:
+    with _config_snapshots_lock:
+        return _config_snapshots.get(etag)
+
+
+def _serialize_config(c: models.AgencyEmailConfig, blacklist: list[str]) -> dict:
+    return {
+        "agency_id":              c.agency_id,
+        # ── Gmail ──────────────────────────────────────────────────────────
+        "gmail_access_token":     fernet_decrypt_str(c.gmail_access_token)  if c.gmail_access_token  else None,
+        "gmail_refresh_token":    fernet_decrypt_str(c.gmail_refresh_token) if c.gmail_refresh_token else None,
+        "gmail_token_expiry":     c.gmail_token_expiry.isoformat()  if c.gmail_token_expiry  else None,
+        "gmail_email":            c.gmail_email,
+        # ── Outlook ────────────────────────────────────────────────────────
+        "outlook_access_token":   fernet_decrypt_str(c.outlook_access_token)  if c.outlook_access_token  else None,
+        "outlook_refresh_token":  fernet_decrypt_str(c.outlook_refresh_token) if c.outlook_refresh_token else None,
+        "outlook_token_expiry":   c.outlook_token_expiry.isoformat() if c.outlook_token_expiry else None,
+        "outlook_email":          c.outlook_email,
+        # ── IMAP ───────────────────────────────────────────────────────────
+        "enabled":                c.enabled,
+        # ── Blacklist agence ───────────────────────────────────────────────
+        "agency_blacklist":       blacklist,
+    }
+
 
 @router.get("/configs")
 async def get_watcher_configs(
     secret: str,
-    db: Session = Depends(get_db),
+    response: Response,
+    delta: bool = False,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     Retourne la liste des configs actives avec tokens Gmail ET/OU Outlook.
     Appelé par le watcher toutes les CONFIG_REFRESH_INTERVAL secondes.
+
+    Requête conditionnelle : ETag calculé sur les versions (updated_at de la
+    config + état de la blacklist) → 304 si rien n'a changé, sans charger ni
+    déchiffrer aucun token.
+    Avec `delta=true`, la réponse est {"full", "configs", "removed"} : seules
+    les agences modifiées depuis l'ETag fourni sont renvoyées (état complet si
+    l'ETag est inconnu, ex. après redémarrage).
     """
     if secret != settings.WATCHER_SECRET:
         raise HTTPException(status_code=403, detail="Secret invalide")
 
-    configs = (
-        db.query(models.AgencyEmailConfig)
-        .filter(
-            or_(
-                models.AgencyEmailConfig.gmail_refresh_token.isnot(None),
-                models.AgencyEmailConfig.outlook_refresh_token.isnot(None),
-            )
+    Config, Blacklist = models.AgencyEmailConfig, models.AgencyBlacklist
+    active = or_(Config.gmail_refresh_token.isnot(None), Config.outlook_refresh_token.isnot(None))
+
+    # 1. Versions uniquement (2 requêtes, aucune colonne de token)
+    active_ids = select(Config.agency_id).where(active)
+    blacklist_versions = {
+        aid: f"{n}.{max_id}"
+        for aid, n, max_id in await db.execute(
+            select(Blacklist.agency_id, func.count(), func.max(Blacklist.id))
+            .where(Blacklist.agency_id.in_(active_ids))
+            .group_by(Blacklist.agency_id)
         )
-        .all()
-    )
-
-    result = []
-    for c in configs:
-        blacklist = db.query(models.AgencyBlacklist).filter(
-            models.AgencyBlacklist.agency_id == c.agency_id
-        ).all()
-        result.append({
-            "agency_id":              c.agency_id,
-            # ── Gmail ──────────────────────────────────────────────────────────
-            "gmail_access_token":     fernet_decrypt_str(c.gmail_access_token)  if c.gmail_access_token  else None,
-            "gmail_refresh_token":    fernet_decrypt_str(c.gmail_refresh_token) if c.gmail_refresh_token else None,
-            "gmail_token_expiry":     c.gmail_token_expiry.isoformat()  if c.gmail_token_expiry  else None,
-            "gmail_email":            c.gmail_email,
-            # ── Outlook ────────────────────────────────────────────────────────
-            "outlook_access_token":   fernet_decrypt_str(c.outlook_access_token)  if c.outlook_access_token  else None,
-            "outlook_refresh_token":  fernet_decrypt_str(c.outlook_refresh_token) if c.outlook_refresh_token else None,
-            "outlook_token_expiry":   c.outlook_token_expiry.isoformat() if c.outlook_token_expiry else None,
-            "outlook_email":          c.outlook_email,
-            # ── IMAP ───────────────────────────────────────────────────────────
-            "enabled":                c.enabled,
-            # ── Blacklist agence ───────────────────────────────────────────────
-            "agency_blacklist":       [b.pattern for b in blacklist],
-        })
+    }
+    versions = {
+        aid: f"{updated_at.isoformat() if updated_at else ''}|{blacklist_versions.get(aid, '0')}"
+        for aid, updated_at in await db.execute(select(Config.agency_id, Config.updated_at).where(active))
+    }
+    etag = _config_etag(versions)
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+    previous = _known_config_snapshot(if_none_match) if delta and if_none_match else None
+    _remember_config_snapshot(etag, versions)
+
+    # 2. Configs complètes des seules agences à (re)transmettre
+    if previous is None:
+        wanted, removed = active, []
+    else:
+        changed = [aid for aid, v in versions.items() if previous.get(aid) != v]
+        wanted, removed = Config.agency_id.in_(changed), sorted(set(previous) - set(versions))
+
+    configs = (await db.execute(select(Config).where(wanted))).scalars().all()
+    blacklists: dict[int, list[str]] = defaultdict(list)
+    if configs:
+        # Une seule requête pour toutes les blacklists (plus de N+1)
+        for aid, pattern in await db.execute(
+            select(Blacklist.agency_id, Blacklist.pattern)
+            .where(Blacklist.agency_id.in_([c.agency_id for c in configs]))
+            .order_by(Blacklist.id)
+        ):
+            blacklists[aid].append(pattern)
+
+    result = [_serialize_config(c, blacklists[c.agency_id]) for c in configs]
 
     gmail_count   = sum(1 for c in configs if c.gmail_refresh_token)
     outlook_count = sum(1 for c in configs if c.outlook_refresh_token)
-    log.info(f"[watcher/configs] {len(result)} agence(s) — Gmail:{gmail_count} Outlook:{outlook_count}")
-    return result
+    log.info(
+        f"[watcher/configs] {len(result)}/{len(versions)} agence(s) transmise(s) — "
+        f"Gmail:{gmail_count} Outlook:{outlook_count} retirées:{len(removed)}"
+    )
+    if not delta:
+        return result
+    return {"full": previous is None, "configs": result, "removed": removed}
 
 
 # ── POST /watcher/update-token ─────────────────────────────────────────────────
@@ -254,43 +275,70 @@ async def watcher_heartbeat(
 
 # ── GET /watcher/check-sender ─────────────────────────────────────────────────
 
+def _check_watcher_secret(request: Request) -> None:
+    auth = request.headers.get("x-watcher-secret", "")
+    if not settings.WATCHER_SECRET or not hmac.compare_digest(auth, settings.WATCHER_SECRET):
+        raise HTTPException(status_code=403, detail="Secret invalide")
+
+
 @router.get("/check-sender")
 async def check_known_sender(
     email: EmailStr,
     agency_id: int,
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     """
     Vérifie si un email est déjà connu (candidat existant dans les dossiers).
-    Gère la normalisation Gmail (points + alias ignorés).
-    
-    Appelé par le watcher pour décider si un email sans PJ/mots-clés doit être accepté.
-    
+    Comparaison sur la clé canonique (casse, alias +, points Gmail ignorés),
+    servie par l'index (agency_id, normalized_email).
+
+    Appelé par le watcher en repli, quand son cache known-senders est indisponible.
+
     Retourne : {"is_known": true/false}
     """
-    # Vérification du secret
-    auth = request.headers.get("x-watcher-secret", "")
-    if not settings.WATCHER_SECRET or not hmac.compare_digest(auth, settings.WATCHER_SECRET):
-        raise HTTPException(status_code=403, detail="Secret invalide")
-    
-    # Normalisation email
-    normalized, canonical = normalize_email(email)
-    
-    # Liste des variantes à chercher
-    variants = list(set([email.lower(), normalized, canonical]))
-    
-    log.debug(f"[watcher/check-sender] Recherche email={email} variants={variants}")
-    
-    # Recherche en base avec toutes les variantes
-    exists = db.query(models.TenantFile).filter(
-        models.TenantFile.agency_id == agency_id,
-        or_(*[
-            models.TenantFile.candidate_email == variant
-            for variant in variants
-        ])
-    ).first() is not None
-    
+    _check_watcher_secret(request)
+
+    exists = (await db.execute(
+        select(models.TenantFile.id).where(
+            models.TenantFile.agency_id == agency_id,
+            models.TenantFile.normalized_email == canonical_email(email),
+        ).limit(1)
+    )).first() is not None
+
     log.info(f"[watcher/check-sender] email={email} agency={agency_id} is_known={exists}")
-    
-    return {"is_known": exists}
\ No newline at end of file
+
+    return {"is_known": exists}
+
+
+# ── GET /watcher/known-senders ────────────────────────────────────────────────
+
+@router.get("/known-senders")
+async def list_known_senders(
+    agency_id: int,
+    request: Request,
+    since: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Clés canoniques des candidats connus d'une agence, pour le cache local du
+    watcher. `since` : seuls les dossiers modifiés depuis (synchro incrémentale).
+
+    Retourne : {"senders": [...], "cursor": <updated_at max | since>}
+    """
+    _check_watcher_secret(request)
+
+    query = select(models.TenantFile.normalized_email, models.TenantFile.updated_at).where(
+        models.TenantFile.agency_id == agency_id,
+        models.TenantFile.normalized_email.isnot(None),
+    )
+    if since is not None:
+        query = query.where(models.TenantFile.updated_at >= since)
+    rows = (await db.execute(query)).all()
+
+    cursor = max((updated_at for _, updated_at in rows), default=since)
+    log.info(f"[watcher/known-senders] agency={agency_id} since={since} → {len(rows)} expéditeur(s)")
+    return {
+        "senders": sorted({key for key, _ in rows}),
+        "cursor": cursor.isoformat() if cursor else None,
+    }
@@ -21,6 +21,20 @@ class Settings:
 
     # ── Base de données ────────────────────────────────
     DATABASE_URL: str = os.getenv("DATABASE_URL", "")
+    # Profil de pool : "api" | "worker" | "maintenance" (cf. database.POOL_PROFILES)
+    DB_POOL_PROFILE: str = os.getenv("DB_POOL_PROFILE", "api").strip().lower()
+    # Surcharges optionnelles du profil
+    DB_POOL_SIZE: int | None = int(os.getenv("DB_POOL_SIZE")) if os.getenv("DB_POOL_SIZE") else None
+    DB_MAX_OVERFLOW: int | None = int(os.getenv("DB_MAX_OVERFLOW")) if os.getenv("DB_MAX_OVERFLOW") else None
+    DB_POOL_TIMEOUT: int | None = int(os.getenv("DB_POOL_TIMEOUT")) if os.getenv("DB_POOL_TIMEOUT") else None
+    DB_POOL_RECYCLE: int | None = int(os.getenv("DB_POOL_RECYCLE")) if os.getenv("DB_POOL_RECYCLE") else None
+    # Derrière PgBouncer (mode transaction) : caches de prepared statements désactivés
+    DB_PGBOUNCER: bool = os.getenv("DB_PGBOUNCER", "false").strip().lower() == "true"
+    # Réplique en lecture (optionnelle) : routes de lecture seule via get_read_db
+    DATABASE_REPLICA_URL: str = os.getenv("DATABASE_REPLICA_URL", "").strip()
+    # Retard de réplication toléré avant repli sur le primaire, et fréquence de mesure
+    DB_REPLICA_MAX_LAG_SECONDS: float = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "5"))
+    DB_REPLICA_LAG_CHECK_SECONDS: float = float(os.getenv("DB_REPLICA_LAG_CHECK_SECONDS", "5"))
 
     # ── Redis / RQ ─────────────────────────────────────
     REDIS_URL: str = os.getenv("REDIS_URL", "")
@@ -61,6 +75,34 @@ class Settings:
     R2_BUCKET_NAME: str = os.getenv("R2_BUCKET_NAME", "cipherflow-uploads")
     R2_ENDPOINT_URL: str = os.getenv("R2_ENDPOINT_URL", "")
 
+    # ── Export ZIP ─────────────────────────────────────
+    # Téléchargements R2 parallèles par export (pool borné)
+    EXPORT_PREFETCH_WORKERS: int = int(os.getenv("EXPORT_PREFETCH_WORKERS", "4"))
+    # Durée de validité du lien de téléchargement d'un export groupé
+    EXPORT_TTL_HOURS: int = int(os.getenv("EXPORT_TTL_HOURS", "24"))
+
+    # ── Dashboard ──────────────────────────────────────
+    # Durée de cache des KPIs /dashboard/stats (par processus)
+    DASHBOARD_STATS_TTL_SECONDS: int = int(os.getenv("DASHBOARD_STATS_TTL_SECONDS", "15"))
+    # Profondeur d'historique des agrégats journaliers (séries temporelles)
+    STATS_DAILY_RETENTION_DAYS: int = int(os.getenv("STATS_DAILY_RETENTION_DAYS", "730"))
+
+    # ── Worker emails ──────────────────────────────────
+    # Verrou par candidat (agence + expéditeur) : un job à la fois par candidat.
+    # TTL > durée max d'un job ; attente max avant re-planification du job
+    # (à garder très en deçà du job_timeout RQ, 180 s par défaut).
+    EMAIL_CANDIDATE_LOCK_TTL_SECONDS: int = int(os.getenv("EMAIL_CANDIDATE_LOCK_TTL_SECONDS", "600"))
+    EMAIL_CANDIDATE_LOCK_WAIT_SECONDS: int = int(os.getenv("EMAIL_CANDIDATE_LOCK_WAIT_SECONDS", "10"))
+
+    # Durée de mémorisation des clés d'idempotence du webhook (re-soumissions du watcher)
+    WEBHOOK_IDEMPOTENCY_TTL_SECONDS: int = int(os.getenv("WEBHOOK_IDEMPOTENCY_TTL_SECONDS", str(7 * 24 * 3600)))
+    # Réservation avant enqueue : 2× le timeout HTTP du watcher (60 s)
+    WEBHOOK_IDEMPOTENCY_PENDING_TTL_SECONDS: int = int(os.getenv("WEBHOOK_IDEMPOTENCY_PENDING_TTL_SECONDS", "120"))
+
+    # ── Rétention RGPD ─────────────────────────────────
+    # FileAnalysis supprimés (et commités) par lot lors du cleanup
+    RETENTION_BATCH_SIZE: int = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+
     # ── Validation prod ────────────────────────────────
     def validate(self):
         if self.ENV in ("prod", "production"):
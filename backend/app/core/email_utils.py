@@ -0,0 +1,25 @@
+# app/core/email_utils.py
+"""
+Normalisation des adresses email candidat.
+
+canonical_email() donne la clé sous laquelle un candidat est rattaché à son
+dossier (TenantFile.normalized_email) :
+- casse et espaces ignorés
+- alias « + » retirés (user+annonce@x.fr → user@x.fr)
+- Gmail / Googlemail : points du local-part ignorés
+"""
+
+GMAIL_DOMAINS = ("gmail.com", "googlemail.com")
+
+
+def canonical_email(email: str) -> str:
+    if not email:
+        return ""
+    email = email.strip().lower()
+    local, _, domain = email.partition("@")
+    if not domain:
+        return email
+    local = local.split("+")[0]
+    if domain in GMAIL_DOMAINS:
+        local = local.replace(".", "")
+    return f"{local}@{domain}"
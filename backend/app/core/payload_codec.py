@@ -0,0 +1,68 @@
+# app/core/payload_codec.py
+"""
+Encodage compact des emails entre le watcher, le webhook et la queue RQ.
+
+- Corps HTTP : le backend annonce `Accept-Encoding: gzip, identity` sur toutes
+  ses réponses webhook ; le watcher n'envoie `Content-Encoding: gzip` qu'après
+  cette annonce (un backend antérieur ne l'annonce pas et répondrait 422 à un
+  corps gzip). Tout autre codage reçoit un 415.
+- Jobs RQ : les pièces jointes sont stockées en octets bruts (`content`) au
+  lieu de base64 (+33 %). RQ compresse déjà `job.data` (zlib) : recompresser
+  le payload n'apporterait rien, retirer le base64 si.
+
+Chiffres mesurés : scripts/benchmark_transport.py.
+"""
+
+import base64
+import zlib
+from typing import Any, Dict, Optional
+
+SUPPORTED_CONTENT_ENCODINGS = ("gzip", "identity")
+ACCEPT_ENCODING = ", ".join(SUPPORTED_CONTENT_ENCODINGS)
+
+# Borne du corps décompressé (protection contre les « zip bombs »)
+MAX_DECODED_BODY_BYTES = 64 * 1024 * 1024
+
+
+class UnsupportedContentEncoding(ValueError):
+    pass
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+def decode_body(body: bytes, content_encoding: Optional[str]) -> bytes:
+    """Corps HTTP brut → JSON (octets), selon l'en-tête Content-Encoding."""
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return body
+    if encoding != "gzip":
+        raise UnsupportedContentEncoding(f"Content-Encoding non supporté : '{encoding}'")
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        decoded = decompressor.decompress(body, MAX_DECODED_BODY_BYTES)
+    except zlib.error as e:
+        raise ValueError(f"Corps gzip invalide : {e}")
+    if decompressor.unconsumed_tail:
+        raise BodyTooLarge(f"Corps décompressé > {MAX_DECODED_BODY_BYTES // (1024 * 1024)} Mo")
+    return decoded
+
+
+def compact_job_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Payload webhook → payload de job : pièces jointes décodées en octets bruts."""
+    attachments = []
+    for att in payload.get("attachments") or []:
+        att = dict(att)
+        if "content_base64" in att:
+            att["content"] = base64.b64decode(att.pop("content_base64") or "")
+        attachments.append(att)
+    return {**payload, "attachments": attachments}
+
+
+def attachment_bytes(att: Dict[str, Any]) -> bytes:
+    """Contenu d'une pièce jointe, qu'elle vienne d'un job compact ou d'un ancien job (base64)."""
+    if att.get("content") is not None:
+        return att["content"]
+    return base64.b64decode(att.get("content_base64") or "")
@@ -8,6 +8,7 @@ Utilitaires sécurité CipherFlow :
 - Envoi emails système (verification, reset)
 """
 
+import functools
 import hashlib
 import logging
 import os
@@ -48,6 +49,12 @@ def decrypt_bytes(data: bytes) -> bytes:
 
 # ── Fernet (chiffrement tokens DB) ────────────────────────────────────────────
 
+@functools.lru_cache(maxsize=4)
+def _token_fernet(key: str) -> Fernet:
+    # Une instance par clé (dérivation + validation de clé faites une seule fois)
+    return Fernet(key.encode())
+
+
 def fernet_encrypt_str(value: str) -> str:
     """Chiffre une chaîne avec FERNET_KEY (stockage tokens en DB).
     Retourne la valeur en clair si la clé n'est pas configurée (dev).
@@ -56,8 +63,7 @@ def fernet_encrypt_str(value: str) -> str:
     key = (app_settings.FERNET_KEY or "").strip()
     if not key:
         return value
-    f = Fernet(key.encode() if isinstance(key, str) else key)
-    return f.encrypt(value.encode()).decode()
+    return _token_fernet(key).encrypt(value.encode()).decode()
 
 
 def fernet_decrypt_str(encrypted: str) -> str:
@@ -70,8 +76,7 @@ def fernet_decrypt_str(encrypted: str) -> str:
     if not key:
         return encrypted
     try:
-        f = Fernet(key.encode() if isinstance(key, str) else key)
-        return f.decrypt(encrypted.encode()).decode()
+        return _token_fernet(key).decrypt(encrypted.encode()).decode()
     except Exception:
         return ""
 
@@ -1,6 +1,20 @@
+import logging
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from app.core.config import settings
+
+log = logging.getLogger(__name__)
 
 # 1. Configuration de l'URL
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -11,22 +25,333 @@ if not DATABASE_URL:
 if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-# 2. Création du Moteur
+DATABASE_REPLICA_URL = settings.DATABASE_REPLICA_URL
+if DATABASE_REPLICA_URL.startswith("postgres://"):
+    DATABASE_REPLICA_URL = DATABASE_REPLICA_URL.replace("postgres://", "postgresql://", 1)
+
+
+# 2. Profils de pool par type de process
+# api         : requêtes HTTP concurrentes (uvicorn)
+# worker      : un job RQ à la fois par process → petit pool
+# maintenance : worker dédié à la rétention (longues transactions, peu de connexions)
+# Chaque valeur est surchargeable via settings (DB_POOL_SIZE, DB_MAX_OVERFLOW…).
+POOL_PROFILES = {
+    "api":         {"pool_size": 10, "max_overflow": 10, "pool_timeout": 10, "pool_recycle": 1800},
+    "worker":      {"pool_size": 2,  "max_overflow": 2,  "pool_timeout": 30, "pool_recycle": 1800},
+    "maintenance": {"pool_size": 1,  "max_overflow": 1,  "pool_timeout": 60, "pool_recycle": 1800},
+}
+SLOW_CHECKOUT_WARN_SECONDS = 1.0
+
+
+def pool_settings(profile: str) -> dict:
+    if profile not in POOL_PROFILES:
+        log.warning(f"[db] Profil de pool inconnu '{profile}' — profil 'api' utilisé")
+        profile = "api"
+    cfg = dict(POOL_PROFILES[profile])
+    overrides = {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+    }
+    cfg.update({k: v for k, v in overrides.items() if v is not None})
+    return cfg
+
+
+def pgbouncer_connect_args(url: str) -> dict:
+    """
+    Derrière PgBouncer en mode transaction, les prepared statements côté
+    serveur ne survivent pas d'une transaction à l'autre : on désactive les
+    caches de statements des drivers qui en ont un.
+    psycopg2 n'en utilise pas — rien à faire.
+    """
+    if "+asyncpg" in url:
+        return {"statement_cache_size": 0, "prepared_statement_cache_size": 0}
+    if "+psycopg" in url and "+psycopg2" not in url:
+        return {"prepare_threshold": None}
+    return {}
+
+
+# 3. Instrumentation du pool
+class PoolStats:
+    """Compteurs du pool (process courant) : attente au checkout, timeouts, pic."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total_s = 0.0
+        self.wait_max_s = 0.0
+        self.checked_out_peak = 0
+
+    def record_wait(self, seconds: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.wait_total_s += seconds
+            self.wait_max_s = max(self.wait_max_s, seconds)
+
+    def record_checked_out(self, n: int) -> None:
+        with self._lock:
+            self.checked_out_peak = max(self.checked_out_peak, n)
+
+
+class _InstrumentedPoolMixin:
+    """Mesure le temps d'attente d'une connexion libre (pools à file)."""
+
+    stats: PoolStats
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except Exception:
+            self.stats.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        waited = time.perf_counter() - started
+        self.stats.record_wait(waited)
+        self.stats.record_checked_out(self.checkedout())
+        if waited > SLOW_CHECKOUT_WARN_SECONDS:
+            log.warning(
+                f"[db] Attente connexion {waited:.2f}s — pool saturé "
+                f"({self.checkedout()} en cours, overflow={self.overflow()})"
+            )
+        return conn
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    stats = PoolStats()
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    stats = PoolStats()
+
+
+class InstrumentedReplicaPool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    stats = PoolStats()
+
+
+def _pool_snapshot(pool) -> dict:
+    if not isinstance(pool, _InstrumentedPoolMixin):
+        return {"pool": type(pool).__name__}
+    stats = pool.stats
+    return {
+        "pool_size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "checked_out_peak": stats.checked_out_peak,
+        "checkouts": stats.checkouts,
+        "timeouts": stats.timeouts,
+        "wait_avg_ms": round(stats.wait_total_s / stats.checkouts * 1000, 3) if stats.checkouts else 0.0,
+        "wait_max_ms": round(stats.wait_max_s * 1000, 3),
+    }
+
+
+def pool_metrics() -> dict:
+    """Instantané des pools (sync + async + réplique) pour /admin/db-pool."""
+    metrics = {
+        "profile": DB_POOL_PROFILE,
+        **_pool_snapshot(engine.pool),
+        "async": _pool_snapshot(async_engine.pool),
+    }
+    if replica_engine is not None:
+        metrics["replica"] = {**_pool_snapshot(replica_engine.pool), **_replica_state}
+    return metrics
+
+
+def async_database_url(url: str) -> str:
+    """
+    URL du driver async équivalent : asyncpg pour Postgres, aiosqlite pour SQLite.
+    asyncpg ne comprend pas `sslmode` (libpq) : converti en `ssl`.
+    """
+    u = make_url(url)
+    if u.get_backend_name() == "sqlite":
+        return u.set(drivername="sqlite+aiosqlite").render_as_string(hide_password=False)
+    if u.get_backend_name() == "postgresql":
+        query = dict(u.query)
+        if "sslmode" in query:
+            query["ssl"] = query.pop("sslmode")
+        return u.set(drivername="postgresql+asyncpg", query=query).render_as_string(hide_password=False)
+    return url
+
+
+# 4. Création du Moteur
+DB_POOL_PROFILE = settings.DB_POOL_PROFILE
+DB_PGBOUNCER = settings.DB_PGBOUNCER
+
 if DATABASE_URL.startswith("sqlite"):
     engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 else:
-    engine = create_engine(DATABASE_URL)
+    engine = create_engine(
+        DATABASE_URL,
+        poolclass=InstrumentedQueuePool,
+        pool_pre_ping=True,   # connexions coupées (redeploy Postgres, idle timeout) → reconnexion transparente
+        connect_args=pgbouncer_connect_args(DATABASE_URL) if DB_PGBOUNCER else {},
+        **pool_settings(DB_POOL_PROFILE),
+    )
+    log.info(f"[db] Pool '{DB_POOL_PROFILE}' : {pool_settings(DB_POOL_PROFILE)} pgbouncer={DB_PGBOUNCER}")
 
-# 3. Session
+# 5. Moteur async (routes de lecture FastAPI — ne bloque pas la boucle d'événements)
+ASYNC_DATABASE_URL = async_database_url(DATABASE_URL)
+if DATABASE_URL.startswith("sqlite"):
+    async_engine = create_async_engine(ASYNC_DATABASE_URL)
+else:
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_pre_ping=True,
+        connect_args=pgbouncer_connect_args(ASYNC_DATABASE_URL) if DB_PGBOUNCER else {},
+        **pool_settings(DB_POOL_PROFILE),
+    )
+
+# 6. Réplique en lecture (optionnelle, async uniquement)
+replica_engine = None
+if DATABASE_REPLICA_URL:
+    ASYNC_REPLICA_URL = async_database_url(DATABASE_REPLICA_URL)
+    if DATABASE_REPLICA_URL.startswith("sqlite"):
+        replica_engine = create_async_engine(ASYNC_REPLICA_URL)
+    else:
+        replica_engine = create_async_engine(
+            ASYNC_REPLICA_URL,
+            poolclass=InstrumentedReplicaPool,
+            pool_pre_ping=True,
+            connect_args=pgbouncer_connect_args(ASYNC_REPLICA_URL) if DB_PGBOUNCER else {},
+            **pool_settings(DB_POOL_PROFILE),
+        )
+    log.info(f"[db] Réplique en lecture activée (retard max {settings.DB_REPLICA_MAX_LAG_SECONDS}s)")
+
+# 7. Sessions
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False : pas de lazy-load implicite (interdit en async) après commit
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+ReplicaAsyncSessionLocal = (
+    async_sessionmaker(replica_engine, autoflush=False, expire_on_commit=False)
+    if replica_engine is not None else None
+)
 
-# 4. Base (Le socle commun)
+# 8. Base (Le socle commun)
 Base = declarative_base()
 
-# 5. Dépendance
+
+# 9. Santé de la réplique
+# Sur un standby Postgres : 0 si tout le WAL reçu est rejoué (primaire inactif),
+# sinon l'âge de la dernière transaction rejouée.
+REPLICA_LAG_SQL = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+_replica_state = {"healthy": False, "lag_s": None, "checked_at": None}
+
+
+async def replica_lag_seconds(db) -> float | None:
+    """Retard de réplication en secondes (None si inconnu). 0 hors Postgres."""
+    if db.bind.dialect.name != "postgresql":
+        return 0.0
+    lag = (await db.execute(REPLICA_LAG_SQL)).scalar()
+    return float(lag) if lag is not None else None
+
+
+async def use_replica() -> bool:
+    """
+    True si la réplique peut servir les lectures : configurée, joignable et
+    en retard de moins de DB_REPLICA_MAX_LAG_SECONDS. Mesure mise en cache
+    DB_REPLICA_LAG_CHECK_SECONDS pour ne pas doubler chaque requête.
+    """
+    if ReplicaAsyncSessionLocal is None:
+        return False
+    now = time.monotonic()
+    checked_at = _replica_state["checked_at"]
+    if checked_at is not None and now - checked_at < settings.DB_REPLICA_LAG_CHECK_SECONDS:
+        return _replica_state["healthy"]
+
+    try:
+        async with ReplicaAsyncSessionLocal() as db:
+            lag = await replica_lag_seconds(db)
+        healthy = lag is not None and lag <= settings.DB_REPLICA_MAX_LAG_SECONDS
+    except Exception as e:
+        log.warning(f"[db] Réplique injoignable — lectures sur le primaire : {e}")
+        lag, healthy = None, False
+
+    if healthy != _replica_state["healthy"]:
+        log.info(f"[db] Réplique {'utilisée' if healthy else 'écartée'} (retard={lag})")
+    _replica_state.update(healthy=healthy, lag_s=lag, checked_at=now)
+    return healthy
+
+
+# 10. Dépendances
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db():
+    """
+    Session async pour les routes de lecture à fort trafic.
+    Le code synchrone (services, worker RQ) continue d'utiliser get_db / SessionLocal.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_read_db():
+    """
+    Session async de lecture seule : réplique si disponible et à jour,
+    primaire sinon. Ne jamais écrire via cette session.
+    """
+    factory = ReplicaAsyncSessionLocal if await use_replica() else AsyncSessionLocal
+    async with factory() as db:
+        yield db
+
+
+# 11. Mesure par job (worker)
+# Compteurs du job courant : commits, requêtes et temps passé en base.
+# ContextVar → isolé par job / tâche asyncio, sans coût hors d'un track_db_usage().
+_db_usage: ContextVar[Optional[dict]] = ContextVar("db_usage", default=None)
+
+
+@contextmanager
+def track_db_usage():
+    """
+    Mesure l'activité base du bloc : {"commits", "statements", "db_ms"}.
+    db_ms = temps cumulé d'exécution des requêtes (hors attente du pool).
+    Les mesures imbriquées sont aussi comptées dans la mesure englobante.
+    """
+    parent = _db_usage.get()
+    usage = {"commits": 0, "statements": 0, "db_ms": 0.0}
+    token = _db_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _db_usage.reset(token)
+        if parent is not None:
+            for k, v in usage.items():
+                parent[k] += v
+        usage["db_ms"] = round(usage["db_ms"], 1)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _usage_before_execute(conn, cursor, statement, parameters, context, executemany):
+    if _db_usage.get() is not None:
+        conn.info.setdefault("usage_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _usage_after_execute(conn, cursor, statement, parameters, context, executemany):
+    usage = _db_usage.get()
+    started = conn.info.get("usage_started")
+    if usage is not None and started:
+        usage["statements"] += 1
+        usage["db_ms"] += (time.perf_counter() - started.pop()) * 1000
+
+
+@event.listens_for(Engine, "commit")
+def _usage_commit(conn):
+    usage = _db_usage.get()
+    if usage is not None:
+        usage["commits"] += 1
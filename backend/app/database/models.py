@@ -1,11 +1,14 @@
 from datetime import datetime
 import enum
+import json
 
 from sqlalchemy import (
-    Column, Integer, String, Boolean,
-    DateTime, ForeignKey, Text, Enum,
+    BigInteger, Column, Integer, String, Boolean,
+    Date, DateTime, ForeignKey, Text, Enum, Index, text,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates
+
+from app.core.email_utils import canonical_email
 
 from .database import Base
 
@@ -188,8 +191,9 @@ class AppSettings(Base):
 class EmailAnalysis(Base):
     __tablename__ = "email_analyses"
 
-    id = Column(Integer, primary_key=True, index=True)
-    agency_id = Column(Integer, ForeignKey("agencies.id"), index=True)
+    id = Column(Integer, primary_key=True)   # clé primaire déjà indexée
+    # Pas d'index mono-colonne : préfixe de ix_email_analyses_agency_created_id
+    agency_id = Column(Integer, ForeignKey("agencies.id"))
     sender_email = Column(String)
     subject = Column(String)
     is_devis = Column(Boolean, default=False)
@@ -212,6 +216,12 @@ class EmailAnalysis(Base):
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
+    __table_args__ = (
+        # Pagination keyset de /email/history, derniers emails du dashboard :
+        # (agency_id, created_at DESC, id DESC) ; sert aussi tout filtre agency_id seul
+        Index("ix_email_analyses_agency_created_id", "agency_id", "created_at", "id"),
+    )
+
 
 # ============================================================
 # 📄 DOCUMENTS ANALYSÉS
@@ -220,12 +230,16 @@ class EmailAnalysis(Base):
 class FileAnalysis(Base):
     __tablename__ = "file_analyses"
 
-    id = Column(Integer, primary_key=True, index=True)
-    agency_id = Column(Integer, ForeignKey("agencies.id"), index=True)
+    id = Column(Integer, primary_key=True)   # clé primaire déjà indexée
+    # agency_id / file_hash : couverts par les index composites (recherches toujours par agence)
+    agency_id = Column(Integer, ForeignKey("agencies.id"))
     owner_id = Column(Integer, ForeignKey("users.id"))
     filename = Column(String)
     file_type = Column(String)
-    file_hash = Column(String, index=True, nullable=True)
+    file_hash = Column(String, nullable=True)
+    # Clé de l'objet R2 (stockage adressé par contenu). NULL = fichier historique
+    # stocké directement sous `filename`.
+    storage_key = Column(String, nullable=True, index=True)
     sender = Column(String)
     extracted_date = Column(String)
     amount = Column(String)
@@ -233,6 +247,37 @@ class FileAnalysis(Base):
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
+    __table_args__ = (
+        # Listing /api/files/history : pagination keyset + filtres type / date
+        Index("ix_file_analyses_agency_id_id", "agency_id", "id"),
+        Index("ix_file_analyses_agency_type_id", "agency_id", "file_type", "id"),
+        Index("ix_file_analyses_agency_created", "agency_id", "created_at"),
+        # Déduplication des pièces jointes (_process_attachment)
+        Index("ix_file_analyses_agency_hash", "agency_id", "file_hash"),
+    )
+
+
+# ============================================================
+# 📦 OBJETS R2 ADRESSÉS PAR CONTENU
+# ============================================================
+
+class StoredObject(Base):
+    """
+    Un objet R2 par contenu distinct (clé dérivée du SHA-256).
+    ref_count = nombre de FileAnalysis qui pointent vers l'objet ;
+    l'objet n'est supprimé de R2 que lorsque le compteur tombe à 0.
+    """
+    __tablename__ = "stored_objects"
+
+    id = Column(Integer, primary_key=True, index=True)
+    file_hash = Column(String(64), unique=True, index=True, nullable=False)
+    object_key = Column(String, unique=True, nullable=False)
+    ref_count = Column(Integer, default=1, nullable=False)
+    size = Column(Integer, nullable=True)
+    content_type = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
 
 # ============================================================
 # 🗂️ DOSSIER LOCATAIRE
@@ -241,31 +286,85 @@ class FileAnalysis(Base):
 class TenantFile(Base):
     __tablename__ = "tenant_files"
 
-    id = Column(Integer, primary_key=True, index=True)
-    agency_id = Column(Integer, ForeignKey("agencies.id"), index=True, nullable=False)
+    id = Column(Integer, primary_key=True)   # clé primaire déjà indexée
+    # Pas d'index mono-colonne sur agency_id / candidate_email : couverts par les
+    # index composites ci-dessous (toutes les recherches sont filtrées par agence)
+    agency_id = Column(Integer, ForeignKey("agencies.id"), nullable=False)
     status = Column(Enum(TenantFileStatus), default=TenantFileStatus.NEW, nullable=False)
-    candidate_email = Column(String, index=True, nullable=True)
+    candidate_email = Column(String, nullable=True)
+    # Clé canonique de l'expéditeur (canonical_email), tenue à jour par _sync_normalized_email
+    normalized_email = Column(String, nullable=True)
     candidate_name = Column(String, nullable=True)
-    checklist_json = Column(Text, nullable=True)
+    # Compteurs de documents rattachés, par type (checklist incrémentale, cf. tenant_service)
+    doc_id_count = Column(Integer, default=0, server_default="0", nullable=False)
+    doc_payslip_count = Column(Integer, default=0, server_default="0", nullable=False)
+    doc_tax_count = Column(Integer, default=0, server_default="0", nullable=False)
+    doc_work_contract_count = Column(Integer, default=0, server_default="0", nullable=False)
+    doc_address_proof_count = Column(Integer, default=0, server_default="0", nullable=False)
+    doc_bank_count = Column(Integer, default=0, server_default="0", nullable=False)
     risk_level = Column(String, nullable=True)
     is_closed = Column(Boolean, default=False, nullable=False)
     closed_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
+    __table_args__ = (
+        # Listing /tenant-files : pagination keyset + filtres statut / date / préfixe email
+        Index("ix_tenant_files_agency_id_id", "agency_id", "id"),
+        Index("ix_tenant_files_agency_status_id", "agency_id", "status", "id"),
+        Index("ix_tenant_files_agency_created", "agency_id", "created_at"),
+        Index(
+            "ix_tenant_files_agency_email_prefix", "agency_id", "candidate_email",
+            postgresql_ops={"candidate_email": "varchar_pattern_ops"},
+        ),
+        # ensure_tenant_file : au plus un dossier OUVERT par candidat — index
+        # unique partiel (cible de l'upsert ON CONFLICT), les dossiers clos
+        # (la majorité avec le temps) n'y figurent pas
+        Index(
+            "uq_tenant_files_open_agency_email", "agency_id", "candidate_email",
+            unique=True,
+            postgresql_where=text("is_closed = false"),
+            sqlite_where=text("is_closed = 0"),
+        ),
+        # Expéditeur connu (check-sender, known-senders du watcher)
+        Index("ix_tenant_files_agency_normalized_email", "agency_id", "normalized_email"),
+    )
+
     agency = relationship("Agency", back_populates="tenant_files")
     email_links = relationship("TenantEmailLink", back_populates="tenant_file", cascade="all, delete-orphan")
     document_links = relationship("TenantDocumentLink", back_populates="tenant_file", cascade="all, delete-orphan")
 
+    @validates("candidate_email")
+    def _sync_normalized_email(self, key, value):
+        self.normalized_email = canonical_email(value) or None
+        return value
+
+    @property
+    def checklist(self) -> dict:
+        """Checklist dérivée des compteurs (aucun parcours des liens)."""
+        from app.services.tenant_service import build_checklist
+        return build_checklist(self)
+
+    @property
+    def checklist_json(self) -> str:
+        # Format historique (texte JSON) conservé pour l'API et le frontend
+        return json.dumps(self.checklist)
+
 
 class TenantEmailLink(Base):
     __tablename__ = "tenant_email_links"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)   # clé primaire déjà indexée
     tenant_file_id = Column(Integer, ForeignKey("tenant_files.id"), index=True, nullable=False)
-    email_analysis_id = Column(Integer, ForeignKey("email_analyses.id"), index=True, nullable=False)
+    # Pas d'index mono-colonne : préfixe de ix_tenant_email_links_email_tenant
+    email_analysis_id = Column(Integer, ForeignKey("email_analyses.id"), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
+    __table_args__ = (
+        # email → dossier (historique, ensure_email_link) : index-only
+        Index("ix_tenant_email_links_email_tenant", "email_analysis_id", "tenant_file_id"),
+    )
+
     tenant_file = relationship("TenantFile", back_populates="email_links")
     email = relationship("EmailAnalysis")
 
@@ -273,18 +372,84 @@ class TenantEmailLink(Base):
 class TenantDocumentLink(Base):
     __tablename__ = "tenant_document_links"
 
-    id = Column(Integer, primary_key=True, index=True)
-    tenant_file_id = Column(Integer, ForeignKey("tenant_files.id"), index=True, nullable=False)
+    id = Column(Integer, primary_key=True)   # clé primaire déjà indexée
+    # Pas d'index mono-colonne : préfixe de ix_tenant_document_links_tenant_file
+    tenant_file_id = Column(Integer, ForeignKey("tenant_files.id"), nullable=False)
     file_analysis_id = Column(Integer, ForeignKey("file_analyses.id"), index=True, nullable=False)
     doc_type = Column(Enum(TenantDocType), default=TenantDocType.OTHER, nullable=False)
     quality = Column(Enum(DocQuality), default=DocQuality.OK, nullable=False)
     notes = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
+    __table_args__ = (
+        # Rattachement / détachement d'un document à un dossier
+        Index("ix_tenant_document_links_tenant_file", "tenant_file_id", "file_analysis_id"),
+    )
+
     tenant_file = relationship("TenantFile", back_populates="document_links")
     file = relationship("FileAnalysis")
 
 
+# ============================================================
+# 📦 EXPORT GROUPÉ DE DOSSIERS (job RQ)
+# ============================================================
+
+class ExportJob(Base):
+    __tablename__ = "export_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    agency_id = Column(Integer, ForeignKey("agencies.id"), nullable=False, index=True)
+    requested_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+    # Valeurs possibles : "pending" | "running" | "success" | "failed"
+    status = Column(String, default="pending", nullable=False)
+    filters_json = Column(Text, nullable=True)
+    total_dossiers = Column(Integer, default=0, nullable=False)
+    processed_dossiers = Column(Integer, default=0, nullable=False)
+    object_key = Column(String, nullable=True)
+    size_bytes = Column(BigInteger, nullable=True)   # archives > 2 Gio
+    download_token = Column(String, unique=True, index=True, nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+    error = Column(Text, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+# ============================================================
+# 📊 COMPTEURS DASHBOARD (rollup incrémental)
+# ============================================================
+
+class AgencyStatCounter(Base):
+    """
+    Compteur agrégé par agence, tenu à jour par les hooks ORM de stats_service
+    et recalé périodiquement. `key` précise la métrique (catégorie, statut…),
+    chaîne vide pour un total.
+    """
+    __tablename__ = "agency_stat_counters"
+
+    agency_id = Column(Integer, ForeignKey("agencies.id"), primary_key=True)
+    metric = Column(String, primary_key=True)
+    key = Column(String, primary_key=True, default="")
+    value = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class AgencyDailyStat(Base):
+    """
+    Agrégat journalier par agence (séries temporelles du dashboard).
+    Compte le trafic reçu : n'est pas décrémenté quand les lignes sources
+    sont supprimées (rétention RGPD), seulement purgé après STATS_DAILY_RETENTION_DAYS.
+    """
+    __tablename__ = "agency_daily_stats"
+
+    agency_id = Column(Integer, ForeignKey("agencies.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    metric = Column(String, primary_key=True)
+    key = Column(String, primary_key=True, default="")
+    value = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
 # ============================================================
 # 🚫 BLACKLIST PERSONNALISÉE PAR AGENCE
 # ============================================================
@@ -37,6 +37,7 @@ from app.api.outlook_oauth_routes import router as outlook_router
 from app.api.watcher_routes import router as watcher_router
 from app.api.admin_routes import router as admin_router
 from app.api.feedback_routes import router as feedback_router
+from app.api.export_routes import router as export_router
 from app.services.retention_service import retention_worker
 from app.services.heartbeat_service import heartbeat_monitor
 
@@ -116,6 +117,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
     allow_headers=["Content-Type", "Authorization", "X-Watcher-Secret"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # ── OAuth Google ───────────────────────────────────────────────────────────────
@@ -142,6 +144,46 @@ class WebhookEmailPayload(BaseModel):
     filter_decision: Optional[str] = None
     filter_reasons: Optional[List[str]] = None
     filter_score: Optional[int] = None
+    # « provider:boîte:message_id » — une re-soumission du même message n'est pas retraitée
+    idempotency_key: Optional[str] = None
+
+
+@app.middleware("http")
+async def advertise_webhook_encodings(request: Request, call_next):
+    """
+    Annonce les Content-Encoding acceptés sur toutes les réponses webhook (y
+    compris les erreurs) : le watcher ne compresse qu'après cette annonce.
+    """
+    response = await call_next(request)
+    if request.url.path.startswith("/webhook/"):
+        from app.core.payload_codec import ACCEPT_ENCODING
+
+        response.headers["Accept-Encoding"] = ACCEPT_ENCODING
+    return response
+
+
+async def _read_webhook_json(request: Request) -> Any:
+    """Corps JSON du watcher, éventuellement compressé (Content-Encoding: gzip)."""
+    import json
+    from app.core import payload_codec
+
+    try:
+        body = payload_codec.decode_body(await request.body(), request.headers.get("Content-Encoding"))
+    except payload_codec.UnsupportedContentEncoding as e:
+        raise HTTPException(415, str(e), headers={"Accept-Encoding": payload_codec.ACCEPT_ENCODING})
+    except payload_codec.BodyTooLarge as e:
+        raise HTTPException(413, str(e))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    try:
+        return json.loads(body)
+    except ValueError as e:
+        raise HTTPException(422, f"JSON invalide : {e}")
+
+
+def _alias_from(to_email: str) -> str:
+    """inbox+alias@domaine → alias (email_alias de l'agence)."""
+    return to_email.split("@")[0].split("+")[-1] if to_email else ""
 
 
 @app.post("/webhook/email")
@@ -156,20 +198,34 @@ async def email_webhook(request: Request):
     if not hmac.compare_digest(auth, WATCHER_SECRET):
         raise HTTPException(403, "Webhook non autorisé")
 
+    raw = await _read_webhook_json(request)
     try:
-        raw = await request.json()
         payload_model = WebhookEmailPayload(**raw)
     except Exception as e:
         raise HTTPException(422, f"Payload webhook invalide : {e}")
 
     payload: Dict[str, Any] = payload_model.model_dump()
 
+    # ── Déduplication (re-soumission après timeout / crash du watcher) ────────
+    from app.services import idempotency_service
+
+    redis_url = os.getenv("REDIS_URL", "redis://localhost:6379")
+    r = redis.from_url(redis_url)
+    idem_key = payload.get("idempotency_key")
+    claimed, existing_job_id = idempotency_service.claim(r, idem_key)
+    if not claimed:
+        if existing_job_id == idempotency_service.PENDING:
+            # Premier envoi encore en cours : le watcher réessaiera (message non marqué lu)
+            raise HTTPException(409, "Email déjà en cours de soumission")
+        log.info(f"[webhook] Doublon ignoré {idem_key} → job {existing_job_id}")
+        return {"status": "duplicate", "job_id": existing_job_id}
+
     # ── Résolution agency_id depuis to_email ──────────────────────────────────
     if payload.get("agency_id") is None:
         db = SessionLocal()
         try:
             to_email = payload.get("to_email", "")
-            alias = to_email.split("@")[0].split("+")[-1] if to_email else ""
+            alias = _alias_from(to_email)
             agency = None
             if alias:
                 agency = db.query(Agency).filter(Agency.email_alias == alias).first()
@@ -182,24 +238,133 @@ async def email_webhook(request: Request):
             payload["agency_id"] = agency.id
             log.info(f"[webhook] agency_id résolu : {payload['agency_id']} (alias='{alias}')")
         except HTTPException:
+            idempotency_service.release(r, idem_key)
             raise
         except Exception as e:
+            idempotency_service.release(r, idem_key)
             log.error(f"[webhook] Erreur résolution agency_id : {e}")
             raise HTTPException(status_code=500, detail="Erreur interne lors de la résolution de l'agence.")
         finally:
             db.close()
 
+    from app.core.payload_codec import compact_job_payload
     from app.tasks import process_email_job
 
-    redis_url = os.getenv("REDIS_URL", "redis://localhost:6379")
-    r = redis.from_url(redis_url)
     q = Queue("emails", connection=r)
-    job = q.enqueue(process_email_job, payload)
+    try:
+        job = q.enqueue(process_email_job, compact_job_payload(payload))
+    except Exception:
+        idempotency_service.release(r, idem_key)
+        raise
+    idempotency_service.record_job(r, idem_key, job.id)
 
     log.info(f"[webhook] Job enqueued sur queue 'emails' : {job.id} | agency_id={payload.get('agency_id')}")
     return {"status": "queued", "job_id": job.id}
 
 
+WEBHOOK_BATCH_MAX_EMAILS = 50
+
+
+@app.post("/webhook/emails:batch")
+async def email_webhook_batch(request: Request):
+    """
+    Lot d'emails du watcher (un cycle de polling) : validation email par email,
+    alias résolus en une requête, déduplication et enqueue en pipelines Redis.
+    Statut par email (même ordre que la requête) :
+      queued | duplicate (job d'origine) | pending (premier envoi en cours) | invalid.
+    Le watcher ne marque lus que les emails queued / duplicate.
+    """
+    import hmac
+    import redis
+    from rq import Queue
+    from app.database.database import SessionLocal
+    from app.core.payload_codec import compact_job_payload
+    from app.database.models import Agency
+    from app.services import idempotency_service
+    from app.tasks import process_email_job
+
+    auth = request.headers.get("X-Watcher-Secret", "")
+    if not hmac.compare_digest(auth, WATCHER_SECRET):
+        raise HTTPException(403, "Webhook non autorisé")
+
+    body = await _read_webhook_json(request)
+    try:
+        items = body["emails"]
+        if not isinstance(items, list):
+            raise TypeError("'emails' doit être une liste")
+    except Exception as e:
+        raise HTTPException(422, f"Payload batch invalide : {e}")
+    if len(items) > WEBHOOK_BATCH_MAX_EMAILS:
+        raise HTTPException(422, f"Lot trop volumineux : {len(items)} emails (max {WEBHOOK_BATCH_MAX_EMAILS})")
+
+    results: List[Dict[str, Any]] = [{"index": i} for i in range(len(items))]
+    payloads: Dict[int, Dict[str, Any]] = {}
+    for i, item in enumerate(items):
+        try:
+            payloads[i] = WebhookEmailPayload(**item).model_dump()
+        except Exception as e:
+            results[i].update(status="invalid", error=f"Payload webhook invalide : {e}")
+
+    # ── Résolution des alias (une requête pour le lot) ────────────────────────
+    aliases = {i: _alias_from(p["to_email"]) for i, p in payloads.items() if p.get("agency_id") is None}
+    if aliases:
+        db = SessionLocal()
+        try:
+            agency_ids = dict(
+                db.query(Agency.email_alias, Agency.id)
+                .filter(Agency.email_alias.in_({a for a in aliases.values() if a}))
+                .all()
+            )
+        except Exception as e:
+            log.error(f"[webhook] Erreur résolution agency_id (lot) : {e}")
+            raise HTTPException(status_code=500, detail="Erreur interne lors de la résolution de l'agence.")
+        finally:
+            db.close()
+        for i, alias in aliases.items():
+            if alias in agency_ids:
+                payloads[i]["agency_id"] = agency_ids[alias]
+            else:
+                log.warning(f"[webhook] Alias '{alias}' non résolu (lot, index={i}) — rejeté")
+                results[i].update(status="invalid", error=f"Alias email inconnu : '{alias}'")
+                del payloads[i]
+
+    # ── Déduplication puis enqueue (un pipeline Redis) ────────────────────────
+    r = redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379"))
+    indices = list(payloads)
+    keys = [payloads[i].get("idempotency_key") for i in indices]
+    to_enqueue = []
+    for i, (claimed, job_id) in zip(indices, idempotency_service.claim_many(r, keys)):
+        if claimed:
+            to_enqueue.append(i)
+        elif job_id == idempotency_service.PENDING:
+            results[i].update(status="pending")
+        else:
+            results[i].update(status="duplicate", job_id=job_id)
+
+    if to_enqueue:
+        q = Queue("emails", connection=r)
+        pipe = r.pipeline()
+        try:
+            jobs = q.enqueue_many(
+                [Queue.prepare_data(process_email_job, args=(compact_job_payload(payloads[i]),)) for i in to_enqueue],
+                pipeline=pipe,
+            )
+            for i, job in zip(to_enqueue, jobs):
+                idempotency_service.record_job(pipe, payloads[i].get("idempotency_key"), job.id)
+            pipe.execute()
+        except Exception:
+            idempotency_service.release(r, *(payloads[i].get("idempotency_key") for i in to_enqueue))
+            raise
+        for i, job in zip(to_enqueue, jobs):
+            results[i].update(status="queued", job_id=job.id)
+
+    log.info(
+        f"[webhook] Lot de {len(items)} email(s) : {len(to_enqueue)} enqueued, "
+        f"{len(items) - len(to_enqueue)} non enqueued (doublons / invalides)"
+    )
+    return {"results": results}
+
+
 # ── Routers ────────────────────────────────────────────────────────────────────
 app.include_router(auth_router)
 app.include_router(admin_router)
@@ -213,6 +378,7 @@ app.include_router(tenant_router)
 app.include_router(invoice_router)
 app.include_router(settings_router)
 app.include_router(feedback_router)
+app.include_router(export_router)
 
 
 @app.get("/health")
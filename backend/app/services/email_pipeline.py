@@ -5,38 +5,50 @@ Orchestrateur du pipeline email CipherFlow.
 Ordre d'exécution :
   1. Analyse pièces jointes (indépendantes, erreur isolée)
   2. Analyse email (Mistral)
-  3. Sauvegarde EmailAnalysis
+  3. Sauvegarde EmailAnalysis + pièces jointes
   4. Création / récupération dossier locataire
   5. Lien email ↔ dossier
   6. Attachement documents ↔ dossier
   7. Recalcul checklist
   8. Génération réponse (avec état réel du dossier)
   9. Sauvegarde réponse + envoi éventuel
+
+Unité de travail : aucune écriture pendant les appels Mistral (étapes 1-2),
+puis deux transactions —
+  • phase « ingestion » (étapes 3-7, un commit) : l'email devient visible
+    en processing_status="processing". Les contenus des pièces jointes sont
+    uploadés dans R2 avant son ouverture : elle ne couvre que des écritures
+    en base. Chaque pièce jointe et le travail dossier sont isolés dans un
+    SAVEPOINT : un échec n'annule que sa partie ;
+  • phase « réponse » (étapes 8-9, un commit) : réponse, envoi et
+    processing_status="success".
+En cas d'erreur après l'ingestion, l'email passe en "failed" (commit dédié).
+Le nombre de commits et le temps passé en base sont journalisés par job.
 """
 
 import asyncio
-import base64
 import hashlib
-import json
 import logging
 import os
 import time
+from dataclasses import dataclass
+from datetime import datetime
 from pathlib import Path
 from typing import List, Optional
 
 from app.core.config import settings
-from app.database.database import SessionLocal
+from app.core.email_utils import canonical_email
+from app.core.payload_codec import attachment_bytes
+from app.database.database import SessionLocal, track_db_usage
 from app.database import models
 from app.database.models import TenantDocType
 from app.services.email_service import analyze_email, generate_reply
 from app.services.document_service import analyze_document, DocumentAnalysisResult
 from app.services.mistral_service import MistralRateLimitError
-from app.services.storage_service import upload_file
+from app.services.storage_service import content_object_key, store_object, upload_content
 from app.services.tenant_service import (
+    apply_email_to_tenant_file,
     ensure_tenant_file,
-    ensure_email_link,
-    attach_files_to_tenant_file,
-    recompute_checklist,
 )
 
 log = logging.getLogger(__name__)
@@ -45,26 +57,37 @@ UPLOAD_DIR = Path(settings.UPLOAD_DIR)
 UPLOAD_DIR.mkdir(exist_ok=True)
 
 
-# ── Normalisation email candidat ───────────────────────────────────────────────
-
-def _normalize_candidate_email(email: str) -> str:
-    if not email:
-        return ""
-    email = email.strip().lower()
-    local, _, domain = email.partition("@")
-    if not domain:
-        return email
-    local = local.split("+")[0]
-    if domain in ("gmail.com", "googlemail.com"):
-        local = local.replace(".", "")
-    return f"{local}@{domain}"
+@dataclass
+class AnalyzedAttachment:
+    """Pièce jointe analysée, pas encore écrite en base (existing_id si doublon)."""
+    filename: str
+    content_type: str
+    file_hash: str
+    raw_bytes: bytes = b""
+    doc_result: Optional[DocumentAnalysisResult] = None
+    existing_id: Optional[int] = None
+    existing_filename: str = ""
+    stored: bool = False     # contenu déjà présent dans R2 (autre fichier, autre agence)
+    uploaded: bool = False   # contenu uploadé par ce job, avant la phase d'ingestion
 
 
 # ── Entrée principale ──────────────────────────────────────────────────────────
 
 async def run_email_pipeline(payload: dict) -> None:
+    with track_db_usage() as usage:
+        try:
+            await _run_email_pipeline(payload)
+        finally:
+            log.info(
+                f"[pipeline] Base : commits={usage['commits']} "
+                f"requêtes={usage['statements']} db_ms={usage['db_ms']}"
+            )
+
+
+async def _run_email_pipeline(payload: dict) -> None:
     db = SessionLocal()
     new_email = None
+    ingested = False
 
     try:
         agency_id: int = payload["agency_id"]
@@ -82,28 +105,28 @@ async def run_email_pipeline(payload: dict) -> None:
             f"subject={subject!r} pj={len(attachments)}"
         )
 
-        # ── ÉTAPE 1 : Analyse pièces jointes ──────────────────────────────────
-        attachment_ids: List[int] = []
-        attachment_summary: str = ""
-        candidate_name_from_docs: Optional[str] = None
-
+        # ── ÉTAPE 1 : Analyse pièces jointes (lecture seule) ──────────────────
+        analyzed: List[AnalyzedAttachment] = []
         for att in attachments:
             try:
-                attachment_id, summary_line, doc_candidate_name = await _process_attachment(
-                    db=db,
-                    att=att,
-                    agency_id=agency_id,
-                    from_email=from_email,
-                )
-                if attachment_id:
-                    attachment_ids.append(attachment_id)
-                    attachment_summary += f"- {summary_line}\n"
-                    if doc_candidate_name and not candidate_name_from_docs:
-                        candidate_name_from_docs = doc_candidate_name
+                item = await _analyze_attachment(db=db, att=att, agency_id=agency_id)
+                if item:
+                    analyzed.append(item)
             except Exception as e:
                 if isinstance(e, MistralRateLimitError):
                     raise
                 log.error(f"[pipeline] PJ échouée ({att.get('filename', '?')}) : {e}")
+        # Termine la transaction de lecture : rien n'est tenu ouvert pendant Mistral
+        db.rollback()
+
+        attachment_summary = "".join(
+            f"- {_summary_line(item)}\n" for item in analyzed
+        )
+        candidate_name_from_docs = next(
+            (item.doc_result.candidate_name for item in analyzed
+             if item.doc_result and item.doc_result.candidate_name),
+            None,
+        )
 
         # ── ÉTAPE 2 : Analyse email ────────────────────────────────────────────
         log.info("[pipeline] Étape 2 : analyse email")
@@ -115,8 +138,29 @@ async def run_email_pipeline(payload: dict) -> None:
             attachment_summary=attachment_summary,
         )
 
-        # ── ÉTAPE 3 : Sauvegarde EmailAnalysis ────────────────────────────────
-        log.info("[pipeline] Étape 3 : sauvegarde email")
+        # ── Upload R2 des nouveaux contenus, aucune transaction ouverte ───────
+        persistable: List[AnalyzedAttachment] = []
+        for item in analyzed:
+            try:
+                _upload_attachment(item)
+                persistable.append(item)
+            except Exception as e:
+                log.error(f"[pipeline] PJ non uploadée ({item.filename}) : {e}")
+
+        # ── PHASE INGESTION (étapes 3-7) : un commit ──────────────────────────
+        log.info("[pipeline] Étape 3 : sauvegarde email et pièces jointes")
+        attachment_ids: List[int] = []
+        for item in persistable:
+            try:
+                with db.begin_nested():
+                    attachment_ids.append(_persist_attachment(db, item, agency_id, from_email))
+            except Exception as e:
+                log.error(f"[pipeline] PJ non sauvegardée ({item.filename}) : {e}")
+                if item.uploaded:
+                    # Pas de suppression : un job concurrent peut référencer la même clé
+                    # (adressée par contenu). Un envoi ultérieur du contenu la réutilise.
+                    log.warning(f"[pipeline] Objet R2 sans référence : {content_object_key(item.file_hash)}")
+
         new_email = models.EmailAnalysis(
             agency_id=agency_id,
             sender_email=from_email,
@@ -134,28 +178,37 @@ async def run_email_pipeline(payload: dict) -> None:
             processing_status="processing",
         )
         db.add(new_email)
-        db.commit()
-        db.refresh(new_email)
-        log.info(f"[pipeline] EmailAnalysis créé id={new_email.id}")
+        db.flush()
 
-        # ── ÉTAPE 4 : Dossier locataire ────────────────────────────────────────
-        log.info("[pipeline] Étape 4 : dossier locataire")
+        log.info("[pipeline] Étapes 4-7 : dossier locataire, liens et checklist")
         candidate_name = email_result.candidate_name or candidate_name_from_docs
-        normalized_email = _normalize_candidate_email(from_email)
-
         tenant_file = None
+        checklist = None
         try:
-            tenant_file = ensure_tenant_file(
-                db=db,
-                agency_id=agency_id,
-                candidate_email=normalized_email,
-                candidate_name=candidate_name,
-            )
+            with db.begin_nested():
+                tenant_file = ensure_tenant_file(
+                    db=db,
+                    agency_id=agency_id,
+                    candidate_email=canonical_email(from_email),
+                    candidate_name=candidate_name,
+                    commit=False,
+                )
+                if tenant_file:
+                    checklist = apply_email_to_tenant_file(
+                        db, tenant_file, new_email.id, attachment_ids, commit=False,
+                    )
         except Exception as e:
-            log.error(f"[pipeline] Erreur création dossier : {e}")
+            tenant_file, checklist = None, None
+            log.error(f"[pipeline] Erreur mise à jour dossier (liens / documents / checklist) : {e}")
+
+        email_id = new_email.id
+        tenant_file_id = tenant_file.id if tenant_file else None
+        db.commit()
+        ingested = True
+        log.info(f"[pipeline] EmailAnalysis créé id={email_id} dossier_id={tenant_file_id}")
 
         # ── Notification email à l'agent ───────────────────────────────────────
-        if tenant_file:
+        if tenant_file_id:
             try:
                 admin = (db.query(models.User)
                            .filter(models.User.agency_id == agency_id,
@@ -168,31 +221,11 @@ async def run_email_pipeline(payload: dict) -> None:
                         from_email=from_email,
                         subject=subject,
                         summary=email_result.summary,
-                        tenant_file_id=tenant_file.id,
+                        tenant_file_id=tenant_file_id,
                     )
             except Exception as e:
                 log.warning(f"[pipeline] Notification agent non envoyée : {e}")
 
-        # ── ÉTAPES 5-7 : Liens et checklist ───────────────────────────────────
-        if tenant_file:
-
-            try:
-                ensure_email_link(db, tenant_file.id, new_email.id)
-            except Exception as e:
-                log.error(f"[pipeline] Erreur lien email : {e}")
-
-            if attachment_ids:
-                try:
-                    attach_files_to_tenant_file(db, tenant_file, attachment_ids)
-                except Exception as e:
-                    log.error(f"[pipeline] Erreur attachement docs : {e}")
-
-            try:
-                db.refresh(tenant_file)
-                recompute_checklist(db, tenant_file)
-            except Exception as e:
-                log.error(f"[pipeline] Erreur recalcul checklist : {e}")
-
         # ── ÉTAPE 8 : Génération réponse ───────────────────────────────────────
         log.info("[pipeline] Étape 8 : génération réponse")
 
@@ -202,16 +235,18 @@ async def run_email_pipeline(payload: dict) -> None:
         payslip_required = 3
         payslip_received = 0
 
-        if tenant_file:
-            try:
-                db.refresh(tenant_file)
-                checklist = json.loads(tenant_file.checklist_json or "{}")
-                received_docs = checklist.get("received", [])
-                missing_docs = checklist.get("missing", [])
-                payslip_required = checklist.get("payslip_required", 3)
-                payslip_received = checklist.get("payslip_received", 0)
-            except Exception as e:
-                log.warning(f"[pipeline] Impossible de lire la checklist : {e}")
+        if checklist:
+            received_docs = checklist["received"]
+            missing_docs = checklist["missing"]
+            payslip_required = checklist["payslip_required"]
+            payslip_received = checklist["payslip_received"]
+
+        # Lectures terminées avant l'appel Mistral
+        app_s = db.query(models.AppSettings).filter(
+            models.AppSettings.agency_id == agency_id
+        ).first()
+        auto_reply_enabled = bool(app_s and app_s.auto_reply_enabled)
+        db.rollback()
 
         reply_result = await generate_reply(
             from_email=from_email,
@@ -229,25 +264,16 @@ async def run_email_pipeline(payload: dict) -> None:
             payslip_received=payslip_received,
         )
 
-        # ── ÉTAPE 9 : Sauvegarde réponse ──────────────────────────────────────
+        # ── PHASE RÉPONSE (étape 9) : un commit ───────────────────────────────
         log.info("[pipeline] Étape 9 : sauvegarde réponse")
-        new_email.suggested_response_text = reply_result.reply
-        db.commit()
 
         # Décide de l'envoi auto selon : payload.send_email OU auto_reply_enabled (settings)
         should_send = send_email  # flag du payload (watcher/manuel)
-        if not should_send and reply_result.reply:
-            try:
-                app_s = db.query(models.AppSettings).filter(
-                    models.AppSettings.agency_id == agency_id
-                ).first()
-                if (app_s and app_s.auto_reply_enabled
-                        and payload.get("filter_decision") == "accept"
-                        and not new_email.reply_sent):
-                    should_send = True
-            except Exception as e:
-                log.warning(f"[pipeline] Erreur lecture auto_reply_enabled : {e}")
+        if (not should_send and reply_result.reply and auto_reply_enabled
+                and payload.get("filter_decision") == "accept"):
+            should_send = True
 
+        reply_sent_at = None
         if should_send and reply_result.reply:
             try:
                 await _send_reply(
@@ -255,21 +281,21 @@ async def run_email_pipeline(payload: dict) -> None:
                     subject=f"Re: {subject}",
                     body=reply_result.reply,
                 )
-                new_email.reply_sent = True
-                from datetime import datetime
-                new_email.reply_sent_at = datetime.utcnow()
-                db.commit()
+                reply_sent_at = datetime.utcnow()
             except Exception as e:
                 log.error(f"[pipeline] Erreur envoi email : {e}")
 
-        from datetime import datetime as _dt
+        new_email.suggested_response_text = reply_result.reply
+        if reply_sent_at:
+            new_email.reply_sent = True
+            new_email.reply_sent_at = reply_sent_at
         new_email.processing_status = "success"
-        new_email.processed_at = _dt.utcnow()
+        new_email.processed_at = datetime.utcnow()
         db.commit()
 
         log.info(
-            f"[pipeline] ✅ SUCCESS email_id={new_email.id} "
-            f"dossier_id={tenant_file.id if tenant_file else 'N/A'} "
+            f"[pipeline] ✅ SUCCESS email_id={email_id} "
+            f"dossier_id={tenant_file_id or 'N/A'} "
             f"docs={len(attachment_ids)}"
         )
 
@@ -277,13 +303,12 @@ async def run_email_pipeline(payload: dict) -> None:
         db.rollback()
         log.error(f"[pipeline] ❌ FATAL ERROR : {e}", exc_info=True)
 
+        # Avant l'ingestion rien n'a été écrit : il n'y a pas d'email à marquer
         try:
-            if new_email and new_email.id:
-                from datetime import datetime as _dt
+            if ingested:
                 new_email.processing_status = "failed"
-                new_email.processed_at = _dt.utcnow()
+                new_email.processed_at = datetime.utcnow()
                 new_email.processing_error = str(e)[:1000]
-                db.add(new_email)
                 db.commit()
         except Exception as inner_e:
             log.error(f"[pipeline] Impossible de marquer l'email en FAILED : {inner_e}")
@@ -296,22 +321,22 @@ async def run_email_pipeline(payload: dict) -> None:
 
 # ── Traitement d'une pièce jointe ──────────────────────────────────────────────
 
-async def _process_attachment(
+async def _analyze_attachment(
     db,
     att: dict,
     agency_id: int,
-    from_email: str,
-) -> tuple[Optional[int], str, Optional[str]]:
-    if not att.get("content_base64"):
-        return None, "", None
+) -> Optional[AnalyzedAttachment]:
+    """Déduplication puis analyse Mistral. N'écrit rien en base."""
+    raw_bytes = attachment_bytes(att)
+    if not raw_bytes:
+        return None
 
-    raw_bytes = base64.b64decode(att["content_base64"])
     filename = att.get("filename", "document")
     content_type = att.get("content_type", "application/pdf")
 
     file_hash = hashlib.sha256(raw_bytes).hexdigest()
     existing = (
-        db.query(models.FileAnalysis)
+        db.query(models.FileAnalysis.id, models.FileAnalysis.filename)
         .filter(
             models.FileAnalysis.agency_id == agency_id,
             models.FileAnalysis.file_hash == file_hash,
@@ -321,7 +346,16 @@ async def _process_attachment(
 
     if existing:
         log.info(f"[pipeline] Doublon détecté ({filename}), réutilisation id={existing.id}")
-        return existing.id, existing.filename, None
+        return AnalyzedAttachment(
+            filename=filename, content_type=content_type, file_hash=file_hash,
+            existing_id=existing.id, existing_filename=existing.filename,
+        )
+
+    stored = (
+        db.query(models.StoredObject.id)
+        .filter(models.StoredObject.file_hash == file_hash)
+        .first()
+    ) is not None
 
     try:
         doc_result = await analyze_document(
@@ -348,14 +382,54 @@ async def _process_attachment(
             f"la checklist ne sera pas mise à jour pour ce document."
         )
 
-    safe_name = f"{agency_id}_{int(time.time())}_{filename}"
-    upload_file(raw_bytes, safe_name, content_type)
-    log.info(f"[pipeline] Fichier uploadé dans R2 : {safe_name}")
+    return AnalyzedAttachment(
+        filename=filename, content_type=content_type, file_hash=file_hash,
+        raw_bytes=raw_bytes, doc_result=doc_result, stored=stored,
+    )
+
+
+def _summary_line(item: AnalyzedAttachment) -> str:
+    if item.existing_id:
+        return item.existing_filename
+    doc_result = item.doc_result
+    return f"{item.filename} ({doc_result.doc_type}) — {doc_result.summary[:80]}"
+
+
+def _upload_attachment(item: AnalyzedAttachment) -> None:
+    """Upload R2 d'un contenu absent du stockage. À appeler hors transaction."""
+    if item.existing_id or item.stored:
+        return
+    storage_key = upload_content(item.raw_bytes, item.file_hash, item.content_type)
+    item.uploaded = True
+    log.info(f"[pipeline] Fichier stocké dans R2 : {item.filename} → {storage_key}")
+
+
+def _persist_attachment(
+    db,
+    item: AnalyzedAttachment,
+    agency_id: int,
+    from_email: str,
+) -> int:
+    """
+    Référence le contenu (StoredObject) et crée le FileAnalysis. Flush
+    seulement : à appeler dans un SAVEPOINT de la phase d'ingestion, après
+    _upload_attachment. Si le contenu `stored` a été libéré entre-temps par
+    un autre job, store_object le ré-uploade (cas rare).
+    """
+    if item.existing_id:
+        return item.existing_id
+
+    doc_result = item.doc_result
+    safe_name = f"{agency_id}_{int(time.time())}_{item.filename}"
+    storage_key = store_object(
+        db, item.raw_bytes, item.file_hash, item.content_type, uploaded=item.uploaded,
+    )
 
     new_file = models.FileAnalysis(
         agency_id=agency_id,
         filename=safe_name,
-        file_hash=file_hash,
+        file_hash=item.file_hash,
+        storage_key=storage_key,
         file_type=doc_result.doc_type,
         summary=doc_result.summary,
         sender=from_email,
@@ -363,16 +437,13 @@ async def _process_attachment(
         amount=doc_result.amount,
     )
     db.add(new_file)
-    db.commit()
-    db.refresh(new_file)
+    db.flush()
 
-    summary_line = f"{filename} ({doc_result.doc_type}) — {doc_result.summary[:80]}"
     log.info(
-        f"[pipeline] PJ traitée : {filename} → "
+        f"[pipeline] PJ traitée : {item.filename} → "
         f"type={doc_result.doc_type} success={doc_result.success} id={new_file.id}"
     )
-
-    return new_file.id, summary_line, doc_result.candidate_name
+    return new_file.id
 
 
 # ── Envoi email via Resend ─────────────────────────────────────────────────────
@@ -0,0 +1,371 @@
+# app/services/export_service.py
+"""
+Export ZIP des dossiers locataires.
+
+- ZIP écrit en flux (zipfile sur un flux non seekable) : chaque entrée est
+  envoyée dès qu'elle est écrite, rien n'est bufferisé en entier.
+- Téléchargements R2 préchargés en parallèle avec un pool borné
+  (au plus EXPORT_PREFETCH_WORKERS * 2 fichiers en mémoire).
+- PDF / images déjà compressés stockés tels quels (ZIP_STORED).
+- Emails et documents liés chargés en deux requêtes (pas de N+1).
+- Export groupé (job RQ) : plusieurs dossiers dans une seule archive R2,
+  pool de téléchargement partagé entre dossiers, progression en base.
+"""
+
+import json
+import logging
+import secrets
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.core.config import settings
+from app.database.models import (
+    EmailAnalysis, ExportJob, FileAnalysis, TenantDocumentLink, TenantEmailLink,
+    TenantFile, TenantFileStatus,
+)
+from app.services.storage_service import download_file, object_key_for, upload_stream
+
+log = logging.getLogger(__name__)
+
+# Formats déjà compressés : les re-deflater coûte du CPU pour ~0 % de gain
+PRECOMPRESSED_EXTENSIONS = {
+    ".pdf", ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".heif",
+    ".zip", ".gz", ".docx", ".xlsx",
+}
+
+
+# ── ZIP en flux ────────────────────────────────────────────────────────────────
+
+class _ChunkSink:
+    """Flux d'écriture non seekable : zipfile y écrit, on vide entre deux entrées."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        out = b"".join(self._chunks)
+        self._chunks.clear()
+        return out
+
+
+def compress_type_for(arcname: str) -> int:
+    if Path(arcname).suffix.lower() in PRECOMPRESSED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def iter_zip(entries: Iterable[Tuple[str, bytes]]) -> Iterator[bytes]:
+    """Génère les octets d'un ZIP au fil des entrées (arcname, data)."""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w") as zf:
+        for arcname, data in entries:
+            zf.writestr(arcname, data, compress_type=compress_type_for(arcname))
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    chunk = sink.drain()
+    if chunk:
+        yield chunk
+
+
+def write_zip(entries: Iterable[Tuple[str, bytes]], fileobj) -> int:
+    """Écrit un ZIP en flux dans `fileobj` (fichier temporaire, upload…). Retourne la taille."""
+    size = 0
+    for chunk in iter_zip(entries):
+        fileobj.write(chunk)
+        size += len(chunk)
+    return size
+
+
+# ── Préchargement R2 ───────────────────────────────────────────────────────────
+
+def prefetch(
+    items: Iterable,
+    key_func: Callable[[object], str],
+    workers: Optional[int] = None,
+    pool: Optional[ThreadPoolExecutor] = None,
+) -> Iterator[Tuple[object, Optional[bytes]]]:
+    """
+    Télécharge les objets R2 de `items` en parallèle et les restitue dans l'ordre.
+    Fenêtre glissante de `workers * 2` téléchargements en vol → mémoire bornée.
+    `pool` permet de partager les threads entre plusieurs appels (export groupé).
+    Un téléchargement en échec donne (item, None).
+    """
+    workers = max(1, workers or settings.EXPORT_PREFETCH_WORKERS)
+    if pool is None:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="r2-prefetch") as own_pool:
+            yield from prefetch(items, key_func, workers, own_pool)
+        return
+
+    window = workers * 2
+    pending: deque = deque()
+    for item in items:
+        key = key_func(item)
+        pending.append((item, key, pool.submit(download_file, key)))
+        if len(pending) >= window:
+            yield _result(*pending.popleft())
+    while pending:
+        yield _result(*pending.popleft())
+
+
+def _result(item, key: str, future) -> Tuple[object, Optional[bytes]]:
+    try:
+        return item, future.result()
+    except Exception as e:
+        log.warning(f"[export] Impossible de télécharger {key}: {e}")
+        return item, None
+
+
+# ── Données d'un dossier ───────────────────────────────────────────────────────
+
+def load_tenant_file_export(db, tf: TenantFile) -> Tuple[list, List[FileAnalysis]]:
+    """Emails (dicts sérialisables) et documents liés au dossier, en deux requêtes."""
+    return load_tenant_files_export(db, [tf.id])[tf.id]
+
+
+def load_tenant_files_export(
+    db, tenant_file_ids: List[int],
+) -> Dict[int, Tuple[list, List[FileAnalysis]]]:
+    """Même chose pour plusieurs dossiers : toujours deux requêtes au total."""
+    data: Dict[int, Tuple[list, List[FileAnalysis]]] = {tid: ([], []) for tid in tenant_file_ids}
+
+    emails = (
+        db.query(TenantEmailLink.tenant_file_id, EmailAnalysis)
+        .join(EmailAnalysis, TenantEmailLink.email_analysis_id == EmailAnalysis.id)
+        .filter(TenantEmailLink.tenant_file_id.in_(tenant_file_ids))
+        .order_by(TenantEmailLink.id)
+        .all()
+    )
+    for tid, ea in emails:
+        data[tid][0].append({
+            "id": ea.id,
+            "sender_email": ea.sender_email,
+            "subject": ea.subject,
+            "category": ea.category,
+            "urgency": ea.urgency,
+            "summary": ea.summary,
+            "received_at": ea.created_at.isoformat() if ea.created_at else None,
+        })
+
+    documents = (
+        db.query(TenantDocumentLink.tenant_file_id, FileAnalysis)
+        .join(FileAnalysis, TenantDocumentLink.file_analysis_id == FileAnalysis.id)
+        .filter(TenantDocumentLink.tenant_file_id.in_(tenant_file_ids))
+        .order_by(TenantDocumentLink.id)
+        .all()
+    )
+    for tid, fa in documents:
+        data[tid][1].append(fa)
+
+    return data
+
+
+def archive_basename(tf: TenantFile) -> str:
+    """Nom de fichier sûr dérivé du candidat (sans extension)."""
+    candidate = tf.candidate_name or tf.candidate_email or f"dossier_{tf.id}"
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in candidate)
+
+
+def document_arcname(fa: FileAnalysis) -> str:
+    ext = Path(fa.filename or "").suffix or ""
+    return f"{fa.file_type or 'document'}_{fa.id}{ext}"
+
+
+def tenant_file_entries(
+    tf: TenantFile,
+    emails_data: list,
+    documents: List[FileAnalysis],
+    fetched: Iterable[Tuple[FileAnalysis, Optional[bytes]]],
+    prefix: str = "",
+) -> Iterator[Tuple[str, bytes]]:
+    """
+    Entrées ZIP d'un dossier : emails.json, documents/, summary.pdf.
+    `fetched` fournit (document, octets) — typiquement prefetch(documents, object_key_for).
+    """
+    yield f"{prefix}emails.json", json.dumps(emails_data, ensure_ascii=False, indent=2).encode()
+
+    for fa, file_bytes in fetched:
+        if file_bytes is not None:
+            yield f"{prefix}documents/{document_arcname(fa)}", file_bytes
+
+    try:
+        yield f"{prefix}summary.pdf", bytes(generate_summary_pdf(tf, emails_data, documents))
+    except Exception as e:
+        log.warning(f"[export] Erreur génération PDF summary: {e}")
+
+
+def generate_summary_pdf(tf, emails_data: list, documents: list) -> bytes:
+    """Génère un PDF de synthèse du dossier locataire."""
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_auto_page_break(auto=True, margin=15)
+
+    pdf.set_font("Helvetica", "B", 16)
+    pdf.cell(0, 10, "Dossier locataire - Resume", ln=True)
+    pdf.set_font("Helvetica", size=11)
+    pdf.ln(4)
+
+    candidate = tf.candidate_name or tf.candidate_email or f"#{tf.id}"
+    status_val = tf.status.value if hasattr(tf.status, "value") else str(tf.status)
+
+    for label, value in [
+        ("Candidat", candidate),
+        ("Email", tf.candidate_email or "-"),
+        ("Statut", status_val),
+        ("Exporte le", datetime.utcnow().strftime("%d/%m/%Y %H:%M") + " UTC"),
+    ]:
+        pdf.cell(40, 8, f"{label} :", ln=False)
+        pdf.cell(0, 8, str(value), ln=True)
+
+    pdf.ln(6)
+    pdf.set_font("Helvetica", "B", 13)
+    pdf.cell(0, 8, f"Emails ({len(emails_data)})", ln=True)
+    pdf.set_font("Helvetica", size=10)
+    for e in emails_data:
+        subj = (e.get("subject") or "(sans sujet)")[:80]
+        sender = e.get("sender_email") or ""
+        pdf.cell(0, 6, f"  - {subj} ({sender})", ln=True)
+        if e.get("summary"):
+            truncated = (e["summary"] or "")[:200]
+            pdf.set_font("Helvetica", "I", 9)
+            pdf.multi_cell(0, 5, f"    {truncated}")
+            pdf.set_font("Helvetica", size=10)
+
+    pdf.ln(4)
+    pdf.set_font("Helvetica", "B", 13)
+    pdf.cell(0, 8, f"Documents ({len(documents)})", ln=True)
+    pdf.set_font("Helvetica", size=10)
+    for d in documents:
+        doc_type = d.file_type or "Document"
+        pdf.cell(0, 6, f"  - {doc_type} — {d.filename}", ln=True)
+        if d.summary:
+            truncated = (d.summary or "")[:200]
+            pdf.set_font("Helvetica", "I", 9)
+            pdf.multi_cell(0, 5, f"    {truncated}")
+            pdf.set_font("Helvetica", size=10)
+
+    return pdf.output()
+
+
+# ── Export groupé (job RQ) ─────────────────────────────────────────────────────
+
+EXPORT_BATCH_SIZE = 100        # dossiers chargés par lot (2 requêtes par lot)
+PROGRESS_COMMIT_EVERY = 10     # fréquence de mise à jour de la progression
+
+
+def bulk_export_query(db, agency_id: int, filters: dict):
+    """Dossiers sélectionnés par les filtres d'un export groupé."""
+    query = db.query(TenantFile).filter(TenantFile.agency_id == agency_id)
+    if filters.get("status"):
+        query = query.filter(TenantFile.status == TenantFileStatus(filters["status"]))
+    if filters.get("created_from"):
+        query = query.filter(TenantFile.created_at >= datetime.fromisoformat(filters["created_from"]))
+    if filters.get("created_to"):
+        query = query.filter(TenantFile.created_at <= datetime.fromisoformat(filters["created_to"]))
+    if not filters.get("include_closed", True):
+        query = query.filter(TenantFile.is_closed == False)
+    return query
+
+
+def run_bulk_export(db, export_job_id: int) -> None:
+    """
+    Construit l'archive d'un export groupé et l'upload dans R2.
+    L'archive est écrite en flux dans un fichier temporaire (mémoire bornée),
+    puis uploadée en multipart.
+    """
+    job = db.query(ExportJob).filter(ExportJob.id == export_job_id).first()
+    if not job:
+        log.warning(f"[export] ExportJob introuvable id={export_job_id}")
+        return
+
+    # Les commits de progression ne doivent pas expirer les dossiers en cours d'écriture
+    db.expire_on_commit = False
+    job.status = "running"
+    db.commit()
+
+    try:
+        filters = json.loads(job.filters_json or "{}")
+        ids = [
+            row[0] for row in
+            bulk_export_query(db, job.agency_id, filters)
+            .with_entities(TenantFile.id)
+            .order_by(TenantFile.id)
+            .all()
+        ]
+        job.total_dossiers = len(ids)
+        job.processed_dossiers = 0
+        db.commit()
+        log.info(f"[export] Job #{job.id} agency={job.agency_id} : {len(ids)} dossier(s)")
+
+        object_key = f"exports/{job.agency_id}/export_{job.id}.zip"
+        workers = settings.EXPORT_PREFETCH_WORKERS
+        with tempfile.TemporaryFile() as tmp, \
+                ThreadPoolExecutor(max_workers=workers, thread_name_prefix="r2-prefetch") as pool:
+            size = write_zip(_bulk_entries(db, job, ids, pool), tmp)
+            tmp.seek(0)
+            upload_stream(tmp, size, object_key, "application/zip")
+
+        now = datetime.utcnow()
+        job.object_key = object_key
+        job.size_bytes = size
+        job.download_token = secrets.token_urlsafe(32)
+        job.expires_at = now + timedelta(hours=settings.EXPORT_TTL_HOURS)
+        job.status = "success"
+        job.finished_at = now
+        db.commit()
+        log.info(f"[export] ✅ Job #{job.id} terminé ({size} octets)")
+
+    except Exception as e:
+        db.rollback()
+        job.status = "failed"
+        job.error = str(e)[:1000]
+        job.finished_at = datetime.utcnow()
+        db.commit()
+        log.error(f"[export] ❌ Job #{job.id} échoué : {e}", exc_info=True)
+        raise
+
+
+def _bulk_entries(db, job: ExportJob, ids: List[int], pool) -> Iterator[Tuple[str, bytes]]:
+    processed = 0
+    for start in range(0, len(ids), EXPORT_BATCH_SIZE):
+        batch = ids[start:start + EXPORT_BATCH_SIZE]
+        tenant_files = (
+            db.query(TenantFile).filter(TenantFile.id.in_(batch)).order_by(TenantFile.id).all()
+        )
+        data = load_tenant_files_export(db, batch)
+
+        # Un seul flux de préchargement pour tout le lot : les téléchargements
+        # du dossier suivant démarrent pendant l'écriture du dossier courant
+        all_docs = (fa for tf in tenant_files for fa in data[tf.id][1])
+        fetched = prefetch(all_docs, object_key_for, pool=pool)
+
+        for tf in tenant_files:
+            emails_data, documents = data[tf.id]
+            prefix = f"dossier_{tf.id}_{archive_basename(tf)}/"
+            yield from tenant_file_entries(
+                tf, emails_data, documents,
+                fetched=islice(fetched, len(documents)),
+                prefix=prefix,
+            )
+            processed += 1
+            if processed % PROGRESS_COMMIT_EVERY == 0:
+                job.processed_dossiers = processed
+                db.commit()
+
+    job.processed_dossiers = processed
+    db.commit()
@@ -0,0 +1,105 @@
+# app/services/idempotency_service.py
+"""
+Idempotence du webhook email (watcher → backend).
+
+Le watcher ne marque un message lu qu'après un 200 du webhook : un timeout
+ou un crash entre l'enqueue et le marquage re-soumet le même email, ce qui
+relancerait tout le pipeline Mistral. Chaque soumission porte une clé
+« provider:boîte:message_id » ; la première réserve la clé (SET NX EX) puis
+y enregistre l'id du job RQ, les suivantes reçoivent cet id sans rien enqueuer.
+
+La réservation (« pending ») ne vit que WEBHOOK_IDEMPOTENCY_PENDING_TTL_SECONDS :
+un backend tué entre la réservation et l'enqueue ne bloque l'email que le temps
+d'une nouvelle tentative du watcher. L'id du job est gardé le TTL complet.
+
+Redis indisponible → pas de déduplication (fail-open), l'email est traité.
+"""
+
+import logging
+from typing import List, Optional, Tuple
+
+from app.core.config import settings
+
+log = logging.getLogger(__name__)
+
+IDEMPOTENCY_PREFIX = "cipherflow:webhook:idem:"
+DEDUP_COUNTER_KEY = "cipherflow:webhook:dedup"
+PENDING = "pending"   # clé réservée, job pas encore enqueued
+
+
+def idempotency_key(provider: str, mailbox: str, message_id: str) -> str:
+    return f"{provider}:{(mailbox or '').strip().lower()}:{message_id}"
+
+
+def claim(conn, key: Optional[str]) -> Tuple[bool, Optional[str]]:
+    """
+    (réservée ?, job_id existant). Sans clé ou sans Redis : (True, None).
+    Un doublon dont le premier envoi est encore en cours renvoie (False, "pending").
+    """
+    if not key:
+        return True, None
+    redis_key = IDEMPOTENCY_PREFIX + key
+    try:
+        if conn.set(redis_key, PENDING, nx=True, ex=settings.WEBHOOK_IDEMPOTENCY_PENDING_TTL_SECONDS):
+            return True, None
+        existing = conn.get(redis_key)
+        conn.incr(DEDUP_COUNTER_KEY)
+    except Exception as e:
+        log.warning(f"[idempotency] Redis indisponible ({e}) — pas de déduplication pour {key}")
+        return True, None
+    if isinstance(existing, bytes):
+        existing = existing.decode()
+    return False, existing or PENDING
+
+
+def claim_many(conn, keys: List[Optional[str]]) -> List[Tuple[bool, Optional[str]]]:
+    """claim() pour un lot, en deux allers-retours Redis (pipelines) quel que soit N."""
+    results: List[Tuple[bool, Optional[str]]] = [(True, None)] * len(keys)
+    indexed = [(i, k) for i, k in enumerate(keys) if k]
+    if not indexed:
+        return results
+    try:
+        pipe = conn.pipeline(transaction=False)
+        for _, key in indexed:
+            pipe.set(IDEMPOTENCY_PREFIX + key, PENDING, nx=True, ex=settings.WEBHOOK_IDEMPOTENCY_PENDING_TTL_SECONDS)
+        taken = [(i, k) for (i, k), ok in zip(indexed, pipe.execute()) if not ok]
+        if not taken:
+            return results
+        pipe = conn.pipeline(transaction=False)
+        for _, key in taken:
+            pipe.get(IDEMPOTENCY_PREFIX + key)
+        pipe.incrby(DEDUP_COUNTER_KEY, len(taken))
+        existing = pipe.execute()[:-1]
+    except Exception as e:
+        log.warning(f"[idempotency] Redis indisponible ({e}) — pas de déduplication pour le lot")
+        return [(True, None)] * len(keys)
+    for (i, _), job_id in zip(taken, existing):
+        if isinstance(job_id, bytes):
+            job_id = job_id.decode()
+        results[i] = (False, job_id or PENDING)
+    return results
+
+
+def record_job(conn, key: Optional[str], job_id: str) -> None:
+    """Associe la clé réservée à l'id du job, TTL porté au TTL complet. `conn` peut être un pipeline."""
+    if not key:
+        return
+    try:
+        conn.set(IDEMPOTENCY_PREFIX + key, job_id, xx=True, ex=settings.WEBHOOK_IDEMPOTENCY_TTL_SECONDS)
+    except Exception as e:
+        log.warning(f"[idempotency] Enregistrement du job impossible pour {key} : {e}")
+
+
+def release(conn, *keys: Optional[str]) -> None:
+    """Libère des clés réservées dont l'enqueue a échoué : le watcher pourra réessayer."""
+    keys = [IDEMPOTENCY_PREFIX + k for k in keys if k]
+    if not keys:
+        return
+    try:
+        conn.delete(*keys)
+    except Exception as e:
+        log.warning(f"[idempotency] Libération impossible pour {keys} : {e}")
+
+
+def dedup_metrics(conn) -> dict:
+    return {"duplicates": int(conn.get(DEDUP_COUNTER_KEY) or 0)}
@@ -0,0 +1,128 @@
+# app/services/job_lock_service.py
+"""
+Sérialisation des jobs email par candidat.
+
+Deux emails du même candidat (agence + expéditeur canonique) ne doivent pas
+être traités en parallèle : ils se disputeraient le dossier, les rattachements
+et la checklist. Les candidats différents, eux, restent traités en parallèle
+par tous les workers de la queue 'emails'.
+
+Verrou Redis par clé (SET NX PX + relâche compare-and-delete) :
+  - le TTL borne l'effet d'un worker tué en plein job ;
+  - un job dont le candidat est déjà en cours attend brièvement le verrou
+    (polling, EMAIL_CANDIDATE_LOCK_WAIT_SECONDS, bien en deçà du job_timeout
+    RQ) puis lève CandidateLockBusy : le job est re-planifié (enqueue_in, voir
+    app.tasks) au lieu d'occuper un slot de worker. Il ne s'exécute jamais
+    sans verrou tant que Redis répond.
+
+Garantie : exclusion mutuelle par candidat, PAS l'ordre d'arrivée. Un job
+re-planifié repasse en fin de queue : un email plus récent du même candidat
+peut prendre le verrou avant lui. Le pipeline ne doit donc pas dépendre de
+l'ordre des emails d'un candidat (upserts, compteurs en SQL).
+
+Métriques d'attente partagées entre workers (hash Redis) : lues par
+GET /admin/email-locks.
+"""
+
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.core.email_utils import canonical_email
+
+log = logging.getLogger(__name__)
+
+CANDIDATE_LOCK_PREFIX = "cipherflow:email-lock:"
+LOCK_STATS_KEY = "cipherflow:email-lock:stats"
+LOCK_POLL_SECONDS = 0.2
+
+# Relâche le verrou seulement s'il nous appartient encore (TTL expiré → repris par un autre job)
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def candidate_lock_key(agency_id, from_email: str) -> str:
+    return f"{CANDIDATE_LOCK_PREFIX}{agency_id}:{canonical_email(from_email)}"
+
+
+class CandidateLockBusy(Exception):
+    """Verrou du candidat toujours tenu après l'attente max : job à re-planifier."""
+
+
+@contextmanager
+def candidate_lock(conn, key: str):
+    """
+    Exécute le bloc en tenant le verrou `key`. Produit le temps d'attente (s).
+    Verrou toujours pris après EMAIL_CANDIDATE_LOCK_WAIT_SECONDS : lève
+    CandidateLockBusy sans exécuter le bloc.
+    Si Redis est indisponible, le bloc s'exécute sans verrou (fail-open).
+    Les autres exceptions (dont JobTimeoutException de RQ) sont propagées.
+    """
+    token = uuid.uuid4().hex
+    ttl_ms = settings.EMAIL_CANDIDATE_LOCK_TTL_SECONDS * 1000
+    started = time.monotonic()
+    acquired = busy = False
+
+    try:
+        while True:
+            if conn.set(key, token, nx=True, px=ttl_ms):
+                acquired = True
+                break
+            if time.monotonic() - started >= settings.EMAIL_CANDIDATE_LOCK_WAIT_SECONDS:
+                busy = True
+                break
+            time.sleep(LOCK_POLL_SECONDS)
+        waited = time.monotonic() - started
+        _record_wait(conn, waited, acquired)
+    except (RedisError, OSError) as e:
+        waited = time.monotonic() - started
+        log.warning(f"[locks] Redis indisponible ({e}) — traitement sans verrou")
+
+    if busy:
+        raise CandidateLockBusy(key)
+
+    if waited >= LOCK_POLL_SECONDS:
+        log.info(f"[locks] {key} : attente {waited:.1f}s (job précédent du même candidat)")
+    try:
+        yield waited
+    finally:
+        if acquired:
+            try:
+                conn.eval(_RELEASE_SCRIPT, 1, key, token)
+            except Exception as e:
+                log.warning(f"[locks] Relâche impossible pour {key} ({e}) — expiration par TTL")
+
+
+def _record_wait(conn, waited: float, acquired: bool) -> None:
+    conn.hincrby(LOCK_STATS_KEY, "jobs", 1)
+    if waited >= LOCK_POLL_SECONDS:
+        conn.hincrby(LOCK_STATS_KEY, "contended", 1)
+        conn.hincrbyfloat(LOCK_STATS_KEY, "wait_ms_total", round(waited * 1000, 1))
+    if not acquired:
+        conn.hincrby(LOCK_STATS_KEY, "timeouts", 1)
+
+
+def lock_metrics(conn) -> dict:
+    """Compteurs cumulés depuis la création du hash (tous workers confondus)."""
+    raw = {
+        (k.decode() if isinstance(k, bytes) else k): float(v)
+        for k, v in (conn.hgetall(LOCK_STATS_KEY) or {}).items()
+    }
+    jobs = int(raw.get("jobs", 0))
+    contended = int(raw.get("contended", 0))
+    wait_total = raw.get("wait_ms_total", 0.0)
+    return {
+        "jobs": jobs,
+        "contended": contended,
+        "timeouts": int(raw.get("timeouts", 0)),
+        "wait_ms_total": round(wait_total, 1),
+        "wait_avg_ms": round(wait_total / contended, 1) if contended else 0.0,
+    }
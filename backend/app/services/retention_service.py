@@ -4,22 +4,43 @@ Nettoyage RGPD périodique.
 
 FIX P0 : suppression des fichiers dans Cloudflare R2 (plus os.remove sur disque).
 FIX P1 : activé par défaut via ENABLE_RETENTION_WORKER=true en prod.
+P2 : suppression par lots (DELETE … RETURNING + DeleteObjects R2), un commit
+     par lot, exécutée hors de la boucle asyncio de l'API.
+P3 : planification distribuée — un seul réplica API par cycle (bail Redis
+     SET NX EX), le travail est découpé en un job RQ par agence (queue
+     'maintenance') exécutable en parallèle par les workers.
 """
 
 import asyncio
 import json
 import logging
 import os
+import uuid
 from datetime import datetime, timedelta
 
+from sqlalchemy import delete
+
+from app.core.config import settings
 from app.database.database import SessionLocal
 from app.database.models import (
-    Agency, AppSettings, EmailAnalysis, FileAnalysis, TenantFile
+    Agency, AppSettings, EmailAnalysis, ExportJob, FileAnalysis,
+    TenantDocumentLink, TenantFile,
 )
-from app.services.storage_service import delete_file as r2_delete
+from app.services.stats_service import purge_daily_stats, reconcile_agency_stats
+from app.services.storage_service import delete_files, release_objects
+from app.services.tenant_service import reconcile_document_counters
 
 log = logging.getLogger(__name__)
 
+RETENTION_INTERVAL_SECONDS = 6 * 60 * 60   # un cycle toutes les 6 heures
+LEADER_POLL_SECONDS = 5 * 60                # fréquence de tentative d'acquisition du bail
+RETENTION_LEASE_KEY = "cipherflow:retention:lease"
+RETENTION_QUEUE = "maintenance"
+AGENCY_JOB_TIMEOUT = 2 * 60 * 60
+
+# Identifiant de ce processus dans le bail (diagnostic uniquement)
+INSTANCE_ID = f"{os.getenv('HOSTNAME', 'local')}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
 DEFAULT_RETENTION_CONFIG = {
     "emails_days": 365,
     "tenant_files_days_after_closure": 365 * 5,
@@ -45,81 +66,205 @@ def get_retention_config(db, agency_id: int) -> dict:
 
 
 def run_retention_cleanup(db) -> None:
+    """Cleanup complet en séquentiel (toutes agences) — usage manuel / scripts."""
     now = datetime.utcnow()
 
-    for agency in db.query(Agency).all():
-        cfg = get_retention_config(db, agency.id)
+    for (agency_id,) in db.query(Agency.id).all():
+        run_agency_retention(db, agency_id, now)
 
-        # ── Emails ────────────────────────────────────────────────────────────
-        cutoff = now - timedelta(days=int(cfg["emails_days"]))
-        deleted_emails = (
-            db.query(EmailAnalysis)
-            .filter(
-                EmailAnalysis.agency_id == agency.id,
-                EmailAnalysis.created_at < cutoff,
-            )
-            .delete(synchronize_session=False)
+    run_global_retention(db, now)
+    log.info("[retention] Cleanup RGPD terminé")
+
+
+def run_agency_retention(db, agency_id: int, now: datetime) -> None:
+    """Applique la politique de rétention d'une agence puis commit."""
+    cfg = get_retention_config(db, agency_id)
+
+    # ── Emails ────────────────────────────────────────────────────────────────
+    cutoff = now - timedelta(days=int(cfg["emails_days"]))
+    deleted_emails = (
+        db.query(EmailAnalysis)
+        .filter(
+            EmailAnalysis.agency_id == agency_id,
+            EmailAnalysis.created_at < cutoff,
         )
-        if deleted_emails:
-            log.info(f"[retention] agency={agency.id} : {deleted_emails} emails supprimés")
+        .delete(synchronize_session=False)
+    )
+    if deleted_emails:
+        log.info(f"[retention] agency={agency_id} : {deleted_emails} emails supprimés")
 
-        # ── FileAnalysis + fichiers R2 ─────────────────────────────────────────
-        cutoff = now - timedelta(days=int(cfg["file_analyses_days"]))
-        old_files = (
-            db.query(FileAnalysis)
+    # ── FileAnalysis + fichiers R2 ─────────────────────────────────────────────
+    cutoff = now - timedelta(days=int(cfg["file_analyses_days"]))
+    deleted_files = purge_file_analyses(db, agency_id, cutoff)
+    if deleted_files:
+        log.info(f"[retention] agency={agency_id} : {deleted_files} fichiers supprimés")
+
+    # ── Anonymisation dossiers fermés ──────────────────────────────────────────
+    cutoff = now - timedelta(days=int(cfg["tenant_files_days_after_closure"]))
+    anonymized = 0
+    for tf in (
+        db.query(TenantFile)
+        .filter(
+            TenantFile.agency_id == agency_id,
+            TenantFile.is_closed == True,
+            TenantFile.closed_at < cutoff,
+        )
+        .all()
+    ):
+        tf.candidate_email = None
+        tf.candidate_name = None
+        tf.risk_level = None
+        anonymized += 1
+
+    if anonymized:
+        log.info(f"[retention] agency={agency_id} : {anonymized} dossiers anonymisés")
+
+    # ── Recalage des compteurs dashboard et documents des dossiers ─────────────
+    # Les suppressions en masse ci-dessus contournent les hooks ORM et detach_document
+    reconcile_agency_stats(db, agency_id)
+    reconcile_document_counters(db, agency_id)
+
+    db.commit()
+
+
+def purge_file_analyses(db, agency_id: int, cutoff: datetime) -> int:
+    """
+    Supprime les FileAnalysis expirés d'une agence par lots de
+    RETENTION_BATCH_SIZE, et leurs objets R2 devenus orphelins.
+
+    Les objets R2 orphelins sont supprimés AVANT le commit du lot, tant que
+    les lignes StoredObject sont verrouillées : un store_object concurrent du
+    même contenu attend le commit, puis ré-uploade et recrée sa ligne. Supprimer
+    après le commit effacerait cet objet tout juste ré-uploadé.
+    Un échec R2 laisse au pire un objet orphelin ; un échec du commit, des
+    FileAnalysis expirés sans fichier, re-purgés au cycle suivant.
+    """
+    total = 0
+    while True:
+        ids = [
+            row.id
+            for row in db.query(FileAnalysis.id)
             .filter(
-                FileAnalysis.agency_id == agency.id,
+                FileAnalysis.agency_id == agency_id,
                 FileAnalysis.created_at < cutoff,
             )
-            .all()
+            .order_by(FileAnalysis.id)
+            .limit(settings.RETENTION_BATCH_SIZE)
+        ]
+        if not ids:
+            return total
+
+        db.execute(
+            delete(TenantDocumentLink).where(TenantDocumentLink.file_analysis_id.in_(ids))
         )
+        rows = db.execute(
+            delete(FileAnalysis)
+            .where(FileAnalysis.id.in_(ids))
+            .returning(FileAnalysis.storage_key, FileAnalysis.filename)
+        ).all()
 
-        for f in old_files:
-            # FIX P0 : suppression dans R2 (plus os.remove)
-            if f.filename:
-                try:
-                    r2_delete(f.filename)
-                    log.info(f"[retention] Fichier supprimé de R2 : {f.filename}")
-                except Exception as e:
-                    log.warning(f"[retention] R2 delete échoué ({f.filename}) : {e}")
-            db.delete(f)
-
-        if old_files:
-            log.info(f"[retention] agency={agency.id} : {len(old_files)} fichiers supprimés")
-
-        # ── Anonymisation dossiers fermés ──────────────────────────────────────
-        cutoff = now - timedelta(days=int(cfg["tenant_files_days_after_closure"]))
-        anonymized = 0
-        for tf in (
-            db.query(TenantFile)
-            .filter(
-                TenantFile.agency_id == agency.id,
-                TenantFile.is_closed == True,
-                TenantFile.closed_at < cutoff,
+        # storage_key absent → fichier historique stocké sous filename
+        orphan_keys = release_objects(db, [r.storage_key or r.filename for r in rows])
+        failed = delete_files(orphan_keys)
+        db.commit()
+        if failed:
+            log.warning(
+                f"[retention] agency={agency_id} : {len(failed)} objet(s) R2 orphelin(s) "
+                f"non supprimé(s) : {failed[:10]}"
             )
-            .all()
-        ):
-            tf.candidate_email = None
-            tf.candidate_name = None
-            tf.risk_level = None
-            anonymized += 1
 
-        if anonymized:
-            log.info(f"[retention] agency={agency.id} : {anonymized} dossiers anonymisés")
+        total += len(rows)
+        log.info(f"[retention] agency={agency_id} : lot de {len(rows)} fichiers supprimé ({total} au total)")
+
+
+def run_global_retention(db, now: datetime) -> None:
+    """Purges non rattachées à une agence : archives d'export, agrégats journaliers. Commit."""
+    purge_expired_exports(db, now)
+
+    horizon = (now - timedelta(days=settings.STATS_DAILY_RETENTION_DAYS)).date()
+    purged = purge_daily_stats(db, horizon)
+    if purged:
+        log.info(f"[retention] {purged} bucket(s) de statistiques journalières antérieurs au {horizon} supprimés")
 
     db.commit()
-    log.info("[retention] Cleanup RGPD terminé")
+
+
+def purge_expired_exports(db, now: datetime) -> None:
+    """Supprime de R2 les archives d'export groupé dont le lien a expiré."""
+    expired = (
+        db.query(ExportJob)
+        .filter(
+            ExportJob.object_key.isnot(None),
+            ExportJob.expires_at < now,
+        )
+        .all()
+    )
+    failed = set(delete_files(job.object_key for job in expired))
+    for job in expired:
+        if job.object_key in failed:
+            continue
+        job.object_key = None
+        job.download_token = None
+
+    if expired:
+        log.info(f"[retention] {len(expired)} archive(s) d'export expirée(s) supprimée(s)")
+
+
+# ── Planification distribuée ───────────────────────────────────────────────────
+
+def acquire_retention_lease(conn) -> bool:
+    """
+    Tente de prendre le bail du cycle courant.
+    Le bail expire de lui-même après RETENTION_INTERVAL_SECONDS : il n'est
+    jamais relâché, c'est sa durée qui cadence les cycles. Si le leader
+    meurt, un autre réplica prend le cycle suivant.
+    """
+    return bool(conn.set(RETENTION_LEASE_KEY, INSTANCE_ID, nx=True, ex=RETENTION_INTERVAL_SECONDS))
+
+
+def schedule_retention_jobs(db, conn) -> int:
+    """Enqueue un job RQ par agence + un job de purge des exports. Retourne le nombre d'agences."""
+    from rq import Queue
+    from app.tasks import retention_agency_job, retention_exports_job
+
+    q = Queue(RETENTION_QUEUE, connection=conn)
+    now_iso = datetime.utcnow().isoformat()
+    agency_ids = [row.id for row in db.query(Agency.id).order_by(Agency.id)]
+
+    # Un job par agence : après un crash de worker, les agences déjà traitées
+    # (jobs terminés) ne sont pas rejouées, seul le job interrompu échoue
+    for agency_id in agency_ids:
+        q.enqueue(
+            retention_agency_job, agency_id, now_iso,
+            job_timeout=AGENCY_JOB_TIMEOUT,
+            description=f"retention agency={agency_id}",
+        )
+    q.enqueue(retention_exports_job, now_iso, description="retention exports")
+    return len(agency_ids)
+
+
+def _schedule_once() -> None:
+    import redis
+
+    db = SessionLocal()
+    try:
+        conn = redis.from_url(settings.REDIS_URL or "redis://localhost:6379")
+        if not acquire_retention_lease(conn):
+            return
+        count = schedule_retention_jobs(db, conn)
+        log.info(f"[retention] Leader {INSTANCE_ID} : {count} job(s) agence planifié(s)")
+    except Exception as e:
+        log.error(f"[retention] Erreur planification : {e}")
+    finally:
+        db.close()
 
 
 async def retention_worker() -> None:
-    """Tourne en tâche de fond toutes les 6 heures."""
+    """
+    Tourne en tâche de fond dans chaque réplica API : toutes les
+    LEADER_POLL_SECONDS, tente de prendre le bail ; seul le détenteur
+    planifie le cycle. Le nettoyage lui-même tourne dans les workers RQ.
+    """
     while True:
-        db = SessionLocal()
-        try:
-            log.info("[retention] Lancement cleanup…")
-            run_retention_cleanup(db)
-        except Exception as e:
-            log.error(f"[retention] Erreur : {e}")
-        finally:
-            db.close()
-        await asyncio.sleep(6 * 60 * 60)
+        await asyncio.to_thread(_schedule_once)
+        await asyncio.sleep(LEADER_POLL_SECONDS)
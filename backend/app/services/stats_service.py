@@ -0,0 +1,450 @@
+# app/services/stats_service.py
+"""
+Statistiques dashboard pré-agrégées.
+
+Les compteurs (table agency_stat_counters) sont mis à jour incrémentalement
+par un hook `after_flush` sur toute Session : chaque création / modification /
+suppression ORM d'un EmailAnalysis ou d'un TenantFile applique son delta dans
+la même transaction (UPSERT additif, sans lecture préalable).
+
+Les suppressions en masse (query.delete, DELETE … RETURNING) contournent les
+hooks : reconcile_agency_stats recalcule les compteurs depuis les tables
+sources, appelé par la rétention à chaque cycle.
+
+Le même hook alimente les agrégats journaliers (agency_daily_stats) lus par
+GET /dashboard/timeseries : une ligne par (agence, jour, métrique, clé).
+"""
+
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import (
+    DateTime, String, and_, cast, event, func, inspect, null, select, union_all,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.database.models import (
+    AgencyDailyStat, AgencyStatCounter, EmailAnalysis, FileAnalysis,
+    TenantFile, TenantFileStatus,
+)
+
+log = logging.getLogger(__name__)
+
+# ── Métriques ──────────────────────────────────────────────────────────────────
+EMAILS_TOTAL = "emails"
+EMAILS_URGENT = "emails_urgent"
+EMAILS_BY_CATEGORY = "emails_category"
+TENANT_FILES_TOTAL = "tenant_files"
+TENANT_FILES_BY_STATUS = "tenant_files_status"
+
+# Agrégats journaliers
+DAILY_EMAILS_BY_CATEGORY = "emails_category"
+DAILY_EMAILS_BY_URGENCY = "emails_urgency"
+DAILY_EMAILS_BY_FILTER = "emails_filter_decision"
+DAILY_DOCUMENTS_BY_TYPE = "documents_type"
+DAILY_TENANT_STATUS_IN = "tenant_status_in"   # transitions vers un statut
+DAILY_METRICS = (
+    DAILY_EMAILS_BY_CATEGORY, DAILY_EMAILS_BY_URGENCY, DAILY_EMAILS_BY_FILTER,
+    DAILY_DOCUMENTS_BY_TYPE, DAILY_TENANT_STATUS_IN,
+)
+MAX_TIMESERIES_DAYS = 366
+DASHBOARD_RECENTS = 5
+
+CounterKey = Tuple[int, str, str]          # (agency_id, metric, key)
+DailyKey = Tuple[int, date, str, str]      # (agency_id, day, metric, key)
+
+
+def is_urgent(urgency) -> bool:
+    """Même règle que l'ancien filtre SQL lower(urgency) LIKE '%urg%'."""
+    return "urg" in (urgency or "").lower()
+
+
+def _status_key(status) -> str:
+    status = status or TenantFileStatus.NEW   # défaut de colonne
+    return status.value if hasattr(status, "value") else status
+
+
+# ── Calcul des deltas ──────────────────────────────────────────────────────────
+
+def _email_keys(agency_id, category, urgency):
+    yield (agency_id, EMAILS_TOTAL, "")
+    yield (agency_id, EMAILS_BY_CATEGORY, category or "")
+    if is_urgent(urgency):
+        yield (agency_id, EMAILS_URGENT, "")
+
+
+def _tenant_file_keys(agency_id, status):
+    yield (agency_id, TENANT_FILES_TOTAL, "")
+    yield (agency_id, TENANT_FILES_BY_STATUS, _status_key(status))
+
+
+def _previous(obj, attr):
+    """Valeur avant flush d'un attribut (ou valeur courante si inchangé)."""
+    hist = inspect(obj).attrs[attr].history
+    if hist.deleted:
+        return hist.deleted[0]
+    return getattr(obj, attr)
+
+
+def collect_deltas(session: Session) -> Counter:
+    deltas: Counter = Counter()
+
+    for obj in session.new:
+        if isinstance(obj, EmailAnalysis) and obj.agency_id:
+            deltas.update(_email_keys(obj.agency_id, obj.category, obj.urgency))
+        elif isinstance(obj, TenantFile) and obj.agency_id:
+            deltas.update(_tenant_file_keys(obj.agency_id, obj.status))
+
+    for obj in session.dirty:
+        if isinstance(obj, EmailAnalysis) and obj.agency_id:
+            if not session.is_modified(obj, include_collections=False):
+                continue
+            deltas.subtract(_email_keys(
+                obj.agency_id, _previous(obj, "category"), _previous(obj, "urgency"),
+            ))
+            deltas.update(_email_keys(obj.agency_id, obj.category, obj.urgency))
+        elif isinstance(obj, TenantFile) and obj.agency_id:
+            if not session.is_modified(obj, include_collections=False):
+                continue
+            deltas.subtract(_tenant_file_keys(obj.agency_id, _previous(obj, "status")))
+            deltas.update(_tenant_file_keys(obj.agency_id, obj.status))
+
+    for obj in session.deleted:
+        if isinstance(obj, EmailAnalysis) and obj.agency_id:
+            deltas.subtract(_email_keys(
+                obj.agency_id, _previous(obj, "category"), _previous(obj, "urgency"),
+            ))
+        elif isinstance(obj, TenantFile) and obj.agency_id:
+            deltas.subtract(_tenant_file_keys(obj.agency_id, _previous(obj, "status")))
+
+    return Counter({k: v for k, v in deltas.items() if v})
+
+
+_UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def _apply_additive(connection, table, rows: List[dict]) -> None:
+    """
+    value = value + delta par ligne. PostgreSQL / SQLite : INSERT … ON CONFLICT
+    DO UPDATE (executemany). Autres dialectes : UPDATE puis INSERT.
+    """
+    insert = _UPSERT_INSERTS.get(connection.dialect.name)
+    if insert is None:
+        _update_then_insert(connection, table, rows)
+        return
+    stmt = insert(table)
+    connection.execute(
+        stmt.on_conflict_do_update(
+            index_elements=list(table.primary_key.columns),
+            set_={
+                "value": table.c.value + stmt.excluded.value,
+                "updated_at": stmt.excluded.updated_at,
+            },
+        ),
+        rows,
+    )
+
+
+def _update_then_insert(connection, table, rows: List[dict]) -> None:
+    """Repli sans UPSERT : UPDATE additif, INSERT si la ligne n'existe pas encore."""
+    for row in rows:
+        update_stmt = (
+            table.update()
+            .where(and_(*(col == row[col.name] for col in table.primary_key.columns)))
+            .values(value=table.c.value + row["value"], updated_at=row["updated_at"])
+        )
+        if connection.execute(update_stmt).rowcount:
+            continue
+        try:
+            with connection.begin_nested():
+                connection.execute(table.insert().values(**row))
+        except IntegrityError:
+            # Ligne créée entre-temps par une autre transaction
+            connection.execute(update_stmt)
+
+
+def apply_deltas(connection, deltas: Counter) -> None:
+    """INSERT … ON CONFLICT DO UPDATE SET value = value + delta (executemany)."""
+    if not deltas:
+        return
+    now = datetime.utcnow()
+    _apply_additive(connection, AgencyStatCounter.__table__, [
+        {"agency_id": a, "metric": m, "key": k, "value": v, "updated_at": now}
+        for (a, m, k), v in deltas.items()
+    ])
+
+
+def apply_daily_deltas(connection, deltas: Counter) -> None:
+    if not deltas:
+        return
+    now = datetime.utcnow()
+    _apply_additive(connection, AgencyDailyStat.__table__, [
+        {"agency_id": a, "day": d, "metric": m, "key": k, "value": v, "updated_at": now}
+        for (a, d, m, k), v in deltas.items()
+    ])
+
+
+def _email_daily_keys(agency_id, day, category, urgency, filter_decision):
+    yield (agency_id, day, DAILY_EMAILS_BY_CATEGORY, category or "")
+    yield (agency_id, day, DAILY_EMAILS_BY_URGENCY, (urgency or "").lower())
+    yield (agency_id, day, DAILY_EMAILS_BY_FILTER, filter_decision or "")
+
+
+def _day(value: Optional[datetime]) -> date:
+    return (value or datetime.utcnow()).date()
+
+
+def collect_daily_deltas(session: Session) -> Counter:
+    """
+    Deltas journaliers. Un email est compté le jour de sa réception ; une
+    reclassification déplace le compte entre clés du même jour. Les
+    suppressions ne décrémentent pas (historique du trafic reçu).
+    """
+    deltas: Counter = Counter()
+    today = datetime.utcnow().date()
+
+    for obj in session.new:
+        if isinstance(obj, EmailAnalysis) and obj.agency_id:
+            deltas.update(_email_daily_keys(
+                obj.agency_id, _day(obj.created_at), obj.category, obj.urgency, obj.filter_decision,
+            ))
+        elif isinstance(obj, FileAnalysis) and obj.agency_id:
+            deltas[(obj.agency_id, _day(obj.created_at), DAILY_DOCUMENTS_BY_TYPE, obj.file_type or "")] += 1
+        elif isinstance(obj, TenantFile) and obj.agency_id:
+            deltas[(obj.agency_id, today, DAILY_TENANT_STATUS_IN, _status_key(obj.status))] += 1
+
+    for obj in session.dirty:
+        if not (getattr(obj, "agency_id", None) and session.is_modified(obj, include_collections=False)):
+            continue
+        if isinstance(obj, EmailAnalysis):
+            day = _day(obj.created_at)
+            deltas.subtract(_email_daily_keys(
+                obj.agency_id, day, _previous(obj, "category"), _previous(obj, "urgency"),
+                _previous(obj, "filter_decision"),
+            ))
+            deltas.update(_email_daily_keys(
+                obj.agency_id, day, obj.category, obj.urgency, obj.filter_decision,
+            ))
+        elif isinstance(obj, TenantFile):
+            old, new = _status_key(_previous(obj, "status")), _status_key(obj.status)
+            if old != new:
+                deltas[(obj.agency_id, today, DAILY_TENANT_STATUS_IN, new)] += 1
+
+    return Counter({k: v for k, v in deltas.items() if v})
+
+
+# active_history : à l'affectation, l'ancienne valeur est chargée même si
+# l'attribut était expiré (cas typique après un commit), sinon l'historique
+# ne permettrait pas de retirer le delta de l'ancienne catégorie / statut.
+for _attr in (
+    EmailAnalysis.category, EmailAnalysis.urgency, EmailAnalysis.filter_decision,
+    TenantFile.status,
+):
+    event.listen(_attr, "set", lambda target, value, oldvalue, initiator: value,
+                 active_history=True, retval=True)
+
+
+@event.listens_for(Session, "after_flush")
+def _update_counters_after_flush(session, flush_context):
+    # L'état pré-flush (new / dirty / deleted + historique) est encore disponible ici
+    deltas = collect_deltas(session)
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+        for agency_id in {a for a, _, _ in deltas}:
+            invalidate_cache(agency_id)
+
+    daily = collect_daily_deltas(session)
+    if daily:
+        apply_daily_deltas(session.connection(), daily)
+
+
+def record_tenant_file_insert(connection, agency_id: int, status=TenantFileStatus.NEW) -> None:
+    """
+    Deltas d'un dossier inséré hors unit of work (upsert Core de
+    ensure_tenant_file, que le hook after_flush ne voit pas).
+    """
+    apply_deltas(connection, Counter(_tenant_file_keys(agency_id, status)))
+    today = datetime.utcnow().date()
+    apply_daily_deltas(connection, Counter({
+        (agency_id, today, DAILY_TENANT_STATUS_IN, _status_key(status)): 1,
+    }))
+    invalidate_cache(agency_id)
+
+
+# ── Recalage ───────────────────────────────────────────────────────────────────
+
+def reconcile_agency_stats(db, agency_id: int) -> None:
+    """
+    Recalcule les compteurs d'une agence depuis les tables sources.
+    Corrige la dérive due aux suppressions en masse. Ne commit pas.
+    """
+    fresh: Counter = Counter()
+
+    for category, urgency, n in (
+        db.query(EmailAnalysis.category, EmailAnalysis.urgency, func.count(EmailAnalysis.id))
+        .filter(EmailAnalysis.agency_id == agency_id)
+        .group_by(EmailAnalysis.category, EmailAnalysis.urgency)
+    ):
+        for key in _email_keys(agency_id, category, urgency):
+            fresh[key] += n
+
+    for status, n in (
+        db.query(TenantFile.status, func.count(TenantFile.id))
+        .filter(TenantFile.agency_id == agency_id)
+        .group_by(TenantFile.status)
+    ):
+        for key in _tenant_file_keys(agency_id, status):
+            fresh[key] += n
+
+    current = {
+        (agency_id, c.metric, c.key): c.value
+        for c in db.query(AgencyStatCounter).filter(AgencyStatCounter.agency_id == agency_id)
+    }
+    drift = Counter({k: fresh.get(k, 0) - v for k, v in current.items()})
+    drift.update({k: v for k, v in fresh.items() if k not in current})
+    drift = Counter({k: v for k, v in drift.items() if v})
+
+    if drift:
+        log.warning(f"[stats] agency={agency_id} : dérive corrigée sur {len(drift)} compteur(s)")
+        apply_deltas(db.connection(), drift)
+        invalidate_cache(agency_id)
+
+
+# ── Lecture (avec cache court) ─────────────────────────────────────────────────
+
+_cache_lock = threading.Lock()
+_cache: Dict[int, Tuple[float, dict]] = {}
+
+
+def invalidate_cache(agency_id: int) -> None:
+    with _cache_lock:
+        _cache.pop(agency_id, None)
+
+
+def _dashboard_stmt(agency_id: int):
+    """
+    Compteurs de l'agence + DASHBOARD_RECENTS derniers emails en un UNION ALL :
+    un seul aller-retour. Colonnes : metric, key, value, subject, urgency,
+    created_at ; une ligne « email récent » a metric NULL, key = catégorie,
+    value = id.
+    """
+    counters = select(
+        AgencyStatCounter.metric, AgencyStatCounter.key, AgencyStatCounter.value,
+        cast(null(), String).label("subject"), cast(null(), String).label("urgency"),
+        cast(null(), DateTime).label("created_at"),
+    ).where(AgencyStatCounter.agency_id == agency_id)
+    recents = (
+        select(
+            EmailAnalysis.category, EmailAnalysis.id, EmailAnalysis.subject,
+            EmailAnalysis.urgency, EmailAnalysis.created_at,
+        )
+        .where(EmailAnalysis.agency_id == agency_id)
+        .order_by(EmailAnalysis.created_at.desc(), EmailAnalysis.id.desc())
+        .limit(DASHBOARD_RECENTS)
+        .subquery()
+    )
+    return union_all(
+        counters,
+        select(
+            cast(null(), String), recents.c.category, recents.c.id,
+            recents.c.subject, recents.c.urgency, recents.c.created_at,
+        ),
+    )
+
+
+def get_agency_stats(db, agency_id: int) -> dict:
+    """
+    KPIs, répartition par catégorie et derniers emails, en une requête
+    (cache DASHBOARD_STATS_TTL_SECONDS).
+    """
+    now = time.monotonic()
+    with _cache_lock:
+        hit = _cache.get(agency_id)
+        if hit and hit[0] > now:
+            return hit[1]
+
+    values: Dict[str, Dict[str, int]] = {}
+    recents: List[dict] = []
+    for metric, key, value, subject, urgency, created_at in db.execute(_dashboard_stmt(agency_id)):
+        if metric is None:
+            recents.append({
+                "id": value, "subject": subject, "category": key,
+                "urgency": urgency, "created_at": created_at,
+            })
+        else:
+            values.setdefault(metric, {})[key] = value
+    # UNION ALL : l'ordre du sous-SELECT n'est pas garanti dans le résultat
+    recents.sort(key=lambda r: (r["created_at"] or datetime.min, r["id"]), reverse=True)
+
+    stats = {
+        "kpis": {
+            "total_emails": values.get(EMAILS_TOTAL, {}).get("", 0),
+            "high_urgency": values.get(EMAILS_URGENT, {}).get("", 0),
+            "tenant_files": values.get(TENANT_FILES_TOTAL, {}).get("", 0),
+            "tenant_files_incomplete": values.get(TENANT_FILES_BY_STATUS, {}).get(
+                TenantFileStatus.INCOMPLETE.value, 0
+            ),
+        },
+        "distribution": [
+            {"name": key or None, "value": n}
+            for key, n in sorted(values.get(EMAILS_BY_CATEGORY, {}).items())
+            if n > 0
+        ],
+        "recents": recents,
+    }
+
+    with _cache_lock:
+        _cache[agency_id] = (now + settings.DASHBOARD_STATS_TTL_SECONDS, stats)
+    return stats
+
+
+# ── Séries temporelles ─────────────────────────────────────────────────────────
+
+def get_timeseries(
+    db,
+    agency_id: int,
+    start: date,
+    end: date,
+    metrics: Iterable[str] = DAILY_METRICS,
+) -> dict:
+    """
+    Séries journalières [start, end] (bornes incluses), une valeur par jour
+    (0 si aucun bucket). Une seule requête par plage de clé primaire.
+    """
+    metrics = list(metrics)
+    days: List[date] = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    index = {d: i for i, d in enumerate(days)}
+
+    series: Dict[str, Dict[str, List[int]]] = {m: {} for m in metrics}
+    rows = (
+        db.query(AgencyDailyStat.day, AgencyDailyStat.metric, AgencyDailyStat.key, AgencyDailyStat.value)
+        .filter(
+            AgencyDailyStat.agency_id == agency_id,
+            AgencyDailyStat.day >= start,
+            AgencyDailyStat.day <= end,
+            AgencyDailyStat.metric.in_(metrics),
+        )
+    )
+    for day, metric, key, value in rows:
+        if not value:
+            continue
+        values = series[metric].setdefault(key, [0] * len(days))
+        values[index[day]] = value
+
+    return {"days": [d.isoformat() for d in days], "series": series}
+
+
+def purge_daily_stats(db, before: date) -> int:
+    """Supprime les buckets journaliers antérieurs à `before` (toutes agences). Ne commit pas."""
+    return (
+        db.query(AgencyDailyStat)
+        .filter(AgencyDailyStat.day < before)
+        .delete(synchronize_session=False)
+    )
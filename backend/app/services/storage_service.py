@@ -5,15 +5,24 @@ Service de stockage Cloudflare R2 via minio-py.
 P1 : client Minio singleton (stable, pas de breaking changes comme boto3).
 P2 : chiffrement Fernet avant upload, déchiffrement après download.
      Les fichiers au repos dans R2 sont illisibles sans la clé FERNET_KEY.
+P3 : stockage adressé par contenu (objects/<sha256[:2]>/<sha256>) avec
+     compteur de références (table stored_objects) : un contenu identique
+     n'est uploadé qu'une fois, toutes agences et tous chemins confondus.
 """
 
 import logging
+import tempfile
 import threading
+from collections import Counter
 from io import BytesIO
+from typing import Iterable, List
 
 from minio import Minio
+from minio.deleteobjects import DeleteObject
+from sqlalchemy.exc import IntegrityError
 
 from app.core.config import settings
+from app.database.models import FileAnalysis, StoredObject
 
 log = logging.getLogger(__name__)
 
@@ -166,10 +175,281 @@ def download_file(filename: str) -> bytes:
     return raw
 
 
+# Flux chiffrés : enregistrements [longueur (4 octets big-endian) | jeton Fernet]
+STREAM_CHUNK_SIZE = 16 * 1024 * 1024
+ENCRYPTED_STREAM_FLAG = "chunked"
+
+
+def upload_stream(
+    fileobj,
+    length: int,
+    filename: str,
+    content_type: str = "application/octet-stream",
+) -> str:
+    """
+    Upload en flux (multipart) d'un gros fichier déjà sur disque — archives d'export.
+    Fernet exige le contenu entier en mémoire : le fichier est donc chiffré par
+    morceaux de STREAM_CHUNK_SIZE (metadata 'encrypted=chunked'), déchiffrés un
+    par un par stream_file. Le flux chiffré transite par un fichier temporaire.
+    """
+    fernet = _get_fernet()
+    encrypted_flag = "0"
+    if fernet:
+        encrypted = tempfile.TemporaryFile()
+        while True:
+            chunk = fileobj.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            token = fernet.encrypt(chunk)
+            encrypted.write(len(token).to_bytes(4, "big"))
+            encrypted.write(token)
+        length = encrypted.tell()
+        encrypted.seek(0)
+        fileobj, encrypted_flag = encrypted, ENCRYPTED_STREAM_FLAG
+
+    client = _get_client()
+    try:
+        client.put_object(
+            bucket_name=settings.R2_BUCKET_NAME.strip(),
+            object_name=filename,
+            data=fileobj,
+            length=length,
+            content_type=content_type,
+            metadata={"encrypted": encrypted_flag},
+            part_size=16 * 1024 * 1024,
+        )
+    finally:
+        if encrypted_flag == ENCRYPTED_STREAM_FLAG:
+            fileobj.close()
+    log.info(f"[storage] Upload R2 (flux, chiffré={encrypted_flag != '0'}) : {filename} ({length} octets)")
+    return filename
+
+
+def _read_exact(response, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        part = response.read(size - len(data))
+        if not part:
+            break
+        data += part
+    return data
+
+
+def _decrypt_stream(response, filename: str):
+    fernet = _get_fernet()
+    if not fernet:
+        raise RuntimeError(f"Fichier '{filename}' chiffré mais FERNET_KEY absent")
+    while True:
+        header = _read_exact(response, 4)
+        if not header:
+            return
+        token = _read_exact(response, int.from_bytes(header, "big"))
+        yield fernet.decrypt(token)
+
+
+def stream_file(filename: str, chunk_size: int = 1024 * 1024):
+    """
+    Générateur d'octets depuis R2, par morceaux.
+    Les fichiers chiffrés d'un bloc (upload_file) sont déchiffrés en entier ;
+    ceux chiffrés par morceaux (upload_stream) le sont morceau par morceau.
+    """
+    client = _get_client()
+    bucket = settings.R2_BUCKET_NAME.strip()
+
+    try:
+        stat = client.stat_object(bucket_name=bucket, object_name=filename)
+        encrypted_flag = (stat.metadata or {}).get("x-amz-meta-encrypted", "0")
+    except Exception:
+        encrypted_flag = "0"
+
+    if encrypted_flag == "1":
+        yield download_file(filename)
+        return
+
+    response = client.get_object(bucket_name=bucket, object_name=filename)
+    try:
+        if encrypted_flag == ENCRYPTED_STREAM_FLAG:
+            yield from _decrypt_stream(response, filename)
+        else:
+            yield from response.stream(chunk_size)
+    finally:
+        response.close()
+        response.release_conn()
+
+
 def delete_file(filename: str) -> None:
     client = _get_client()
     client.remove_object(
         bucket_name=settings.R2_BUCKET_NAME.strip(),
         object_name=filename,
     )
-    log.info(f"[storage] Supprimé de R2 : {filename}")
\ No newline at end of file
+    log.info(f"[storage] Supprimé de R2 : {filename}")
+
+
+# Limite S3 / R2 : 1000 clés par requête DeleteObjects
+DELETE_BATCH_SIZE = 1000
+
+
+def delete_files(filenames: Iterable[str]) -> List[str]:
+    """
+    Suppression groupée (DeleteObjects, 1000 clés par requête).
+    Retourne les clés dont la suppression a échoué.
+    """
+    keys = list(dict.fromkeys(k for k in filenames if k))
+    if not keys:
+        return []
+
+    client = _get_client()
+    bucket = settings.R2_BUCKET_NAME.strip()
+    failed: List[str] = []
+
+    for start in range(0, len(keys), DELETE_BATCH_SIZE):
+        chunk = keys[start:start + DELETE_BATCH_SIZE]
+        try:
+            # remove_objects est paresseux : itérer les erreurs envoie la requête
+            for err in client.remove_objects(bucket, (DeleteObject(k) for k in chunk)):
+                log.warning(f"[storage] Suppression R2 échouée {err.name} : {err.message}")
+                failed.append(err.name)
+        except Exception as e:
+            log.warning(f"[storage] Suppression R2 groupée échouée ({len(chunk)} clés) : {e}")
+            failed.extend(chunk)
+
+    log.info(f"[storage] Supprimés de R2 : {len(keys) - len(failed)}/{len(keys)}")
+    return failed
+
+
+# ── Stockage adressé par contenu ───────────────────────────────────────────────
+
+def content_object_key(file_hash: str) -> str:
+    """Clé R2 déterministe dérivée du SHA-256 du contenu (en clair)."""
+    return f"objects/{file_hash[:2]}/{file_hash}"
+
+
+def object_key_for(file_analysis: FileAnalysis) -> str:
+    """
+    Clé R2 d'un FileAnalysis.
+    Les fichiers historiques (avant stockage adressé) n'ont pas de storage_key :
+    l'objet est alors stocké sous `filename`.
+    """
+    return file_analysis.storage_key or file_analysis.filename
+
+
+def upload_content(
+    file_bytes: bytes,
+    file_hash: str,
+    content_type: str = "application/octet-stream",
+) -> str:
+    """
+    Upload le contenu sous sa clé adressée, sans toucher à la base : à appeler
+    hors transaction, puis store_object(..., uploaded=True) pour la référence.
+    """
+    return upload_file(file_bytes, content_object_key(file_hash), content_type)
+
+
+def store_object(
+    db,
+    file_bytes: bytes,
+    file_hash: str,
+    content_type: str = "application/octet-stream",
+    uploaded: bool = False,
+) -> str:
+    """
+    Ajoute une référence vers le contenu `file_hash` et retourne sa clé R2.
+    Upload uniquement si le contenu n'est pas déjà présent et que l'appelant
+    ne l'a pas déjà fait (uploaded=True, via upload_content).
+
+    Ne commit pas : la référence est validée avec le FileAnalysis de l'appelant.
+    """
+    obj = (
+        db.query(StoredObject)
+        .filter(StoredObject.file_hash == file_hash)
+        .with_for_update()
+        .first()
+    )
+    if obj:
+        obj.ref_count += 1
+        log.info(f"[storage] Contenu déjà présent : {obj.object_key} (refs={obj.ref_count})")
+        return obj.object_key
+
+    object_key = content_object_key(file_hash)
+    if not uploaded:
+        upload_file(file_bytes, object_key, content_type)
+
+    try:
+        with db.begin_nested():
+            db.add(StoredObject(
+                file_hash=file_hash,
+                object_key=object_key,
+                ref_count=1,
+                size=len(file_bytes),
+                content_type=content_type,
+            ))
+    except IntegrityError:
+        # Upload concurrent du même contenu : l'objet R2 est identique,
+        # on ajoute simplement notre référence.
+        db.query(StoredObject).filter(StoredObject.file_hash == file_hash).update(
+            {StoredObject.ref_count: StoredObject.ref_count + 1},
+            synchronize_session=False,
+        )
+    return object_key
+
+
+def release_object(db, object_key: str) -> bool:
+    """
+    Retire une référence vers `object_key` et supprime l'objet R2
+    quand il n'est plus référencé. Retourne True si l'objet a été supprimé.
+
+    Ne commit pas : à valider avec la suppression du FileAnalysis.
+    """
+    obj = (
+        db.query(StoredObject)
+        .filter(StoredObject.object_key == object_key)
+        .with_for_update()
+        .first()
+    )
+    if obj is None:
+        # Fichier historique, non compté : une seule référence possible
+        delete_file(object_key)
+        return True
+
+    obj.ref_count -= 1
+    if obj.ref_count > 0:
+        log.info(f"[storage] Référence retirée : {object_key} (refs={obj.ref_count})")
+        return False
+
+    delete_file(object_key)
+    db.delete(obj)
+    return True
+
+
+def release_objects(db, object_keys: Iterable[str]) -> List[str]:
+    """
+    Version groupée de release_object : retire une référence par occurrence
+    de clé et retourne les clés R2 devenues orphelines, À SUPPRIMER PAR
+    L'APPELANT AVANT commit (via delete_files).
+
+    Les lignes supprimées restent verrouillées jusqu'au commit : un
+    store_object concurrent du même contenu (clé R2 identique, adressée par
+    contenu) attend, puis ré-uploade. Supprimer l'objet R2 après le commit
+    pourrait effacer ce nouvel upload.
+    """
+    counts = Counter(k for k in object_keys if k)
+    if not counts:
+        return []
+
+    to_delete: List[str] = []
+    objs = (
+        db.query(StoredObject)
+        .filter(StoredObject.object_key.in_(list(counts)))
+        .with_for_update()
+        .all()
+    )
+    for obj in objs:
+        obj.ref_count -= counts.pop(obj.object_key)
+        if obj.ref_count <= 0:
+            to_delete.append(obj.object_key)
+            db.delete(obj)
+
+    # Clés restantes : fichiers historiques, non comptés
+    to_delete.extend(counts)
+    return to_delete
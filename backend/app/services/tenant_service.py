@@ -4,18 +4,23 @@ Logique métier des dossiers locataires.
 - Création / récupération d'un dossier
 - Lien email ↔ dossier
 - Attachement documents ↔ dossier (sans doublons)
-- Recalcul checklist et statut
+- Checklist incrémentale (compteurs par type) et statut
 
 Toutes les fonctions prennent une session DB en paramètre.
 Ce service est synchrone (compatible RQ worker).
 """
 
-import json
 import logging
-from typing import List, Optional
+from collections import Counter
+from datetime import datetime
+from typing import List, Optional, Tuple
 
+from sqlalchemy import case, func, insert, literal_column, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
 
+from app.core.email_utils import canonical_email
 from app.database import models
 from app.database.models import (
     TenantFile,
@@ -26,6 +31,7 @@ from app.database.models import (
     FileAnalysis,
     DocQuality,
 )
+from app.services.stats_service import record_tenant_file_insert
 
 log = logging.getLogger(__name__)
 
@@ -67,10 +73,14 @@ def ensure_tenant_file(
     agency_id: int,
     candidate_email: str,
     candidate_name: Optional[str] = None,
+    commit: bool = True,
 ) -> Optional[TenantFile]:
     """
     Récupère ou crée un dossier locataire.
     Identifié de façon unique par : agency_id + candidate_email normalisé.
+    Au plus un dossier ouvert par candidat (index unique partiel) : des workers
+    concurrents convergent sur la même ligne via INSERT … ON CONFLICT.
+    commit=False : flush seulement, l'appelant valide (unité de travail du pipeline).
     """
     email = normalize_email(candidate_email)
 
@@ -78,7 +88,74 @@ def ensure_tenant_file(
         log.warning("[tenant_service] email vide — dossier non créé")
         return None
 
-    tenant_file = (
+    tenant_file, created = _upsert_open_tenant_file(db, agency_id, email, candidate_name)
+    if commit:
+        db.commit()
+    if created:
+        log.info(f"[tenant_service] Nouveau dossier créé id={tenant_file.id} email={email}")
+    else:
+        log.info(f"[tenant_service] Dossier existant id={tenant_file.id}")
+    return tenant_file
+
+
+_UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def _upsert_open_tenant_file(
+    db: Session,
+    agency_id: int,
+    email: str,
+    candidate_name: Optional[str],
+) -> Tuple[TenantFile, bool]:
+    """(dossier ouvert, créé ?) — une requête sous Postgres, création ou non."""
+    dialect = db.get_bind().dialect.name
+    if dialect not in _UPSERT_INSERTS:
+        return _get_or_create_open_tenant_file(db, agency_id, email, candidate_name)
+
+    now = datetime.utcnow()
+    stmt = _UPSERT_INSERTS[dialect](TenantFile).values(
+        agency_id=agency_id,
+        candidate_email=email,
+        normalized_email=canonical_email(email) or None,
+        candidate_name=candidate_name,
+        status=TenantFileStatus.NEW,
+        is_closed=False,
+        created_at=now,
+        updated_at=now,
+    )
+    target = {
+        "index_elements": [TenantFile.agency_id, TenantFile.candidate_email],
+        "index_where": TenantFile.is_closed == False,
+    }
+
+    if dialect == "postgresql":
+        # DO UPDATE (et non DO NOTHING) pour que RETURNING renvoie aussi la
+        # ligne existante ; xmax = 0 ⇔ ligne insérée par cette requête
+        stmt = stmt.on_conflict_do_update(
+            **target,
+            set_={"candidate_name": func.coalesce(TenantFile.candidate_name, stmt.excluded.candidate_name)},
+        ).returning(TenantFile, literal_column("xmax = 0"))
+        tenant_file, created = db.execute(
+            stmt, execution_options={"populate_existing": True},
+        ).one()
+    else:
+        # SQLite : un seul écrivain à la fois — DO NOTHING, puis lecture si le dossier existait
+        tenant_file = db.scalars(stmt.on_conflict_do_nothing(**target).returning(TenantFile)).first()
+        created = tenant_file is not None
+        if not created:
+            tenant_file = _open_tenant_file(db, agency_id, email)
+            if candidate_name and not tenant_file.candidate_name:
+                tenant_file.candidate_name = candidate_name
+                db.flush()
+
+    if created:
+        # Insertion hors unit of work : le hook after_flush des stats ne la voit pas
+        record_tenant_file_insert(db.connection(), agency_id)
+    return tenant_file, created
+
+
+def _open_tenant_file(db: Session, agency_id: int, email: str) -> Optional[TenantFile]:
+    return (
         db.query(TenantFile)
         .filter(
             TenantFile.agency_id == agency_id,
@@ -88,25 +165,30 @@ def ensure_tenant_file(
         .first()
     )
 
+
+def _get_or_create_open_tenant_file(
+    db: Session,
+    agency_id: int,
+    email: str,
+    candidate_name: Optional[str],
+) -> Tuple[TenantFile, bool]:
+    """Repli sans UPSERT : lecture puis création ORM (l'index unique protège des doublons)."""
+    tenant_file = _open_tenant_file(db, agency_id, email)
     if tenant_file:
         if candidate_name and not tenant_file.candidate_name:
             tenant_file.candidate_name = candidate_name
-            db.commit()
-        log.info(f"[tenant_service] Dossier existant id={tenant_file.id}")
-        return tenant_file
+            db.flush()
+        return tenant_file, False
 
     tenant_file = TenantFile(
         agency_id=agency_id,
         candidate_email=email,
         candidate_name=candidate_name,
         status=TenantFileStatus.NEW,
-        checklist_json=json.dumps(_empty_checklist()),
     )
     db.add(tenant_file)
-    db.commit()
-    db.refresh(tenant_file)
-    log.info(f"[tenant_service] Nouveau dossier créé id={tenant_file.id} email={email}")
-    return tenant_file
+    db.flush()
+    return tenant_file, True
 
 
 # ── Lien email ↔ dossier ───────────────────────────────────────────────────────
@@ -116,6 +198,15 @@ def ensure_email_link(
     tenant_file_id: int,
     email_analysis_id: int,
 ) -> None:
+    if _add_email_link(db, tenant_file_id, email_analysis_id):
+        db.commit()
+        log.info(
+            f"[tenant_service] Email lié : email_id={email_analysis_id} "
+            f"→ dossier_id={tenant_file_id}"
+        )
+
+
+def _add_email_link(db: Session, tenant_file_id: int, email_analysis_id: int) -> bool:
     existing = (
         db.query(TenantEmailLink)
         .filter(
@@ -125,62 +216,119 @@ def ensure_email_link(
         .first()
     )
 
-    if not existing:
-        link = TenantEmailLink(
-            tenant_file_id=tenant_file_id,
-            email_analysis_id=email_analysis_id,
-        )
-        db.add(link)
-        db.commit()
-        log.info(
-            f"[tenant_service] Email lié : email_id={email_analysis_id} "
-            f"→ dossier_id={tenant_file_id}"
-        )
+    if existing:
+        return False
+    db.add(TenantEmailLink(tenant_file_id=tenant_file_id, email_analysis_id=email_analysis_id))
+    return True
+
+
+# ── Compteurs de documents ─────────────────────────────────────────────────────
+# Un compteur typé par type de document sur le dossier, tenu à jour à chaque
+# rattachement / détachement : la checklist se calcule sans parcourir les liens.
+# rebuild_checklist() / reconcile_document_counters() recomptent depuis les
+# liens (réparation uniquement, jamais sur un chemin de lecture).
+
+DOC_COUNTER_COLUMNS = {
+    TenantDocType.ID.value: "doc_id_count",
+    TenantDocType.PAYSLIP.value: "doc_payslip_count",
+    TenantDocType.TAX.value: "doc_tax_count",
+    TenantDocType.WORK_CONTRACT.value: "doc_work_contract_count",
+    TenantDocType.ADDRESS_PROOF.value: "doc_address_proof_count",
+    TenantDocType.BANK.value: "doc_bank_count",
+}
+
+
+def _doc_type_value(doc_type) -> str:
+    return doc_type.value if hasattr(doc_type, "value") else str(doc_type)
+
+
+def doc_count(tenant_file: TenantFile, doc_type) -> int:
+    column = DOC_COUNTER_COLUMNS.get(_doc_type_value(doc_type))
+    return (getattr(tenant_file, column) or 0) if column else 0
+
+
+def apply_document_deltas(db: Session, tenant_file: TenantFile, deltas: dict) -> None:
+    """
+    Ajuste les compteurs ({doc_type: delta}) en un seul UPDATE SQL
+    `col = max(col + delta, 0)` : pas de lecture-modification-écriture en
+    Python, des rattachements / détachements concurrents ne perdent aucun
+    incrément. Les valeurs relues (RETURNING) sont reportées sur l'instance.
+    Ne commit pas.
+    """
+    values = {}
+    for doc_type, delta in deltas.items():
+        column = DOC_COUNTER_COLUMNS.get(_doc_type_value(doc_type))
+        if column and delta:
+            col = getattr(TenantFile, column)
+            values[column] = case((col + delta < 0, 0), else_=col + delta)
+    if not values:
+        return
+    row = db.execute(
+        update(TenantFile)
+        .where(TenantFile.id == tenant_file.id)
+        .values(values)
+        .returning(*(getattr(TenantFile, column) for column in values))
+        .execution_options(synchronize_session=False)
+    ).one()
+    for column, value in zip(values, row):
+        set_committed_value(tenant_file, column, value)
+
+
+def apply_document_delta(db: Session, tenant_file: TenantFile, doc_type, delta: int) -> None:
+    """Ajuste le compteur du type (+1 rattachement, -1 détachement). Ne commit pas."""
+    apply_document_deltas(db, tenant_file, {_doc_type_value(doc_type): delta})
+
+
+def has_documents(tenant_file: TenantFile) -> bool:
+    return any(getattr(tenant_file, column) for column in DOC_COUNTER_COLUMNS.values())
 
 
 # ── Attachement documents ──────────────────────────────────────────────────────
 
-def attach_files_to_tenant_file(
+VALID_DOC_TYPES = {e.value for e in TenantDocType}
+
+
+def attach_files_bulk(
     db: Session,
     tenant_file: TenantFile,
     file_ids: List[int],
-) -> None:
+) -> List[int]:
+    """
+    Rattache des documents au dossier en lot : une requête pour les liens
+    existants, une pour les FileAnalysis, un seul INSERT multi-lignes.
+    Compteurs ajustés en un UPDATE SQL. Ne commit pas. Retourne les ids effectivement rattachés.
+    """
     if not file_ids:
-        return
+        return []
 
+    # Doublons exacts : seuls les liens des fichiers candidats sont lus
     existing_file_ids = {
-        link.file_analysis_id
-        for link in tenant_file.document_links
+        file_id for (file_id,) in
+        db.query(TenantDocumentLink.file_analysis_id).filter(
+            TenantDocumentLink.tenant_file_id == tenant_file.id,
+            TenantDocumentLink.file_analysis_id.in_(file_ids),
+        )
     }
-
-    # Compte les fiches de paie déjà présentes
-    existing_payslip_count = sum(
-        1 for link in tenant_file.document_links
-        if link.doc_type.value == TenantDocType.PAYSLIP.value
-    )
-
-    # Types uniques déjà présents (hors payslip)
-    existing_unique_types = {
-        link.doc_type.value
-        for link in tenant_file.document_links
-        if link.doc_type.value in UNIQUE_DOC_TYPES
+    files = {
+        fa.id: fa for fa in
+        db.query(FileAnalysis).filter(FileAnalysis.id.in_(file_ids))
     }
 
-    for file_id in file_ids:
+    links = []
+    added: Counter = Counter()   # rattachements de ce lot, par type
+    for file_id in dict.fromkeys(file_ids):
         # Doublon exact (même fichier)
         if file_id in existing_file_ids:
             log.info(f"[tenant_service] Doublon ignoré : file_id={file_id}")
             continue
 
-        file_analysis = db.query(FileAnalysis).get(file_id)
+        file_analysis = files.get(file_id)
         if not file_analysis:
             log.warning(f"[tenant_service] FileAnalysis introuvable : id={file_id}")
             continue
 
         doc_type = file_analysis.file_type or TenantDocType.OTHER.value
-
-        valid_types = {e.value for e in TenantDocType}
-        if doc_type not in valid_types:
+        if doc_type not in VALID_DOC_TYPES:
             doc_type = TenantDocType.OTHER.value
 
         # FIX Bug #1 : les documents OTHER ne sont jamais attachés au dossier
@@ -192,69 +340,98 @@ def attach_files_to_tenant_file(
             )
             continue
 
+        present = doc_count(tenant_file, doc_type) + added[doc_type]
+
         # Fiches de paie : on en accepte jusqu'à 3
         if doc_type == TenantDocType.PAYSLIP.value:
-            if existing_payslip_count >= PAYSLIP_REQUIRED_COUNT:
+            if present >= PAYSLIP_REQUIRED_COUNT:
                 log.info(
                     f"[tenant_service] 3 fiches de paie déjà présentes, "
                     f"document ignoré : file_id={file_id}"
                 )
                 continue
-            existing_payslip_count += 1
 
         # Types uniques : on n'accepte qu'un seul exemplaire
         elif doc_type in UNIQUE_DOC_TYPES:
-            if doc_type in existing_unique_types:
+            if present > 0:
                 log.info(
                     f"[tenant_service] Type unique déjà présent ({doc_type}), "
                     f"ignoré : file_id={file_id}"
                 )
                 continue
-            existing_unique_types.add(doc_type)
 
-        link = TenantDocumentLink(
-            tenant_file_id=tenant_file.id,
-            file_analysis_id=file_id,
-            doc_type=doc_type,
-            quality=DocQuality.OK,
-        )
-        db.add(link)
-        existing_file_ids.add(file_id)
+        links.append({
+            "tenant_file_id": tenant_file.id,
+            "file_analysis_id": file_id,
+            "doc_type": TenantDocType(doc_type),
+            "quality": DocQuality.OK,
+        })
+        added[doc_type] += 1
         log.info(
             f"[tenant_service] Document attaché : file_id={file_id} type={doc_type}"
         )
 
+    if links:
+        db.execute(insert(TenantDocumentLink), links)
+        apply_document_deltas(db, tenant_file, added)
+    return [link["file_analysis_id"] for link in links]
+
+
+def attach_files_to_tenant_file(
+    db: Session,
+    tenant_file: TenantFile,
+    file_ids: List[int],
+) -> None:
+    if not file_ids:
+        return
+    attach_files_bulk(db, tenant_file, file_ids)
     db.commit()
 
 
-# ── Checklist & statut ─────────────────────────────────────────────────────────
+def detach_document(db: Session, tenant_file: TenantFile, link: TenantDocumentLink) -> None:
+    """Supprime un lien document ↔ dossier et décrémente le compteur. Ne commit pas."""
+    apply_document_delta(db, tenant_file, link.doc_type, -1)
+    db.delete(link)
+
 
-def _empty_checklist() -> dict:
+def detach_file_everywhere(db: Session, file_id: int) -> List[TenantFile]:
     """
-    Format unifié attendu par le frontend :
-    {
-      required: [...],   # liste avec payslip répété 3 fois
-      received: [],
-      missing: [...],
-      payslip_required: 3,
-      payslip_received: 0,
-    }
+    Détache un document de tous les dossiers qui le référencent.
+    Retourne les dossiers affectés (compteurs déjà ajustés). Ne commit pas.
     """
-    return {
-        "required": REQUIRED_DOC_TYPES,
-        "received": [],
-        "missing": REQUIRED_DOC_TYPES[:],
-        "payslip_required": PAYSLIP_REQUIRED_COUNT,
-        "payslip_received": 0,
-    }
+    links = (
+        db.query(TenantDocumentLink)
+        .filter(TenantDocumentLink.file_analysis_id == file_id)
+        .all()
+    )
+    affected = []
+    for link in links:
+        tenant_file = db.query(TenantFile).get(link.tenant_file_id)
+        if tenant_file:
+            detach_document(db, tenant_file, link)
+            affected.append(tenant_file)
+        else:
+            db.delete(link)
+    return affected
 
 
-def recompute_checklist(db: Session, tenant_file: TenantFile) -> None:
+# ── Checklist & statut ─────────────────────────────────────────────────────────
+
+# Types requis en un exemplaire (les fiches de paie sont comptées à part)
+UNIQUE_REQUIRED_DOC_TYPES = [
+    TenantDocType.ID.value,
+    TenantDocType.TAX.value,
+    TenantDocType.WORK_CONTRACT.value,
+    TenantDocType.ADDRESS_PROOF.value,
+]
+
+
+def build_checklist(tenant_file: TenantFile) -> dict:
     """
-    Recalcule la checklist et le statut du dossier.
+    Checklist calculée depuis les compteurs du dossier.
 
     Gère le cas spécial des fiches de paie (3 requises).
-    Format de sortie :
+    Format de sortie (attendu par le frontend) :
     {
       "required": ["id", "payslip", "payslip", "payslip", "tax", "work_contract", "address_proof"],
       "received": ["id", "payslip", "payslip"],
@@ -263,38 +440,25 @@ def recompute_checklist(db: Session, tenant_file: TenantFile) -> None:
       "payslip_received": 2,
     }
     """
-    all_links = tenant_file.document_links
+    payslip_received = min(doc_count(tenant_file, TenantDocType.PAYSLIP), PAYSLIP_REQUIRED_COUNT)
+
+    received = [
+        dt for dt in UNIQUE_REQUIRED_DOC_TYPES if doc_count(tenant_file, dt) > 0
+    ] + [TenantDocType.PAYSLIP.value] * payslip_received
+
+    # Ordre de REQUIRED_DOC_TYPES conservé, fiches de paie reçues retirées en tête
+    missing = []
+    payslips_to_skip = payslip_received
+    for dt in REQUIRED_DOC_TYPES:
+        if dt == TenantDocType.PAYSLIP.value:
+            if payslips_to_skip:
+                payslips_to_skip -= 1
+                continue
+            missing.append(dt)
+        elif doc_count(tenant_file, dt) == 0:
+            missing.append(dt)
 
-    # Compte des fiches de paie reçues
-    payslip_count = sum(
-        1 for link in all_links
-        if link.doc_type.value == TenantDocType.PAYSLIP.value
-    )
-    payslip_received = min(payslip_count, PAYSLIP_REQUIRED_COUNT)
-
-    # Types uniques reçus (parmi ceux requis, hors payslip)
-    unique_required = [
-        TenantDocType.ID.value,
-        TenantDocType.TAX.value,
-        TenantDocType.WORK_CONTRACT.value,
-        TenantDocType.ADDRESS_PROOF.value,
-    ]
-    received_unique = [
-        dt for dt in unique_required
-        if any(link.doc_type.value == dt for link in all_links)
-    ]
-
-    # Construction de la liste "received" (avec payslip répété N fois)
-    received = received_unique + [TenantDocType.PAYSLIP.value] * payslip_received
-
-    # Construction de la liste "missing"
-    # On part de REQUIRED_DOC_TYPES et on enlève les reçus un par un
-    missing = list(REQUIRED_DOC_TYPES)
-    for r in received:
-        if r in missing:
-            missing.remove(r)
-
-    checklist = {
+    return {
         "required": REQUIRED_DOC_TYPES,
         "received": received,
         "missing": missing,
@@ -302,21 +466,116 @@ def recompute_checklist(db: Session, tenant_file: TenantFile) -> None:
         "payslip_received": payslip_received,
     }
 
-    tenant_file.checklist_json = json.dumps(checklist)
 
-    # ── Calcul statut ──────────────────────────────────────────────────────────
+def _apply_status(tenant_file: TenantFile, checklist: dict) -> None:
     if tenant_file.status == TenantFileStatus.VALIDATED:
         pass  # Ne pas rétrograder un dossier validé
-    elif not missing:
+    elif not checklist["missing"]:
         tenant_file.status = TenantFileStatus.TO_VALIDATE
-    elif received:
+    elif checklist["received"]:
         tenant_file.status = TenantFileStatus.INCOMPLETE
     else:
         tenant_file.status = TenantFileStatus.NEW
 
+
+def recompute_checklist(db: Session, tenant_file: TenantFile) -> None:
+    """
+    Met à jour le statut du dossier depuis sa checklist (compteurs déjà à
+    jour après attach / detach) et commit. Aucun parcours des liens.
+    """
+    checklist = build_checklist(tenant_file)
+    received, missing = checklist["received"], checklist["missing"]
+    _apply_status(tenant_file, checklist)
+
     db.commit()
     log.info(
         f"[tenant_service] Checklist recalculée dossier_id={tenant_file.id} "
         f"statut={tenant_file.status.value} "
         f"reçus={received} manquants={missing}"
-    )
\ No newline at end of file
+    )
+
+
+def apply_email_to_tenant_file(
+    db: Session,
+    tenant_file: TenantFile,
+    email_analysis_id: int,
+    file_ids: List[int],
+    commit: bool = True,
+) -> dict:
+    """
+    Travail « dossier » d'un email en une seule transaction : lien email,
+    rattachement des documents en lot, checklist et statut — un commit.
+    En cas d'erreur, rien n'est appliqué (rollback) et l'exception remonte.
+    commit=False : flush seulement, commit et rollback sont laissés à l'appelant.
+    Retourne la checklist.
+    """
+    try:
+        _add_email_link(db, tenant_file.id, email_analysis_id)
+        attached = attach_files_bulk(db, tenant_file, file_ids)
+        checklist = build_checklist(tenant_file)
+        _apply_status(tenant_file, checklist)
+        tenant_file_id, status = tenant_file.id, tenant_file.status.value
+        if commit:
+            db.commit()
+        else:
+            db.flush()
+    except Exception:
+        if commit:
+            db.rollback()
+        raise
+    log.info(
+        f"[tenant_service] Dossier {tenant_file_id} mis à jour : email={email_analysis_id} "
+        f"documents+{len(attached)} statut={status}"
+    )
+    return checklist
+
+
+def _recount_documents(db: Session, tenant_file_ids: List[int]) -> dict:
+    """{tenant_file_id: {doc_type: n}} depuis les liens (une requête groupée)."""
+    counts: dict = {tid: {} for tid in tenant_file_ids}
+    rows = (
+        db.query(TenantDocumentLink.tenant_file_id, TenantDocumentLink.doc_type, func.count())
+        .filter(TenantDocumentLink.tenant_file_id.in_(tenant_file_ids))
+        .group_by(TenantDocumentLink.tenant_file_id, TenantDocumentLink.doc_type)
+    )
+    for tid, doc_type, n in rows:
+        counts[tid][_doc_type_value(doc_type)] = n
+    return counts
+
+
+def _set_counters(tenant_file: TenantFile, counts: dict) -> bool:
+    changed = False
+    for doc_type, column in DOC_COUNTER_COLUMNS.items():
+        value = counts.get(doc_type, 0)
+        if getattr(tenant_file, column) != value:
+            setattr(tenant_file, column, value)
+            changed = True
+    return changed
+
+
+def rebuild_checklist(db: Session, tenant_file: TenantFile) -> None:
+    """Réparation : recompte les documents depuis les liens, puis recalcule le statut."""
+    counts = _recount_documents(db, [tenant_file.id])[tenant_file.id]
+    if _set_counters(tenant_file, counts):
+        log.warning(f"[tenant_service] Compteurs documents réparés dossier_id={tenant_file.id}")
+    recompute_checklist(db, tenant_file)
+
+
+def reconcile_document_counters(db: Session, agency_id: int) -> int:
+    """
+    Recale les compteurs de tous les dossiers d'une agence (après suppressions
+    en masse qui contournent attach / detach, ex. rétention). Ne commit pas.
+    Retourne le nombre de dossiers corrigés.
+    """
+    tenant_files = db.query(TenantFile).filter(TenantFile.agency_id == agency_id).all()
+    if not tenant_files:
+        return 0
+    counts = _recount_documents(db, [tf.id for tf in tenant_files])
+    fixed = 0
+    for tf in tenant_files:
+        if _set_counters(tf, counts[tf.id]):
+            fixed += 1
+            _apply_status(tf, build_checklist(tf))
+    if fixed:
+        log.info(f"[tenant_service] {fixed} dossier(s) recalé(s) agency={agency_id}")
+    return fixed
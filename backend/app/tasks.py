@@ -14,8 +14,14 @@ log = logging.getLogger(__name__)
 MAX_429_REENQUEUES = 5
 REENQUEUE_DELAY_SECONDS = 60
 
+# Verrou candidat occupé : re-planification plutôt qu'attente dans le worker.
+# Exclusion mutuelle seulement : un job re-planifié peut passer après un email
+# plus récent du même candidat (cf. job_lock_service).
+MAX_LOCK_REENQUEUES = 20
+LOCK_REENQUEUE_DELAY_SECONDS = 30
 
-def process_email_job(payload: Dict[str, Any], retries_429: int = 0) -> None:
+
+def process_email_job(payload: Dict[str, Any], retries_429: int = 0, lock_retries: int = 0) -> None:
     """
     Job RQ exécuté par le worker.
     Lance le pipeline email de façon synchrone (RQ n'est pas async).
@@ -23,8 +29,12 @@ def process_email_job(payload: Dict[str, Any], retries_429: int = 0) -> None:
     Args:
         payload: Données de l'email à traiter
         retries_429: Nombre de re-enqueues déjà effectués suite à des 429 Mistral
+        lock_retries: Nombre de re-enqueues déjà effectués, verrou du candidat occupé
     """
+    import redis
+    from app.core.config import settings
     from app.services.email_pipeline import run_email_pipeline
+    from app.services.job_lock_service import CandidateLockBusy, candidate_lock, candidate_lock_key
     from app.services.mistral_service import MistralRateLimitError
 
     log.info(
@@ -33,7 +43,36 @@ def process_email_job(payload: Dict[str, Any], retries_429: int = 0) -> None:
     )
 
     try:
-        asyncio.run(run_email_pipeline(payload))
+        # Un job à la fois par candidat ; les autres candidats restent en parallèle
+        conn = redis.from_url(settings.REDIS_URL or "redis://localhost:6379")
+        lock_key = candidate_lock_key(payload.get("agency_id"), payload.get("from_email", ""))
+        with candidate_lock(conn, lock_key):
+            asyncio.run(run_email_pipeline(payload))
+
+    except CandidateLockBusy:
+        if lock_retries >= MAX_LOCK_REENQUEUES:
+            log.error(
+                f"[tasks] ❌ Verrou candidat toujours occupé après {MAX_LOCK_REENQUEUES} re-enqueues "
+                f"— from={payload.get('from_email')} agency={payload.get('agency_id')} — job en échec "
+                f"(à relancer depuis le registre failed de RQ)"
+            )
+            raise  # jamais de traitement sans verrou : le job passe FAILED, visible dans RQ
+
+        next_retry = lock_retries + 1
+        log.info(
+            f"[tasks] Candidat déjà en cours — re-enqueue #{next_retry}/{MAX_LOCK_REENQUEUES} "
+            f"dans {LOCK_REENQUEUE_DELAY_SECONDS}s — from={payload.get('from_email')}"
+        )
+        from rq import Queue
+
+        # Échec d'enqueue : l'exception remonte, RQ marque le job failed (pas de perte silencieuse)
+        Queue("emails", connection=conn).enqueue_in(
+            timedelta(seconds=LOCK_REENQUEUE_DELAY_SECONDS),
+            process_email_job,
+            payload,
+            retries_429=retries_429,
+            lock_retries=next_retry,
+        )
 
     except MistralRateLimitError as e:
         if retries_429 >= MAX_429_REENQUEUES:
@@ -50,11 +89,8 @@ def process_email_job(payload: Dict[str, Any], retries_429: int = 0) -> None:
             f"dans {REENQUEUE_DELAY_SECONDS}s — from={payload.get('from_email')}"
         )
         try:
-            import redis
             from rq import Queue
-            from app.core.config import settings
 
-            conn = redis.from_url(settings.REDIS_URL)
             q = Queue("emails", connection=conn)
             q.enqueue_in(
                 timedelta(seconds=REENQUEUE_DELAY_SECONDS),
@@ -69,3 +105,55 @@ def process_email_job(payload: Dict[str, Any], retries_429: int = 0) -> None:
     except Exception as e:
         log.error(f"[tasks] Job échoué : {e}", exc_info=True)
         raise  # RQ marque le job comme failed → visible dans le dashboard
+
+
+def export_tenant_files_job(export_job_id: int) -> None:
+    """
+    Job RQ (queue 'exports') : export groupé de dossiers locataires.
+    Délègue à export_service.run_bulk_export.
+    """
+    from app.database.database import SessionLocal
+    from app.services.export_service import run_bulk_export
+
+    log.info(f"[tasks] Export groupé démarré — export_job_id={export_job_id}")
+    db = SessionLocal()
+    try:
+        run_bulk_export(db, export_job_id)
+    finally:
+        db.close()
+
+
+def retention_agency_job(agency_id: int, now_iso: str) -> None:
+    """
+    Job RQ (queue 'maintenance') : rétention RGPD d'une agence.
+    `now_iso` est figé à la planification pour que toutes les agences
+    d'un même cycle partagent les mêmes dates de coupure.
+    """
+    import time
+    from datetime import datetime
+    from app.database.database import SessionLocal
+    from app.services.retention_service import run_agency_retention
+
+    started = time.monotonic()
+    db = SessionLocal()
+    try:
+        run_agency_retention(db, agency_id, datetime.fromisoformat(now_iso))
+    finally:
+        db.close()
+    log.info(f"[tasks] Rétention agency={agency_id} terminée en {time.monotonic() - started:.1f}s")
+
+
+def retention_exports_job(now_iso: str) -> None:
+    """
+    Job RQ (queue 'maintenance') : purges globales du cycle de rétention
+    (archives d'export expirées, agrégats journaliers hors horizon).
+    """
+    from datetime import datetime
+    from app.database.database import SessionLocal
+    from app.services.retention_service import run_global_retention
+
+    db = SessionLocal()
+    try:
+        run_global_retention(db, datetime.fromisoformat(now_iso))
+    finally:
+        db.close()
@@ -12,12 +12,16 @@ NOUVELLE STRATÉGIE DE FILTRAGE :
 
 import base64
 import email
+import gzip
+import hashlib
+import json
 import logging
 import os
 import re
 import sys
 import threading
 import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 from email.header import decode_header
 from email.utils import parseaddr
@@ -69,11 +73,22 @@ GOOGLE_CLIENT_SECRET     = os.getenv("GOOGLE_OAUTH_CLIENT_SECRET", "")
 MICROSOFT_CLIENT_ID      = os.getenv("MICROSOFT_CLIENT_ID", "")
 MICROSOFT_CLIENT_SECRET  = os.getenv("MICROSOFT_CLIENT_SECRET", "")
 MISTRAL_API_KEY          = os.getenv("MISTRAL_API_KEY", "")
+# Cache des classifications Mistral (newsletters / relances automatiques identiques)
+MISTRAL_CACHE_SIZE       = int(os.getenv("MISTRAL_CACHE_SIZE", "2048"))
+MISTRAL_CACHE_TTL_SEC    = float(os.getenv("MISTRAL_CACHE_TTL_SEC", "21600"))
 AUTO_SEND                = os.getenv("AUTO_SEND", "true").lower() == "true"
 MAX_EMAILS_PER_LOOP      = int(os.getenv("MAX_EMAILS_PER_LOOP", "5"))
 PAUSE_BETWEEN_EMAILS_SEC = float(os.getenv("PAUSE_BETWEEN_EMAILS_SEC", "2"))
 POLL_INTERVAL_SEC        = float(os.getenv("POLL_INTERVAL_SEC", "30"))
+WEBHOOK_BATCH_SIZE       = int(os.getenv("WEBHOOK_BATCH_SIZE", "20"))   # emails max par POST /webhook/emails:batch
+WEBHOOK_GZIP             = os.getenv("WEBHOOK_GZIP", "true").lower() == "true"   # corps webhook compressés
+WEBHOOK_GZIP_MIN_BYTES   = 1024   # en dessous, gzip coûte plus qu'il ne rapporte
 CONFIG_REFRESH_INTERVAL  = float(os.getenv("CONFIG_REFRESH_INTERVAL", "60"))
+# Cache local des expéditeurs connus : synchro incrémentale au plus toutes les
+# KNOWN_SENDERS_REFRESH_SEC (sur échec de lookup), complète toutes les KNOWN_SENDERS_FULL_SYNC_SEC
+KNOWN_SENDERS_REFRESH_SEC   = float(os.getenv("KNOWN_SENDERS_REFRESH_SEC", "30"))
+KNOWN_SENDERS_FULL_SYNC_SEC = float(os.getenv("KNOWN_SENDERS_FULL_SYNC_SEC", "3600"))
+KNOWN_SENDERS_OVERLAP_SEC   = 120   # recouvrement du curseur (commits tardifs, retard de réplique)
 
 missing = []
 if not BACKEND_URL:        missing.append("BACKEND_URL")
@@ -84,10 +99,12 @@ if missing and "--test-bypass" not in sys.argv:
     raise RuntimeError(f"Variables manquantes: {', '.join(missing)}")
 
 WEBHOOK_URL              = f"{BACKEND_URL}/webhook/email"
+WEBHOOK_BATCH_URL        = f"{BACKEND_URL}/webhook/emails:batch"
 CONFIGS_URL              = f"{BACKEND_URL}/watcher/configs"
 TOKEN_UPDATE_URL         = f"{BACKEND_URL}/watcher/update-token"
 OUTLOOK_UPDATE_URL       = f"{BACKEND_URL}/watcher/update-outlook-token"
 CHECK_SENDER_URL         = f"{BACKEND_URL}/watcher/check-sender"
+KNOWN_SENDERS_URL        = f"{BACKEND_URL}/watcher/known-senders"
 HEARTBEAT_URL            = f"{BACKEND_URL}/watcher/heartbeat"
 
 GOOGLE_TOKEN_REFRESH_URL  = "https://oauth2.googleapis.com/token"
@@ -105,15 +122,82 @@ SCOPES = [
 # 🤖 CLASSIFICATION IA (Mistral)
 # ============================================================
 
+# Client partagé par tous les threads agence (pool de connexions HTTP réutilisé)
+_mistral_state: dict = {"client": None}
+_mistral_lock = threading.Lock()
+
+# clé (sha256 expéditeur + sujet + 500 premiers caractères) -> (expire_à, verdict)
+_classification_cache: OrderedDict = OrderedDict()
+_classification_stats = {"hits": 0, "misses": 0}
+_classification_lock = threading.Lock()
+
+
+def _mistral_client() -> Mistral:
+    with _mistral_lock:
+        if _mistral_state["client"] is None:
+            _mistral_state["client"] = Mistral(api_key=MISTRAL_API_KEY)
+        return _mistral_state["client"]
+
+
+def classification_cache_key(from_email: str, subject: str, body: str) -> str:
+    """Expéditeur canonique, sujet et début du corps normalisés (casse, espaces)."""
+    _, sender = parseaddr(from_email)
+    parts = (
+        canonical_sender(sender or from_email),
+        " ".join(subject.split()).lower(),
+        " ".join(body[:500].split()).lower(),
+    )
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def _cached_classification(key: str) -> bool | None:
+    now = time.monotonic()
+    with _classification_lock:
+        entry = _classification_cache.get(key)
+        if entry and entry[0] > now:
+            _classification_cache.move_to_end(key)
+            _classification_stats["hits"] += 1
+            return entry[1]
+        if entry:
+            del _classification_cache[key]
+        _classification_stats["misses"] += 1
+        return None
+
+
+def _store_classification(key: str, is_relevant: bool) -> None:
+    with _classification_lock:
+        _classification_cache[key] = (time.monotonic() + MISTRAL_CACHE_TTL_SEC, is_relevant)
+        _classification_cache.move_to_end(key)
+        while len(_classification_cache) > MISTRAL_CACHE_SIZE:
+            _classification_cache.popitem(last=False)
+
+
+def _cache_hit_rate() -> str:
+    hits, misses = _classification_stats["hits"], _classification_stats["misses"]
+    total = hits + misses
+    return f"{hits}/{total} ({hits / total * 100:.0f} %)" if total else "0/0"
+
+
 def mistral_is_real_estate_email(from_email: str, subject: str, body: str) -> bool:
     """
     Classification rapide via Mistral small.
     Retourne True si l'email est une vraie demande immobilière.
     Fail open : retourne True en cas d'erreur ou si MISTRAL_API_KEY absent.
+    Verdicts mis en cache (LRU, MISTRAL_CACHE_TTL_SEC) : un mail automatique
+    répété (portail, relance) ne coûte qu'un appel. Les erreurs ne sont pas cachées.
     """
     if not MISTRAL_API_KEY:
         return True
 
+    key = classification_cache_key(from_email, subject, body)
+    cached = _cached_classification(key)
+    if cached is not None:
+        log.info(
+            f"[ia] Cache classification → {'✅ OUI' if cached else '❌ NON'} "
+            f"sans appel Mistral (hits {_cache_hit_rate()})"
+        )
+        return cached
+
     prompt = (
         "Tu es un filtre pour une agence immobilière française.\n"
         "Est-ce que cet email est une vraie demande liée à la location "
@@ -126,14 +210,17 @@ def mistral_is_real_estate_email(from_email: str, subject: str, body: str) -> bo
     )
 
     try:
-        client = Mistral(api_key=MISTRAL_API_KEY)
-        response = client.chat.complete(
+        response = _mistral_client().chat.complete(
             model="mistral-small-latest",
             messages=[{"role": "user", "content": prompt}],
         )
         answer = (response.choices[0].message.content or "").strip().upper()
         is_relevant = answer.startswith("OUI")
-        log.info(f"[ia] Mistral réponse={answer!r} → {'✅ OUI' if is_relevant else '❌ NON'}")
+        _store_classification(key, is_relevant)
+        log.info(
+            f"[ia] Mistral réponse={answer!r} → {'✅ OUI' if is_relevant else '❌ NON'} "
+            f"(cache hits {_cache_hit_rate()})"
+        )
         return is_relevant
     except Exception as e:
         log.warning(f"⚠️ MISTRAL_ERROR — fail open : {e}")
@@ -227,16 +314,81 @@ SPAM_KEYWORDS = [
 ]
 
 
+def _lowered_patterns(patterns) -> tuple:
+    """Motifs en minuscules, sans doublon ni vide, dans l'ordre d'origine."""
+    return tuple(dict.fromkeys(p.strip().lower() for p in patterns if p and p.strip()))
+
+
+_SYSTEM_PATTERNS  = _lowered_patterns(SYSTEM_BLACKLIST)
+_SPAM_PATTERNS    = _lowered_patterns(SPAM_KEYWORDS)
+_KEYWORD_PATTERNS = _lowered_patterns(IMMOBILIER_KEYWORDS)
+
+
+class FilterMatcher:
+    """
+    Règles de filtrage d'une agence, préparées une fois : motifs système, spam
+    et immobiliers partagés, blacklist agence mise en minuscules une seule fois.
+    Reconstruit uniquement quand la blacklist de l'agence change (filter_matcher).
+
+    Pas de compilation en automate : chaque motif reste un `in` (recherche de
+    sous-chaîne en C), une regex alternée étant 2 à 3× plus lente sur ces
+    ~30 motifs (scripts/benchmark_filter.py).
+    """
+
+    __slots__ = ("source", "agency")
+
+    def __init__(self, agency_blacklist: list[str] | None = None):
+        self.source = agency_blacklist or []
+        self.agency = _lowered_patterns(self.source)
+
+    def blocked_sender(self, sender: str) -> str | None:
+        """Raison de rejet de l'expéditeur (system_blacklist / agency_blacklist) ou None."""
+        sender_lower = sender.lower()
+        if any(pattern in sender_lower for pattern in _SYSTEM_PATTERNS):
+            return "system_blacklist"
+        if any(pattern in sender_lower for pattern in self.agency):
+            return "agency_blacklist"
+        return None
+
+    @staticmethod
+    def has_spam(text: str) -> bool:
+        return any(pattern in text for pattern in _SPAM_PATTERNS)
+
+    @staticmethod
+    def first_keywords(text: str, limit: int = 3) -> list[str]:
+        """Premiers mots-clés immobiliers présents (ordre de IMMOBILIER_KEYWORDS)."""
+        found = []
+        for keyword in _KEYWORD_PATTERNS:
+            if keyword in text:
+                found.append(keyword)
+                if len(found) == limit:
+                    break
+        return found
+
+
+# agency_id -> FilterMatcher (remplacé quand la blacklist reçue de /watcher/configs change)
+_filter_matchers: dict[int, FilterMatcher] = {}
+
+
+def filter_matcher(agency_id: int | None, agency_blacklist: list[str] | None) -> FilterMatcher:
+    agency_blacklist = agency_blacklist or []
+    matcher = _filter_matchers.get(agency_id)
+    if matcher is None or (matcher.source is not agency_blacklist and matcher.source != agency_blacklist):
+        matcher = FilterMatcher(agency_blacklist)
+        _filter_matchers[agency_id] = matcher
+        log.info(f"[filter] Règles préparées agency={agency_id} ({len(matcher.agency)} motif(s) blacklist agence)")
+    return matcher
+
+
 def is_system_blacklisted(sender: str) -> bool:
     """Vérifie si c'est un email système/bot à ignorer."""
     sender_lower = sender.lower()
-    return any(pattern in sender_lower for pattern in SYSTEM_BLACKLIST)
+    return any(pattern in sender_lower for pattern in _SYSTEM_PATTERNS)
 
 
-def is_agency_blacklisted(sender: str, agency_blacklist: list[str]) -> bool:
-    """Vérifie si l'expéditeur correspond à un pattern de la blacklist agence."""
-    sender_lower = sender.lower()
-    return any(pattern.lower() in sender_lower for pattern in agency_blacklist)
+def is_agency_blacklisted(sender: str, agency_blacklist: list[str] | None, agency_id: int | None = None) -> bool:
+    """Vérifie si l'expéditeur correspond à un pattern de la blacklist agence (règles en cache par agence)."""
+    return filter_matcher(agency_id, agency_blacklist).blocked_sender(sender) == "agency_blacklist"
 
 
 def is_known_sender(sender_email: str, agency_id: int) -> bool:
@@ -270,7 +422,95 @@ def is_known_sender(sender_email: str, agency_id: int) -> bool:
     return False
 
 
-def decide_filter(sender: str, subject: str, body: str, attachments: list, agency_id: int, agency_blacklist: list[str] = []) -> tuple[FilterDecision, list]:
+# ── Cache local des expéditeurs connus ─────────────────────────────────────────
+
+# agency_id -> {"senders": set, "cursor": iso | None, "synced_at": float, "full_at": float}
+_known_senders: dict = {}
+_known_senders_lock = threading.Lock()
+
+
+def canonical_sender(email_addr: str) -> str:
+    """Clé canonique d'un expéditeur — identique à app.core.email_utils.canonical_email."""
+    if not email_addr:
+        return ""
+    email_addr = email_addr.strip().lower()
+    local, _, domain = email_addr.partition("@")
+    if not domain:
+        return email_addr
+    local = local.split("+")[0]
+    if domain in ("gmail.com", "googlemail.com"):
+        local = local.replace(".", "")
+    return f"{local}@{domain}"
+
+
+def sync_known_senders(agency_id: int, full: bool = False) -> bool:
+    """
+    Synchronise le cache d'une agence depuis /watcher/known-senders.
+    Incrémentale (depuis le dernier curseur, avec recouvrement) sauf si `full`
+    ou si le cache est vide. Retourne False si le backend est injoignable.
+    """
+    entry = _known_senders.get(agency_id)
+    params = {"agency_id": agency_id}
+    if entry and not full and entry["cursor"]:
+        since = datetime.fromisoformat(entry["cursor"]) - timedelta(seconds=KNOWN_SENDERS_OVERLAP_SEC)
+        params["since"] = since.isoformat()
+    try:
+        resp = requests.get(
+            KNOWN_SENDERS_URL,
+            params=params,
+            headers={"x-watcher-secret": WATCHER_SECRET},
+            timeout=10,
+        )
+        if resp.status_code != 200:
+            log.warning(f"[filter] known-senders : backend retourné {resp.status_code}")
+            return False
+        data = resp.json()
+    except Exception as e:
+        log.warning(f"[filter] Erreur synchro expéditeurs connus agency={agency_id} : {e}")
+        return False
+
+    now = time.monotonic()
+    with _known_senders_lock:
+        if full or entry is None:
+            entry = {"senders": set(), "cursor": None, "full_at": now}
+            _known_senders[agency_id] = entry
+        entry["senders"].update(data["senders"])
+        entry["cursor"] = data["cursor"] or entry["cursor"]
+        entry["synced_at"] = now
+    log.info(
+        f"[filter] Expéditeurs connus agency={agency_id} : +{len(data['senders'])} "
+        f"({'complète' if 'since' not in params else 'incrémentale'}, total={len(entry['senders'])})"
+    )
+    return True
+
+
+def is_known_sender_cached(sender_email: str, agency_id: int) -> bool:
+    """
+    Expéditeur connu ? Réponse locale dans la grande majorité des cas :
+    - présent dans le cache → connu
+    - absent → synchro incrémentale si la dernière date de plus de
+      KNOWN_SENDERS_REFRESH_SEC (candidat créé entre-temps), puis re-test
+    Cache indisponible → repli sur l'appel HTTP is_known_sender.
+    """
+    key = canonical_sender(sender_email)
+    if not key:
+        return False
+
+    entry = _known_senders.get(agency_id)
+    now = time.monotonic()
+    if entry is None or now - entry["full_at"] > KNOWN_SENDERS_FULL_SYNC_SEC:
+        if not sync_known_senders(agency_id, full=True):
+            return is_known_sender(sender_email, agency_id)
+        entry = _known_senders[agency_id]
+
+    if key in entry["senders"]:
+        return True
+    if now - entry["synced_at"] > KNOWN_SENDERS_REFRESH_SEC and sync_known_senders(agency_id):
+        return key in _known_senders[agency_id]["senders"]
+    return False
+
+
+def decide_filter(sender: str, subject: str, body: str, attachments: list, agency_id: int, agency_blacklist: list[str] | None = None) -> tuple[FilterDecision, list]:
     """
     NOUVELLE STRATÉGIE : Règles séquentielles (OR logic).
     Retourne (decision, reasons)
@@ -284,17 +524,14 @@ def decide_filter(sender: str, subject: str, body: str, attachments: list, agenc
     5. Sinon → IGNORE
     """
     reasons = []
-
-    # ── 1️⃣ BLACKLIST SYSTÈME ──────────────────────────────────────────────────
-    if is_system_blacklisted(sender):
-        reasons.append("system_blacklist")
-        log.info(f"❌ IGNORE (blacklist système) — {sender}")
-        return FilterDecision.IGNORE, reasons
-
-    # ── 1b. BLACKLIST AGENCE ───────────────────────────────────────────────────
-    if agency_blacklist and is_agency_blacklisted(sender, agency_blacklist):
-        reasons.append("agency_blacklist")
-        log.info(f"❌ IGNORE (blacklist agence) — {sender}")
+    matcher = filter_matcher(agency_id, agency_blacklist)
+
+    # ── 1️⃣ BLACKLIST SYSTÈME / 1b. BLACKLIST AGENCE ───────────────────────────
+    blocked = matcher.blocked_sender(sender)
+    if blocked:
+        reasons.append(blocked)
+        label = "système" if blocked == "system_blacklist" else "agence"
+        log.info(f"❌ IGNORE (blacklist {label}) — {sender}")
         return FilterDecision.IGNORE, reasons
     
     # ── 2️⃣ A DES PIÈCES JOINTES ───────────────────────────────────────────────
@@ -307,22 +544,21 @@ def decide_filter(sender: str, subject: str, body: str, attachments: list, agenc
     text = f"{subject} {body}".lower()
     
     # Vérification spam d'abord
-    has_spam = any(spam_word in text for spam_word in SPAM_KEYWORDS)
-    if has_spam:
+    if matcher.has_spam(text):
         reasons.append("spam_keywords")
         log.info(f"❌ IGNORE (spam détecté) — {subject}")
         return FilterDecision.IGNORE, reasons
     
     # Vérification mots-clés immobiliers
-    matched_keywords = [kw for kw in IMMOBILIER_KEYWORDS if kw in text]
+    matched_keywords = matcher.first_keywords(text)
     if matched_keywords:
-        reasons.append(f"immo_keywords:{','.join(matched_keywords[:3])}")
-        log.info(f"✅ ACCEPT (mots-clés: {matched_keywords[:3]}) — agency={agency_id}")
+        reasons.append(f"immo_keywords:{','.join(matched_keywords)}")
+        log.info(f"✅ ACCEPT (mots-clés: {matched_keywords}) — agency={agency_id}")
         return FilterDecision.PROCESS_FULL, reasons
     
     # ── 4️⃣ EXPÉDITEUR CONNU ───────────────────────────────────────────────────
     _, sender_email = parseaddr(sender)
-    if is_known_sender(sender_email, agency_id):
+    if is_known_sender_cached(sender_email, agency_id):
         reasons.append("known_sender")
         log.info(f"✅ ACCEPT (expéditeur connu: {sender_email}) — agency={agency_id}")
         return FilterDecision.PROCESS_LIGHT, reasons
@@ -475,8 +711,115 @@ def download_attachment(service, user_id: str, message_id: str, attachment_id: s
 # 🚀 TRAITEMENT D'UN EMAIL
 # ============================================================
 
-def process_one_message(service, message_id: str, agency_id: int, gmail_email: str, agency_blacklist: list[str] = []):
-    """Traite un email Gmail API et l'envoie au webhook backend."""
+def webhook_idempotency_key(provider: str, mailbox: str, message_id: str) -> str:
+    """
+    Clé d'idempotence du webhook : une re-soumission du même message (timeout,
+    crash avant le marquage lu) n'est pas retraitée par le backend.
+    Même format que app.services.idempotency_service.idempotency_key.
+    """
+    return f"{provider}:{(mailbox or '').strip().lower()}:{message_id}"
+
+
+# gzip négocié : "supported" suit l'en-tête Accept-Encoding des réponses du
+# backend (absent sur une version antérieure, qui répond 422 à un corps gzip)
+_webhook_gzip = {"enabled": WEBHOOK_GZIP, "supported": False}
+
+
+def _backend_accepts_gzip(resp: requests.Response) -> bool:
+    return "gzip" in (resp.headers.get("Accept-Encoding") or "").lower()
+
+
+def post_webhook(url: str, body: dict) -> requests.Response:
+    """
+    POST JSON vers le webhook, compressé en gzip (Content-Encoding) au-delà de
+    WEBHOOK_GZIP_MIN_BYTES, seulement si le backend a annoncé gzip dans une
+    réponse précédente. Un 415 / 422 sans cette annonce renvoie le corps en
+    JSON non compressé et suspend gzip jusqu'à la prochaine annonce.
+    """
+    data = json.dumps(body).encode("utf-8")
+    headers = {"x-watcher-secret": WATCHER_SECRET, "Content-Type": "application/json"}
+    if _webhook_gzip["enabled"] and _webhook_gzip["supported"] and len(data) >= WEBHOOK_GZIP_MIN_BYTES:
+        resp = requests.post(
+            url, data=gzip.compress(data, compresslevel=6),
+            headers={**headers, "Content-Encoding": "gzip"}, timeout=60,
+        )
+        if resp.status_code not in (415, 422) or _backend_accepts_gzip(resp):
+            return resp
+        log.warning(f"⚠️ Backend sans support gzip ({resp.status_code}) — envoi non compressé")
+        _webhook_gzip["supported"] = False
+    resp = requests.post(url, data=data, headers=headers, timeout=60)
+    if _webhook_gzip["enabled"]:
+        _webhook_gzip["supported"] = _backend_accepts_gzip(resp)
+    return resp
+
+
+def submit_to_backend(webhook_payload: dict, on_accepted, batch: list | None, label: str) -> None:
+    """
+    Transmet un email accepté au backend. Dans une boucle de polling (`batch`
+    fourni), il est mis en attente jusqu'au flush du cycle ; sinon POST unitaire.
+    `on_accepted` (marquage lu) n'est appelé qu'une fois l'email accepté.
+    """
+    if batch is not None:
+        batch.append((webhook_payload, on_accepted))
+        return
+    try:
+        resp = post_webhook(WEBHOOK_URL, webhook_payload)
+        if resp.status_code == 200:
+            log.info(f"✅ {label} transmis au backend agency={webhook_payload.get('agency_id')}")
+            on_accepted()
+        else:
+            log.warning(f"⚠️ {label} — Backend {resp.status_code} — {resp.text[:200]}")
+    except Exception as e:
+        log.error(f"❌ {label} — Erreur envoi backend : {e}")
+        _capture(e)
+
+
+def flush_webhook_batch(batch: list, agency_id: int) -> None:
+    """
+    Envoie les emails accumulés pendant le cycle via /webhook/emails:batch
+    (WEBHOOK_BATCH_SIZE par requête). Seuls les emails enqueued ou déjà connus
+    (doublon) sont marqués lus ; les autres seront repris au cycle suivant.
+    """
+    pending, batch[:] = list(batch), []
+    for start in range(0, len(pending), WEBHOOK_BATCH_SIZE):
+        chunk = pending[start:start + WEBHOOK_BATCH_SIZE]
+        try:
+            resp = post_webhook(WEBHOOK_BATCH_URL, {"emails": [payload for payload, _ in chunk]})
+        except Exception as e:
+            log.error(f"❌ Lot — Erreur envoi backend agency={agency_id} : {e}")
+            _capture(e)
+            continue
+
+        if resp.status_code == 404:
+            # Backend sans endpoint batch (déploiement en cours) : envoi unitaire
+            for payload, on_accepted in chunk:
+                submit_to_backend(payload, on_accepted, None, "Email")
+            continue
+        if resp.status_code != 200:
+            log.warning(f"⚠️ Lot — Backend {resp.status_code} — {resp.text[:200]}")
+            continue
+
+        accepted = 0
+        for (_, on_accepted), result in zip(chunk, resp.json().get("results", [])):
+            if result.get("status") in ("queued", "duplicate"):
+                on_accepted()
+                accepted += 1
+            else:
+                log.warning(
+                    f"⚠️ Lot — email #{result.get('index')} non accepté : "
+                    f"{result.get('status')} {result.get('error', '')}"
+                )
+        log.info(f"✅ Lot transmis au backend : {accepted}/{len(chunk)} accepté(s) agency={agency_id}")
+
+
+def process_one_message(
+    service, message_id: str, agency_id: int, gmail_email: str,
+    agency_blacklist: list[str] | None = None, batch: list | None = None,
+):
+    """
+    Traite un email Gmail API et l'envoie au webhook backend
+    (ou l'ajoute au lot `batch` du cycle, cf. flush_webhook_batch).
+    """
 
     msg_data = service.users().messages().get(
         userId="me",
@@ -535,6 +878,7 @@ def process_one_message(service, message_id: str, agency_id: int, gmail_email: s
         webhook_payload = {
             "from_email":      sender_email or sender,
             "to_email":        gmail_email,
+            "idempotency_key": webhook_idempotency_key("gmail", gmail_email, message_id),
             "subject":         subject,
             "content":         body,
             "send_email":      AUTO_SEND,
@@ -543,21 +887,7 @@ def process_one_message(service, message_id: str, agency_id: int, gmail_email: s
             "filter_decision": decision.value,
             "filter_reasons":  reasons,
         }
-        try:
-            resp = requests.post(
-                WEBHOOK_URL,
-                json=webhook_payload,
-                headers={"x-watcher-secret": WATCHER_SECRET},
-                timeout=60,
-            )
-            if resp.status_code == 200:
-                log.info(f"✅ BYPASS transmis au backend agency={agency_id}")
-                _mark_as_read(service, message_id)
-            else:
-                log.warning(f"⚠️ BYPASS — Backend {resp.status_code} — {resp.text[:200]}")
-        except Exception as e:
-            log.error(f"❌ BYPASS — Erreur envoi backend : {e}")
-            _capture(e)
+        submit_to_backend(webhook_payload, lambda: _mark_as_read(service, message_id), batch, "BYPASS")
         return
 
     # ── CLASSIFICATION IA (Mistral) ────────────────────────────────────────────
@@ -571,6 +901,7 @@ def process_one_message(service, message_id: str, agency_id: int, gmail_email: s
     webhook_payload = {
         "from_email":      sender_email or sender,
         "to_email":        gmail_email,
+        "idempotency_key": webhook_idempotency_key("gmail", gmail_email, message_id),
         "subject":         subject,
         "content":         body,
         "send_email":      AUTO_SEND,
@@ -580,21 +911,7 @@ def process_one_message(service, message_id: str, agency_id: int, gmail_email: s
         "filter_reasons":  reasons,
     }
 
-    try:
-        resp = requests.post(
-            WEBHOOK_URL,
-            json=webhook_payload,
-            headers={"x-watcher-secret": WATCHER_SECRET},
-            timeout=60,
-        )
-        if resp.status_code == 200:
-            log.info(f"✅ Transmis au backend agency={agency_id}")
-            _mark_as_read(service, message_id)
-        else:
-            log.warning(f"⚠️ Backend {resp.status_code} — {resp.text[:200]}")
-    except Exception as e:
-        log.error(f"❌ Erreur envoi backend : {e}")
-        _capture(e)
+    submit_to_backend(webhook_payload, lambda: _mark_as_read(service, message_id), batch, "Email")
 
 
 def _mark_as_read(service, message_id: str):
@@ -823,9 +1140,13 @@ def process_one_outlook_message(
     agency_id: int,
     outlook_email: str,
     access_token: str,
-    agency_blacklist: list[str] = [],
+    agency_blacklist: list[str] | None = None,
+    batch: list | None = None,
 ):
-    """Traite un email Outlook (Graph API) et l'envoie au webhook backend."""
+    """
+    Traite un email Outlook (Graph API) et l'envoie au webhook backend
+    (ou l'ajoute au lot `batch` du cycle, cf. flush_webhook_batch).
+    """
     message_id = message.get("id", "")
 
     # Anti-boucle : appel séparé pour récupérer les internetMessageHeaders
@@ -871,6 +1192,7 @@ def process_one_outlook_message(
         webhook_payload = {
             "from_email":      sender_email or sender,
             "to_email":        outlook_email,
+            "idempotency_key": webhook_idempotency_key("outlook", outlook_email, message_id),
             "subject":         subject,
             "content":         body,
             "send_email":      AUTO_SEND,
@@ -879,21 +1201,9 @@ def process_one_outlook_message(
             "filter_decision": decision.value,
             "filter_reasons":  reasons,
         }
-        try:
-            resp = requests.post(
-                WEBHOOK_URL,
-                json=webhook_payload,
-                headers={"x-watcher-secret": WATCHER_SECRET},
-                timeout=60,
-            )
-            if resp.status_code == 200:
-                log.info(f"✅ BYPASS Outlook transmis au backend agency={agency_id}")
-                _mark_outlook_read(message_id, access_token)
-            else:
-                log.warning(f"⚠️ BYPASS Outlook — Backend {resp.status_code} — {resp.text[:200]}")
-        except Exception as e:
-            log.error(f"❌ BYPASS Outlook — Erreur envoi backend : {e}")
-            _capture(e)
+        submit_to_backend(
+            webhook_payload, lambda: _mark_outlook_read(message_id, access_token), batch, "BYPASS Outlook",
+        )
         return
 
     # ── CLASSIFICATION IA (Mistral) ────────────────────────────────────────────
@@ -905,6 +1215,7 @@ def process_one_outlook_message(
     webhook_payload = {
         "from_email":      sender_email or sender,
         "to_email":        outlook_email,
+        "idempotency_key": webhook_idempotency_key("outlook", outlook_email, message_id),
         "subject":         subject,
         "content":         body,
         "send_email":      AUTO_SEND,
@@ -914,21 +1225,9 @@ def process_one_outlook_message(
         "filter_reasons":  reasons,
     }
 
-    try:
-        resp = requests.post(
-            WEBHOOK_URL,
-            json=webhook_payload,
-            headers={"x-watcher-secret": WATCHER_SECRET},
-            timeout=60,
-        )
-        if resp.status_code == 200:
-            log.info(f"✅ Outlook transmis au backend agency={agency_id}")
-            _mark_outlook_read(message_id, access_token)
-        else:
-            log.warning(f"⚠️ Backend {resp.status_code} — {resp.text[:200]}")
-    except Exception as e:
-        log.error(f"❌ Erreur envoi backend Outlook : {e}")
-        _capture(e)
+    submit_to_backend(
+        webhook_payload, lambda: _mark_outlook_read(message_id, access_token), batch, "Outlook",
+    )
 
 
 # ============================================================
@@ -945,6 +1244,8 @@ def watch_agency_outlook(config: dict, stop_event: threading.Event):
 
     while not stop_event.is_set():
         try:
+            # Blacklist relue à chaque cycle : une modification s'applique sans redémarrer le thread
+            agency_blacklist = _configs_state["by_agency"].get(agency_id, config).get("agency_blacklist", [])
             # Refresh token si nécessaire
             updated_config = refresh_outlook_token_if_needed(config)
             if updated_config is None:
@@ -1009,16 +1310,23 @@ def watch_agency_outlook(config: dict, stop_event: threading.Event):
             log.info(f"[outlook] {len(messages)} email(s) non lus "
                      f"(inbox={len(inbox_msgs)}, spam={len(junk_msgs)}) — agency={agency_id}")
 
-            for message in messages:
-                if stop_event.is_set():
-                    break
-                try:
-                    process_one_outlook_message(message, agency_id, outlook_email, access_token, agency_blacklist)
-                except Exception as e:
-                    log.error(f"[outlook] Erreur traitement message {message.get('id')} : {e}")
-                    _capture(e)
-
-                time.sleep(PAUSE_BETWEEN_EMAILS_SEC)
+            # Emails acceptés envoyés en un lot en fin de cycle
+            batch: list = []
+            try:
+                for message in messages:
+                    if stop_event.is_set():
+                        break
+                    try:
+                        process_one_outlook_message(
+                            message, agency_id, outlook_email, access_token, agency_blacklist, batch,
+                        )
+                    except Exception as e:
+                        log.error(f"[outlook] Erreur traitement message {message.get('id')} : {e}")
+                        _capture(e)
+
+                    time.sleep(PAUSE_BETWEEN_EMAILS_SEC)
+            finally:
+                flush_webhook_batch(batch, agency_id)
 
         except Exception as e:
             log.warning(f"⚠️ Erreur boucle Outlook agency={agency_id} : {e}")
@@ -1043,6 +1351,8 @@ def watch_agency_gmail(config: dict, stop_event: threading.Event):
 
     while not stop_event.is_set():
         try:
+            # Blacklist relue à chaque cycle : une modification s'applique sans redémarrer le thread
+            agency_blacklist = _configs_state["by_agency"].get(agency_id, config).get("agency_blacklist", [])
             creds = build_credentials(config)
             creds = refresh_if_needed(creds, agency_id)
 
@@ -1062,19 +1372,24 @@ def watch_agency_gmail(config: dict, stop_event: threading.Event):
             messages = result.get("messages", [])
             log.info(f"[watcher] {len(messages)} email(s) non lus — agency={agency_id}")
 
-            for msg in messages:
-                if stop_event.is_set():
-                    break
-                try:
-                    process_one_message(service, msg["id"], agency_id, gmail_email, agency_blacklist)
-                except HttpError as e:
-                    log.error(f"[watcher] Erreur Gmail API message {msg['id']} : {e}")
-                    _capture(e)
-                except Exception as e:
-                    log.error(f"[watcher] Erreur traitement message {msg['id']} : {e}")
-                    _capture(e)
-
-                time.sleep(PAUSE_BETWEEN_EMAILS_SEC)
+            # Emails acceptés envoyés en un lot en fin de cycle
+            batch: list = []
+            try:
+                for msg in messages:
+                    if stop_event.is_set():
+                        break
+                    try:
+                        process_one_message(service, msg["id"], agency_id, gmail_email, agency_blacklist, batch)
+                    except HttpError as e:
+                        log.error(f"[watcher] Erreur Gmail API message {msg['id']} : {e}")
+                        _capture(e)
+                    except Exception as e:
+                        log.error(f"[watcher] Erreur traitement message {msg['id']} : {e}")
+                        _capture(e)
+
+                    time.sleep(PAUSE_BETWEEN_EMAILS_SEC)
+            finally:
+                flush_webhook_batch(batch, agency_id)
 
         except Exception as e:
             log.warning(f"⚠️ Erreur boucle Gmail agency={agency_id} : {e}")
@@ -1089,16 +1404,34 @@ def watch_agency_gmail(config: dict, stop_event: threading.Event):
 # 🔄 GESTIONNAIRE MULTI-TENANT
 # ============================================================
 
+# Dernier état connu des configs (ETag + config par agence) pour les requêtes conditionnelles
+_configs_state: dict = {"etag": None, "by_agency": {}}
+
+
 def fetch_configs() -> list:
-    """Récupère toutes les configs actives (Gmail OU Outlook connecté)."""
+    """
+    Récupère toutes les configs actives (Gmail OU Outlook connecté).
+    Requête conditionnelle : 304 → configs en cache, 200 → delta appliqué.
+    """
+    headers = {"If-None-Match": _configs_state["etag"]} if _configs_state["etag"] else {}
     try:
         resp = requests.get(
             CONFIGS_URL,
-            params={"secret": WATCHER_SECRET},
+            params={"secret": WATCHER_SECRET, "delta": "true"},
+            headers=headers,
             timeout=10,
         )
+        if resp.status_code == 304:
+            return list(_configs_state["by_agency"].values())
         if resp.status_code == 200:
-            return resp.json()
+            data = resp.json()
+            by_agency = {} if data["full"] else dict(_configs_state["by_agency"])
+            for agency_id in data["removed"]:
+                by_agency.pop(agency_id, None)
+            for config in data["configs"]:
+                by_agency[config["agency_id"]] = config
+            _configs_state.update(etag=resp.headers.get("ETag"), by_agency=by_agency)
+            return list(by_agency.values())
         log.warning(f"⚠️ Impossible de récupérer les configs : {resp.status_code}")
     except Exception as e:
         log.error(f"❌ Erreur fetch configs : {e}")
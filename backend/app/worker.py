@@ -5,7 +5,16 @@ import sys
 # on remonte d'un niveau pour atteindre /app/ et pouvoir importer "app.tasks"
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-import app.tasks  # noqa: F401 — pré-import requis pour que RQ resolve app.tasks.process_email_job
+# Files écoutées : toutes par défaut, ou un sous-ensemble (ex. RQ_QUEUES=maintenance
+# pour un worker dédié à la rétention). Ordre = priorité : les emails passent avant
+# les exports groupés, la maintenance (rétention RGPD) en dernier.
+QUEUES = [q.strip() for q in os.getenv("RQ_QUEUES", "emails,exports,maintenance").split(",") if q.strip()]
+
+# Profil de pool DB — à fixer AVANT l'import de l'app (création de l'engine)
+os.environ.setdefault("DB_POOL_PROFILE", "maintenance" if QUEUES == ["maintenance"] else "worker")
+
+import app.tasks  # noqa: F401 — pré-import requis pour que RQ resolve les jobs de app.tasks
+import app.services.stats_service  # noqa: F401 — enregistre les hooks ORM des compteurs dashboard
 
 from redis import Redis
 from rq import Worker
@@ -17,9 +26,10 @@ if not redis_url:
 redis_conn = Redis.from_url(redis_url)
 
 if __name__ == "__main__":
-    print("🚀 RQ Worker started — listening on 'emails'")
-    worker = Worker(["emails"], connection=redis_conn)
-    worker.work()
+    print(f"🚀 RQ Worker started — listening on {QUEUES}")
+    worker = Worker(QUEUES, connection=redis_conn)
+    # Scheduler requis pour les jobs re-planifiés (enqueue_in : 429 Mistral, verrou candidat)
+    worker.work(with_scheduler=True)
 
 
 
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Benchmark des règles de filtrage du watcher (decide_filter, hors expéditeur connu).
+
+Compare sur un corpus d'emails générés (candidatures, spam, notifications,
+emails sans rapport ; corps courts à longs) :
+  1. « avant »   : implémentation d'origine (lower() de chaque motif de la
+                   blacklist agence par email, liste complète des mots-clés) ;
+  2. « matcher » : FilterMatcher préparé une fois par agence (app.watcher) ;
+  3. « regex »   : une regex alternée par famille de motifs (écartée : plus lente).
+Vérifie que les trois donnent la même décision et les mêmes raisons.
+
+Usage :
+    cd backend
+    python scripts/benchmark_filter.py
+    python scripts/benchmark_filter.py --emails 5000 --blacklist 200 --runs 7
+"""
+
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.argv.append("--test-bypass")   # app.watcher exige sinon ses variables d'environnement
+
+from app.watcher import (  # noqa: E402
+    IMMOBILIER_KEYWORDS, SPAM_KEYWORDS, SYSTEM_BLACKLIST, FilterMatcher,
+)
+
+sys.argv.remove("--test-bypass")
+
+FILLER = (
+    "bonjour merci pour votre retour je vous contacte au sujet de ma situation "
+    "vous trouverez les éléments demandés nous restons disponibles cordialement "
+    "la réunion est décalée à jeudi pensez à valider le planning de la semaine"
+).split()
+
+
+# ── Implémentations comparées (renvoient la liste des raisons) ──────────────────
+
+def rules_before(sender, text, agency_blacklist):
+    sender_lower = sender.lower()
+    if any(p in sender_lower for p in SYSTEM_BLACKLIST):
+        return ["system_blacklist"]
+    if agency_blacklist and any(p.lower() in sender_lower for p in agency_blacklist):
+        return ["agency_blacklist"]
+    if any(w in text for w in SPAM_KEYWORDS):
+        return ["spam_keywords"]
+    matched = [kw for kw in IMMOBILIER_KEYWORDS if kw in text]
+    return [f"immo_keywords:{','.join(matched[:3])}"] if matched else []
+
+
+def rules_matcher(matcher):
+    def run(sender, text, _):
+        blocked = matcher.blocked_sender(sender)
+        if blocked:
+            return [blocked]
+        if matcher.has_spam(text):
+            return ["spam_keywords"]
+        matched = matcher.first_keywords(text)
+        return [f"immo_keywords:{','.join(matched)}"] if matched else []
+    return run
+
+
+def rules_regex(agency_blacklist):
+    def alternation(patterns):
+        return re.compile("|".join(re.escape(p.lower()) for p in sorted(patterns, key=len, reverse=True)))
+
+    system, spam = alternation(SYSTEM_BLACKLIST), alternation(SPAM_KEYWORDS)
+    agency = alternation(agency_blacklist) if agency_blacklist else None
+    # Lookahead : toutes les positions, y compris les mots-clés imbriqués
+    keywords = re.compile("(?=(" + alternation(IMMOBILIER_KEYWORDS).pattern + "))")
+    # Mots-clés préfixes d'un mot-clé plus long, présents à la même position
+    prefixes = {kw: {p for p in IMMOBILIER_KEYWORDS if kw.startswith(p)} for kw in IMMOBILIER_KEYWORDS}
+
+    def run(sender, text, _):
+        sender_lower = sender.lower()
+        if system.search(sender_lower):
+            return ["system_blacklist"]
+        if agency and agency.search(sender_lower):
+            return ["agency_blacklist"]
+        if spam.search(text):
+            return ["spam_keywords"]
+        found = set()
+        for m in keywords.finditer(text):
+            found |= prefixes[m.group(1)]
+        matched = [kw for kw in IMMOBILIER_KEYWORDS if kw in found]
+        return [f"immo_keywords:{','.join(matched[:3])}"] if matched else []
+    return run
+
+
+# ── Corpus ──────────────────────────────────────────────────────────────────────
+
+def build_corpus(n: int, blacklist: list[str], rng: random.Random) -> list:
+    emails = []
+    for i in range(n):
+        words = [rng.choice(FILLER) for _ in range(rng.choice([20, 80, 300, 1500]))]
+        kind = rng.random()
+        sender = f"Personne {i} <personne{i}@{rng.choice(['gmail.com', 'orange.fr', 'free.fr'])}>"
+        if kind < 0.35:                                          # candidature
+            for kw in rng.sample(IMMOBILIER_KEYWORDS, rng.randint(1, 4)):
+                words.insert(rng.randrange(len(words)), kw)
+        elif kind < 0.45:                                        # spam
+            words.insert(rng.randrange(len(words)), rng.choice(SPAM_KEYWORDS))
+        elif kind < 0.55:                                        # notification système
+            sender = f"GitHub <{rng.choice(['notifications@github.com', 'noreply@github.com'])}>"
+        elif kind < 0.65 and blacklist:                          # blacklist agence
+            sender = f"Pub <promo@{rng.choice(blacklist).lstrip('@')}>"
+        text = f"Sujet {i} {' '.join(words)}".lower()
+        emails.append((sender, text))
+    return emails
+
+
+def measure(fn, corpus, blacklist, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        for sender, text in corpus:
+            fn(sender, text, blacklist)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) / len(corpus) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=2000)
+    parser.add_argument("--blacklist", type=int, default=50, help="motifs dans la blacklist agence")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    blacklist = [f"@Promo-{n}.Example.com" for n in range(args.blacklist)]
+    corpus = build_corpus(args.emails, blacklist, rng)
+
+    started = time.perf_counter()
+    matcher = FilterMatcher(blacklist)
+    build_us = (time.perf_counter() - started) * 1e6
+
+    engines = {
+        "avant": rules_before,
+        "matcher": rules_matcher(matcher),
+        "regex": rules_regex(blacklist),
+    }
+    reference = [rules_before(s, t, blacklist) for s, t in corpus]
+    for name, fn in engines.items():
+        assert [fn(s, t, blacklist) for s, t in corpus] == reference, f"{name} : décisions différentes"
+
+    print(f"{len(corpus)} emails, blacklist agence de {len(blacklist)} motifs "
+          f"(préparation du matcher : {build_us:.0f} µs, une fois par changement de config)\n")
+    base = None
+    for name, fn in engines.items():
+        per_email = measure(fn, corpus, blacklist, args.runs)
+        base = base or per_email
+        print(f"  {name:<8} {per_email:8.1f} µs / email   (×{base / per_email:.2f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Benchmark des index composites / partiels sur les requêtes chaudes.
+
+Crée le schéma sur une base VIDE, la peuple (agences, emails, documents,
+dossiers, liens), puis mesure chaque requête deux fois :
+  1. « avant » : index composites supprimés (seuls les index mono-colonne restent)
+  2. « après » : index composites recréés (état de models.py / des migrations)
+Affiche pour chacune le plan d'exécution et la latence médiane.
+
+Usage :
+    cd backend
+    python scripts/benchmark_indexes.py                       # SQLite temporaire
+    python scripts/benchmark_indexes.py --agencies 50 --emails 20000
+    BENCH_DATABASE_URL=postgresql://…/scratch python scripts/benchmark_indexes.py
+
+⚠️  Ne jamais viser la base de prod : le script refuse une base déjà peuplée.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, inspect, text
+
+from app.database.models import Base
+
+# ── Requêtes mesurées (reflet des accès ORM de l'application) ───────────────────
+QUERIES = {
+    "dedup pièce jointe (_process_attachment)": (
+        "SELECT id FROM file_analyses WHERE agency_id = :agency_id AND file_hash = :file_hash LIMIT 1"
+    ),
+    "dossier ouvert (ensure_tenant_file)": (
+        "SELECT id FROM tenant_files WHERE agency_id = :agency_id "
+        "AND candidate_email = :email AND is_closed = {false} LIMIT 1"
+    ),
+    "expéditeur connu (check-sender)": (
+        "SELECT id FROM tenant_files WHERE agency_id = :agency_id "
+        "AND normalized_email = :email LIMIT 1"
+    ),
+    "historique emails (keyset)": (
+        "SELECT id FROM email_analyses WHERE agency_id = :agency_id "
+        "ORDER BY created_at DESC, id DESC LIMIT 50"
+    ),
+    "dossier lié à un email": (
+        "SELECT min(tenant_file_id) FROM tenant_email_links WHERE email_analysis_id = :email_id"
+    ),
+    "documents d'un dossier": (
+        "SELECT file_analysis_id FROM tenant_document_links WHERE tenant_file_id = :tenant_file_id"
+    ),
+    "liste dossiers (keyset)": (
+        "SELECT id FROM tenant_files WHERE agency_id = :agency_id ORDER BY id DESC LIMIT 100"
+    ),
+    "liste dossiers par statut (keyset)": (
+        "SELECT id FROM tenant_files WHERE agency_id = :agency_id AND status = 'NEW' "
+        "ORDER BY id DESC LIMIT 100"
+    ),
+    "historique documents (keyset)": (
+        "SELECT id FROM file_analyses WHERE agency_id = :agency_id ORDER BY id DESC LIMIT 100"
+    ),
+    "historique documents par période": (
+        "SELECT id FROM file_analyses WHERE agency_id = :agency_id AND created_at >= :since LIMIT 100"
+    ),
+    "dossiers par période": (
+        "SELECT id FROM tenant_files WHERE agency_id = :agency_id AND created_at >= :since LIMIT 100"
+    ),
+    "historique documents par type (keyset)": (
+        "SELECT id FROM file_analyses WHERE agency_id = :agency_id AND file_type = 'payslip' "
+        "ORDER BY id DESC LIMIT 100"
+    ),
+}
+
+
+def composite_indexes():
+    return [ix for table in Base.metadata.sorted_tables for ix in table.indexes if len(ix.columns) > 1]
+
+
+# ── Jeu de données ─────────────────────────────────────────────────────────────
+
+def seed(engine, agencies: int, emails: int, rng: random.Random) -> dict:
+    now = datetime.utcnow()
+    t = {name: Base.metadata.tables[name] for name in (
+        "agencies", "email_analyses", "file_analyses", "tenant_files",
+        "tenant_email_links", "tenant_document_links",
+    )}
+    files_per_agency = emails // 2
+    tenants_per_agency = max(emails // 10, 1)
+
+    with engine.begin() as conn:
+        conn.execute(t["agencies"].insert(), [
+            {"id": a, "name": f"Agence {a}", "created_at": now, "updated_at": now}
+            for a in range(1, agencies + 1)
+        ])
+        for a in range(1, agencies + 1):
+            e0, f0, t0 = (a - 1) * emails, (a - 1) * files_per_agency, (a - 1) * tenants_per_agency
+            conn.execute(t["email_analyses"].insert(), [
+                {
+                    "id": e0 + i + 1, "agency_id": a, "sender_email": f"c{i % tenants_per_agency}@a{a}.fr",
+                    "subject": "Candidature", "category": rng.choice(["candidature", "autre"]),
+                    "urgency": rng.choice(["normale", "urgente"]), "processing_status": "success",
+                    "created_at": now - timedelta(minutes=emails - i), "updated_at": now,
+                }
+                for i in range(emails)
+            ])
+            conn.execute(t["file_analyses"].insert(), [
+                {
+                    "id": f0 + i + 1, "agency_id": a, "filename": f"{a}_{i}.pdf", "file_type": "payslip",
+                    "file_hash": f"{a:04d}{i:060d}", "created_at": now, "updated_at": now,
+                }
+                for i in range(files_per_agency)
+            ])
+            conn.execute(t["tenant_files"].insert(), [
+                {
+                    "id": t0 + i + 1, "agency_id": a, "candidate_email": f"c{i}@a{a}.fr",
+                    "normalized_email": f"c{i}@a{a}.fr",
+                    "status": "NEW", "is_closed": i % 5 != 0,   # 80 % de dossiers clos
+                    "created_at": now, "updated_at": now,
+                }
+                for i in range(tenants_per_agency)
+            ])
+            conn.execute(t["tenant_email_links"].insert(), [
+                {"tenant_file_id": t0 + i % tenants_per_agency + 1, "email_analysis_id": e0 + i + 1,
+                 "created_at": now}
+                for i in range(emails)
+            ])
+            conn.execute(t["tenant_document_links"].insert(), [
+                {"tenant_file_id": t0 + i % tenants_per_agency + 1, "file_analysis_id": f0 + i + 1,
+                 "doc_type": "PAYSLIP", "quality": "OK", "created_at": now}
+                for i in range(files_per_agency)
+            ])
+
+    return {"emails": emails, "files": files_per_agency, "tenants": tenants_per_agency}
+
+
+def sample_params(agencies: int, sizes: dict, rng: random.Random) -> dict:
+    a = rng.randint(1, agencies)
+    i = rng.randrange(sizes["tenants"])
+    return {
+        "agency_id": a,
+        "file_hash": f"{a:04d}{rng.randrange(sizes['files']):060d}",
+        "email": f"c{i}@a{a}.fr",
+        "email_id": (a - 1) * sizes["emails"] + rng.randrange(sizes["emails"]) + 1,
+        "tenant_file_id": (a - 1) * sizes["tenants"] + i + 1,
+        "since": datetime.utcnow() - timedelta(days=1),
+    }
+
+
+# ── Mesure ─────────────────────────────────────────────────────────────────────
+
+def explain(conn, sql: str, params: dict) -> str:
+    if conn.dialect.name == "sqlite":
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params).all()
+        return "\n".join(f"    {r[-1]}" for r in rows)
+    rows = conn.execute(text(f"EXPLAIN {sql}"), params).all()
+    return "\n".join(f"    {r[0]}" for r in rows)
+
+
+def measure(engine, agencies: int, sizes: dict, runs: int, seed_value: int) -> dict:
+    rng = random.Random(seed_value)   # mêmes paramètres pour « avant » et « après »
+    results = {}
+    with engine.connect() as conn:
+        false = "false" if conn.dialect.name != "sqlite" else "0"
+        for label, template in QUERIES.items():
+            sql = template.format(false=false)
+            params = [sample_params(agencies, sizes, rng) for _ in range(runs)]
+            timings = []
+            for p in params:
+                started = time.perf_counter()
+                conn.execute(text(sql), p).all()
+                timings.append((time.perf_counter() - started) * 1000)
+            results[label] = (statistics.median(timings), explain(conn, sql, params[0]))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agencies", type=int, default=20)
+    parser.add_argument("--emails", type=int, default=5000, help="emails par agence")
+    parser.add_argument("--runs", type=int, default=200, help="exécutions par requête")
+    args = parser.parse_args()
+
+    url = os.getenv("BENCH_DATABASE_URL")
+    if not url:
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        url = f"sqlite:///{path}"
+    engine = create_engine(url)
+
+    if inspect(engine).has_table("agencies"):
+        with engine.connect() as conn:
+            if conn.execute(text("SELECT 1 FROM agencies LIMIT 1")).first():
+                print("❌  Base déjà peuplée — utilisez une base de test vide.")
+                sys.exit(1)
+
+    print(f"🗄️  {url} — {args.agencies} agences × {args.emails} emails")
+    Base.metadata.create_all(engine)
+    rng = random.Random(42)
+    sizes = seed(engine, args.agencies, args.emails, rng)
+
+    indexes = composite_indexes()
+    with engine.begin() as conn:
+        for ix in indexes:
+            ix.drop(conn)
+        conn.execute(text("ANALYZE"))
+    before = measure(engine, args.agencies, sizes, args.runs, seed_value=7)
+
+    with engine.begin() as conn:
+        for ix in indexes:
+            ix.create(conn)
+        conn.execute(text("ANALYZE"))
+    after = measure(engine, args.agencies, sizes, args.runs, seed_value=7)
+
+    print(f"\n{len(indexes)} index composites : {', '.join(ix.name for ix in indexes)}\n")
+    for label in QUERIES:
+        (b_ms, b_plan), (a_ms, a_plan) = before[label], after[label]
+        ratio = b_ms / a_ms if a_ms else float("inf")
+        print(f"── {label} : {b_ms:.3f} ms → {a_ms:.3f} ms (×{ratio:.1f})")
+        print(f"  avant :\n{b_plan}")
+        print(f"  après :\n{a_plan}\n")
+
+    Base.metadata.drop_all(engine)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Benchmark du transport watcher → webhook → Redis (RQ).
+
+Génère un corpus réaliste de candidatures (bulletins de salaire et avis
+d'imposition en PDF, pièce d'identité scannée en JPEG, justificatif photographié
+en PNG), puis mesure pour chaque email :
+  1. octets sur le réseau : JSON brut vs JSON gzip (Content-Encoding), unitaire
+     et par lot de WEBHOOK_BATCH_SIZE ;
+  2. octets en Redis : hash du job RQ avec le payload webhook (base64)
+     vs payload compact (pièces jointes en octets bruts, compact_job_payload).
+Affiche aussi le coût CPU de la compression / décompression.
+
+Usage :
+    cd backend
+    python scripts/benchmark_transport.py
+    python scripts/benchmark_transport.py --emails 200 --batch 20 --seed 3
+
+Aucune connexion Redis n'est ouverte : le job est sérialisé comme RQ le ferait.
+"""
+
+import argparse
+import base64
+import gzip
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis
+from fpdf import FPDF
+from PIL import Image, ImageDraw, ImageFilter
+from rq.job import Job
+
+from app.core.payload_codec import compact_job_payload, decode_body
+from app.tasks import process_email_job
+
+# ── Corpus ──────────────────────────────────────────────────────────────────────
+
+def _payslip_pdf(rng: random.Random, title: str) -> bytes:
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Helvetica", "B", 14)
+    pdf.cell(0, 10, title, new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font("Helvetica", size=9)
+    for _ in range(rng.randint(25, 45)):
+        label = rng.choice(["Salaire de base", "Prime", "CSG deductible", "Retraite", "Mutuelle", "Net a payer"])
+        pdf.cell(0, 5, f"{label:<30} {rng.uniform(10, 4000):>10.2f} EUR", new_x="LMARGIN", new_y="NEXT")
+    return bytes(pdf.output())
+
+
+def _scan_image(rng: random.Random, fmt: str, size=(1240, 1754)) -> bytes:
+    """Page scannée / photographiée : fond bruité, lignes de texte, flou léger."""
+    noise = Image.effect_noise(size, rng.uniform(8, 20)).convert("RGB")
+    img = Image.blend(Image.new("RGB", size, (236, 232, 224)), noise, 0.15)
+    draw = ImageDraw.Draw(img)
+    for y in range(120, size[1] - 120, 38):
+        draw.rectangle([90, y, rng.randint(400, size[0] - 90), y + 14], fill=(40, 40, 50))
+    img = img.filter(ImageFilter.GaussianBlur(0.8))
+    buf = io.BytesIO()
+    if fmt == "JPEG":
+        img.save(buf, "JPEG", quality=85)
+    else:
+        img.save(buf, "PNG", optimize=True)
+    return buf.getvalue()
+
+
+def build_corpus(n_emails: int, seed: int) -> list:
+    rng = random.Random(seed)
+    # Pièces générées une fois puis réutilisées : seul l'ordre de grandeur compte
+    pool = {
+        "bulletin": [_payslip_pdf(rng, f"Bulletin de salaire {m}/2026") for m in range(1, 4)],
+        "avis": [_payslip_pdf(rng, "Avis d'impot sur le revenu 2025")],
+        "identite": [_scan_image(rng, "JPEG") for _ in range(2)],
+        "justificatif": [_scan_image(rng, "PNG", size=(900, 1200))],
+    }
+    emails = []
+    for n in range(n_emails):
+        kinds = rng.sample(["bulletin", "bulletin", "bulletin", "avis", "identite", "justificatif"], rng.randint(1, 4))
+        attachments = []
+        for k, kind in enumerate(kinds):
+            raw = rng.choice(pool[kind])
+            ext, ctype = {
+                "identite": ("jpg", "image/jpeg"),
+                "justificatif": ("png", "image/png"),
+            }.get(kind, ("pdf", "application/pdf"))
+            attachments.append({
+                "filename": f"{kind}_{k}.{ext}",
+                "content_type": ctype,
+                "content_base64": base64.b64encode(raw).decode("utf-8"),
+            })
+        emails.append({
+            "from_email": f"candidat{n}@gmail.com",
+            "to_email": "inbox+agence@cipherflow.io",
+            "subject": "Candidature appartement T3 — dossier complet",
+            "content": "Bonjour,\nVeuillez trouver ci-joint mon dossier de location.\nCordialement\n" * 3,
+            "send_email": True,
+            "attachments": attachments,
+            "agency_id": 1,
+            "filter_decision": "accept",
+            "filter_reasons": ["pj_pertinente"],
+            "filter_score": 80,
+            "idempotency_key": f"gmail:inbox@agence.fr:{n:08x}",
+        })
+    return emails
+
+
+# ── Mesures ─────────────────────────────────────────────────────────────────────
+
+def redis_job_bytes(conn, payload: dict) -> int:
+    """Taille du hash RQ (job.data déjà compressé par RQ en zlib)."""
+    job = Job.create(process_email_job, args=(payload,), connection=conn)
+    return sum(len(k) + len(v if isinstance(v, bytes) else str(v)) for k, v in job.to_dict().items())
+
+
+def _fmt(n: float) -> str:
+    return f"{n / 1024:,.1f} Ko" if n < 1024 * 1024 else f"{n / (1024 * 1024):,.2f} Mo"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=100)
+    parser.add_argument("--batch", type=int, default=20)
+    parser.add_argument("--level", type=int, default=6, help="niveau gzip (watcher : 6)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    emails = build_corpus(args.emails, args.seed)
+    raw_att = sum(len(base64.b64decode(a["content_base64"])) for e in emails for a in e["attachments"])
+    print(f"Corpus : {len(emails)} emails, "
+          f"{sum(len(e['attachments']) for e in emails)} pièces jointes, {_fmt(raw_att)} de fichiers\n")
+
+    # Réseau — unitaire
+    json_sizes, gzip_sizes, enc_ms, dec_ms = [], [], [], []
+    for e in emails:
+        body = json.dumps(e).encode("utf-8")
+        t0 = time.perf_counter()
+        packed = gzip.compress(body, compresslevel=args.level)
+        t1 = time.perf_counter()
+        decode_body(packed, "gzip")
+        t2 = time.perf_counter()
+        json_sizes.append(len(body))
+        gzip_sizes.append(len(packed))
+        enc_ms.append((t1 - t0) * 1000)
+        dec_ms.append((t2 - t1) * 1000)
+
+    # Réseau — par lot
+    batch_json = batch_gzip = 0
+    for start in range(0, len(emails), args.batch):
+        body = json.dumps({"emails": emails[start:start + args.batch]}).encode("utf-8")
+        batch_json += len(body)
+        batch_gzip += len(gzip.compress(body, compresslevel=args.level))
+
+    # Redis
+    conn = redis.Redis()   # jamais connecté : Job.create / to_dict ne font pas d'aller-retour
+    redis_b64 = sum(redis_job_bytes(conn, e) for e in emails)
+    redis_compact = sum(redis_job_bytes(conn, compact_job_payload(e)) for e in emails)
+
+    def line(label, before, after):
+        print(f"  {label:<28} {_fmt(before):>12} → {_fmt(after):>12}  (-{(1 - after / before) * 100:.1f} %)")
+
+    print("Réseau (watcher → webhook)")
+    line("unitaire JSON → gzip", sum(json_sizes), sum(gzip_sizes))
+    line(f"lot de {args.batch} JSON → gzip", batch_json, batch_gzip)
+    print(f"  {'gzip CPU / email':<28} compression {statistics.median(enc_ms):.2f} ms, "
+          f"décompression {statistics.median(dec_ms):.2f} ms (médianes)\n")
+    print("Redis (hash du job RQ, data zlib par RQ)")
+    line("base64 → octets bruts", redis_b64, redis_compact)
+
+
+if __name__ == "__main__":
+    main()
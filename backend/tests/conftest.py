@@ -2,15 +2,18 @@
 """
 Fixtures partagées pour tous les tests CipherFlow.
 
-- SQLite in-memory (StaticPool) → isolation par test
+- SQLite fichier temporaire (tmp_path) → isolation par test, partagé entre
+  la session sync et la session async (aiosqlite) des routes de lecture
 - TestClient FastAPI avec injection DB de test via dependency_override
 - Helpers : test_agency, test_user, auth_token, auth_headers
 """
+import asyncio
 import os
 import pytest
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import NullPool
 from fastapi.testclient import TestClient
 from unittest.mock import patch
 
@@ -34,7 +37,7 @@ os.environ.setdefault("GOOGLE_OAUTH_REDIRECT_URL",   "http://localhost:8000/auth
 os.environ.setdefault("FRONTEND_URL",                "http://localhost:5173")
 os.environ.setdefault("BACKEND_URL",                 "http://localhost:8000")
 
-from app.database.database import get_db
+from app.database.database import get_async_db, get_db, get_read_db
 from app.database.models import Base, Agency, User, UserRole, AppSettings
 from app.security import get_password_hash
 from app.main import app
@@ -64,15 +67,20 @@ WATCHER_SECRET = os.environ["WATCHER_SECRET"]
 # ══════════════════════════════════════════════════════════════════════════════
 
 @pytest.fixture(scope="function")
-def test_engine():
+def test_db_path(tmp_path):
     """
-    Moteur SQLite in-memory avec StaticPool (connexion unique → données
-    partagées dans le même processus, isolation entre tests).
+    Fichier SQLite propre à chaque test. Une base in-memory ne peut pas être
+    partagée entre le driver sync et aiosqlite : on passe par un fichier.
     """
+    return tmp_path / "test.db"
+
+
+@pytest.fixture(scope="function")
+def test_engine(test_db_path):
+    """Moteur SQLite sync sur le fichier de test (isolation entre tests)."""
     engine = create_engine(
-        "sqlite:///:memory:",
+        f"sqlite:///{test_db_path}",
         connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
     )
     Base.metadata.create_all(engine)
     yield engine
@@ -80,6 +88,14 @@ def test_engine():
     engine.dispose()
 
 
+@pytest.fixture(scope="function")
+def async_session_factory(test_engine, test_db_path):
+    """Sessions async (aiosqlite) sur le même fichier que test_engine."""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{test_db_path}", poolclass=NullPool)
+    yield async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    asyncio.run(engine.dispose())
+
+
 @pytest.fixture(scope="function")
 def db_session(test_engine):
     """Session SQLAlchemy sur la DB de test."""
@@ -94,16 +110,22 @@ def db_session(test_engine):
 # ══════════════════════════════════════════════════════════════════════════════
 
 @pytest.fixture(scope="function")
-def client(db_session):
+def client(db_session, async_session_factory):
     """
     TestClient FastAPI avec :
-    - DB de test injectée via dependency_override
+    - DB de test injectée via dependency_override (sync + async)
     - Mocks : send_verification_email, send_reset_password_email
     """
     def override_get_db():
         yield db_session
 
+    async def override_get_async_db():
+        async with async_session_factory() as session:
+            yield session
+
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    app.dependency_overrides[get_read_db] = override_get_async_db
 
     mock_verify  = patch("app.api.auth_routes.send_verification_email")
     mock_reset   = patch("app.api.auth_routes.send_reset_password_email")
@@ -5,6 +5,7 @@ Tests de la blacklist personnalisée par agence.
 - CRUD via API : ajout, liste, suppression
 - Vérification GET /watcher/configs inclut agency_blacklist
 - Unit test de is_agency_blacklisted()
+- Règles préparées par agence (FilterMatcher), reconstruites au changement de blacklist
 """
 import os
 import pytest
@@ -174,3 +175,64 @@ class TestIsAgencyBlacklisted:
             "user@mail.spam.com",
             ["spam.com"]
         ) is True
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# ⚙️ Règles préparées par agence (FilterMatcher)
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestFilterMatcher:
+
+    def test_reconstruit_seulement_si_blacklist_change(self):
+        from app.watcher import filter_matcher
+
+        blacklist = ["@Spam.com"]
+        first = filter_matcher(987, blacklist)
+        assert filter_matcher(987, blacklist) is first
+        assert filter_matcher(987, ["@Spam.com"]) is first          # même contenu
+        updated = filter_matcher(987, ["@spam.com", "@junk.io"])
+        assert updated is not first
+        assert updated.blocked_sender("Pub <promo@JUNK.io>") == "agency_blacklist"
+
+    def test_wrapper_et_defauts_sans_reconstruction(self):
+        from app.watcher import filter_matcher, is_agency_blacklisted
+
+        matcher = filter_matcher(988, None)
+        assert filter_matcher(988, []) is matcher                     # None ≡ liste vide
+        assert is_agency_blacklisted("a@spam.com", ["@spam.com"], agency_id=988)
+        cached = filter_matcher(988, ["@spam.com"])
+        assert is_agency_blacklisted("b@spam.com", ["@spam.com"], agency_id=988)
+        assert filter_matcher(988, ["@spam.com"]) is cached           # pas de reconstruction par appel
+
+    def test_blacklist_systeme_prioritaire(self):
+        from app.watcher import FilterMatcher
+
+        matcher = FilterMatcher(["github.com"])
+        assert matcher.blocked_sender("GitHub <noreply@github.com>") == "system_blacklist"
+        assert matcher.blocked_sender("candidat@gmail.com") is None
+
+    def test_motifs_vides_ignores(self):
+        from app.watcher import FilterMatcher
+
+        assert FilterMatcher(["", "  "]).blocked_sender("candidat@gmail.com") is None
+
+    def test_trois_premiers_mots_cles_ordre_de_la_liste(self):
+        from app.watcher import IMMOBILIER_KEYWORDS, FilterMatcher
+
+        text = "ci-joint mon bulletin de salaire et ma pièce d'identité pour le dossier de location"
+        expected = [kw for kw in IMMOBILIER_KEYWORDS if kw in text][:3]
+        assert FilterMatcher.first_keywords(text) == expected == ["dossier", "location", "pièce d'identité"]
+
+    def test_decide_filter_raisons_inchangees(self):
+        from unittest.mock import patch
+        from app.watcher import FilterDecision, decide_filter
+
+        with patch("app.watcher.is_known_sender_cached", return_value=False):
+            assert decide_filter("x@spam.com", "Dossier", "", [], 1, ["@spam.com"]) == \
+                (FilterDecision.IGNORE, ["agency_blacklist"])
+            assert decide_filter("a@gmail.com", "Bitcoin", "dossier", [], 1, []) == \
+                (FilterDecision.IGNORE, ["spam_keywords"])
+            assert decide_filter("a@gmail.com", "Candidature T3", "mon dossier", [], 1, []) == \
+                (FilterDecision.PROCESS_FULL, ["immo_keywords:candidature,dossier,t3"])
+            assert decide_filter("a@gmail.com", "Réunion", "jeudi", [], 1, []) == \
+                (FilterDecision.IGNORE, ["no_criteria_matched"])
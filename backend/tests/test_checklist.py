@@ -0,0 +1,225 @@
+# backend/tests/test_checklist.py
+"""
+Tests de la checklist incrémentale des dossiers locataires.
+
+- attach : compteurs par type incrémentés en SQL, plafonds (3 fiches de paie, types uniques)
+- checklist dérivée des compteurs (format historique : required / received / missing)
+- detach (route) et suppression de document : compteurs décrémentés, statut recalculé
+- réparation : rebuild_checklist / reconcile_document_counters recomptent depuis les liens
+- apply_email_to_tenant_file : un commit, nombre de requêtes indépendant du nombre de PJ
+"""
+import json
+from contextlib import contextmanager
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import event, update
+
+from app.database.models import (
+    EmailAnalysis, FileAnalysis, TenantDocumentLink, TenantEmailLink, TenantFile, TenantFileStatus,
+)
+from app.services.tenant_service import (
+    apply_document_delta, apply_email_to_tenant_file, attach_files_to_tenant_file, build_checklist,
+    rebuild_checklist, recompute_checklist, reconcile_document_counters,
+)
+
+
+@pytest.fixture
+def tenant(db_session, test_user):
+    tf = TenantFile(agency_id=test_user.agency_id, candidate_email="jean@test.com")
+    db_session.add(tf)
+    db_session.commit()
+    return tf
+
+
+def _files(db_session, agency_id, *types):
+    files = [
+        FileAnalysis(agency_id=agency_id, filename=f"{i}_{t}.pdf", file_type=t)
+        for i, t in enumerate(types)
+    ]
+    db_session.add_all(files)
+    db_session.commit()
+    return [f.id for f in files]
+
+
+class TestAttachCounters:
+
+    def test_compteurs_et_plafonds(self, db_session, tenant):
+        ids = _files(db_session, tenant.agency_id,
+                     "payslip", "payslip", "payslip", "payslip", "id", "id", "other")
+        attach_files_to_tenant_file(db_session, tenant, ids)
+
+        assert tenant.doc_payslip_count == 3
+        assert tenant.doc_id_count == 1
+        assert db_session.query(TenantDocumentLink).count() == 4
+
+    def test_doublon_exact_ignore(self, db_session, tenant):
+        ids = _files(db_session, tenant.agency_id, "tax")
+        attach_files_to_tenant_file(db_session, tenant, ids)
+        attach_files_to_tenant_file(db_session, tenant, ids)
+        assert tenant.doc_tax_count == 1
+
+    def test_increment_sql_sans_ecrasement(self, db_session, tenant):
+        # Un autre worker a rattaché un document entre-temps : l'instance en
+        # mémoire est périmée, l'incrément SQL ne doit pas écraser sa valeur.
+        db_session.execute(
+            update(TenantFile).where(TenantFile.id == tenant.id).values(doc_payslip_count=2)
+        )
+        attach_files_to_tenant_file(db_session, tenant, _files(db_session, tenant.agency_id, "payslip"))
+
+        assert tenant.doc_payslip_count == 3
+        db_session.expire_all()
+        assert db_session.get(TenantFile, tenant.id).doc_payslip_count == 3
+
+    def test_decrement_borne_a_zero(self, db_session, tenant):
+        apply_document_delta(db_session, tenant, "tax", -1)
+        assert tenant.doc_tax_count == 0
+
+    def test_checklist_format_historique(self, db_session, tenant):
+        attach_files_to_tenant_file(
+            db_session, tenant, _files(db_session, tenant.agency_id, "id", "payslip", "payslip"),
+        )
+        recompute_checklist(db_session, tenant)
+
+        checklist = json.loads(tenant.checklist_json)
+        assert checklist["received"] == ["id", "payslip", "payslip"]
+        assert checklist["missing"] == ["payslip", "tax", "work_contract", "address_proof"]
+        assert checklist["payslip_received"] == 2
+        assert tenant.status == TenantFileStatus.INCOMPLETE
+
+    def test_dossier_complet_a_valider(self, db_session, tenant):
+        attach_files_to_tenant_file(db_session, tenant, _files(
+            db_session, tenant.agency_id,
+            "id", "payslip", "payslip", "payslip", "tax", "work_contract", "address_proof",
+        ))
+        recompute_checklist(db_session, tenant)
+        assert build_checklist(tenant)["missing"] == []
+        assert tenant.status == TenantFileStatus.TO_VALIDATE
+
+
+class TestDetach:
+
+    def test_route_detach_decremente(self, client, auth_headers, db_session, tenant):
+        file_id, = _files(db_session, tenant.agency_id, "id")
+        attach_files_to_tenant_file(db_session, tenant, [file_id])
+        recompute_checklist(db_session, tenant)
+
+        resp = client.delete(f"/tenant-files/{tenant.id}/documents/{file_id}", headers=auth_headers)
+        assert resp.status_code == 200
+        assert "id" in resp.json()["checklist"]["missing"]
+
+        db_session.refresh(tenant)
+        assert tenant.doc_id_count == 0
+        assert tenant.status == TenantFileStatus.NEW
+
+    def test_suppression_document_decremente(self, client, auth_headers, db_session, tenant):
+        ids = _files(db_session, tenant.agency_id, "payslip", "tax")
+        attach_files_to_tenant_file(db_session, tenant, ids)
+        recompute_checklist(db_session, tenant)
+
+        with patch("app.api.file_routes.release_object"):
+            resp = client.delete(f"/api/files/{ids[0]}", headers=auth_headers)
+        assert resp.status_code == 200
+
+        db_session.refresh(tenant)
+        assert tenant.doc_payslip_count == 0
+        assert tenant.doc_tax_count == 1
+        assert tenant.status == TenantFileStatus.INCOMPLETE
+
+
+class TestRepair:
+
+    def test_rebuild_recompte_depuis_les_liens(self, db_session, tenant):
+        attach_files_to_tenant_file(db_session, tenant, _files(db_session, tenant.agency_id, "id"))
+        tenant.doc_id_count = 0
+        tenant.doc_payslip_count = 2   # dérive simulée
+        db_session.commit()
+
+        rebuild_checklist(db_session, tenant)
+        assert tenant.doc_id_count == 1
+        assert tenant.doc_payslip_count == 0
+        assert tenant.status == TenantFileStatus.INCOMPLETE
+
+    def test_reconcile_agence(self, db_session, tenant):
+        file_id, = _files(db_session, tenant.agency_id, "tax")
+        attach_files_to_tenant_file(db_session, tenant, [file_id])
+        # Suppression en masse qui contourne detach_document (ex. rétention)
+        db_session.query(TenantDocumentLink).delete()
+        db_session.commit()
+
+        assert reconcile_document_counters(db_session, tenant.agency_id) == 1
+        db_session.commit()
+        assert tenant.doc_tax_count == 0
+        assert tenant.status == TenantFileStatus.NEW
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# 📦 Mise à jour du dossier en une transaction
+# ══════════════════════════════════════════════════════════════════════════════
+
+@contextmanager
+def _count_queries(engine):
+    statements = []
+
+    def _before(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _before)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", _before)
+
+
+class TestApplyEmailToTenantFile:
+
+    def _run(self, db_session, test_engine, agency_id, types):
+        tf = TenantFile(agency_id=agency_id, candidate_email=f"c{len(types)}@test.com")
+        email = EmailAnalysis(agency_id=agency_id, sender_email=tf.candidate_email, subject="Dossier")
+        db_session.add_all([tf, email])
+        db_session.commit()
+        email_id = email.id
+        file_ids = _files(db_session, agency_id, *types)
+
+        # Dossier expiré par les commits précédents, comme dans le pipeline
+        with _count_queries(test_engine) as statements, \
+                patch.object(db_session, "commit", wraps=db_session.commit) as commit:
+            checklist = apply_email_to_tenant_file(db_session, tf, email_id, file_ids)
+        return tf, email, checklist, statements, commit.call_count
+
+    def test_une_transaction(self, db_session, test_engine, test_user):
+        tf, email, checklist, _, commits = self._run(
+            db_session, test_engine, test_user.agency_id, ["id", "payslip", "tax"],
+        )
+        assert commits == 1
+        assert checklist["received"] == ["id", "tax", "payslip"]
+        assert tf.status == TenantFileStatus.INCOMPLETE
+        assert db_session.query(TenantEmailLink).filter_by(email_analysis_id=email.id).count() == 1
+        assert db_session.query(TenantDocumentLink).filter_by(tenant_file_id=tf.id).count() == 3
+
+    def test_requetes_independantes_du_nombre_de_documents(self, db_session, test_engine, test_user):
+        *_, one, _ = self._run(db_session, test_engine, test_user.agency_id, ["id"])
+        *_, many, _ = self._run(
+            db_session, test_engine, test_user.agency_id,
+            ["id", "payslip", "payslip", "payslip", "tax", "work_contract", "address_proof"],
+        )
+        # rechargement dossier, lien email existant ?, liens existants, documents,
+        # INSERT liens (multi-lignes), UPDATE compteurs documents (SQL),
+        # INSERT lien email, UPDATE dossier, compteurs stats
+        assert len(many) == len(one)
+        assert len(many) <= 10
+
+    def test_erreur_rien_applique(self, db_session, test_user):
+        tf = TenantFile(agency_id=test_user.agency_id, candidate_email="x@test.com")
+        email = EmailAnalysis(agency_id=test_user.agency_id, sender_email="x@test.com", subject="s")
+        db_session.add_all([tf, email])
+        db_session.commit()
+        file_ids = _files(db_session, test_user.agency_id, "id")
+
+        with patch("app.services.tenant_service.build_checklist", side_effect=RuntimeError("boom")):
+            with pytest.raises(RuntimeError):
+                apply_email_to_tenant_file(db_session, tf, email.id, file_ids)
+
+        assert db_session.query(TenantEmailLink).count() == 0
+        assert db_session.query(TenantDocumentLink).count() == 0
+        assert tf.doc_id_count == 0
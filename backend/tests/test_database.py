@@ -0,0 +1,141 @@
+# backend/tests/test_database.py
+"""
+Tests de la configuration du pool de connexions.
+
+- Profils api / worker / maintenance + surcharges settings
+- Arguments PgBouncer selon le driver
+- InstrumentedQueuePool : checkouts, attente, pic
+- URL du moteur async (asyncpg / aiosqlite)
+- get_read_db : réplique si à jour, repli sur le primaire sinon (deux fichiers SQLite)
+- GET /admin/db-pool protégé par x-watcher-secret
+"""
+import asyncio
+import os
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.database import database
+from app.database.database import (
+    InstrumentedQueuePool, PoolStats, async_database_url, pgbouncer_connect_args, pool_settings,
+)
+
+WATCHER_SECRET = os.environ.get("WATCHER_SECRET", "test-secret-ci")
+
+
+class TestPoolProfiles:
+
+    def test_profils_et_surcharge(self):
+        assert pool_settings("worker")["pool_size"] == 2
+        assert pool_settings("inconnu") == pool_settings("api")
+        with patch("app.database.database.settings.DB_POOL_SIZE", 7):
+            cfg = pool_settings("maintenance")
+        assert cfg["pool_size"] == 7
+        assert cfg["max_overflow"] == 1
+
+    def test_pgbouncer_par_driver(self):
+        assert pgbouncer_connect_args("postgresql+asyncpg://x/db")["statement_cache_size"] == 0
+        assert pgbouncer_connect_args("postgresql+psycopg://x/db") == {"prepare_threshold": None}
+        assert pgbouncer_connect_args("postgresql://x/db") == {}
+
+
+class TestInstrumentedPool:
+
+    def test_compteurs(self, tmp_path):
+        with patch.object(InstrumentedQueuePool, "stats", PoolStats()):
+            engine = create_engine(
+                f"sqlite:///{tmp_path / 'pool.db'}",
+                poolclass=InstrumentedQueuePool, pool_size=2, max_overflow=0,
+            )
+            with engine.connect() as c1, engine.connect() as c2:
+                c1.execute(text("SELECT 1"))
+                c2.execute(text("SELECT 1"))
+            stats = engine.pool.stats
+            assert stats.checkouts >= 2
+            assert stats.checked_out_peak == 2
+            assert stats.timeouts == 0
+            engine.dispose()
+
+
+class TestAsyncDatabaseUrl:
+
+    def test_postgres_vers_asyncpg(self):
+        url = async_database_url("postgresql://u:p@h:5432/db?sslmode=require")
+        assert url == "postgresql+asyncpg://u:p@h:5432/db?ssl=require"
+
+    def test_sqlite_vers_aiosqlite(self):
+        assert async_database_url("sqlite:///./sql_app.db") == "sqlite+aiosqlite:///./sql_app.db"
+
+
+class TestReadReplica:
+
+    @pytest.fixture
+    def primary_and_replica(self, tmp_path):
+        """Deux bases SQLite distinctes, marquées pour savoir laquelle a servi la lecture."""
+        factories = {}
+        for name in ("primary", "replica"):
+            path = tmp_path / f"{name}.db"
+            engine = create_engine(f"sqlite:///{path}")
+            with engine.begin() as conn:
+                conn.execute(text("CREATE TABLE origin (name TEXT)"))
+                conn.execute(text("INSERT INTO origin VALUES (:n)"), {"n": name})
+            engine.dispose()
+            factories[name] = async_sessionmaker(
+                create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool),
+                expire_on_commit=False,
+            )
+        state = {"healthy": False, "lag_s": None, "checked_at": None}
+        with patch.object(database, "AsyncSessionLocal", factories["primary"]), \
+                patch.object(database, "ReplicaAsyncSessionLocal", factories["replica"]), \
+                patch.object(database, "_replica_state", state):
+            yield state
+
+    @staticmethod
+    def _read_origin() -> str:
+        async def _run():
+            gen = database.get_read_db()
+            db = await gen.__anext__()
+            try:
+                return (await db.execute(text("SELECT name FROM origin"))).scalar()
+            finally:
+                await gen.aclose()
+        return asyncio.run(_run())
+
+    def test_replique_a_jour_servie(self, primary_and_replica):
+        assert self._read_origin() == "replica"
+        assert primary_and_replica["healthy"] is True
+
+    def test_retard_excessif_repli_primaire(self, primary_and_replica):
+        with patch.object(database, "replica_lag_seconds", AsyncMock(return_value=60.0)):
+            assert self._read_origin() == "primary"
+        assert primary_and_replica["lag_s"] == 60.0
+
+    def test_replique_injoignable_repli_primaire(self, primary_and_replica):
+        with patch.object(database, "replica_lag_seconds", AsyncMock(side_effect=OSError("down"))):
+            assert self._read_origin() == "primary"
+
+    def test_mesure_mise_en_cache(self, primary_and_replica):
+        lag = AsyncMock(return_value=0.0)
+        with patch.object(database, "replica_lag_seconds", lag):
+            self._read_origin()
+            self._read_origin()
+        assert lag.await_count == 1
+
+    def test_sans_replique_primaire(self, primary_and_replica):
+        with patch.object(database, "ReplicaAsyncSessionLocal", None):
+            assert self._read_origin() == "primary"
+
+
+class TestAdminDbPool:
+
+    def test_secret_requis(self, client):
+        assert client.get("/admin/db-pool").status_code == 403
+
+    def test_metriques(self, client):
+        resp = client.get("/admin/db-pool", headers={"x-watcher-secret": WATCHER_SECRET})
+        assert resp.status_code == 200
+        assert resp.json()["profile"] == "api"
+        assert "async" in resp.json()
@@ -0,0 +1,81 @@
+# backend/tests/test_email_history.py
+"""
+Tests de l'historique emails paginé.
+
+- GET /email/history : pagination keyset (created_at, id), sans doublon ni trou
+- Filtres serveur : category, urgency, processing_status, reply_sent
+- Dossier lié résolu par jointure (nom + email candidat)
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.database.models import EmailAnalysis, TenantEmailLink, TenantFile
+
+BASE = datetime(2025, 6, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def emails(db_session, test_user):
+    aid = test_user.agency_id
+    rows = []
+    for i in range(7):
+        rows.append(EmailAnalysis(
+            agency_id=aid,
+            sender_email=f"c{i}@test.com",
+            subject=f"Sujet {i}",
+            summary="Résumé",
+            category="candidature" if i % 2 == 0 else "autre",
+            urgency="haute" if i < 2 else "normale",
+            reply_sent=(i == 3),
+            processing_status="success",
+            # Deux emails à la même date : le départage se fait sur l'id
+            created_at=BASE + timedelta(minutes=min(i, 5)),
+        ))
+    db_session.add_all(rows)
+    db_session.commit()
+    return rows
+
+
+class TestEmailHistory:
+
+    def test_pagination_keyset_complete(self, client, auth_headers, emails):
+        seen, cursor = [], None
+        while True:
+            url = "/email/history?limit=3" + (f"&cursor={cursor}" if cursor else "")
+            resp = client.get(url, headers=auth_headers)
+            assert resp.status_code == 200
+            data = resp.json()
+            seen.extend(item["id"] for item in data["items"])
+            cursor = data["next_cursor"]
+            if not cursor:
+                break
+
+        expected = [e.id for e in sorted(emails, key=lambda e: (e.created_at, e.id), reverse=True)]
+        assert seen == expected
+
+    def test_filtres_serveur(self, client, auth_headers, emails):
+        resp = client.get("/email/history?category=candidature&urgency=normale", headers=auth_headers)
+        subjects = {item["subject"] for item in resp.json()["items"]}
+        assert subjects == {"Sujet 2", "Sujet 4", "Sujet 6"}
+
+        resp = client.get("/email/history?reply_sent=true", headers=auth_headers)
+        assert [item["subject"] for item in resp.json()["items"]] == ["Sujet 3"]
+
+    def test_dossier_lie_joint(self, client, auth_headers, db_session, test_user, emails):
+        tf = TenantFile(agency_id=test_user.agency_id, candidate_email="c0@test.com",
+                        candidate_name="Jean Test")
+        db_session.add(tf)
+        db_session.commit()
+        db_session.add(TenantEmailLink(tenant_file_id=tf.id, email_analysis_id=emails[0].id))
+        db_session.commit()
+
+        items = client.get("/email/history", headers=auth_headers).json()["items"]
+        by_id = {item["id"]: item for item in items}
+        assert by_id[emails[0].id]["tenant_name"] == "Jean Test"
+        assert by_id[emails[0].id]["tenant_file_id"] == tf.id
+        assert by_id[emails[1].id]["tenant_file_id"] is None
+
+    def test_curseur_invalide_retourne_400(self, client, auth_headers):
+        resp = client.get("/email/history?cursor=!!pas-un-curseur", headers=auth_headers)
+        assert resp.status_code == 400
@@ -0,0 +1,159 @@
+# backend/tests/test_export.py
+"""
+Tests de l'export ZIP des dossiers locataires.
+
+- GET /tenant-files/{id}/export : ZIP streamé, documents + emails.json + summary.pdf
+- PDF / JPEG stockés sans recompression, JSON compressé
+- Document R2 indisponible → ignoré, l'export continue
+- Export groupé : création du job, filtres, archive unique, lien expirant
+"""
+import io
+import json
+import zipfile
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.database.models import (
+    EmailAnalysis, ExportJob, FileAnalysis, TenantDocumentLink, TenantEmailLink,
+    TenantFile, TenantFileStatus, TenantDocType,
+)
+from app.services.export_service import run_bulk_export
+
+
+@pytest.fixture
+def tenant_with_docs(db_session, test_user):
+    aid = test_user.agency_id
+    tf = TenantFile(agency_id=aid, candidate_email="jean@test.com", status=TenantFileStatus.INCOMPLETE)
+    email = EmailAnalysis(agency_id=aid, sender_email="jean@test.com", subject="Candidature", summary="Dossier")
+    pdf = FileAnalysis(agency_id=aid, filename="1_1_bulletin.pdf", storage_key="objects/aa/aa", file_type="payslip")
+    jpg = FileAnalysis(agency_id=aid, filename="1_1_cni.jpg", storage_key="objects/bb/bb", file_type="id")
+    db_session.add_all([tf, email, pdf, jpg])
+    db_session.commit()
+    db_session.add_all([
+        TenantEmailLink(tenant_file_id=tf.id, email_analysis_id=email.id),
+        TenantDocumentLink(tenant_file_id=tf.id, file_analysis_id=pdf.id, doc_type=TenantDocType.PAYSLIP),
+        TenantDocumentLink(tenant_file_id=tf.id, file_analysis_id=jpg.id, doc_type=TenantDocType.ID),
+    ])
+    db_session.commit()
+    return tf, pdf, jpg
+
+
+def _fake_download(key):
+    return {"objects/aa/aa": b"%PDF-payslip" * 50, "objects/bb/bb": b"\xff\xd8jpeg" * 50}[key]
+
+
+class TestExportZip:
+
+    def test_export_contient_documents_et_emails(self, client, auth_headers, tenant_with_docs):
+        tf, pdf, jpg = tenant_with_docs
+        with patch("app.services.export_service.download_file", side_effect=_fake_download):
+            resp = client.get(f"/tenant-files/{tf.id}/export", headers=auth_headers)
+
+        assert resp.status_code == 200
+        zf = zipfile.ZipFile(io.BytesIO(resp.content))
+        names = set(zf.namelist())
+        assert f"documents/payslip_{pdf.id}.pdf" in names
+        assert f"documents/id_{jpg.id}.jpg" in names
+        assert "emails.json" in names
+        emails = json.loads(zf.read("emails.json"))
+        assert emails[0]["subject"] == "Candidature"
+        assert zf.read(f"documents/payslip_{pdf.id}.pdf") == _fake_download("objects/aa/aa")
+
+    def test_pdf_et_jpeg_non_recompresses(self, client, auth_headers, tenant_with_docs):
+        tf, pdf, jpg = tenant_with_docs
+        with patch("app.services.export_service.download_file", side_effect=_fake_download):
+            resp = client.get(f"/tenant-files/{tf.id}/export", headers=auth_headers)
+
+        zf = zipfile.ZipFile(io.BytesIO(resp.content))
+        assert zf.getinfo(f"documents/payslip_{pdf.id}.pdf").compress_type == zipfile.ZIP_STORED
+        assert zf.getinfo(f"documents/id_{jpg.id}.jpg").compress_type == zipfile.ZIP_STORED
+        assert zf.getinfo("emails.json").compress_type == zipfile.ZIP_DEFLATED
+
+    def test_document_indisponible_ignore(self, client, auth_headers, tenant_with_docs):
+        tf, pdf, jpg = tenant_with_docs
+
+        def _partial(key):
+            if key == "objects/aa/aa":
+                raise RuntimeError("R2 KO")
+            return _fake_download(key)
+
+        with patch("app.services.export_service.download_file", side_effect=_partial):
+            resp = client.get(f"/tenant-files/{tf.id}/export", headers=auth_headers)
+
+        zf = zipfile.ZipFile(io.BytesIO(resp.content))
+        assert f"documents/payslip_{pdf.id}.pdf" not in zf.namelist()
+        assert f"documents/id_{jpg.id}.jpg" in zf.namelist()
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# 📦 Export groupé
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestBulkExport:
+
+    def test_creation_job_enqueue(self, client, auth_headers, db_session):
+        mock_q = MagicMock()
+        with patch("redis.from_url", return_value=MagicMock()), \
+                patch("rq.Queue", return_value=mock_q):
+            resp = client.post(
+                "/exports/tenant-files",
+                json={"status": "validated", "created_from": "2025-01-01T00:00:00"},
+                headers=auth_headers,
+            )
+
+        assert resp.status_code == 200
+        data = resp.json()
+        assert data["status"] == "pending"
+        assert data["download_token"] is None
+        mock_q.enqueue.assert_called_once()
+        job = db_session.query(ExportJob).filter(ExportJob.id == data["job_id"]).one()
+        assert json.loads(job.filters_json)["status"] == "validated"
+
+    def test_statut_inconnu_retourne_400(self, client, auth_headers):
+        resp = client.post("/exports/tenant-files", json={"status": "bidon"}, headers=auth_headers)
+        assert resp.status_code == 400
+
+    def test_archive_filtree_et_progression(self, db_session, test_user, tenant_with_docs):
+        tf, pdf, jpg = tenant_with_docs
+        other = TenantFile(agency_id=test_user.agency_id, candidate_email="autre@test.com",
+                           status=TenantFileStatus.NEW)
+        db_session.add(other)
+        job = ExportJob(agency_id=test_user.agency_id,
+                        filters_json=json.dumps({"status": "incomplete"}))
+        db_session.add(job)
+        db_session.commit()
+
+        uploaded = {}
+
+        def _capture_upload(fileobj, length, key, content_type):
+            uploaded["data"] = fileobj.read()
+            uploaded["key"] = key
+
+        with patch("app.services.export_service.download_file", side_effect=_fake_download), \
+                patch("app.services.export_service.upload_stream", side_effect=_capture_upload):
+            run_bulk_export(db_session, job.id)
+
+        db_session.refresh(job)
+        assert job.status == "success"
+        assert job.total_dossiers == 1
+        assert job.processed_dossiers == 1
+        assert job.download_token
+        assert job.size_bytes == len(uploaded["data"])
+
+        names = zipfile.ZipFile(io.BytesIO(uploaded["data"])).namelist()
+        assert f"dossier_{tf.id}_jean_test_com/documents/payslip_{pdf.id}.pdf" in names
+        assert not any(n.startswith(f"dossier_{other.id}_") for n in names)
+
+    def test_lien_expire_retourne_410(self, client, db_session, test_user):
+        job = ExportJob(
+            agency_id=test_user.agency_id, status="success",
+            object_key="exports/1/export_1.zip", download_token="tok-expire",
+            expires_at=datetime.utcnow() - timedelta(hours=1),
+        )
+        db_session.add(job)
+        db_session.commit()
+
+        resp = client.get("/exports/download/tok-expire")
+        assert resp.status_code == 410
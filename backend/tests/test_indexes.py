@@ -0,0 +1,38 @@
+# backend/tests/test_indexes.py
+"""
+Tests des index des tables du chemin d'insertion (un email ingéré écrit dans
+chacune) : aucun index redondant.
+
+- pas d'index sur la seule clé primaire (déjà indexée)
+- pas d'index dont les colonnes sont un préfixe d'un autre index non partiel
+"""
+import pytest
+
+from app.database.models import Base
+
+HOT_TABLES = (
+    "email_analyses", "file_analyses", "tenant_files",
+    "tenant_email_links", "tenant_document_links",
+)
+
+
+def _columns(index):
+    return [c.name for c in index.columns]
+
+
+@pytest.mark.parametrize("table_name", HOT_TABLES)
+def test_pas_d_index_redondant(table_name):
+    table = Base.metadata.tables[table_name]
+    pk = [c.name for c in table.primary_key.columns]
+    # Un index partiel ne couvre qu'une partie des lignes : il ne rend rien redondant
+    full = [ix for ix in table.indexes if ix.dialect_options["postgresql"]["where"] is None]
+
+    for index in table.indexes:
+        cols = _columns(index)
+        assert cols != pk, f"{index.name} : clé primaire déjà indexée"
+        for other in full:
+            if other is index or index.unique:
+                continue
+            other_cols = _columns(other)
+            assert not (len(cols) < len(other_cols) and other_cols[:len(cols)] == cols), \
+                f"{index.name} est un préfixe de {other.name}"
@@ -0,0 +1,207 @@
+# backend/tests/test_job_locks.py
+"""
+Tests de la sérialisation des jobs email par candidat (verrou Redis).
+
+- clé : agence + expéditeur canonique
+- même candidat : le second job attend la fin du premier
+- candidats différents : aucune attente
+- attente max dépassée : CandidateLockBusy → job re-planifié (enqueue_in) ;
+  re-enqueues épuisés : job en échec, jamais traité sans verrou
+- Redis indisponible : traitement sans verrou (fail-open)
+- timeout RQ pendant l'attente : propagé (pas de fail-open)
+- métriques GET /admin/email-locks
+"""
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.core.config import settings
+from app.services import job_lock_service
+from app.services.job_lock_service import (
+    LOCK_STATS_KEY, CandidateLockBusy, candidate_lock, candidate_lock_key, lock_metrics,
+)
+
+
+class FakeRedis:
+    """Sous-ensemble de redis-py utilisé par job_lock_service (TTL ignoré)."""
+
+    def __init__(self):
+        self.data, self.hashes = {}, {}
+        self._mutex = threading.Lock()
+
+    def set(self, key, value, nx=False, px=None):
+        with self._mutex:
+            if nx and key in self.data:
+                return None
+            self.data[key] = value
+            return True
+
+    def eval(self, script, numkeys, key, token):
+        with self._mutex:
+            if self.data.get(key) == token:
+                del self.data[key]
+                return 1
+            return 0
+
+    def hincrby(self, name, field, amount=1):
+        h = self.hashes.setdefault(name, {})
+        h[field] = h.get(field, 0) + amount
+
+    def hincrbyfloat(self, name, field, amount):
+        self.hincrby(name, field, amount)
+
+    def hgetall(self, name):
+        return dict(self.hashes.get(name, {}))
+
+
+@pytest.fixture(autouse=True)
+def fast_poll(monkeypatch):
+    monkeypatch.setattr(job_lock_service, "LOCK_POLL_SECONDS", 0.01)
+
+
+class TestCandidateLock:
+
+    def test_cle_canonique(self):
+        assert candidate_lock_key(3, "Jean.Dupont+immo@Gmail.com") == candidate_lock_key(3, "jeandupont@gmail.com")
+        assert candidate_lock_key(3, "jean@test.com") != candidate_lock_key(4, "jean@test.com")
+
+    def test_meme_candidat_serialise(self):
+        conn = FakeRedis()
+        key = candidate_lock_key(1, "jean@test.com")
+        order = []
+        first_in = threading.Event()
+
+        def first():
+            with candidate_lock(conn, key):
+                first_in.set()
+                time.sleep(0.1)
+                order.append("premier")
+
+        t = threading.Thread(target=first)
+        t.start()
+        first_in.wait()
+        with candidate_lock(conn, key) as waited:
+            order.append("second")
+        t.join()
+
+        assert order == ["premier", "second"]
+        assert waited > 0
+        assert key not in conn.data   # verrou relâché
+        metrics = lock_metrics(conn)
+        assert metrics["jobs"] == 2
+        assert metrics["contended"] == 1
+        assert metrics["wait_avg_ms"] > 0
+
+    def test_candidats_differents_paralleles(self):
+        conn = FakeRedis()
+        with candidate_lock(conn, candidate_lock_key(1, "a@test.com")):
+            with candidate_lock(conn, candidate_lock_key(1, "b@test.com")) as waited:
+                assert waited < job_lock_service.LOCK_POLL_SECONDS
+        assert lock_metrics(conn)["contended"] == 0
+
+    def test_attente_max_depassee(self, monkeypatch):
+        monkeypatch.setattr(settings, "EMAIL_CANDIDATE_LOCK_WAIT_SECONDS", 0)
+        conn = FakeRedis()
+        key = candidate_lock_key(1, "jean@test.com")
+        conn.set(key, "autre-job")
+
+        with pytest.raises(CandidateLockBusy):
+            with candidate_lock(conn, key):
+                pytest.fail("le bloc ne doit pas s'exécuter")
+        assert conn.data[key] == "autre-job"
+        assert lock_metrics(conn)["timeouts"] == 1
+
+    def test_timeout_job_propage(self):
+        from rq.timeouts import JobTimeoutException
+
+        conn = MagicMock()
+        conn.set.side_effect = JobTimeoutException("job_timeout atteint")
+        with pytest.raises(JobTimeoutException):
+            with candidate_lock(conn, "k"):
+                pytest.fail("le pipeline ne doit pas tourner sans verrou")
+
+    def test_redis_indisponible_fail_open(self):
+        conn = MagicMock()
+        conn.set.side_effect = ConnectionError("redis down")
+        ran = False
+        with candidate_lock(conn, "k"):
+            ran = True
+        assert ran
+        conn.eval.assert_not_called()
+
+
+class TestProcessEmailJob:
+
+    def test_pipeline_sous_verrou(self):
+        from app.tasks import process_email_job
+
+        conn = FakeRedis()
+        seen = {}
+
+        async def fake_pipeline(payload):
+            seen["locked"] = dict(conn.data)
+
+        with patch("redis.from_url", return_value=conn), \
+                patch("app.services.email_pipeline.run_email_pipeline", fake_pipeline):
+            process_email_job({"agency_id": 1, "from_email": "Jean@Test.com"})
+
+        assert candidate_lock_key(1, "jean@test.com") in seen["locked"]
+        assert conn.data == {}
+
+    def test_verrou_occupe_job_replanifie(self, monkeypatch):
+        from app.tasks import LOCK_REENQUEUE_DELAY_SECONDS, process_email_job
+
+        monkeypatch.setattr(settings, "EMAIL_CANDIDATE_LOCK_WAIT_SECONDS", 0)
+        conn = FakeRedis()
+        conn.set(candidate_lock_key(1, "jean@test.com"), "job-en-cours")
+        pipeline = MagicMock()
+        payload = {"agency_id": 1, "from_email": "jean@test.com"}
+
+        with patch("redis.from_url", return_value=conn), \
+                patch("app.services.email_pipeline.run_email_pipeline", pipeline), \
+                patch("rq.Queue.enqueue_in") as enqueue_in:
+            process_email_job(payload, retries_429=2, lock_retries=3)
+
+        pipeline.assert_not_called()
+        delay, func, arg = enqueue_in.call_args.args
+        assert delay.total_seconds() == LOCK_REENQUEUE_DELAY_SECONDS
+        assert (func, arg) == (process_email_job, payload)
+        assert enqueue_in.call_args.kwargs == {"retries_429": 2, "lock_retries": 4}
+
+    def test_reenqueues_epuises_job_en_echec(self, monkeypatch):
+        from app.tasks import MAX_LOCK_REENQUEUES, process_email_job
+
+        monkeypatch.setattr(settings, "EMAIL_CANDIDATE_LOCK_WAIT_SECONDS", 0)
+        conn = FakeRedis()
+        conn.set(candidate_lock_key(1, "jean@test.com"), "job-en-cours")
+        pipeline = MagicMock()
+
+        with patch("redis.from_url", return_value=conn), \
+                patch("app.services.email_pipeline.run_email_pipeline", pipeline), \
+                patch("rq.Queue.enqueue_in") as enqueue_in:
+            with pytest.raises(CandidateLockBusy):
+                process_email_job({"agency_id": 1, "from_email": "jean@test.com"}, lock_retries=MAX_LOCK_REENQUEUES)
+
+        pipeline.assert_not_called()
+        enqueue_in.assert_not_called()
+
+
+class TestAdminEndpoint:
+
+    def test_metriques(self, client):
+        conn = FakeRedis()
+        conn.hincrby(LOCK_STATS_KEY, "jobs", 4)
+        conn.hincrby(LOCK_STATS_KEY, "contended", 2)
+        conn.hincrbyfloat(LOCK_STATS_KEY, "wait_ms_total", 300.0)
+
+        with patch("redis.from_url", return_value=conn):
+            r = client.get("/admin/email-locks", headers={"x-watcher-secret": settings.WATCHER_SECRET})
+        assert r.status_code == 200
+        assert r.json() == {
+            "jobs": 4, "contended": 2, "timeouts": 0, "wait_ms_total": 300.0, "wait_avg_ms": 150.0,
+        }
+
+    def test_secret_requis(self, client):
+        assert client.get("/admin/email-locks").status_code == 403
@@ -0,0 +1,121 @@
+# backend/tests/test_known_senders.py
+"""
+Tests de la détection d'expéditeur connu.
+
+- TenantFile.normalized_email tenu à jour (casse, alias +, points Gmail)
+- GET /watcher/check-sender sur la clé canonique
+- GET /watcher/known-senders : complet puis incrémental (since)
+- Cache du watcher : lookup local, synchro incrémentale sur absence, repli HTTP
+"""
+import os
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.core.email_utils import canonical_email
+from app.database.models import TenantFile, TenantFileStatus
+
+WATCHER_SECRET = os.environ.get("WATCHER_SECRET", "test-secret-ci")
+HEADERS = {"x-watcher-secret": WATCHER_SECRET}
+
+SAMPLES = [
+    "Jean.Dupont@Gmail.com", "jean.dupont+annonce@googlemail.com", "marie+x@outlook.fr",
+    " Paul@Exemple.FR ", "sans-arobase", "",
+]
+
+
+class TestNormalizedEmail:
+
+    def test_colonne_synchronisee(self, db_session, test_agency):
+        tf = TenantFile(agency_id=test_agency.id, candidate_email="Jean.Dupont+annonce@gmail.com",
+                        status=TenantFileStatus.NEW)
+        db_session.add(tf)
+        db_session.commit()
+        assert tf.normalized_email == "jeandupont@gmail.com"
+
+        tf.candidate_email = None
+        db_session.commit()
+        assert tf.normalized_email is None
+
+    def test_watcher_meme_regle_que_backend(self):
+        from app.watcher import canonical_sender
+        for email in SAMPLES:
+            assert canonical_sender(email) == canonical_email(email)
+
+
+class TestCheckSenderEndpoints:
+
+    @pytest.fixture
+    def known(self, db_session, test_agency):
+        tf = TenantFile(agency_id=test_agency.id, candidate_email="jean.dupont@gmail.com",
+                        status=TenantFileStatus.NEW)
+        db_session.add(tf)
+        db_session.commit()
+        return tf
+
+    def test_check_sender_variante_gmail(self, client, known):
+        resp = client.get("/watcher/check-sender", headers=HEADERS,
+                          params={"email": "JeanDupont+site@gmail.com", "agency_id": known.agency_id})
+        assert resp.json() == {"is_known": True}
+
+    def test_check_sender_autre_agence(self, client, known):
+        resp = client.get("/watcher/check-sender", headers=HEADERS,
+                          params={"email": "jean.dupont@gmail.com", "agency_id": known.agency_id + 1})
+        assert resp.json() == {"is_known": False}
+
+    def test_known_senders_complet_puis_incremental(self, client, db_session, known):
+        data = client.get("/watcher/known-senders", headers=HEADERS,
+                          params={"agency_id": known.agency_id}).json()
+        assert data["senders"] == ["jeandupont@gmail.com"]
+        assert data["cursor"]
+
+        later = TenantFile(agency_id=known.agency_id, candidate_email="marie@test.fr",
+                           status=TenantFileStatus.NEW,
+                           created_at=datetime.utcnow() + timedelta(minutes=5),
+                           updated_at=datetime.utcnow() + timedelta(minutes=5))
+        db_session.add(later)
+        db_session.commit()
+
+        since = (datetime.utcnow() + timedelta(minutes=1)).isoformat()
+        data = client.get("/watcher/known-senders", headers=HEADERS,
+                          params={"agency_id": known.agency_id, "since": since}).json()
+        assert data["senders"] == ["marie@test.fr"]
+
+    def test_secret_requis(self, client):
+        assert client.get("/watcher/known-senders", params={"agency_id": 1}).status_code == 403
+
+
+class TestWatcherKnownSendersCache:
+
+    @pytest.fixture
+    def watcher(self):
+        from app import watcher
+        with patch.object(watcher, "_known_senders", {}):
+            yield watcher
+
+    @staticmethod
+    def _resp(senders, cursor="2026-01-01T00:00:00"):
+        resp = MagicMock(status_code=200)
+        resp.json.return_value = {"senders": senders, "cursor": cursor}
+        return resp
+
+    def test_lookup_local_sans_appel(self, watcher):
+        with patch.object(watcher.requests, "get", return_value=self._resp(["jeandupont@gmail.com"])) as get:
+            assert watcher.is_known_sender_cached("Jean.Dupont@gmail.com", 1) is True
+            assert watcher.is_known_sender_cached("jeandupont+x@gmail.com", 1) is True
+        assert get.call_count == 1   # synchro initiale uniquement
+
+    def test_absence_synchro_incrementale_bornee(self, watcher):
+        responses = [self._resp([]), self._resp(["nouveau@test.fr"], "2026-01-01T00:10:00")]
+        with patch.object(watcher.requests, "get", side_effect=responses) as get:
+            assert watcher.is_known_sender_cached("nouveau@test.fr", 1) is False   # synchro récente
+            watcher._known_senders[1]["synced_at"] -= watcher.KNOWN_SENDERS_REFRESH_SEC + 1
+            assert watcher.is_known_sender_cached("nouveau@test.fr", 1) is True
+        assert "since" in get.call_args.kwargs["params"]
+
+    def test_backend_injoignable_repli_http(self, watcher):
+        with patch.object(watcher.requests, "get", side_effect=OSError("down")), \
+                patch.object(watcher, "is_known_sender", return_value=True) as fallback:
+            assert watcher.is_known_sender_cached("x@test.fr", 1) is True
+        fallback.assert_called_once_with("x@test.fr", 1)
@@ -0,0 +1,93 @@
+# backend/tests/test_listing.py
+"""
+Tests des listings paginés.
+
+- GET /api/files/history : curseur X-Next-Cursor, filtre type, compteur
+- GET /tenant-files      : curseur, filtres statut / préfixe email, compteur
+- Sans paramètre : première page de LIST_PAGE_SIZE, jamais la table complète
+"""
+from app.database.models import FileAnalysis, TenantFile, TenantFileStatus
+
+
+def _collect(client, headers, url):
+    ids, cursor = [], None
+    while True:
+        sep = "&" if "?" in url else "?"
+        resp = client.get(url + (f"{sep}cursor={cursor}" if cursor else ""), headers=headers)
+        assert resp.status_code == 200
+        ids.extend(item["id"] for item in resp.json())
+        cursor = resp.headers.get("X-Next-Cursor")
+        if not cursor:
+            return ids
+
+
+class TestFilesHistory:
+
+    def test_pagination_et_filtre_type(self, client, auth_headers, db_session, test_user):
+        aid = test_user.agency_id
+        files = [
+            FileAnalysis(agency_id=aid, filename=f"f{i}.pdf",
+                         file_type="payslip" if i % 2 else "id")
+            for i in range(5)
+        ]
+        db_session.add_all(files)
+        db_session.commit()
+
+        ids = _collect(client, auth_headers, "/api/files/history?limit=2")
+        assert ids == sorted((f.id for f in files), reverse=True)
+
+        ids = _collect(client, auth_headers, "/api/files/history?limit=2&file_type=payslip")
+        assert ids == [files[3].id, files[1].id]
+
+        resp = client.get("/api/files/history/count?file_type=id", headers=auth_headers)
+        assert resp.json() == {"total": 3}
+        assert "max-age" in resp.headers["Cache-Control"]
+
+
+class TestTenantFilesListing:
+
+    def test_pagination_filtres_et_compteur(self, client, auth_headers, db_session, test_user):
+        aid = test_user.agency_id
+        tfs = [
+            TenantFile(agency_id=aid, candidate_email="jean@test.com", status=TenantFileStatus.NEW),
+            TenantFile(agency_id=aid, candidate_email="jeanne@test.com", status=TenantFileStatus.VALIDATED),
+            TenantFile(agency_id=aid, candidate_email="paul@test.com", status=TenantFileStatus.NEW),
+            TenantFile(agency_id=aid, candidate_email="jea_n@test.com", status=TenantFileStatus.NEW),
+        ]
+        db_session.add_all(tfs)
+        db_session.commit()
+
+        assert _collect(client, auth_headers, "/tenant-files?limit=3") == [t.id for t in reversed(tfs)]
+
+        ids = _collect(client, auth_headers, "/tenant-files?candidate_email=JEAN")
+        assert ids == [tfs[1].id, tfs[0].id]
+
+        resp = client.get("/tenant-files/count?status=new", headers=auth_headers)
+        assert resp.json() == {"total": 3}
+
+    def test_statut_inconnu_retourne_400(self, client, auth_headers):
+        resp = client.get("/tenant-files?status=bidon", headers=auth_headers)
+        assert resp.status_code == 400
+
+
+class TestPageParDefaut:
+
+    def test_page_bornee_sans_parametre(self, client, auth_headers, db_session, test_user):
+        from app.api.tenant_routes import LIST_PAGE_SIZE
+
+        aid = test_user.agency_id
+        n = LIST_PAGE_SIZE + 5
+        db_session.add_all(
+            TenantFile(agency_id=aid, candidate_email=f"c{i}@test.com") for i in range(n)
+        )
+        db_session.add_all(FileAnalysis(agency_id=aid, filename=f"f{i}.pdf", file_type="id") for i in range(n))
+        db_session.commit()
+
+        for url in ("/tenant-files", "/api/files/history"):
+            resp = client.get(url, headers=auth_headers)
+            assert len(resp.json()) == LIST_PAGE_SIZE
+            cursor = resp.headers["X-Next-Cursor"]
+            rest = client.get(f"{url}?cursor={cursor}", headers=auth_headers)
+            assert len(rest.json()) == 5
+            assert "X-Next-Cursor" not in rest.headers
+            assert len(_collect(client, auth_headers, url)) == n
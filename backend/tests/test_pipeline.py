@@ -6,10 +6,13 @@ Complète test_pipeline_e2e.py en testant :
   - auto_reply_enabled=True + filter_decision=accept  → _send_reply appelé
   - auto_reply_enabled=True + filter_decision=ignore  → _send_reply non appelé
   - auto_reply_enabled=False                          → _send_reply non appelé
+  - unité de travail : deux commits par email, SAVEPOINT par pièce jointe,
+    upload R2 hors transaction
 
 Note : test_pipeline_e2e.py couvre la création EmailAnalysis / TenantFile.
 """
 import asyncio
+import base64
 import os
 from unittest.mock import MagicMock, patch
 
@@ -31,9 +34,12 @@ os.environ.setdefault("GOOGLE_OAUTH_CLIENT_SECRET", "test-google-client-secret")
 os.environ.setdefault("FRONTEND_URL", "http://localhost:5173")
 os.environ.setdefault("BACKEND_URL", "http://localhost:8000")
 
-from app.database.models import Base, AppSettings
+from app.database.database import track_db_usage
+from app.database.models import Base, AppSettings, EmailAnalysis, FileAnalysis, StoredObject, TenantFile
+from app.services.document_service import DocumentAnalysisResult
 from app.services.email_pipeline import run_email_pipeline
 from app.services.email_service import EmailAnalysisResult, EmailReplyResult
+from app.services.storage_service import store_object
 
 MOCK_EMAIL_RESULT = EmailAnalysisResult(
     category="dossier_locataire",
@@ -90,7 +96,7 @@ def _run_pipeline_with_send_mock(TestSession, payload) -> MagicMock:
         patch("app.services.email_pipeline.SessionLocal", TestSession),
         patch("app.services.email_pipeline.analyze_email", return_value=MOCK_EMAIL_RESULT),
         patch("app.services.email_pipeline.generate_reply", return_value=MOCK_REPLY_RESULT),
-        patch("app.services.email_pipeline.upload_file"),
+        patch("app.services.email_pipeline.store_object"),
         patch("app.services.email_pipeline._send_reply", mock_send),
         patch("app.services.email_pipeline._notify_agent_new_dossier"),
     ):
@@ -127,3 +133,144 @@ class TestAutoReply:
         mock_send = _run_pipeline_with_send_mock(TestSession, payload)
 
         mock_send.assert_not_called()
+
+
+def _attachment(name: str, content: bytes) -> dict:
+    return {
+        "filename": name,
+        "content_type": "application/pdf",
+        "content_base64": base64.b64encode(content).decode(),
+    }
+
+
+class TestUniteDeTravail:
+    """Phases transactionnelles du pipeline : ingestion puis réponse."""
+
+    PAYLOAD = {
+        **BASE_PAYLOAD,
+        "attachments": [_attachment("cni.pdf", b"cni"), _attachment("bulletin.pdf", b"bulletin")],
+    }
+
+    def _run(self, TestSession, payload, upload_side_effect=None, store_side_effect=None):
+        docs = [
+            DocumentAnalysisResult(doc_type="id", summary="CNI"),
+            DocumentAnalysisResult(doc_type="payslip", summary="Bulletin"),
+        ]
+        with (
+            patch("app.services.email_pipeline.SessionLocal", TestSession),
+            patch("app.services.email_pipeline.analyze_email", return_value=MOCK_EMAIL_RESULT),
+            patch("app.services.email_pipeline.analyze_document", side_effect=docs),
+            patch("app.services.email_pipeline.generate_reply", return_value=MOCK_REPLY_RESULT),
+            patch("app.services.email_pipeline.upload_content",
+                  side_effect=upload_side_effect or (lambda raw, h, ct: f"objects/{h}")),
+            patch("app.services.email_pipeline.store_object", side_effect=store_side_effect or store_object),
+            patch("app.services.email_pipeline._send_reply"),
+            patch("app.services.email_pipeline._notify_agent_new_dossier"),
+            track_db_usage() as usage,
+        ):
+            asyncio.run(run_email_pipeline(payload))
+        return usage
+
+    def test_deux_commits_par_email(self):
+        _, TestSession = _make_engine_with_auto_reply(enabled=False)
+
+        usage = self._run(TestSession, self.PAYLOAD)
+
+        # ingestion (email + PJ + dossier + checklist) puis réponse
+        assert usage["commits"] == 2
+        assert usage["statements"] > 0
+        db = TestSession()
+        try:
+            email = db.query(EmailAnalysis).one()
+            assert email.processing_status == "success"
+            assert email.processed_at is not None
+            assert db.query(FileAnalysis).count() == 2
+            tf = db.query(TenantFile).one()
+            assert tf.doc_id_count == 1 and tf.doc_payslip_count == 1
+        finally:
+            db.close()
+
+    def test_piece_jointe_en_erreur_isolee(self):
+        _, TestSession = _make_engine_with_auto_reply(enabled=False)
+
+        def upload(raw, file_hash, content_type):
+            if raw == b"bulletin":
+                raise RuntimeError("R2 indisponible")
+            return f"objects/{file_hash}"
+
+        usage = self._run(TestSession, self.PAYLOAD, upload_side_effect=upload)
+
+        assert usage["commits"] == 2
+        db = TestSession()
+        try:
+            assert db.query(FileAnalysis).count() == 1
+            assert db.query(EmailAnalysis).one().processing_status == "success"
+            tf = db.query(TenantFile).one()
+            assert tf.doc_id_count == 1 and tf.doc_payslip_count == 0
+        finally:
+            db.close()
+
+    def test_upload_hors_transaction(self):
+        _, TestSession = _make_engine_with_auto_reply(enabled=False)
+        sessions = []
+
+        def session_factory():
+            sessions.append(TestSession())
+            return sessions[-1]
+
+        def upload(raw, file_hash, content_type):
+            assert not sessions[0].in_transaction()
+            return f"objects/{file_hash}"
+
+        with patch("app.services.email_pipeline.SessionLocal", session_factory):
+            self._run(session_factory, self.PAYLOAD, upload_side_effect=upload)
+
+        db = TestSession()
+        try:
+            # références posées dans la phase d'ingestion, sans second upload
+            assert {o.ref_count for o in db.query(StoredObject).all()} == {1}
+            assert db.query(StoredObject).count() == 2
+        finally:
+            db.close()
+
+    def test_echec_savepoint_apres_upload(self):
+        _, TestSession = _make_engine_with_auto_reply(enabled=False)
+        upload = MagicMock(side_effect=lambda raw, h, ct: f"objects/{h}")
+
+        def store(db, raw, file_hash, content_type, uploaded=False):
+            assert uploaded
+            if raw == b"bulletin":
+                raise RuntimeError("contrainte violée")
+            return store_object(db, raw, file_hash, content_type, uploaded=uploaded)
+
+        self._run(TestSession, self.PAYLOAD, upload_side_effect=upload, store_side_effect=store)
+
+        assert upload.call_count == 2
+        db = TestSession()
+        try:
+            assert db.query(FileAnalysis).count() == 1
+            assert db.query(StoredObject).count() == 1
+        finally:
+            db.close()
+
+    def test_echec_reponse_marque_failed(self):
+        _, TestSession = _make_engine_with_auto_reply(enabled=False)
+
+        with (
+            patch("app.services.email_pipeline.SessionLocal", TestSession),
+            patch("app.services.email_pipeline.analyze_email", return_value=MOCK_EMAIL_RESULT),
+            patch("app.services.email_pipeline.generate_reply", side_effect=RuntimeError("Mistral KO")),
+            patch("app.services.email_pipeline._notify_agent_new_dossier"),
+        ):
+            with pytest.raises(RuntimeError):
+                asyncio.run(run_email_pipeline(BASE_PAYLOAD))
+
+        db = TestSession()
+        try:
+            email = db.query(EmailAnalysis).one()
+            assert email.processing_status == "failed"
+            assert "Mistral KO" in email.processing_error
+            # l'ingestion est conservée : le dossier existe
+            assert db.query(TenantFile).count() == 1
+        finally:
+            db.close()
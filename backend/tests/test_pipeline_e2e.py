@@ -3,7 +3,8 @@
 Tests end-to-end du pipeline email CipherFlow.
 
 Couvre :
-  1. mistral_is_real_estate_email() — classification IA (Mistral mocké)
+  1. mistral_is_real_estate_email() — classification IA (Mistral mocké),
+     client partagé et cache des verdicts
   2. run_email_pipeline() — pipeline complet (DB SQLite in-memory, Mistral mocké)
      a. Email immobilier : EmailAnalysis + TenantFile + TenantEmailLink créés
      b. Email non immobilier (newsletter) : rien créé en base
@@ -17,6 +18,7 @@ import asyncio
 import json
 import os
 import tempfile
+from collections import OrderedDict
 from unittest.mock import MagicMock, patch
 
 import pytest
@@ -51,6 +53,17 @@ from app.watcher import mistral_is_real_estate_email
 # 🔧 Fixtures DB
 # ══════════════════════════════════════════════════════════════════════════════
 
+@pytest.fixture(autouse=True)
+def fresh_mistral_state():
+    """Client Mistral partagé et cache de classification propres à chaque test."""
+    from app import watcher
+
+    with patch.object(watcher, "_mistral_state", {"client": None}), \
+            patch.object(watcher, "_classification_cache", OrderedDict()), \
+            patch.object(watcher, "_classification_stats", {"hits": 0, "misses": 0}):
+        yield watcher
+
+
 @pytest.fixture(scope="function")
 def test_engine():
     """Moteur SQLite in-memory isolé par test."""
@@ -174,6 +187,66 @@ class TestMistralIsRealEstateEmail:
             assert "x" * 500 in prompt
 
 
+class TestMistralClientEtCache:
+    """Client Mistral unique et verdicts mis en cache (LRU + TTL)."""
+
+    def _response(self, answer):
+        response = MagicMock()
+        response.choices = [MagicMock(message=MagicMock(content=answer))]
+        return response
+
+    def test_client_partage_entre_appels(self):
+        with patch("app.watcher.Mistral") as MockMistral:
+            MockMistral.return_value.chat.complete.return_value = self._response("OUI")
+            mistral_is_real_estate_email("a@b.com", "Visite", "Bonjour")
+            mistral_is_real_estate_email("c@d.com", "Dossier", "Ci-joint")
+        MockMistral.assert_called_once()
+        assert MockMistral.return_value.chat.complete.call_count == 2
+
+    def test_mail_repete_sans_appel_api(self, fresh_mistral_state):
+        with patch("app.watcher.Mistral") as MockMistral:
+            complete = MockMistral.return_value.chat.complete
+            complete.return_value = self._response("NON")
+            first = mistral_is_real_estate_email("Portail <alerte@portail.fr>", "Nouvelles annonces", "Voici  les biens")
+            again = mistral_is_real_estate_email("alerte@PORTAIL.fr", "nouvelles annonces ", "Voici les biens")
+        assert first is again is False
+        complete.assert_called_once()
+        assert fresh_mistral_state._classification_stats == {"hits": 1, "misses": 1}
+
+    def test_corps_au_dela_de_500_caracteres_ignore(self):
+        with patch("app.watcher.Mistral") as MockMistral:
+            complete = MockMistral.return_value.chat.complete
+            complete.return_value = self._response("OUI")
+            mistral_is_real_estate_email("a@b.com", "Relance", "x" * 500 + "signature 1")
+            mistral_is_real_estate_email("a@b.com", "Relance", "x" * 500 + "signature 2")
+        complete.assert_called_once()
+
+    def test_erreur_non_cachee(self):
+        with patch("app.watcher.Mistral") as MockMistral:
+            complete = MockMistral.return_value.chat.complete
+            complete.side_effect = [Exception("Timeout API"), self._response("NON")]
+            assert mistral_is_real_estate_email("a@b.com", "Sujet", "Corps") is True
+            assert mistral_is_real_estate_email("a@b.com", "Sujet", "Corps") is False
+        assert complete.call_count == 2
+
+    def test_ttl_et_taille_max(self, fresh_mistral_state, monkeypatch):
+        watcher = fresh_mistral_state
+        monkeypatch.setattr(watcher, "MISTRAL_CACHE_SIZE", 2)
+        with patch("app.watcher.Mistral") as MockMistral:
+            complete = MockMistral.return_value.chat.complete
+            complete.return_value = self._response("OUI")
+            for sender in ("a@b.com", "c@d.com", "e@f.com"):
+                mistral_is_real_estate_email(sender, "Sujet", "Corps")
+            assert len(watcher._classification_cache) == 2
+            mistral_is_real_estate_email("a@b.com", "Sujet", "Corps")   # évincé (LRU)
+            assert complete.call_count == 4
+
+            monkeypatch.setattr(watcher, "MISTRAL_CACHE_TTL_SEC", -1)
+            mistral_is_real_estate_email("g@h.com", "Sujet", "Corps")
+            mistral_is_real_estate_email("g@h.com", "Sujet", "Corps")   # expiré
+            assert complete.call_count == 6
+
+
 # ══════════════════════════════════════════════════════════════════════════════
 # 🔄 Section 2 — run_email_pipeline() end-to-end
 # ══════════════════════════════════════════════════════════════════════════════
@@ -203,7 +276,7 @@ def patched_pipeline(test_engine):
     - SessionLocal → SQLite in-memory
     - analyze_email → résultat fixe
     - generate_reply → réponse fixe
-    - upload_file → no-op
+    - upload_content / store_object → no-op
     - _send_reply → no-op
     """
     TestSession = sessionmaker(autocommit=False, autoflush=False, bind=test_engine)
@@ -211,12 +284,13 @@ def patched_pipeline(test_engine):
     p1 = patch("app.services.email_pipeline.SessionLocal", TestSession)
     p2 = patch("app.services.email_pipeline.analyze_email", return_value=MOCK_EMAIL_RESULT)
     p3 = patch("app.services.email_pipeline.generate_reply", return_value=MOCK_REPLY_RESULT)
-    p4 = patch("app.services.email_pipeline.upload_file")
-    p5 = patch("app.services.email_pipeline._send_reply")
+    p4 = patch("app.services.email_pipeline.store_object")
+    p5 = patch("app.services.email_pipeline.upload_content")
+    p6 = patch("app.services.email_pipeline._send_reply")
 
-    p1.start(); p2.start(); p3.start(); p4.start(); p5.start()
+    p1.start(); p2.start(); p3.start(); p4.start(); p5.start(); p6.start()
     yield TestSession
-    p5.stop(); p4.stop(); p3.stop(); p2.stop(); p1.stop()
+    p6.stop(); p5.stop(); p4.stop(); p3.stop(); p2.stop(); p1.stop()
 
 
 class TestRunEmailPipeline:
@@ -261,7 +335,7 @@ class TestRunEmailPipeline:
 
         db = patched_pipeline()
         try:
-            # _normalize_candidate_email ne retire les points que pour @gmail.com
+            # canonical_email ne retire les points que pour @gmail.com
             # test.com → thomas.durand@test.com inchangé
             tf = db.query(TenantFile).filter(
                 TenantFile.agency_id == 1,
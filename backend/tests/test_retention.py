@@ -0,0 +1,130 @@
+# backend/tests/test_retention.py
+"""
+Tests du nettoyage RGPD.
+
+- FileAnalysis expirés supprimés par lots, liens documents compris
+- Objets R2 supprimés en groupe, uniquement à la dernière référence,
+  avant le commit (lignes StoredObject encore verrouillées)
+- Fichiers récents conservés
+- Planification : un seul leader par cycle, un job RQ par agence
+"""
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+from app.database.models import (
+    Agency, FileAnalysis, StoredObject, TenantDocumentLink, TenantFile, TenantDocType,
+)
+from app.services.retention_service import (
+    RETENTION_INTERVAL_SECONDS, RETENTION_LEASE_KEY,
+    acquire_retention_lease, purge_file_analyses, schedule_retention_jobs,
+)
+
+OLD = datetime.utcnow() - timedelta(days=400)
+CUTOFF = datetime.utcnow() - timedelta(days=365)
+
+
+class TestPurgeFileAnalyses:
+
+    def test_suppression_par_lots(self, db_session, test_user):
+        aid = test_user.agency_id
+        db_session.add_all([
+            FileAnalysis(agency_id=aid, filename=f"{aid}_1_doc{i}.pdf", created_at=OLD)
+            for i in range(5)
+        ])
+        db_session.add(FileAnalysis(agency_id=aid, filename="recent.pdf"))
+        db_session.commit()
+
+        with patch("app.services.retention_service.settings.RETENTION_BATCH_SIZE", 2), \
+                patch("app.services.retention_service.delete_files", return_value=[]) as mock_delete:
+            deleted = purge_file_analyses(db_session, aid, CUTOFF)
+
+        assert deleted == 5
+        assert mock_delete.call_count == 3
+        assert [f.filename for f in db_session.query(FileAnalysis).all()] == ["recent.pdf"]
+
+    def test_objet_partage_conserve(self, db_session, test_user):
+        aid = test_user.agency_id
+        key = "objects/ab/abcd"
+        db_session.add(StoredObject(file_hash="abcd", object_key=key, ref_count=2))
+        old = FileAnalysis(agency_id=aid, filename="1_1_a.pdf", storage_key=key, created_at=OLD)
+        recent = FileAnalysis(agency_id=aid, filename="1_2_a.pdf", storage_key=key)
+        tf = TenantFile(agency_id=aid, candidate_email="x@test.com")
+        db_session.add_all([old, recent, tf])
+        db_session.commit()
+        db_session.add(TenantDocumentLink(
+            tenant_file_id=tf.id, file_analysis_id=old.id, doc_type=TenantDocType.ID,
+        ))
+        db_session.commit()
+
+        with patch("app.services.retention_service.delete_files", return_value=[]) as mock_delete:
+            assert purge_file_analyses(db_session, aid, CUTOFF) == 1
+
+        mock_delete.assert_called_once_with([])
+        assert db_session.query(StoredObject).one().ref_count == 1
+        assert db_session.query(TenantDocumentLink).count() == 0
+
+    def test_derniere_reference_supprime_objet(self, db_session, test_user):
+        aid = test_user.agency_id
+        key = "objects/cd/cdef"
+        db_session.add(StoredObject(file_hash="cdef", object_key=key, ref_count=1))
+        db_session.add_all([
+            FileAnalysis(agency_id=aid, filename="1_1_b.pdf", storage_key=key, created_at=OLD),
+            FileAnalysis(agency_id=aid, filename="1_1_legacy.pdf", created_at=OLD),
+        ])
+        db_session.commit()
+
+        with patch("app.services.retention_service.delete_files", return_value=[]) as mock_delete:
+            purge_file_analyses(db_session, aid, CUTOFF)
+
+        assert sorted(mock_delete.call_args[0][0]) == ["1_1_legacy.pdf", key]
+        assert db_session.query(StoredObject).count() == 0
+
+    def test_objet_r2_supprime_avant_commit(self, db_session, test_user):
+        """Suppression R2 sous verrou : un store_object concurrent attend le commit puis ré-uploade."""
+        aid = test_user.agency_id
+        key = "objects/ef/ef01"
+        db_session.add(StoredObject(file_hash="ef01", object_key=key, ref_count=1))
+        db_session.add(FileAnalysis(agency_id=aid, filename="1_1_c.pdf", storage_key=key, created_at=OLD))
+        db_session.commit()
+
+        order = []
+        real_commit = db_session.commit
+
+        def commit():
+            order.append("commit")
+            real_commit()
+
+        with patch.object(db_session, "commit", side_effect=commit), \
+                patch("app.services.retention_service.delete_files",
+                      side_effect=lambda keys: order.append(("delete", list(keys))) or []):
+            purge_file_analyses(db_session, aid, CUTOFF)
+
+        assert order[:2] == [("delete", [key]), "commit"]
+
+
+class TestPlanificationDistribuee:
+
+    def test_bail_nx_avec_expiration(self):
+        conn = MagicMock()
+        conn.set.return_value = None  # bail déjà détenu par un autre réplica
+        assert acquire_retention_lease(conn) is False
+
+        conn.set.return_value = True
+        assert acquire_retention_lease(conn) is True
+        _, kwargs = conn.set.call_args
+        assert conn.set.call_args[0][0] == RETENTION_LEASE_KEY
+        assert kwargs == {"nx": True, "ex": RETENTION_INTERVAL_SECONDS}
+
+    def test_un_job_par_agence(self, db_session, test_agency):
+        db_session.add(Agency(name="Autre agence"))
+        db_session.commit()
+        mock_q = MagicMock()
+
+        with patch("rq.Queue", return_value=mock_q):
+            count = schedule_retention_jobs(db_session, MagicMock())
+
+        assert count == db_session.query(Agency).count() == 2
+        # 2 agences + 1 purge des exports
+        assert mock_q.enqueue.call_count == 3
+        agency_args = {c.args[1] for c in mock_q.enqueue.call_args_list[:2]}
+        assert agency_args == {a.id for a in db_session.query(Agency).all()}
@@ -0,0 +1,224 @@
+# backend/tests/test_stats.py
+"""
+Tests des compteurs dashboard pré-agrégés.
+
+- Création / modification / suppression ORM → compteurs à jour (hook after_flush)
+- Suppression en masse → dérive corrigée par reconcile_agency_stats
+- Dialecte sans UPSERT : repli UPDATE puis INSERT
+- GET /dashboard/stats : KPIs et derniers emails en une requête
+- Agrégats journaliers + GET /dashboard/timeseries
+"""
+from collections import Counter
+from datetime import date, datetime
+from unittest.mock import patch
+
+from sqlalchemy import event
+
+from app.database.models import (
+    AgencyDailyStat, AgencyStatCounter, EmailAnalysis, FileAnalysis, TenantFile,
+    TenantFileStatus,
+)
+from app.services.stats_service import (
+    apply_deltas, get_agency_stats, invalidate_cache, purge_daily_stats, reconcile_agency_stats,
+)
+
+
+def _counters(db, agency_id):
+    return {
+        (c.metric, c.key): c.value
+        for c in db.query(AgencyStatCounter).filter(AgencyStatCounter.agency_id == agency_id)
+    }
+
+
+class TestCompteursIncrementaux:
+
+    def test_creation_et_modification_email(self, db_session, test_user):
+        aid = test_user.agency_id
+        email = EmailAnalysis(agency_id=aid, sender_email="a@test.com", category="autre", urgency="normale")
+        db_session.add(email)
+        db_session.commit()
+
+        # Cas pipeline : attributs expirés par le commit, puis classification
+        email.category = "candidature"
+        email.urgency = "Urgente"
+        db_session.commit()
+
+        c = _counters(db_session, aid)
+        assert c[("emails", "")] == 1
+        assert c[("emails_urgent", "")] == 1
+        assert c[("emails_category", "candidature")] == 1
+        assert c[("emails_category", "autre")] == 0
+
+        db_session.delete(email)
+        db_session.commit()
+        c = _counters(db_session, aid)
+        assert c[("emails", "")] == 0
+        assert c[("emails_urgent", "")] == 0
+
+    def test_transition_statut_dossier(self, db_session, test_user):
+        aid = test_user.agency_id
+        tf = TenantFile(agency_id=aid, candidate_email="x@test.com")
+        db_session.add(tf)
+        db_session.commit()
+        tf.status = TenantFileStatus.INCOMPLETE
+        db_session.commit()
+
+        c = _counters(db_session, aid)
+        assert c[("tenant_files", "")] == 1
+        assert c[("tenant_files_status", "new")] == 0
+        assert c[("tenant_files_status", "incomplete")] == 1
+
+
+class TestRecalage:
+
+    def test_suppression_en_masse_recalee(self, db_session, test_user):
+        aid = test_user.agency_id
+        db_session.add_all([
+            EmailAnalysis(agency_id=aid, sender_email=f"{i}@test.com", category="autre")
+            for i in range(3)
+        ])
+        db_session.commit()
+
+        db_session.query(EmailAnalysis).filter(EmailAnalysis.sender_email == "0@test.com") \
+            .delete(synchronize_session=False)
+        db_session.commit()
+        assert _counters(db_session, aid)[("emails", "")] == 3   # hook contourné
+
+        reconcile_agency_stats(db_session, aid)
+        db_session.commit()
+        c = _counters(db_session, aid)
+        assert c[("emails", "")] == 2
+        assert c[("emails_category", "autre")] == 2
+
+
+class TestDashboardStats:
+
+    def test_kpis_depuis_compteurs(self, client, auth_headers, db_session, test_user):
+        aid = test_user.agency_id
+        invalidate_cache(aid)
+        db_session.add_all([
+            EmailAnalysis(agency_id=aid, sender_email="a@test.com", subject="A",
+                          category="candidature", urgency="urgent"),
+            EmailAnalysis(agency_id=aid, sender_email="b@test.com", subject="B",
+                          category="autre", urgency="basse"),
+            TenantFile(agency_id=aid, status=TenantFileStatus.INCOMPLETE),
+        ])
+        db_session.commit()
+
+        resp = client.get("/dashboard/stats", headers=auth_headers)
+        assert resp.status_code == 200
+        data = resp.json()
+        assert data["kpis"] == {
+            "total_emails": 2, "high_urgency": 1,
+            "tenant_files": 1, "tenant_files_incomplete": 1,
+        }
+        assert {d["name"]: d["value"] for d in data["charts"]["distribution"]} == {
+            "autre": 1, "candidature": 1,
+        }
+        assert [r["subject"] for r in data["recents"]] == ["B", "A"]
+        assert get_agency_stats(db_session, aid) is get_agency_stats(db_session, aid)
+
+    def test_une_requete(self, db_session, test_engine, test_user):
+        aid = test_user.agency_id
+        invalidate_cache(aid)
+        db_session.add_all(
+            EmailAnalysis(agency_id=aid, sender_email=f"{i}@test.com", subject=f"S{i}", category="autre")
+            for i in range(8)
+        )
+        db_session.commit()
+
+        statements = []
+
+        def _before(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(test_engine, "before_cursor_execute", _before)
+        try:
+            stats = get_agency_stats(db_session, aid)
+        finally:
+            event.remove(test_engine, "before_cursor_execute", _before)
+
+        assert len(statements) == 1
+        assert stats["kpis"]["total_emails"] == 8
+        assert [r["subject"] for r in stats["recents"]] == ["S7", "S6", "S5", "S4", "S3"]
+
+
+class TestDialecteSansUpsert:
+
+    def test_update_puis_insert(self, db_session, test_user):
+        aid = test_user.agency_id
+        connection = db_session.connection()
+        with patch.object(connection.dialect, "name", "mssql"):
+            apply_deltas(connection, Counter({(aid, "emails", ""): 2}))
+            apply_deltas(connection, Counter({(aid, "emails", ""): 3, (aid, "emails_category", "x"): 1}))
+        assert _counters(db_session, aid) == {("emails", ""): 5, ("emails_category", "x"): 1}
+
+
+class TestAgregatsJournaliers:
+
+    def test_buckets_par_jour_et_reclassification(self, db_session, test_user):
+        aid = test_user.agency_id
+        email = EmailAnalysis(agency_id=aid, sender_email="a@test.com", category="autre",
+                              urgency="Normale", filter_decision="process",
+                              created_at=datetime(2025, 3, 1, 10, 0))
+        db_session.add_all([
+            email,
+            FileAnalysis(agency_id=aid, filename="f.pdf", file_type="payslip",
+                         created_at=datetime(2025, 3, 2, 9, 0)),
+        ])
+        db_session.commit()
+        email.category = "candidature"
+        db_session.commit()
+
+        rows = {
+            (r.day, r.metric, r.key): r.value
+            for r in db_session.query(AgencyDailyStat).filter(AgencyDailyStat.agency_id == aid)
+        }
+        assert rows[(date(2025, 3, 1), "emails_category", "candidature")] == 1
+        assert rows[(date(2025, 3, 1), "emails_category", "autre")] == 0
+        assert rows[(date(2025, 3, 1), "emails_urgency", "normale")] == 1
+        assert rows[(date(2025, 3, 2), "documents_type", "payslip")] == 1
+
+        # La suppression ne décrémente pas l'historique ; la purge par horizon oui
+        db_session.delete(email)
+        db_session.commit()
+        assert db_session.query(AgencyDailyStat).filter(
+            AgencyDailyStat.metric == "emails_urgency").one().value == 1
+        purge_daily_stats(db_session, date(2025, 3, 2))
+        db_session.commit()
+        assert {r.day for r in db_session.query(AgencyDailyStat)} == {date(2025, 3, 2)}
+
+    def test_endpoint_timeseries(self, client, auth_headers, db_session, test_user):
+        aid = test_user.agency_id
+        db_session.add_all([
+            EmailAnalysis(agency_id=aid, sender_email=f"{i}@test.com", category="candidature",
+                          created_at=datetime(2025, 3, 1 + i % 2, 12, 0))
+            for i in range(3)
+        ])
+        tf = TenantFile(agency_id=aid)
+        db_session.add(tf)
+        db_session.commit()
+        tf.status = TenantFileStatus.INCOMPLETE
+        db_session.commit()
+
+        resp = client.get(
+            "/dashboard/timeseries?start=2025-03-01&end=2025-03-03&metrics=emails_category",
+            headers=auth_headers,
+        )
+        assert resp.status_code == 200
+        data = resp.json()
+        assert data["days"] == ["2025-03-01", "2025-03-02", "2025-03-03"]
+        assert data["series"] == {"emails_category": {"candidature": [2, 1, 0]}}
+
+        today = datetime.utcnow().date().isoformat()
+        data = client.get(
+            f"/dashboard/timeseries?start={today}&end={today}&metrics=tenant_status_in",
+            headers=auth_headers,
+        ).json()
+        assert data["series"]["tenant_status_in"] == {"new": [1], "incomplete": [1]}
+
+    def test_parametres_invalides(self, client, auth_headers):
+        assert client.get("/dashboard/timeseries?metrics=bidon", headers=auth_headers).status_code == 400
+        assert client.get(
+            "/dashboard/timeseries?start=2024-01-01&end=2025-06-01", headers=auth_headers,
+        ).status_code == 400
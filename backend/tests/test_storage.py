@@ -0,0 +1,139 @@
+# backend/tests/test_storage.py
+"""
+Tests du stockage R2 adressé par contenu.
+
+- Même contenu → un seul upload, compteur de références incrémenté
+- Contenu uploadé en amont (hors transaction) → référence seule
+- Suppression → objet R2 supprimé uniquement à la dernière référence
+- Fichier historique (sans storage_key) → suppression directe
+- Suppression groupée R2 → une requête par tranche de 1000 clés
+- Archive d'export : chiffrée par morceaux, déchiffrée en flux
+"""
+import hashlib
+from unittest.mock import MagicMock, patch
+
+from app.database.models import FileAnalysis, StoredObject
+from app.services.storage_service import (
+    content_object_key, delete_files, object_key_for, release_object, store_object,
+)
+
+CONTENT = b"%PDF-1.4 fiche de paie"
+CONTENT_HASH = hashlib.sha256(CONTENT).hexdigest()
+
+
+class TestStoreObject:
+
+    def test_premier_stockage_upload(self, db_session):
+        with patch("app.services.storage_service.upload_file") as mock_upload:
+            key = store_object(db_session, CONTENT, CONTENT_HASH, "application/pdf")
+            db_session.commit()
+
+        assert key == content_object_key(CONTENT_HASH)
+        mock_upload.assert_called_once()
+        obj = db_session.query(StoredObject).one()
+        assert obj.ref_count == 1
+        assert obj.size == len(CONTENT)
+
+    def test_contenu_identique_un_seul_upload(self, db_session):
+        with patch("app.services.storage_service.upload_file") as mock_upload:
+            k1 = store_object(db_session, CONTENT, CONTENT_HASH)
+            db_session.commit()
+            k2 = store_object(db_session, CONTENT, CONTENT_HASH)
+            db_session.commit()
+
+        assert k1 == k2
+        assert mock_upload.call_count == 1
+        assert db_session.query(StoredObject).one().ref_count == 2
+
+    def test_contenu_deja_uploade(self, db_session):
+        with patch("app.services.storage_service.upload_file") as mock_upload:
+            key = store_object(db_session, CONTENT, CONTENT_HASH, uploaded=True)
+            db_session.commit()
+
+        assert key == content_object_key(CONTENT_HASH)
+        mock_upload.assert_not_called()
+        assert db_session.query(StoredObject).one().ref_count == 1
+
+
+class TestReleaseObject:
+
+    def test_suppression_a_la_derniere_reference(self, db_session):
+        with patch("app.services.storage_service.upload_file"):
+            key = store_object(db_session, CONTENT, CONTENT_HASH)
+            store_object(db_session, CONTENT, CONTENT_HASH)
+            db_session.commit()
+
+        with patch("app.services.storage_service.delete_file") as mock_delete:
+            assert release_object(db_session, key) is False
+            db_session.commit()
+            mock_delete.assert_not_called()
+
+            assert release_object(db_session, key) is True
+            db_session.commit()
+            mock_delete.assert_called_once_with(key)
+
+        assert db_session.query(StoredObject).count() == 0
+
+    def test_fichier_historique_supprime_directement(self, db_session):
+        legacy = FileAnalysis(agency_id=1, filename="1_1700000000_cni.pdf")
+        assert object_key_for(legacy) == "1_1700000000_cni.pdf"
+
+        with patch("app.services.storage_service.delete_file") as mock_delete:
+            assert release_object(db_session, object_key_for(legacy)) is True
+            mock_delete.assert_called_once_with("1_1700000000_cni.pdf")
+
+
+class TestDeleteFiles:
+
+    def test_suppression_par_tranches(self):
+        client = MagicMock()
+        client.remove_objects.side_effect = lambda bucket, objs: (list(objs), iter([]))[1]
+        keys = [f"objects/00/{i}" for i in range(2500)]
+
+        with patch("app.services.storage_service._get_client", return_value=client):
+            assert delete_files(keys) == []
+
+        assert client.remove_objects.call_count == 3
+
+    def test_erreurs_retournees(self):
+        err = MagicMock()
+        err.name, err.message = "objects/00/1", "AccessDenied"
+        client = MagicMock()
+        client.remove_objects.return_value = iter([err])
+
+        with patch("app.services.storage_service._get_client", return_value=client):
+            assert delete_files(["objects/00/1", "objects/00/2"]) == ["objects/00/1"]
+
+
+class TestUploadStream:
+
+    def test_archive_chiffree_par_morceaux(self, monkeypatch):
+        import io
+        from cryptography.fernet import Fernet
+        from app.services import storage_service
+
+        monkeypatch.setattr(storage_service, "STREAM_CHUNK_SIZE", 1000)
+        fernet = Fernet(Fernet.generate_key())
+        monkeypatch.setattr(storage_service, "_get_fernet", lambda: fernet)
+        stored = {}
+
+        def put_object(bucket_name, object_name, data, length, content_type, metadata, part_size):
+            stored.update(body=data.read(), length=length, metadata=metadata)
+
+        client = MagicMock()
+        client.put_object.side_effect = put_object
+        monkeypatch.setattr(storage_service, "_get_client", lambda: client)
+
+        archive = bytes(range(256)) * 20   # 5120 octets → 6 morceaux
+        storage_service.upload_stream(io.BytesIO(archive), len(archive), "exports/1/export_1.zip")
+
+        assert stored["metadata"] == {"encrypted": "chunked"}
+        assert stored["length"] == len(stored["body"])
+        assert archive[:256] not in stored["body"]
+
+        client.stat_object.return_value = MagicMock(metadata={"x-amz-meta-encrypted": "chunked"})
+        client.get_object.return_value = io.BytesIO(stored["body"])
+        client.get_object.return_value.release_conn = lambda: None
+        chunks = list(storage_service.stream_file("exports/1/export_1.zip"))
+        assert len(chunks) == 6
+        assert b"".join(chunks) == archive
@@ -0,0 +1,88 @@
+# backend/tests/test_tenant_upsert.py
+"""
+Tests de ensure_tenant_file (upsert du dossier ouvert d'un candidat).
+
+- un seul dossier ouvert par (agence, email) : index unique partiel
+- appels répétés / workers concurrents → même ligne, compteurs stats à jour
+- dossier clos : un nouveau dossier peut être ouvert
+"""
+import pytest
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from app.database.models import AgencyStatCounter, TenantFile
+from app.services.tenant_service import ensure_tenant_file
+
+
+def _counter(db, agency_id, metric, key=""):
+    row = db.get(AgencyStatCounter, (agency_id, metric, key))
+    return row.value if row else 0
+
+
+class TestEnsureTenantFile:
+
+    def test_creation_puis_reutilisation(self, db_session, test_user):
+        aid = test_user.agency_id
+        first = ensure_tenant_file(db_session, aid, " Jean@Test.com ")
+        second = ensure_tenant_file(db_session, aid, "jean@test.com", candidate_name="Jean Dupont")
+
+        assert first.id == second.id
+        assert second.candidate_name == "Jean Dupont"
+        assert second.normalized_email == "jean@test.com"
+        assert db_session.query(TenantFile).count() == 1
+        # Insertion hors unit of work : compteurs mis à jour explicitement
+        assert _counter(db_session, aid, "tenant_files") == 1
+        assert _counter(db_session, aid, "tenant_files_status", "new") == 1
+
+    def test_nom_existant_conserve(self, db_session, test_user):
+        aid = test_user.agency_id
+        ensure_tenant_file(db_session, aid, "jean@test.com", candidate_name="Jean")
+        tf = ensure_tenant_file(db_session, aid, "jean@test.com", candidate_name="Autre")
+        assert tf.candidate_name == "Jean"
+
+    def test_deux_workers_meme_dossier(self, test_engine, test_user):
+        Session = sessionmaker(bind=test_engine, autoflush=False)
+        worker_a, worker_b = Session(), Session()
+        try:
+            a = ensure_tenant_file(worker_a, test_user.agency_id, "jean@test.com")
+            b = ensure_tenant_file(worker_b, test_user.agency_id, "jean@test.com")
+            assert a.id == b.id
+            assert worker_a.query(TenantFile).count() == 1
+        finally:
+            worker_a.close()
+            worker_b.close()
+
+    def test_dossier_clos_nouveau_dossier(self, db_session, test_user):
+        aid = test_user.agency_id
+        old = ensure_tenant_file(db_session, aid, "jean@test.com")
+        old.is_closed = True
+        db_session.commit()
+
+        new = ensure_tenant_file(db_session, aid, "jean@test.com")
+        assert new.id != old.id
+        assert db_session.query(TenantFile).count() == 2
+
+    def test_email_vide(self, db_session, test_user):
+        assert ensure_tenant_file(db_session, test_user.agency_id, "  ") is None
+
+
+class TestIndexUnique:
+
+    def test_doublon_ouvert_refuse(self, db_session, test_user):
+        aid = test_user.agency_id
+        db_session.add(TenantFile(agency_id=aid, candidate_email="jean@test.com"))
+        db_session.commit()
+        db_session.add(TenantFile(agency_id=aid, candidate_email="jean@test.com"))
+        with pytest.raises(IntegrityError):
+            db_session.commit()
+        db_session.rollback()
+
+    def test_doublons_clos_acceptes(self, db_session, test_user):
+        aid = test_user.agency_id
+        db_session.add_all([
+            TenantFile(agency_id=aid, candidate_email="jean@test.com", is_closed=True),
+            TenantFile(agency_id=aid, candidate_email="jean@test.com", is_closed=True),
+            TenantFile(agency_id=aid, candidate_email="jean@test.com"),
+        ])
+        db_session.commit()
+        assert db_session.query(TenantFile).count() == 3
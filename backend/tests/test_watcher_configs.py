@@ -0,0 +1,122 @@
+# backend/tests/test_watcher_configs.py
+"""
+Tests de GET /watcher/configs (requêtes conditionnelles).
+
+- Blacklists chargées en une requête groupée, rattachées à la bonne agence
+- ETag stable → 304 sans corps
+- delta=true : seules les agences modifiées / retirées sont transmises
+- fetch_configs côté watcher : cache sur 304, application du delta
+"""
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.core.security_utils import fernet_encrypt_str
+from app.database.models import Agency, AgencyBlacklist, AgencyEmailConfig
+
+WATCHER_SECRET = os.environ.get("WATCHER_SECRET", "test-secret-ci")
+
+
+@pytest.fixture
+def two_configs(db_session, test_agency):
+    other = Agency(name="Autre agence", email_alias="autre")
+    db_session.add(other)
+    db_session.commit()
+    configs = []
+    for agency in (test_agency, other):
+        c = AgencyEmailConfig(
+            agency_id=agency.id,
+            gmail_email=f"{agency.email_alias}@gmail.com",
+            gmail_refresh_token=fernet_encrypt_str(f"refresh-{agency.id}"),
+        )
+        db_session.add(c)
+        configs.append(c)
+    db_session.add_all([
+        AgencyBlacklist(agency_id=test_agency.id, pattern="@spam.com"),
+        AgencyBlacklist(agency_id=other.id, pattern="@autre-spam.com"),
+    ])
+    db_session.commit()
+    return configs
+
+
+def _get(client, etag=None, delta=False):
+    headers = {"If-None-Match": etag} if etag else {}
+    params = {"secret": WATCHER_SECRET}
+    if delta:
+        params["delta"] = "true"
+    return client.get("/watcher/configs", params=params, headers=headers)
+
+
+class TestWatcherConfigs:
+
+    def test_blacklists_par_agence(self, client, two_configs):
+        resp = _get(client)
+        assert resp.status_code == 200
+        by_agency = {c["agency_id"]: c for c in resp.json()}
+        a, b = two_configs
+        assert by_agency[a.agency_id]["agency_blacklist"] == ["@spam.com"]
+        assert by_agency[b.agency_id]["agency_blacklist"] == ["@autre-spam.com"]
+        assert by_agency[a.agency_id]["gmail_refresh_token"] == f"refresh-{a.agency_id}"
+        assert resp.headers["ETag"]
+
+    def test_etag_inchange_retourne_304(self, client, two_configs):
+        etag = _get(client).headers["ETag"]
+        with patch("app.api.watcher_routes.fernet_decrypt_str") as decrypt:
+            resp = _get(client, etag=etag, delta=True)
+        assert resp.status_code == 304
+        assert resp.content == b""
+        decrypt.assert_not_called()
+
+    def test_delta_agence_modifiee(self, client, db_session, two_configs):
+        a, b = two_configs
+        etag = _get(client, delta=True).headers["ETag"]
+
+        db_session.add(AgencyBlacklist(agency_id=b.agency_id, pattern="@nouveau.com"))
+        db_session.commit()
+
+        resp = _get(client, etag=etag, delta=True)
+        assert resp.status_code == 200
+        data = resp.json()
+        assert data["full"] is False
+        assert [c["agency_id"] for c in data["configs"]] == [b.agency_id]
+        assert data["configs"][0]["agency_blacklist"] == ["@autre-spam.com", "@nouveau.com"]
+        assert resp.headers["ETag"] != etag
+
+    def test_delta_agence_deconnectee(self, client, db_session, two_configs):
+        a, b = two_configs
+        etag = _get(client, delta=True).headers["ETag"]
+
+        b.gmail_refresh_token = None
+        db_session.commit()
+
+        data = _get(client, etag=etag, delta=True).json()
+        assert data["configs"] == []
+        assert data["removed"] == [b.agency_id]
+
+    def test_etag_inconnu_etat_complet(self, client, two_configs):
+        data = _get(client, etag='"inconnu"', delta=True).json()
+        assert data["full"] is True
+        assert len(data["configs"]) == 2
+
+
+class TestFetchConfigs:
+
+    def test_cache_sur_304_et_delta(self):
+        from app import watcher
+
+        full = MagicMock(status_code=200, headers={"ETag": '"v1"'})
+        full.json.return_value = {
+            "full": True, "removed": [],
+            "configs": [{"agency_id": 1, "x": 1}, {"agency_id": 2, "x": 1}],
+        }
+        not_modified = MagicMock(status_code=304)
+        delta = MagicMock(status_code=200, headers={"ETag": '"v2"'})
+        delta.json.return_value = {"full": False, "removed": [2], "configs": [{"agency_id": 1, "x": 2}]}
+
+        with patch.object(watcher, "_configs_state", {"etag": None, "by_agency": {}}), \
+                patch.object(watcher.requests, "get", side_effect=[full, not_modified, delta]) as get:
+            assert len(watcher.fetch_configs()) == 2
+            assert len(watcher.fetch_configs()) == 2
+            assert get.call_args.kwargs["headers"] == {"If-None-Match": '"v1"'}
+            assert watcher.fetch_configs() == [{"agency_id": 1, "x": 2}]
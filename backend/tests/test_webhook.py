@@ -7,7 +7,20 @@ POST /webhook/email
   - Secret invalide → 403
   - Secret vide    → 403
   - Alias inconnu  → 422
+  - Même idempotency_key → doublon ignoré (job d'origine renvoyé)
+
+POST /webhook/emails:batch
+  - statut par email (queued / duplicate / pending / invalid), un enqueue_many
+  - watcher : flush du lot, marquage lu des seuls emails acceptés
+
+Transport compressé
+  - corps gzip accepté, autre Content-Encoding → 415 ; Accept-Encoding annoncé sur
+    les réponses webhook ; watcher : gzip après annonce, repli JSON sur 415 / 422 non annoncé
+  - job RQ : pièces jointes en octets bruts (plus de base64)
 """
+import base64
+import gzip
+import json
 import os
 import pytest
 from unittest.mock import patch, MagicMock
@@ -34,6 +47,14 @@ def _post_webhook(client, payload, secret=WATCHER_SECRET):
     )
 
 
+def _sent_json(call):
+    """Corps JSON d'un requests.post mocké (décompressé si gzip)."""
+    data = call.kwargs["data"]
+    if call.kwargs["headers"].get("Content-Encoding") == "gzip":
+        data = gzip.decompress(data)
+    return json.loads(data)
+
+
 def _mock_redis_queue():
     """Context managers pour mocker Redis + RQ (importés inline dans main.py)."""
     mock_job = MagicMock()
@@ -115,3 +136,366 @@ class TestWebhookResolutionAgence:
         data = resp.json()
         assert data["status"] == "queued"
         assert "job_id" in data
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# 🔁 Idempotence (re-soumissions du watcher)
+# ══════════════════════════════════════════════════════════════════════════════
+
+class FakeRedis:
+    """Sous-ensemble de redis-py utilisé par idempotency_service (TTL noté, jamais expiré)."""
+
+    def __init__(self):
+        self.data, self.ttls = {}, {}
+
+    def set(self, key, value, nx=False, xx=False, ex=None, keepttl=False):
+        if (nx and key in self.data) or (xx and key not in self.data):
+            return None
+        self.data[key] = value
+        if not keepttl:
+            self.ttls[key] = ex
+        return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+    def incrby(self, key, amount):
+        self.data[key] = int(self.data.get(key, 0)) + amount
+        return self.data[key]
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, conn):
+        self.conn, self.calls = conn, []
+
+    def __getattr__(self, name):
+        return lambda *a, **kw: self.calls.append((name, a, kw))
+
+    def execute(self):
+        calls, self.calls = self.calls, []
+        return [getattr(self.conn, name)(*a, **kw) for name, a, kw in calls]
+
+
+class TestWebhookIdempotence:
+
+    PAYLOAD = {**BASE_PAYLOAD, "agency_id": 1, "idempotency_key": "gmail:inbox@agence.fr:18c2f"}
+
+    def _post(self, client, conn, queue, payload=None):
+        with patch("redis.from_url", return_value=conn), patch("rq.Queue", return_value=queue):
+            return _post_webhook(client, payload or self.PAYLOAD)
+
+    def _queue(self, *job_ids):
+        q = MagicMock()
+        q.enqueue.side_effect = [MagicMock(id=j) for j in job_ids]
+        return q
+
+    def test_doublon_renvoie_job_origine(self, client):
+        conn, q = FakeRedis(), self._queue("job-1", "job-2")
+
+        first = self._post(client, conn, q)
+        second = self._post(client, conn, q)
+
+        assert first.json() == {"status": "queued", "job_id": "job-1"}
+        assert second.status_code == 200
+        assert second.json() == {"status": "duplicate", "job_id": "job-1"}
+        assert q.enqueue.call_count == 1
+
+        with patch("redis.from_url", return_value=conn):
+            r = client.get("/admin/webhook-dedup", headers={"x-watcher-secret": WATCHER_SECRET})
+        assert r.json() == {"duplicates": 1}
+
+    def test_messages_differents_enqueues(self, client):
+        conn, q = FakeRedis(), self._queue("job-1", "job-2")
+        self._post(client, conn, q)
+        resp = self._post(client, conn, q, {**self.PAYLOAD, "idempotency_key": "gmail:inbox@agence.fr:18c30"})
+        assert resp.json()["status"] == "queued"
+        assert q.enqueue.call_count == 2
+
+    def test_premier_envoi_en_cours_409(self, client):
+        conn, q = FakeRedis(), self._queue("job-1")
+        conn.set("cipherflow:webhook:idem:gmail:inbox@agence.fr:18c2f", "pending")
+        resp = self._post(client, conn, q)
+        assert resp.status_code == 409
+        q.enqueue.assert_not_called()
+
+    def test_enqueue_echoue_cle_liberee(self, client):
+        conn = FakeRedis()
+        q = MagicMock()
+        q.enqueue.side_effect = ConnectionError("redis down")
+        with pytest.raises(ConnectionError):
+            self._post(client, conn, q)
+        assert not any(k.startswith("cipherflow:webhook:idem:") for k in conn.data)
+
+    def test_reservation_courte_puis_ttl_complet(self, client):
+        from app.core.config import settings
+        from app.services import idempotency_service
+
+        redis_key = "cipherflow:webhook:idem:gmail:inbox@agence.fr:18c2f"
+        conn = FakeRedis()
+        idempotency_service.claim(conn, "gmail:inbox@agence.fr:18c2f")
+        idempotency_service.claim_many(conn, ["gmail:inbox@agence.fr:18c30"])
+        assert conn.ttls[redis_key] == settings.WEBHOOK_IDEMPOTENCY_PENDING_TTL_SECONDS
+        assert conn.ttls[redis_key.replace("18c2f", "18c30")] == settings.WEBHOOK_IDEMPOTENCY_PENDING_TTL_SECONDS
+        assert settings.WEBHOOK_IDEMPOTENCY_PENDING_TTL_SECONDS < settings.WEBHOOK_IDEMPOTENCY_TTL_SECONDS
+
+        conn = FakeRedis()
+        self._post(client, conn, self._queue("job-1"))
+        assert conn.data[redis_key] == "job-1"
+        assert conn.ttls[redis_key] == settings.WEBHOOK_IDEMPOTENCY_TTL_SECONDS
+
+    def test_sans_cle_pas_de_deduplication(self, client):
+        conn, q = FakeRedis(), self._queue("job-1", "job-2")
+        payload = {**BASE_PAYLOAD, "agency_id": 1}
+        self._post(client, conn, q, payload)
+        self._post(client, conn, q, payload)
+        assert q.enqueue.call_count == 2
+
+    def test_format_cle_watcher(self):
+        from app.services.idempotency_service import idempotency_key
+        from app.watcher import webhook_idempotency_key
+
+        assert webhook_idempotency_key("outlook", " Inbox@Agence.fr", "AAMk=") == \
+            idempotency_key("outlook", " Inbox@Agence.fr", "AAMk=")
+
+
+class TestWebhookBatch:
+
+    def _post(self, client, conn, queue, emails, secret=WATCHER_SECRET):
+        with patch("redis.from_url", return_value=conn), patch("rq.Queue", return_value=queue):
+            return client.post(
+                "/webhook/emails:batch", json={"emails": emails}, headers={"X-Watcher-Secret": secret},
+            )
+
+    def _queue(self):
+        q = MagicMock()
+        q.enqueue_many.side_effect = lambda datas, pipeline: [MagicMock(id=f"job-{n}") for n in range(len(datas))]
+        return q
+
+    def _email(self, message_id, **extra):
+        return {**BASE_PAYLOAD, "agency_id": 1, "idempotency_key": f"gmail:inbox@agence.fr:{message_id}", **extra}
+
+    def test_statut_par_email(self, client, db_session, test_agency):
+        conn, q = FakeRedis(), self._queue()
+        conn.set("cipherflow:webhook:idem:gmail:inbox@agence.fr:deja", "job-ancien")
+
+        emails = [
+            self._email("m1"),
+            self._email("deja"),
+            {"to_email": "x@test.com"},                                   # from_email manquant
+            self._email("m2", agency_id=None, to_email=f"inbox+{test_agency.email_alias}@cipherflow.io"),
+            self._email("m3", agency_id=None, to_email="inbox+inconnu@cipherflow.io"),
+        ]
+        with patch("app.database.database.SessionLocal", side_effect=lambda: db_session):
+            resp = self._post(client, conn, q, emails)
+
+        assert resp.status_code == 200
+        results = resp.json()["results"]
+        assert [r["status"] for r in results] == ["queued", "duplicate", "invalid", "queued", "invalid"]
+        assert results[1]["job_id"] == "job-ancien"
+        assert "Alias email inconnu" in results[4]["error"]
+
+        # Un seul enqueue_many (pipeline) pour les deux emails retenus
+        q.enqueue_many.assert_called_once()
+        assert len(q.enqueue_many.call_args.args[0]) == 2
+        # Clés associées aux jobs créés
+        assert conn.data["cipherflow:webhook:idem:gmail:inbox@agence.fr:m1"] == results[0]["job_id"]
+        assert conn.data["cipherflow:webhook:dedup"] == 1
+
+    def test_secret_invalide(self, client):
+        assert self._post(client, FakeRedis(), self._queue(), [], secret="faux").status_code == 403
+
+    def test_lot_trop_volumineux(self, client):
+        from app.main import WEBHOOK_BATCH_MAX_EMAILS
+
+        emails = [self._email(str(i)) for i in range(WEBHOOK_BATCH_MAX_EMAILS + 1)]
+        assert self._post(client, FakeRedis(), self._queue(), emails).status_code == 422
+
+    def test_enqueue_echoue_cles_liberees(self, client):
+        conn, q = FakeRedis(), MagicMock()
+        q.enqueue_many.side_effect = ConnectionError("redis down")
+        with pytest.raises(ConnectionError):
+            self._post(client, conn, q, [self._email("m1"), self._email("m2")])
+        assert not any(k.startswith("cipherflow:webhook:idem:") for k in conn.data)
+
+
+class TestWatcherBatch:
+
+    def _response(self, status_code, results=None):
+        resp = MagicMock(status_code=status_code, text="")
+        resp.json.return_value = {"results": results or []}
+        return resp
+
+    def test_flush_marque_lus_les_emails_acceptes(self):
+        import app.watcher as watcher
+
+        marked = []
+        batch = []
+        for n in range(3):
+            watcher.submit_to_backend({"from_email": f"{n}@test.com"}, lambda n=n: marked.append(n), batch, "Email")
+        results = [
+            {"index": 0, "status": "queued"},
+            {"index": 1, "status": "pending"},
+            {"index": 2, "status": "duplicate"},
+        ]
+        with patch.object(watcher.requests, "post", return_value=self._response(200, results)) as post:
+            watcher.flush_webhook_batch(batch, agency_id=1)
+
+        post.assert_called_once()
+        assert post.call_args.args[0] == watcher.WEBHOOK_BATCH_URL
+        assert len(_sent_json(post.call_args)["emails"]) == 3
+        assert marked == [0, 2]
+        assert batch == []
+
+    def test_flush_decoupe_en_lots(self, monkeypatch):
+        import app.watcher as watcher
+
+        monkeypatch.setattr(watcher, "WEBHOOK_BATCH_SIZE", 2)
+        batch = [({"n": n}, lambda: None) for n in range(5)]
+        with patch.object(watcher.requests, "post", return_value=self._response(200)) as post:
+            watcher.flush_webhook_batch(batch, agency_id=1)
+        assert [len(_sent_json(c)["emails"]) for c in post.call_args_list] == [2, 2, 1]
+
+    def test_backend_sans_batch_envoi_unitaire(self):
+        import app.watcher as watcher
+
+        marked = []
+        batch = [({"n": n}, lambda n=n: marked.append(n)) for n in range(2)]
+        responses = [self._response(404), self._response(200), self._response(200)]
+        with patch.object(watcher.requests, "post", side_effect=responses) as post:
+            watcher.flush_webhook_batch(batch, agency_id=1)
+        assert [c.args[0] for c in post.call_args_list[1:]] == [watcher.WEBHOOK_URL] * 2
+        assert marked == [0, 1]
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# 🗜️ Transport compressé
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TestTransportCompresse:
+
+    PAYLOAD = {
+        **BASE_PAYLOAD,
+        "agency_id": 1,
+        "attachments": [{
+            "filename": "bulletin.pdf",
+            "content_type": "application/pdf",
+            "content_base64": base64.b64encode(b"%PDF-1.4 salaire" * 100).decode(),
+        }],
+    }
+
+    def _post(self, client, queue, body, encoding):
+        with patch("redis.from_url", return_value=FakeRedis()), patch("rq.Queue", return_value=queue):
+            return client.post(
+                "/webhook/email",
+                content=body,
+                headers={
+                    "X-Watcher-Secret": WATCHER_SECRET,
+                    "Content-Type": "application/json",
+                    "Content-Encoding": encoding,
+                },
+            )
+
+    def test_corps_gzip_accepte_job_en_octets_bruts(self, client):
+        q = MagicMock()
+        q.enqueue.return_value = MagicMock(id="job-1")
+        resp = self._post(client, q, gzip.compress(json.dumps(self.PAYLOAD).encode()), "gzip")
+
+        assert resp.status_code == 200
+        job_payload = q.enqueue.call_args.args[1]
+        att = job_payload["attachments"][0]
+        assert "content_base64" not in att
+        assert att["content"] == b"%PDF-1.4 salaire" * 100
+
+    def test_encodage_non_supporte_415(self, client):
+        q = MagicMock()
+        resp = self._post(client, q, b"\x28\xb5\x2f\xfd", "zstd")
+        assert resp.status_code == 415
+        assert "gzip" in resp.headers["accept-encoding"]
+        q.enqueue.assert_not_called()
+
+    def test_gzip_invalide_400(self, client):
+        assert self._post(client, MagicMock(), b"pas du gzip", "gzip").status_code == 400
+
+    def test_corps_decompresse_trop_gros_413(self, client, monkeypatch):
+        from app.core import payload_codec
+
+        monkeypatch.setattr(payload_codec, "MAX_DECODED_BODY_BYTES", 1024)
+        body = gzip.compress(json.dumps({**self.PAYLOAD, "content": "x" * 10_000}).encode())
+        assert self._post(client, MagicMock(), body, "gzip").status_code == 413
+
+    def test_pipeline_lit_ancien_et_nouveau_format(self):
+        from app.core.payload_codec import attachment_bytes, compact_job_payload
+
+        legacy = self.PAYLOAD["attachments"][0]
+        compact = compact_job_payload(self.PAYLOAD)["attachments"][0]
+        assert attachment_bytes(legacy) == attachment_bytes(compact) == b"%PDF-1.4 salaire" * 100
+
+    def test_backend_annonce_gzip(self, client):
+        q = MagicMock()
+        q.enqueue.return_value = MagicMock(id="job-1")
+        ok = self._post(client, q, json.dumps(self.PAYLOAD).encode(), "identity")
+        refused = client.post("/webhook/email", json=self.PAYLOAD, headers={"X-Watcher-Secret": "mauvais"})
+        assert "gzip" in ok.headers["accept-encoding"]
+        assert "gzip" in refused.headers["accept-encoding"]   # erreurs comprises
+
+    def test_watcher_gzip_apres_annonce(self, monkeypatch):
+        import app.watcher as watcher
+
+        monkeypatch.setattr(watcher, "_webhook_gzip", {"enabled": True, "supported": False})
+        announced = MagicMock(status_code=200, headers={"Accept-Encoding": "gzip, identity"})
+        with patch.object(watcher.requests, "post", return_value=announced) as post:
+            watcher.post_webhook(watcher.WEBHOOK_URL, self.PAYLOAD)
+            watcher.post_webhook(watcher.WEBHOOK_URL, self.PAYLOAD)
+
+        encodings = [c.kwargs["headers"].get("Content-Encoding") for c in post.call_args_list]
+        assert encodings == [None, "gzip"]   # sonde en JSON, gzip une fois annoncé
+        assert all(_sent_json(c) == self.PAYLOAD for c in post.call_args_list)
+
+    @pytest.mark.parametrize("status", [415, 422])
+    def test_watcher_repli_json_backend_anterieur(self, monkeypatch, status):
+        import app.watcher as watcher
+
+        # Backend remplacé par une version sans gzip : 422 (JSON illisible) sans annonce
+        monkeypatch.setattr(watcher, "_webhook_gzip", {"enabled": True, "supported": True})
+        responses = [
+            MagicMock(status_code=status, headers={}),
+            MagicMock(status_code=200, headers={}),
+            MagicMock(status_code=200, headers={}),
+        ]
+        with patch.object(watcher.requests, "post", side_effect=responses) as post:
+            watcher.post_webhook(watcher.WEBHOOK_URL, self.PAYLOAD)
+            resp = watcher.post_webhook(watcher.WEBHOOK_URL, self.PAYLOAD)
+
+        encodings = [c.kwargs["headers"].get("Content-Encoding") for c in post.call_args_list]
+        assert encodings == ["gzip", None, None]   # gzip suspendu faute d'annonce
+        assert resp.status_code == 200
+        assert all(_sent_json(c) == self.PAYLOAD for c in post.call_args_list)
+
+    def test_watcher_422_annonce_non_rejoue(self, monkeypatch):
+        import app.watcher as watcher
+
+        # 422 d'un backend qui accepte gzip : payload réellement invalide, pas de renvoi
+        monkeypatch.setattr(watcher, "_webhook_gzip", {"enabled": True, "supported": True})
+        invalid = MagicMock(status_code=422, headers={"Accept-Encoding": "gzip, identity"})
+        with patch.object(watcher.requests, "post", return_value=invalid) as post:
+            assert watcher.post_webhook(watcher.WEBHOOK_URL, self.PAYLOAD).status_code == 422
+        post.assert_called_once()
+
+    def test_watcher_petit_corps_non_compresse(self, monkeypatch):
+        import app.watcher as watcher
+
+        monkeypatch.setattr(watcher, "_webhook_gzip", {"enabled": True, "supported": True})
+        with patch.object(watcher.requests, "post", return_value=MagicMock(status_code=200, headers={})) as post:
+            watcher.post_webhook(watcher.WEBHOOK_URL, {"from_email": "a@test.com"})
+        assert "Content-Encoding" not in post.call_args.kwargs["headers"]
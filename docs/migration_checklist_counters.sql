@@ -0,0 +1,35 @@
+-- Migration : checklist incrémentale des dossiers locataires
+-- Compteurs de documents par type sur tenant_files, tenus à jour par
+-- tenant_service (attach / detach). La checklist n'est plus sérialisée.
+
+ALTER TABLE tenant_files
+    ADD COLUMN IF NOT EXISTS doc_id_count            INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS doc_payslip_count       INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS doc_tax_count           INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS doc_work_contract_count INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS doc_address_proof_count INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS doc_bank_count          INTEGER NOT NULL DEFAULT 0;
+
+-- Backfill depuis les liens existants (idempotent)
+UPDATE tenant_files tf
+SET doc_id_count            = c.id_n,
+    doc_payslip_count       = c.payslip_n,
+    doc_tax_count           = c.tax_n,
+    doc_work_contract_count = c.work_contract_n,
+    doc_address_proof_count = c.address_proof_n,
+    doc_bank_count          = c.bank_n
+FROM (
+    SELECT tenant_file_id,
+           count(*) FILTER (WHERE doc_type = 'ID')            AS id_n,
+           count(*) FILTER (WHERE doc_type = 'PAYSLIP')       AS payslip_n,
+           count(*) FILTER (WHERE doc_type = 'TAX')           AS tax_n,
+           count(*) FILTER (WHERE doc_type = 'WORK_CONTRACT') AS work_contract_n,
+           count(*) FILTER (WHERE doc_type = 'ADDRESS_PROOF') AS address_proof_n,
+           count(*) FILTER (WHERE doc_type = 'BANK')          AS bank_n
+    FROM tenant_document_links
+    GROUP BY tenant_file_id
+) c
+WHERE tf.id = c.tenant_file_id;
+
+-- checklist_json n'est plus lu ni écrit : à supprimer une fois le déploiement validé
+-- ALTER TABLE tenant_files DROP COLUMN checklist_json;
@@ -0,0 +1,29 @@
+-- Migration : index composites / partiels des requêtes chaudes filtrées par agence
+-- CONCURRENTLY : pas de verrou en écriture, à lancer hors transaction (psql -f).
+-- Mesure avant / après : backend/scripts/benchmark_indexes.py
+
+-- Déduplication des pièces jointes (email_pipeline._process_attachment)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_file_analyses_agency_hash
+    ON file_analyses(agency_id, file_hash);
+
+-- ensure_tenant_file : dossier ouvert d'un candidat (index partiel, dossiers clos exclus)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tenant_files_open_agency_email
+    ON tenant_files(agency_id, candidate_email) WHERE is_closed = false;
+
+-- (agency_id, id) sur email_analyses : retiré, aucune requête ne trie les
+-- emails par id seul — cf. migration_drop_redundant_indexes.sql
+
+-- email → dossier (historique, ensure_email_link) : parcours index-only
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tenant_email_links_email_tenant
+    ON tenant_email_links(email_analysis_id, tenant_file_id);
+
+-- Rattachement / détachement de documents
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tenant_document_links_tenant_file
+    ON tenant_document_links(tenant_file_id, file_analysis_id);
+
+-- Statistiques à jour pour le planificateur
+ANALYZE file_analyses;
+ANALYZE tenant_files;
+ANALYZE email_analyses;
+ANALYZE tenant_email_links;
+ANALYZE tenant_document_links;
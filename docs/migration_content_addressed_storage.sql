@@ -0,0 +1,16 @@
+-- Migration : stockage R2 adressé par contenu (SHA-256) + compteur de références
+-- Les fichiers existants restent sous leur clé historique (storage_key NULL).
+CREATE TABLE IF NOT EXISTS stored_objects (
+    id SERIAL PRIMARY KEY,
+    file_hash VARCHAR(64) NOT NULL UNIQUE,
+    object_key VARCHAR NOT NULL UNIQUE,
+    ref_count INTEGER NOT NULL DEFAULT 1,
+    size INTEGER,
+    content_type VARCHAR,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS ix_stored_objects_file_hash ON stored_objects(file_hash);
+
+ALTER TABLE file_analyses ADD COLUMN IF NOT EXISTS storage_key VARCHAR NULL;
+CREATE INDEX IF NOT EXISTS ix_file_analyses_storage_key ON file_analyses(storage_key);
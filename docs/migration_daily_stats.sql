@@ -0,0 +1,44 @@
+-- Migration : agrégats journaliers par agence (GET /dashboard/timeseries)
+-- Alimentés par l'application ; purgés après STATS_DAILY_RETENTION_DAYS.
+CREATE TABLE IF NOT EXISTS agency_daily_stats (
+    agency_id INTEGER NOT NULL REFERENCES agencies(id),
+    day DATE NOT NULL,
+    metric VARCHAR NOT NULL,
+    key VARCHAR NOT NULL DEFAULT '',
+    value INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (agency_id, day, metric, key)
+);
+
+-- Initialisation depuis l'existant (emails et documents encore présents).
+-- Les transitions de statut passées ne sont pas reconstituables : seules les
+-- créations de dossiers sont reprises (statut 'new' au jour de création).
+INSERT INTO agency_daily_stats (agency_id, day, metric, key, value)
+SELECT agency_id, created_at::date, 'emails_category', COALESCE(category, ''), COUNT(*)
+FROM email_analyses WHERE agency_id IS NOT NULL
+GROUP BY 1, 2, 4
+ON CONFLICT DO NOTHING;
+
+INSERT INTO agency_daily_stats (agency_id, day, metric, key, value)
+SELECT agency_id, created_at::date, 'emails_urgency', lower(COALESCE(urgency, '')), COUNT(*)
+FROM email_analyses WHERE agency_id IS NOT NULL
+GROUP BY 1, 2, 4
+ON CONFLICT DO NOTHING;
+
+INSERT INTO agency_daily_stats (agency_id, day, metric, key, value)
+SELECT agency_id, created_at::date, 'emails_filter_decision', COALESCE(filter_decision, ''), COUNT(*)
+FROM email_analyses WHERE agency_id IS NOT NULL
+GROUP BY 1, 2, 4
+ON CONFLICT DO NOTHING;
+
+INSERT INTO agency_daily_stats (agency_id, day, metric, key, value)
+SELECT agency_id, created_at::date, 'documents_type', COALESCE(file_type, ''), COUNT(*)
+FROM file_analyses WHERE agency_id IS NOT NULL
+GROUP BY 1, 2, 4
+ON CONFLICT DO NOTHING;
+
+INSERT INTO agency_daily_stats (agency_id, day, metric, key, value)
+SELECT agency_id, created_at::date, 'tenant_status_in', 'new', COUNT(*)
+FROM tenant_files
+GROUP BY 1, 2
+ON CONFLICT DO NOTHING;
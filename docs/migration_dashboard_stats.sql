@@ -0,0 +1,36 @@
+-- Migration : compteurs dashboard pré-agrégés (GET /dashboard/stats)
+-- Mis à jour incrémentalement par l'application, recalés à chaque cycle de rétention.
+CREATE TABLE IF NOT EXISTS agency_stat_counters (
+    agency_id INTEGER NOT NULL REFERENCES agencies(id),
+    metric VARCHAR NOT NULL,
+    key VARCHAR NOT NULL DEFAULT '',
+    value INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (agency_id, metric, key)
+);
+
+-- Initialisation depuis l'existant (à lancer une fois, application arrêtée ou non :
+-- le recalage suivant corrige les écarts éventuels)
+INSERT INTO agency_stat_counters (agency_id, metric, key, value)
+SELECT agency_id, 'emails', '', COUNT(*) FROM email_analyses
+WHERE agency_id IS NOT NULL GROUP BY agency_id
+ON CONFLICT DO NOTHING;
+
+INSERT INTO agency_stat_counters (agency_id, metric, key, value)
+SELECT agency_id, 'emails_urgent', '', COUNT(*) FROM email_analyses
+WHERE agency_id IS NOT NULL AND lower(urgency) LIKE '%urg%' GROUP BY agency_id
+ON CONFLICT DO NOTHING;
+
+INSERT INTO agency_stat_counters (agency_id, metric, key, value)
+SELECT agency_id, 'emails_category', COALESCE(category, ''), COUNT(*) FROM email_analyses
+WHERE agency_id IS NOT NULL GROUP BY agency_id, COALESCE(category, '')
+ON CONFLICT DO NOTHING;
+
+INSERT INTO agency_stat_counters (agency_id, metric, key, value)
+SELECT agency_id, 'tenant_files', '', COUNT(*) FROM tenant_files GROUP BY agency_id
+ON CONFLICT DO NOTHING;
+
+INSERT INTO agency_stat_counters (agency_id, metric, key, value)
+SELECT agency_id, 'tenant_files_status', lower(status::text), COUNT(*) FROM tenant_files
+GROUP BY agency_id, lower(status::text)
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,59 @@
+-- Migration : suppression des index redondants sur le chemin d'insertion
+-- Chaque index en trop coûte une écriture par INSERT (email_analyses,
+-- file_analyses, tenant_files et tables de liens à chaque email ingéré).
+-- CONCURRENTLY : pas de verrou en écriture, à lancer hors transaction (psql -f).
+--
+-- Redondants = clé primaire ré-indexée, ou préfixe strict d'un index composite
+-- conservé (toutes les recherches applicatives sont filtrées par agence).
+
+-- Clés primaires déjà indexées (index=True historique sur id)
+DROP INDEX CONCURRENTLY IF EXISTS ix_email_analyses_id;
+DROP INDEX CONCURRENTLY IF EXISTS ix_file_analyses_id;
+DROP INDEX CONCURRENTLY IF EXISTS ix_tenant_files_id;
+DROP INDEX CONCURRENTLY IF EXISTS ix_tenant_email_links_id;
+DROP INDEX CONCURRENTLY IF EXISTS ix_tenant_document_links_id;
+
+-- email_analyses : (agency_id) et (agency_id, id) ⊂ (agency_id, created_at, id).
+-- Aucune requête ne trie les emails par id seul (historique, dashboard :
+-- created_at DESC, id DESC).
+DROP INDEX CONCURRENTLY IF EXISTS ix_email_analyses_agency_id;
+DROP INDEX CONCURRENTLY IF EXISTS ix_email_analyses_agency_id_id;
+
+-- file_analyses : (agency_id) ⊂ (agency_id, id) ; (file_hash) remplacé par
+-- (agency_id, file_hash), la déduplication étant toujours par agence
+DROP INDEX CONCURRENTLY IF EXISTS ix_file_analyses_agency_id;
+DROP INDEX CONCURRENTLY IF EXISTS ix_file_analyses_file_hash;
+
+-- tenant_files : (agency_id) ⊂ (agency_id, id) ; (candidate_email) remplacé par
+-- ix_tenant_files_agency_email_prefix (LIKE 'préfixe%', varchar_pattern_ops) et
+-- uq_tenant_files_open_agency_email (égalité, dossiers ouverts)
+DROP INDEX CONCURRENTLY IF EXISTS ix_tenant_files_agency_id;
+DROP INDEX CONCURRENTLY IF EXISTS ix_tenant_files_candidate_email;
+
+-- Liens : préfixes des index composites (email → dossier, dossier → documents)
+DROP INDEX CONCURRENTLY IF EXISTS ix_tenant_email_links_email_analysis_id;
+DROP INDEX CONCURRENTLY IF EXISTS ix_tenant_document_links_tenant_file_id;
+
+-- Index conservés — plans relevés avec backend/scripts/benchmark_indexes.py
+-- (SQLite, 20 agences × 5 000 emails, médiane de 100 exécutions ; sans index → avec) :
+--   ix_file_analyses_agency_hash          dédup pièce jointe       SCAN → COVERING INDEX, 3.4 → 0.15 ms
+--   uq_tenant_files_open_agency_email     dossier ouvert            SCAN → INDEX,          0.92 → 0.14 ms
+--   ix_tenant_files_agency_normalized_email expéditeur connu        SCAN → COVERING INDEX, 0.43 → 0.14 ms
+--   ix_email_analyses_agency_created_id   historique emails         SCAN + TEMP B-TREE → COVERING INDEX, 16 → 0.19 ms
+--   ix_tenant_email_links_email_tenant    dossier lié à un email    COVERING INDEX,        21 → 0.14 ms
+--   ix_tenant_document_links_tenant_file  documents d'un dossier    SCAN → COVERING INDEX, 4.8 → 0.14 ms
+--   ix_tenant_files_agency_id_id          liste dossiers            SCAN → COVERING INDEX, 0.52 → 0.24 ms
+--   ix_tenant_files_agency_status_id      liste par statut          SCAN → COVERING INDEX, 0.49 → 0.25 ms
+--   ix_tenant_files_agency_created        dossiers par période      SCAN → COVERING INDEX, 0.59 → 0.25 ms
+--   ix_file_analyses_agency_id_id         historique documents      SCAN → COVERING INDEX, 3.1 → 0.24 ms
+--   ix_file_analyses_agency_type_id       documents par type        SCAN → COVERING INDEX, 3.8 → 0.25 ms
+--   ix_file_analyses_agency_created       documents par période     SCAN → COVERING INDEX, 3.4 → 0.22 ms
+-- ix_tenant_files_agency_email_prefix ne sert que sous PostgreSQL (LIKE 'préfixe%'
+-- avec varchar_pattern_ops) : à vérifier avec BENCH_DATABASE_URL sur une base
+-- PostgreSQL de test (EXPLAIN du filtre candidate_email de GET /tenant-files).
+
+ANALYZE email_analyses;
+ANALYZE file_analyses;
+ANALYZE tenant_files;
+ANALYZE tenant_email_links;
+ANALYZE tenant_document_links;
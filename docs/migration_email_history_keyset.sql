@@ -0,0 +1,4 @@
+-- Migration : index de pagination keyset pour GET /email/history
+-- Ordre (created_at DESC, id DESC) par agence — parcouru à l'envers par Postgres.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_email_analyses_agency_created_id
+    ON email_analyses(agency_id, created_at, id);
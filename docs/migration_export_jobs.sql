@@ -0,0 +1,20 @@
+-- Migration : création table export_jobs (export groupé de dossiers, job RQ queue 'exports')
+CREATE TABLE IF NOT EXISTS export_jobs (
+    id SERIAL PRIMARY KEY,
+    agency_id INTEGER NOT NULL REFERENCES agencies(id) ON DELETE CASCADE,
+    requested_by INTEGER REFERENCES users(id) ON DELETE SET NULL,
+    status VARCHAR NOT NULL DEFAULT 'pending',
+    filters_json TEXT,
+    total_dossiers INTEGER NOT NULL DEFAULT 0,
+    processed_dossiers INTEGER NOT NULL DEFAULT 0,
+    object_key VARCHAR,
+    size_bytes BIGINT,
+    download_token VARCHAR UNIQUE,
+    expires_at TIMESTAMP,
+    error TEXT,
+    finished_at TIMESTAMP,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS ix_export_jobs_agency_id ON export_jobs(agency_id);
+CREATE INDEX IF NOT EXISTS ix_export_jobs_download_token ON export_jobs(download_token);
@@ -0,0 +1,3 @@
+-- Migration : export_jobs.size_bytes en BIGINT.
+-- Une archive groupée peut dépasser 2 Gio (limite d'INTEGER).
+ALTER TABLE export_jobs ALTER COLUMN size_bytes TYPE BIGINT;
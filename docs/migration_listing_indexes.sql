@@ -0,0 +1,18 @@
+-- Migration : index composites des listings paginés
+-- GET /api/files/history et GET /tenant-files (pagination keyset sur id + filtres).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_file_analyses_agency_id_id
+    ON file_analyses(agency_id, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_file_analyses_agency_type_id
+    ON file_analyses(agency_id, file_type, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_file_analyses_agency_created
+    ON file_analyses(agency_id, created_at);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tenant_files_agency_id_id
+    ON tenant_files(agency_id, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tenant_files_agency_status_id
+    ON tenant_files(agency_id, status, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tenant_files_agency_created
+    ON tenant_files(agency_id, created_at);
+-- varchar_pattern_ops : requis pour que LIKE 'prefix%' utilise l'index (collation non C)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tenant_files_agency_email_prefix
+    ON tenant_files(agency_id, candidate_email varchar_pattern_ops);
@@ -0,0 +1,27 @@
+-- Migration : clé canonique de l'expéditeur sur les dossiers locataires
+-- (check-sender / known-senders du watcher). Même règle que
+-- app.core.email_utils.canonical_email : casse ignorée, alias « + » retirés,
+-- points ignorés pour Gmail / Googlemail.
+-- Les nouvelles lignes sont renseignées par l'ORM (TenantFile._sync_normalized_email).
+
+ALTER TABLE tenant_files ADD COLUMN IF NOT EXISTS normalized_email VARCHAR;
+
+-- Backfill (à relancer sans risque : idempotent)
+UPDATE tenant_files
+SET normalized_email = CASE
+    WHEN position('@' IN e) = 0 THEN e
+    WHEN split_part(e, '@', 2) IN ('gmail.com', 'googlemail.com') THEN
+        replace(split_part(split_part(e, '@', 1), '+', 1), '.', '') || '@' || split_part(e, '@', 2)
+    ELSE split_part(split_part(e, '@', 1), '+', 1) || '@' || split_part(e, '@', 2)
+END
+FROM (SELECT id AS tf_id, lower(btrim(candidate_email)) AS e FROM tenant_files) AS src
+WHERE tenant_files.id = src.tf_id
+  AND tenant_files.candidate_email IS NOT NULL
+  AND btrim(tenant_files.candidate_email) <> ''
+  AND tenant_files.normalized_email IS NULL;
+
+-- CONCURRENTLY : pas de verrou en écriture, à lancer hors transaction (psql -f)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tenant_files_agency_normalized_email
+    ON tenant_files(agency_id, normalized_email);
+
+ANALYZE tenant_files;
@@ -0,0 +1,29 @@
+-- Migration : au plus un dossier OUVERT par candidat (agency_id, candidate_email).
+-- Index unique partiel, cible de l'upsert INSERT … ON CONFLICT de
+-- tenant_service.ensure_tenant_file : des workers RQ concurrents convergent
+-- sur la même ligne au lieu de créer des doublons.
+
+-- 1. Doublons existants : le plus ancien dossier ouvert est conservé,
+--    les autres sont clos (pas de suppression — à fusionner manuellement si besoin).
+UPDATE tenant_files
+SET is_closed = true, closed_at = now()
+WHERE id IN (
+    SELECT id FROM (
+        SELECT id, row_number() OVER (
+            PARTITION BY agency_id, candidate_email ORDER BY created_at, id
+        ) AS rn
+        FROM tenant_files
+        WHERE is_closed = false AND candidate_email IS NOT NULL
+    ) AS ranked
+    WHERE rn > 1
+);
+
+-- 2. Index unique partiel. CONCURRENTLY : pas de verrou en écriture,
+--    à lancer hors transaction (psql -f).
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_tenant_files_open_agency_email
+    ON tenant_files(agency_id, candidate_email) WHERE is_closed = false;
+
+-- 3. L'ancien index partiel non unique (migration_composite_indexes.sql) est redondant
+DROP INDEX CONCURRENTLY IF EXISTS ix_tenant_files_open_agency_email;
+
+ANALYZE tenant_files;
@@ -56,6 +56,7 @@ const FileAnalysis = ({ token, authFetch }) => {
   const [loading, setLoading] = useState(false);
   const [history, setHistory] = useState([]);
   const [historyLoading, setHistoryLoading] = useState(false);
+  const [historyCursor, setHistoryCursor] = useState(null); // page suivante (X-Next-Cursor)
   const [dragging, setDragging] = useState(false);
   const inputRef = useRef(null);
   const [errorMessage, setErrorMessage] = useState(null);
@@ -69,12 +70,18 @@ const FileAnalysis = ({ token, authFetch }) => {
     return () => clearTimeout(t);
   }, [errorMessage, successMessage]);
 
-  const fetchHistory = async () => {
+  // Historique paginé côté serveur : `more` ajoute la page suivante, sinon première page
+  const fetchHistory = async (more = false) => {
     if (!authFetch) return;
     setHistoryLoading(true);
     try {
-      const res = await authFetch(`${API_BASE}/api/files/history`);
-      if (res.ok) setHistory(await res.json());
+      const cursor = more && historyCursor ? `?cursor=${encodeURIComponent(historyCursor)}` : "";
+      const res = await authFetch(`${API_BASE}/api/files/history${cursor}`);
+      if (res.ok) {
+        const page = await res.json();
+        setHistory((prev) => (more ? [...prev, ...page] : page));
+        setHistoryCursor(res.headers.get("X-Next-Cursor"));
+      }
     } catch (error) {
       console.error("Erreur historique:", error);
     } finally {
@@ -279,7 +286,7 @@ const FileAnalysis = ({ token, authFetch }) => {
         <div className="flex items-center justify-between px-6 py-4 border-b border-surface-border">
           <h3 className="text-sm font-semibold text-ink">Documents traités</h3>
           <button
-            onClick={fetchHistory}
+            onClick={() => fetchHistory()}
             className="w-8 h-8 flex items-center justify-center rounded-lg hover:bg-surface-muted text-ink-secondary transition-colors"
             title="Rafraîchir"
           >
@@ -287,7 +294,7 @@ const FileAnalysis = ({ token, authFetch }) => {
           </button>
         </div>
 
-        {historyLoading ? (
+        {historyLoading && !history.length ? (
           <div className="flex items-center justify-center py-12 text-sm text-ink-tertiary gap-2">
             <Loader2 size={18} className="animate-spin" /> Chargement…
           </div>
@@ -360,6 +367,18 @@ const FileAnalysis = ({ token, authFetch }) => {
                 </div>
               ))}
             </div>
+            {historyCursor && (
+              <div className="flex justify-center px-6 py-4 border-t border-surface-border">
+                <button
+                  onClick={() => fetchHistory(true)}
+                  disabled={historyLoading}
+                  className="inline-flex items-center gap-2 px-3 py-2 bg-white border border-surface-border rounded-lg text-sm text-ink-secondary font-medium hover:bg-surface-muted transition-all duration-200 disabled:opacity-50"
+                >
+                  {historyLoading ? <Loader2 size={15} className="animate-spin" /> : null}
+                  Charger plus
+                </button>
+              </div>
+            )}
           </div>
         )}
       </div>
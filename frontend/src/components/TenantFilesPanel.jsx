@@ -96,6 +96,7 @@ function deriveStatusFromChecklist(checklist) {
 export default function TenantFilesPanel({ authFetch }) {
   const [tenants, setTenants] = useState([]);
   const [tenantsLoading, setTenantsLoading] = useState(false);
+  const [tenantsCursor, setTenantsCursor] = useState(null); // page suivante (X-Next-Cursor)
 
   const [selectedTenantId, setSelectedTenantId] = useState(null);
   const [tenantLoading, setTenantLoading] = useState(false);
@@ -103,6 +104,7 @@ export default function TenantFilesPanel({ authFetch }) {
 
   const [filesHistory, setFilesHistory] = useState([]);
   const [filesLoading, setFilesLoading] = useState(false);
+  const [filesCursor, setFilesCursor] = useState(null);
 
   // ✅ Source de vérité UI pour "Pièces du dossier"
   const [tenantDocuments, setTenantDocuments] = useState([]);
@@ -143,19 +145,25 @@ export default function TenantFilesPanel({ authFetch }) {
     filesHistoryRef.current = Array.isArray(filesHistory) ? filesHistory : [];
   }, [filesHistory]);
 
-  const fetchTenants = async () => {
+  // Listes paginées côté serveur : `more` ajoute la page suivante, sinon première page
+  const withCursor = (url, cursor) => (cursor ? `${url}?cursor=${encodeURIComponent(cursor)}` : url);
+
+  const fetchTenants = async (more = false) => {
     if (!authFetchOk) return;
     setError("");
     setTenantsLoading(true);
     try {
-      const res = await authFetch("/tenant-files");
+      const res = await authFetch(withCursor("/tenant-files", more ? tenantsCursor : null));
       if (!res.ok) {
         const txt = await res.text().catch(() => "");
         throw new Error(txt || "Impossible de charger les dossiers");
       }
       const data = await res.json().catch(() => []);
-      const list = Array.isArray(data) ? data : [];
+      const page = Array.isArray(data) ? data : [];
+      const seen = new Set(tenants.map((t) => t.id));
+      const list = more ? [...tenants, ...page.filter((t) => !seen.has(t.id))] : page;
       setTenants(list);
+      setTenantsCursor(res.headers.get("X-Next-Cursor"));
 
       if (!selectedTenantId && list.length) setSelectedTenantId(list[0].id);
     } catch (e) {
@@ -368,21 +376,23 @@ export default function TenantFilesPanel({ authFetch }) {
     }
   };
 
-  const fetchFilesHistory = async () => {
+  const fetchFilesHistory = async (more = false) => {
     if (!authFetchOk) return;
     setError("");
     setFilesLoading(true);
     try {
-      const res = await authFetch("/api/files/history");
+      const res = await authFetch(withCursor("/api/files/history", more ? filesCursor : null));
       if (!res.ok) {
         const txt = await res.text().catch(() => "");
         throw new Error(txt || "Impossible de charger l'historique des documents");
       }
       const data = await res.json().catch(() => []);
       const arrRaw = Array.isArray(data) ? data : [];
-      const arr = arrRaw.map(normalizeFile).filter(Boolean);
+      const page = arrRaw.map(normalizeFile).filter(Boolean);
+      const arr = more ? uniqById([...filesHistoryRef.current, ...page]) : page;
 
       setFilesHistory(arr);
+      setFilesCursor(res.headers.get("X-Next-Cursor"));
 
       // ✅ Si un dossier est sélectionné, resynchronise tenantDocuments depuis file_ids
       if (tenantDetail?.file_ids) {
@@ -842,7 +852,7 @@ export default function TenantFilesPanel({ authFetch }) {
         </div>
 
         <div className="flex items-center gap-3">
-          <button className={btnGhost} onClick={fetchTenants} disabled={tenantsLoading}>
+          <button className={btnGhost} onClick={() => fetchTenants()} disabled={tenantsLoading}>
             <RefreshCw size={15} />
             {tenantsLoading ? "Chargement..." : "Rafraîchir"}
           </button>
@@ -879,7 +889,7 @@ export default function TenantFilesPanel({ authFetch }) {
           </div>
 
           {/* Liste */}
-          {tenantsLoading ? (
+          {tenantsLoading && !tenants.length ? (
             <div className="flex items-center justify-center py-10 text-sm text-ink-tertiary">Chargement…</div>
           ) : tenants.length === 0 ? (
             <div className="flex flex-col items-center justify-center py-12 text-center p-4">
@@ -923,6 +933,13 @@ export default function TenantFilesPanel({ authFetch }) {
                   </button>
                 );
               })}
+              {tenantsCursor && (
+                <div className="flex justify-center px-4 py-3">
+                  <button type="button" className={btnGhost} onClick={() => fetchTenants(true)} disabled={tenantsLoading}>
+                    {tenantsLoading ? "Chargement..." : "Charger plus"}
+                  </button>
+                </div>
+              )}
             </div>
           )}
         </div>
@@ -1094,6 +1111,11 @@ export default function TenantFilesPanel({ authFetch }) {
                     <button type="button" className={btnPrimary} onClick={handleAttach} disabled={!selectedFileIdToAttach || attachLoading}>
                       {attachLoading ? "..." : "Attacher"}
                     </button>
+                    {filesCursor && (
+                      <button type="button" className={btnGhost} onClick={() => fetchFilesHistory(true)} disabled={filesLoading}>
+                        {filesLoading ? "..." : "Documents plus anciens"}
+                      </button>
+                    )}
                   </div>
                 )}
               </>